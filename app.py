@@ -1,22 +1,27 @@
+import click
 from flask import Flask, render_template, url_for, redirect, session
-from flask_session import Session
 from routes.admin import admin_bp
 from routes.login import login_bp
 from routes.registro import registro_bp
 from routes.prestamos import prestamos_bp
 from routes.catalogo import catalogo_bp
-from utils.db import init_db, crear_admin_inicial, migrar_base_datos
+from utils.db import init_app as init_db_app, init_db, crear_admin_inicial, migrar_base_datos
+from utils.sesiones import init_app as init_sesiones
 
 app = Flask(__name__)
 app.secret_key = 'super-secret-key-change-in-production'
 
 # Configuración de la sesión
-app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_TYPE'] = 'filesystem'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hora
 
-# Inicializar Flask-Session
-Session(app)
+# Permitir sobrescribir la configuración con variables FLASK_* (p. ej. FLASK_DATABASE)
+app.config.from_prefixed_env()
+
+# Conexiones a la base de datos por request (pool + cierre en teardown)
+init_db_app(app)
+
+# Sesiones del servidor en SQLite (sesiones.db junto a la base de datos)
+init_sesiones(app)
 
 # Inicializar base de datos al arrancar
 with app.app_context():
@@ -25,6 +30,11 @@ with app.app_context():
         migrar_base_datos()  # Migrar estructura existente
         crear_admin_inicial()
         print("Base de datos inicializada y migrada correctamente")
+        # Entregar las notificaciones que quedaron en la bandeja antes del reinicio
+        from utils.notificaciones import entregar_pendientes
+        pendientes = entregar_pendientes()
+        if pendientes:
+            print(f"Notificaciones pendientes entregadas: {pendientes}")
     except Exception as e:
         print(f"Error al inicializar base de datos: {e}")
 
@@ -138,3 +148,108 @@ def resetdb():
     init_db()
     crear_admin_inicial()
     print("Base de datos recreada")
+
+@app.cli.command('rebuild-counters')
+def rebuild_counters():
+    """Recalcula los contadores de estadísticas a partir de los datos reales"""
+    from utils.db import get_db_connection, transaccion_inmediata
+    from utils.contadores import recalcular_contadores
+    conn = get_db_connection()
+    try:
+        valores = transaccion_inmediata(conn, recalcular_contadores)
+    finally:
+        conn.close()
+    for nombre, valor in valores.items():
+        print(f"{nombre}: {valor}")
+    print("Contadores recalculados")
+
+@app.cli.command('check-counters')
+def check_counters():
+    """Compara los contadores de estadísticas con los agregados reales"""
+    from utils.db import get_db_connection
+    from utils.contadores import verificar_contadores
+    conn = get_db_connection()
+    try:
+        diferencias = verificar_contadores(conn)
+    finally:
+        conn.close()
+    if not diferencias:
+        print("Contadores consistentes")
+        return
+    for nombre, (guardado, real) in diferencias.items():
+        print(f"{nombre}: contador={guardado} real={real}")
+    raise SystemExit("Contadores inconsistentes; ejecute 'flask rebuild-counters'")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups():
+    """Reconstruye los resúmenes diarios de préstamos a partir de los datos reales"""
+    from utils.db import get_db_connection, transaccion_inmediata
+    from utils.resumenes import recalcular_resumenes
+    conn = get_db_connection()
+    try:
+        filas = transaccion_inmediata(conn, recalcular_resumenes)
+    finally:
+        conn.close()
+    for nombre, cantidad in filas.items():
+        print(f"{nombre}: {cantidad} filas")
+    print("Resúmenes reconstruidos")
+
+@app.cli.command('check-rollups')
+def check_rollups():
+    """Compara los resúmenes diarios de préstamos con los agregados reales"""
+    from utils.db import get_db_connection
+    from utils.resumenes import verificar_resumenes
+    conn = get_db_connection()
+    try:
+        diferencias = verificar_resumenes(conn)
+    finally:
+        conn.close()
+    if not diferencias:
+        print("Resúmenes consistentes")
+        return
+    for nombre, claves in diferencias.items():
+        print(f"{nombre}: {len(claves)} filas distintas, p. ej. {claves[:5]}")
+    raise SystemExit("Resúmenes inconsistentes; ejecute 'flask rebuild-rollups'")
+
+@app.cli.command('purge-sessions')
+def purge_sessions():
+    """Elimina las sesiones vencidas"""
+    eliminadas = app.session_interface.almacen.limpiar_vencidas()
+    print(f"Sesiones vencidas eliminadas: {eliminadas}")
+
+@app.cli.command('purge-reports')
+def purge_reports():
+    """Elimina los reportes generados cuyo tiempo de vida terminó"""
+    from utils.db import get_db_connection
+    from utils.trabajos import limpiar_reportes_vencidos
+    conn = get_db_connection()
+    try:
+        eliminados = limpiar_reportes_vencidos(conn)
+    finally:
+        conn.close()
+    print(f"Reportes vencidos eliminados: {eliminados}")
+
+@app.cli.command('drain-notifications')
+def drain_notifications():
+    """Entrega las notificaciones pendientes de la bandeja de salida"""
+    from utils.db import get_db_connection
+    from utils.notificaciones import drenar_notificaciones
+    conn = get_db_connection()
+    try:
+        procesadas = drenar_notificaciones(conn)
+    finally:
+        conn.close()
+    print(f"Notificaciones procesadas: {procesadas}")
+
+@app.cli.command('archive-notifications')
+@click.option('--dias', type=int, default=None, help='Días que se conservan las notificaciones leídas')
+def archive_notifications(dias):
+    """Archiva las notificaciones leídas más antiguas que el período de retención"""
+    from utils.db import get_db_connection
+    from utils.notificaciones import DIAS_RETENCION, archivar_notificaciones
+    conn = get_db_connection()
+    try:
+        archivadas = archivar_notificaciones(conn, DIAS_RETENCION if dias is None else dias)
+    finally:
+        conn.close()
+    print(f"Notificaciones archivadas: {archivadas}")
@@ -0,0 +1,74 @@
+"""
+Configuración compartida de las pruebas: base de datos temporal por prueba,
+usuarios de prueba y clientes con sesión
+
+app.py abre la base de datos al importarse, así que los test_*.py importan de
+este módulo antes que la aplicación; al ejecutarlos como benchmark también
+trabajan sobre una base temporal y nunca sobre models/database.db.
+"""
+
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('FLASK_DATABASE', os.path.join(tempfile.mkdtemp(), 'database.db'))
+
+import pytest
+
+import utils.db
+from app import app
+from utils.db import get_db_connection, init_db, migrar_base_datos
+
+# Datos de los usuarios de prueba por rol: (nombre, email, teléfono)
+USUARIOS = {
+    'admin': ('Admin', 'admin@prueba.com', '3000000001'),
+    'instructor': ('Instructor', 'instructor@prueba.com', '3000000002'),
+}
+
+def crear_base(ruta=None):
+    """
+    Crea y migra una base de datos vacía y la deja como base de la aplicación
+
+    Args:
+        ruta: Archivo de la base; por defecto uno nuevo en un directorio temporal
+
+    Returns:
+        str: Ruta de la base creada
+    """
+    utils.db.DATABASE = ruta or os.path.join(tempfile.mkdtemp(), 'database.db')
+    init_db()
+    migrar_base_datos()
+    return utils.db.DATABASE
+
+def crear_usuarios(conn, *roles, password='x'):
+    """Inserta un usuario activo por rol; los ids siguen el orden de los roles"""
+    conn.executemany(
+        'INSERT INTO usuarios (nombre, email, telefono, password, rol, activo) VALUES (?, ?, ?, ?, ?, 1)',
+        [(*USUARIOS[rol], password, rol) for rol in roles]
+    )
+    conn.commit()
+
+def cliente_con_sesion(usuario_id=1, rol='admin', **datos):
+    """Cliente de pruebas con la sesión de un usuario ya iniciada"""
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['user_id'] = usuario_id
+        sesion['rol'] = rol
+        sesion.update(datos)
+    return cliente
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """Base de datos vacía y migrada en el directorio temporal de la prueba"""
+    monkeypatch.setattr(utils.db, 'DATABASE', str(tmp_path / 'database.db'))
+    init_db()
+    migrar_base_datos()
+    return utils.db.DATABASE
+
+@pytest.fixture
+def conn(base):
+    """Conexión a la base de la prueba; los módulos la redefinen para sembrar sus datos"""
+    conn = get_db_connection()
+    yield conn
+    conn.close()
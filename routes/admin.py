@@ -1,10 +1,22 @@
-from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for, session
+from flask import Blueprint, Response, request, jsonify, render_template, flash, redirect, url_for, session, g, current_app
 import sqlite3
 import os
-from utils.db import get_db_connection
+from utils.db import get_db
+from utils.cache_catalogo import catalogo_cacheado
+from utils.eventos import contar_no_leidas, publicar_no_leidas
+from utils.notificaciones import avisar_drenador
+from utils.contadores import obtener_contadores
+from utils.paginacion import CLAVES_PRESTAMOS, paginar_consulta
 from werkzeug.utils import secure_filename
-from routes.login import login_required
-from datetime import datetime, timedelta
+from routes.login import login_required, token_required
+from utils.helpers import calcular_dias_prestamo, crear_notificacion, inicio_hace_dias, limites_fecha
+from utils.prestamos import (
+    NOVEDADES_QUE_REDUCEN_CANTIDAD, SELECTORES_DEVOLUCION, DevolucionConcurrente, DevolucionInvalida,
+    DisponibilidadInsuficiente, devolucion_completa, leer_cantidad, registrar_devolucion,
+    registrar_devoluciones, registrar_prestamo, unidades_pendientes
+)
+from utils.usuarios import invalidar_usuario
+from datetime import datetime
 
 # Configuración del Blueprint
 admin_bp = Blueprint('admin', __name__, template_folder='templates')
@@ -21,21 +33,15 @@ def ensure_upload_folder():
         os.makedirs(UPLOAD_FOLDER)
 
 def is_admin():
+    # Las llamadas con token Bearer no usan la sesión
+    if 'api_user' in g:
+        return g.api_user['rol'] == 'admin'
     return session.get('rol') == 'admin'
 
-def crear_notificacion(tipo, titulo, mensaje, fk_usuario=None, fk_prestamo=None):
-    """Crea una notificación en el sistema"""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO notificaciones (tipo, titulo, mensaje, fk_usuario, fk_prestamo)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (tipo, titulo, mensaje, fk_usuario, fk_prestamo))
-        conn.commit()
-    except Exception as e:
-        print(f"Error al crear notificación: {e}")
-    finally:
-        conn.close()
+# Total sin leer para la insignia de notificaciones de base_admin.html
+@admin_bp.context_processor
+def inyectar_no_leidas():
+    return {'notificaciones_no_leidas': contar_no_leidas(get_db())}
 
 # Rutas del Blueprint
 @admin_bp.route('/')
@@ -46,13 +52,10 @@ def admin():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     
-    # Obtener estadísticas
-    total_implementos = conn.execute('SELECT COUNT(*) as count FROM implementos').fetchone()['count']
-    total_usuarios = conn.execute('SELECT COUNT(*) as count FROM usuarios').fetchone()['count']
-    total_prestamos = conn.execute('SELECT COUNT(*) as count FROM prestamos').fetchone()['count']
-    prestamos_activos = conn.execute('SELECT COUNT(*) as count FROM prestamos WHERE fecha_devolucion IS NULL').fetchone()['count']
+    # Obtener estadísticas (contadores mantenidos por triggers)
+    contadores = obtener_contadores(conn)
     
     # Obtener implementos recientes
     implementos = conn.execute('SELECT * FROM implementos ORDER BY fecha_creacion DESC LIMIT 5').fetchall()
@@ -76,13 +79,11 @@ def admin():
         LIMIT 5
     ''').fetchall()
     
-    conn.close()
-    
     return render_template('admin/panel_administrador.html',
-                    total_implementos=total_implementos,
-                    total_usuarios=total_usuarios,
-                    total_prestamos=total_prestamos,
-                    prestamos_activos=prestamos_activos,
+                    total_implementos=contadores['total_implementos'],
+                    total_usuarios=contadores['total_usuarios'],
+                    total_prestamos=contadores['total_prestamos'],
+                    prestamos_activos=contadores['prestamos_activos'],
                     implementos=implementos,
                     notificaciones=notificaciones,
                     usuarios_pendientes=usuarios_pendientes)
@@ -93,9 +94,8 @@ def ver_catalogo():
     if not is_admin():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
-    conn = get_db_connection()
-    implementos = conn.execute('SELECT * FROM implementos ORDER BY id DESC').fetchall()
-    conn.close()
+    conn = get_db()
+    implementos = catalogo_cacheado(conn, orden='recientes')
     return render_template('admin/panel_administrador.html', implementos=implementos)
 
 @admin_bp.route('/catalogo/agregar', methods=['GET', 'POST'])
@@ -125,27 +125,27 @@ def agregar_implemento():
                 file.save(os.path.join(UPLOAD_FOLDER, unique_filename))
                 imagen_url = unique_filename
         
-        conn = get_db_connection()
+        conn = get_db()
         try:
             conn.execute(
                 'INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria, imagen_url) VALUES (?, ?, ?, ?, ?)',
                 (implemento, descripcion, disponibilidad, categoria, imagen_url)
             )
-            conn.commit()
-            
-            # Crear notificación
+
+            # Crear notificación (en la misma transacción)
             crear_notificacion(
+                conn,
                 'implemento_nuevo',
                 'Nuevo implemento agregado',
                 f'{implemento} ha sido agregado al sistema por {session.get("user_nombre")}',
                 session.get('user_id')
             )
+            conn.commit()
+            avisar_drenador()
             
             flash('Implemento agregado correctamente', 'success')
         except sqlite3.Error as e:
             flash(f'Error al guardar en la base de datos: {str(e)}', 'error')
-        finally:
-            conn.close()
         
         return redirect(url_for('admin.ver_catalogo'))
     
@@ -158,7 +158,7 @@ def editar_implemento(id):
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     
     if request.method == 'POST':
         implemento = request.form.get('implemento')
@@ -197,11 +197,9 @@ def editar_implemento(id):
         except sqlite3.Error as e:
             flash(f'Error al actualizar: {str(e)}', 'error')
         
-        conn.close()
         return redirect(url_for('admin.ver_catalogo'))
     
     implemento = conn.execute('SELECT * FROM implementos WHERE id = ?', (id,)).fetchone()
-    conn.close()
     
     if implemento is None:
         flash('Implemento no encontrado', 'error')
@@ -216,7 +214,7 @@ def eliminar_implemento(id):
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     
     try:
         implemento = conn.execute('SELECT imagen_url FROM implementos WHERE id = ?', (id,)).fetchone()
@@ -232,8 +230,6 @@ def eliminar_implemento(id):
         flash('Implemento eliminado correctamente', 'success')
     except sqlite3.Error as e:
         flash(f'Error al eliminar: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin.ver_catalogo'))
 
@@ -245,7 +241,7 @@ def gestion_usuarios():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener y validar filtros
         filtro_estado = request.args.get('estado', 'todos')
@@ -275,19 +271,26 @@ def gestion_usuarios():
             query += " AND rol = ?"
             params.append(filtro_rol)
         
-        query += " ORDER BY id DESC"
-        
-        usuarios = conn.execute(query, params).fetchall()
+        # Página actual por cursor sobre el id (más recientes primero)
+        pagina = paginar_consulta(conn, query, params, (('id', 'id'),), request.args)
         
-        conn.close()
+        # Totales de todos los usuarios (contadores e índice por rol)
+        contadores = obtener_contadores(conn)
+        totales = {
+            'usuarios': contadores['total_usuarios'],
+            'activos': contadores['usuarios_activos'],
+            'pendientes': contadores['total_usuarios'] - contadores['usuarios_activos'],
+            'admins': conn.execute("SELECT COUNT(*) FROM usuarios WHERE rol = 'admin'").fetchone()[0],
+        }
         
         return render_template('admin/gestion_usuarios.html', 
-                             usuarios=usuarios,
+                             usuarios=pagina['filas'],
+                             pagina=pagina,
+                             totales=totales,
                              filtro_estado=filtro_estado,
                              filtro_rol=filtro_rol)
     except Exception as e:
         flash(f'Error al cargar usuarios: {str(e)}', 'error')
-        conn.close()
         return redirect('/admin')
 
 # Gestión de préstamos - Devoluciones
@@ -298,45 +301,49 @@ def devolucion_prestamos():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
 
-    conn = get_db_connection()
+    conn = get_db()
     
     try:
-        prestamos_activos = conn.execute('''
-            SELECT p.*, u.nombre as usuario_nombre, i.implemento,
-                   julianday('now') - julianday(p.fecha_prestamo) as dias_transcurridos
+        # Página actual de préstamos activos por cursor sobre (fecha_prestamo, id)
+        pagina = paginar_consulta(conn, '''
+            SELECT p.*, u.nombre as usuario_nombre, i.implemento
             FROM prestamos p
             JOIN usuarios u ON p.fk_usuario = u.id
             JOIN implementos i ON p.fk_implemento = i.id
             WHERE p.fecha_devolucion IS NULL
-            ORDER BY p.fecha_prestamo DESC
-        ''').fetchall()
+        ''', [], CLAVES_PRESTAMOS, request.args)
         
+        # Los días se calculan contra un único "ahora" para toda la página
+        ahora = datetime.now()
         prestamos_con_dias = []
-        for prestamo in prestamos_activos:
+        for prestamo in pagina['filas']:
             prestamo_dict = dict(prestamo)
-            prestamo_dict['dias_transcurridos'] = int(prestamo['dias_transcurridos']) if prestamo['dias_transcurridos'] else 0
+            prestamo_dict['dias_transcurridos'] = calcular_dias_prestamo(prestamo['fecha_prestamo'], ahora)
             prestamos_con_dias.append(prestamo_dict)
         
-        total_prestamos = len(prestamos_con_dias)
-        implementos_unicos = len(set(p['fk_implemento'] for p in prestamos_con_dias))
+        # Totales de todos los préstamos activos (contador e índice parcial)
+        total_prestamos = obtener_contadores(conn)['prestamos_activos']
+        implementos_unicos = conn.execute(
+            'SELECT COUNT(DISTINCT fk_implemento) FROM prestamos WHERE fecha_devolucion IS NULL'
+        ).fetchone()[0]
         
-        hoy = datetime.now().strftime("%Y-%m-%d")
+        hoy = ahora.strftime("%Y-%m-%d")
         prestamos_hoy = conn.execute('''
-            SELECT COUNT(*) as count FROM prestamos 
-            WHERE DATE(fecha_prestamo) = ? AND fecha_devolucion IS NULL
-        ''', (hoy,)).fetchone()['count']
+            SELECT COALESCE(SUM(cantidad - cantidad_devuelta), 0) as count FROM prestamos 
+            WHERE fecha_prestamo >= ? AND fecha_prestamo < ? AND fecha_devolucion IS NULL
+        ''', limites_fecha(hoy, hoy)).fetchone()['count']
         
     except Exception as e:
         flash(f'Error al cargar préstamos: {str(e)}', 'error')
         prestamos_con_dias = []
+        pagina = None
         total_prestamos = 0
         implementos_unicos = 0
         prestamos_hoy = 0
-    finally:
-        conn.close()
     
     return render_template('admin/dvprestamos.html',
                          prestamos_activos=prestamos_con_dias,
+                         pagina=pagina,
                          total_prestamos=total_prestamos,
                          total_implementos=implementos_unicos,
                          prestamos_hoy=prestamos_hoy)
@@ -345,22 +352,17 @@ def devolucion_prestamos():
 @admin_bp.route('/devolver_prestamo_admin/<int:id>', methods=['POST'])
 @login_required
 def devolver_prestamo_admin(id):
-    print(f"DEBUG: Procesando devolución para préstamo ID: {id}")
-    print(f"DEBUG: Usuario actual: {session.get('user_id')}, Rol: {session.get('rol')}")
-    
     if not is_admin():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener datos del formulario
         novedad = request.form.get('novedad', 'Ninguna')
         estado_implemento = request.form.get('estado_implemento', 'Bueno')
         observaciones = request.form.get('observaciones', '')
         
-        print(f"DEBUG: Datos del formulario - Novedad: {novedad}, Estado: {estado_implemento}, Observaciones: {observaciones}")
-        
         prestamo = conn.execute('''
             SELECT p.*, i.implemento, i.disponibilidad, u.nombre as usuario_nombre
             FROM prestamos p
@@ -377,75 +379,51 @@ def devolver_prestamo_admin(id):
             flash('Este préstamo ya fue devuelto anteriormente.', 'warning')
             return redirect(url_for('admin.devolucion_prestamos'))
         
-        # Registrar la devolución
-        fecha_devolucion = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conn.execute('''
-            UPDATE prestamos 
-            SET fecha_devolucion = ?, novedad = ?, estado_implemento_devolucion = ?, observaciones = ?
-            WHERE id = ?
-        ''', (fecha_devolucion, novedad, estado_implemento, observaciones, id))
-        
-        # Actualizar disponibilidad del implemento según la novedad
-        novedades_que_reducen_cantidad = ['Daño', 'Robo', 'Desgaste excesivo', 'Pérdida']
-        cantidad_a_reducir = 0
-        
-        if novedad in novedades_que_reducen_cantidad:
-            cantidad_a_reducir = 1
-            print(f"DEBUG: Novedad '{novedad}' detectada - reduciendo cantidad en {cantidad_a_reducir}")
-        
-        # Calcular nueva disponibilidad (normalmente +1, pero -1 si hay novedad grave)
-        nueva_disponibilidad = prestamo['disponibilidad'] + 1 - cantidad_a_reducir
-        
-        # Asegurar que la disponibilidad no sea negativa
-        if nueva_disponibilidad < 0:
-            nueva_disponibilidad = 0
-        
-        conn.execute(
-            'UPDATE implementos SET disponibilidad = ? WHERE id = ?',
-            (nueva_disponibilidad, prestamo['fk_implemento'])
-        )
-        
-        # Actualizar estado del implemento si es necesario
-        if estado_implemento != 'Bueno':
-            conn.execute(
-                'UPDATE implementos SET estado = ? WHERE id = ?',
-                (estado_implemento, prestamo['fk_implemento'])
-            )
-        
-        conn.commit()
-        
-        # Crear notificación con información sobre la novedad
+        # Validar unidades a devolver (por defecto, todas las pendientes)
+        pendientes = unidades_pendientes(prestamo)
+        cantidad = leer_cantidad(request.form.get('cantidad'), pendientes)
+        if cantidad <= 0 or cantidad > pendientes:
+            flash(f'La cantidad a devolver debe estar entre 1 y {pendientes}.', 'error')
+            return redirect(url_for('admin.devolucion_prestamos'))
+
+        # Mensaje de la notificación con información sobre la novedad
+        completo = devolucion_completa(prestamo, cantidad)
         mensaje_notif = f'Devolución de {prestamo["implemento"]} por {prestamo["usuario_nombre"]}'
+        if prestamo['cantidad'] > 1:
+            mensaje_notif += f' ({cantidad} de {prestamo["cantidad"]} unidades)'
+        if not completo:
+            mensaje_notif += ' - Devolución parcial'
         if novedad != 'Ninguna':
             mensaje_notif += f' - Novedad: {novedad}'
-            if novedad in novedades_que_reducen_cantidad:
+            if novedad in NOVEDADES_QUE_REDUCEN_CANTIDAD:
                 mensaje_notif += ' - Se redujo la cantidad disponible del implemento'
         
-        crear_notificacion(
-            'devolucion',
-            'Devolución registrada',
-            mensaje_notif,
-            session.get('user_id'),
-            id
-        )
+        # Registrar la devolución, reingresar las unidades al inventario y
+        # encolar la notificación en una sola transacción
+        try:
+            registrar_devolucion(
+                conn, prestamo, cantidad, novedad, estado_implemento, observaciones,
+                notificacion=('devolucion', 'Devolución registrada', mensaje_notif, session.get('user_id'))
+            )
+        except DevolucionConcurrente:
+            flash('El préstamo fue modificado por otra devolución. Revisa las unidades pendientes.', 'warning')
+            return redirect(url_for('admin.devolucion_prestamos'))
         
         flash(f'Devolución registrada exitosamente: {prestamo["implemento"]}', 'success')
         
     except Exception as e:
         flash(f'Error al procesar la devolución: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin.devolucion_prestamos'))
 
 # API para notificaciones
 @admin_bp.route('/api/notificaciones')
-@login_required
+@token_required
 def api_notificaciones():
     if not is_admin():
         return jsonify({'error': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     notificaciones = conn.execute('''
         SELECT n.*, u.nombre as usuario_nombre
         FROM notificaciones n
@@ -454,46 +432,86 @@ def api_notificaciones():
         ORDER BY n.fecha_creacion DESC
         LIMIT 20
     ''').fetchall()
-    conn.close()
     
     return jsonify([dict(notif) for notif in notificaciones])
 
+# Flujo de eventos (SSE) con las notificaciones nuevas y el total sin leer
+@admin_bp.route('/api/notificaciones/stream')
+@login_required
+def stream_notificaciones():
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from utils.db import get_db_connection
+    from utils.eventos import CanalLleno, canal, flujo_notificaciones
+
+    # El navegador envía Last-Event-ID al reconectarse; ?ultimo_id= sirve para la primera conexión
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    try:
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        ultimo_id = None
+
+    try:
+        suscripcion = canal.suscribir()
+    except CanalLleno:
+        respuesta = jsonify({'error': 'Demasiadas conexiones de eventos, intente más tarde'})
+        respuesta.headers['Retry-After'] = '30'
+        return respuesta, 503
+
+    respuesta = Response(
+        flujo_notificaciones(get_db_connection, ultimo_id, suscripcion),
+        mimetype='text/event-stream'
+    )
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    # Si el flujo no llega a iniciarse, la suscripción se libera al cerrar la respuesta
+    respuesta.call_on_close(lambda: canal.cancelar(suscripcion))
+    return respuesta
+
+# Total sin leer y último id, para refrescar la insignia por sondeo (admite If-None-Match)
+@admin_bp.route('/api/notificaciones/contador')
+@login_required
+def contador_notificaciones():
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from utils.eventos import resumen_no_leidas
+
+    resumen = resumen_no_leidas(get_db())
+    respuesta = jsonify(resumen)
+    respuesta.set_etag(f"{resumen['no_leidas']}-{resumen['ultimo_id']}")
+    # El navegador revalida siempre; si no cambió, la respuesta es un 304 vacío
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta.make_conditional(request)
+
 # Marcar notificación como leída
 @admin_bp.route('/api/notificaciones/<int:id>/leer', methods=['POST'])
 @login_required
 def marcar_notificacion_leida(id):
-    print(f"DEBUG: Intentando marcar notificación {id} como leída")
-    print(f"DEBUG: Usuario actual: {session.get('user_id')}, Rol: {session.get('rol')}")
-    
     if not is_admin():
-        print("DEBUG: Usuario no tiene permisos de admin")
         return jsonify({'success': False, 'error': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Verificar que la notificación existe
         notificacion = conn.execute('SELECT * FROM notificaciones WHERE id = ?', (id,)).fetchone()
         if not notificacion:
-            print(f"DEBUG: Notificación {id} no encontrada")
             return jsonify({'success': False, 'error': 'Notificación no encontrada'}), 404
         
-        print(f"DEBUG: Notificación encontrada: {dict(notificacion)}")
-        
         # Verificar si ya está marcada como leída
         if notificacion['leida'] == 1:
-            print(f"DEBUG: Notificación {id} ya está marcada como leída")
             return jsonify({'success': True, 'message': 'Notificación ya estaba marcada como leída'})
         
         # Marcar como leída
         conn.execute('UPDATE notificaciones SET leida = 1 WHERE id = ?', (id,))
         conn.commit()
-        print(f"DEBUG: Notificación {id} marcada como leída exitosamente")
+        publicar_no_leidas(conn)
+        current_app.logger.debug('Notificación %s marcada como leída', id)
         return jsonify({'success': True, 'message': 'Notificación marcada como leída'})
     except Exception as e:
-        print(f"ERROR: Error al marcar notificación como leída: {e}")
+        current_app.logger.exception('Error al marcar la notificación %s como leída', id)
         return jsonify({'success': False, 'error': f'Error del servidor: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 # Marcar todas las notificaciones como leídas
 @admin_bp.route('/api/notificaciones/leer_todas', methods=['POST'])
@@ -502,22 +520,17 @@ def marcar_todas_leidas():
     if not is_admin():
         return jsonify({'error': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        # Contar cuántas notificaciones se van a marcar
-        cursor = conn.execute('SELECT COUNT(*) as count FROM notificaciones WHERE leida = 0')
-        count = cursor.fetchone()['count']
-        
-        # Marcar todas como leídas
-        conn.execute('UPDATE notificaciones SET leida = 1 WHERE leida = 0')
+        # Marcar todas como leídas (rowcount indica cuántas se marcaron)
+        count = conn.execute('UPDATE notificaciones SET leida = 1 WHERE leida = 0').rowcount
         conn.commit()
+        publicar_no_leidas(conn)
         print(f"{count} notificaciones marcadas como leídas")
         return jsonify({'success': True, 'message': f'{count} notificaciones marcadas como leídas'})
     except Exception as e:
         print(f"Error al marcar todas las notificaciones como leídas: {e}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 # Página de notificaciones
 @admin_bp.route('/notificaciones')
@@ -527,7 +540,7 @@ def notificaciones():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener todas las notificaciones
         notificaciones = conn.execute('''
@@ -538,12 +551,9 @@ def notificaciones():
             LIMIT 50
         ''').fetchall()
         
-        conn.close()
-        
         return render_template('admin/notificaciones.html', notificaciones=notificaciones)
     except Exception as e:
         flash(f'Error al cargar notificaciones: {str(e)}', 'error')
-        conn.close()
         return redirect('/admin')
 
 # Eliminar notificación individual
@@ -553,15 +563,14 @@ def eliminar_notificacion(id):
     if not is_admin():
         return jsonify({'error': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('DELETE FROM notificaciones WHERE id = ?', (id,))
         conn.commit()
+        publicar_no_leidas(conn)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 # Eliminar todas las notificaciones leídas
 @admin_bp.route('/api/notificaciones/eliminar_leidas', methods=['POST'])
@@ -570,29 +579,22 @@ def eliminar_notificaciones_leidas():
     if not is_admin():
         return jsonify({'error': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('DELETE FROM notificaciones WHERE leida = 1')
         conn.commit()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 # Gestión de préstamos - Vista principal
 @admin_bp.route('/gestion_prestamos')
 @login_required
 def gestion_prestamos():
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener implementos disponibles
-        implementos_disponibles = conn.execute('''
-            SELECT id, implemento, disponibilidad, categoria 
-            FROM implementos 
-            WHERE disponibilidad > 0 
-            ORDER BY implemento
-        ''').fetchall()
+        implementos_disponibles = catalogo_cacheado(conn, disponibilidad='disponible')
         
         # Obtener y validar filtros
         filtro_estado = request.args.get('estado', 'todos')
@@ -613,8 +615,7 @@ def gestion_prestamos():
         
         # Construir query base para préstamos
         query = '''
-            SELECT p.*, u.nombre as usuario, i.implemento,
-                   julianday('now') - julianday(p.fecha_prestamo) as dias_transcurridos
+            SELECT p.*, u.nombre as usuario, i.implemento
             FROM prestamos p
             JOIN usuarios u ON p.fk_usuario = u.id
             JOIN implementos i ON p.fk_implemento = i.id
@@ -630,24 +631,23 @@ def gestion_prestamos():
         
         # Filtro por días
         if filtro_dias > 0:
-            fecha_limite = (datetime.now() - timedelta(days=filtro_dias)).strftime("%Y-%m-%d")
-            query += " AND DATE(p.fecha_prestamo) >= ?"
-            params.append(fecha_limite)
-        
-        query += " ORDER BY p.fecha_prestamo DESC"
+            query += " AND p.fecha_prestamo >= ?"
+            params.append(inicio_hace_dias(filtro_dias))
         
-        prestamos = conn.execute(query, params).fetchall()
+        # Página actual por cursor sobre (fecha_prestamo, id)
+        pagina = paginar_consulta(conn, query, params, CLAVES_PRESTAMOS, request.args)
+        prestamos = pagina['filas']
         
     except Exception as e:
         flash(f'Error al cargar datos: {str(e)}', 'error')
+        pagina = None
         implementos_disponibles = []
         prestamos = []
-    finally:
-        conn.close()
     
     return render_template('views/gestion_prestamos.html',
                          implementos_disponibles=implementos_disponibles,
                          prestamos=prestamos,
+                         pagina=pagina,
                          filtro_estado=filtro_estado,
                          filtro_dias=filtro_dias)
 
@@ -660,7 +660,7 @@ def registrar_prestamo_individual():
         flash('No tienes permiso para realizar préstamos.', 'error')
         return redirect(url_for('admin.gestion_prestamos'))
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         implemento_id = request.form.get('implemento_id')
         nombre_prestatario = request.form.get('nombre_prestatario')
@@ -684,37 +684,34 @@ def registrar_prestamo_individual():
         fk_usuario = session.get('user_id')
         fecha_prestamo = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Registrar el préstamo individual
-        cursor = conn.execute('''
-            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, 
-                                instructor, jornada, ambiente, fecha_prestamo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (fk_usuario, implemento_id, 'individual', nombre_prestatario, instructor, jornada, ambiente, fecha_prestamo))
-        
-        prestamo_id = cursor.lastrowid
-
-        # Actualizar la disponibilidad del implemento
-        nueva_disponibilidad = implemento['disponibilidad'] - 1
-        conn.execute('UPDATE implementos SET disponibilidad = ? WHERE id = ?', 
-                    (nueva_disponibilidad, implemento_id))
-
-        conn.commit()
-        
-        # Crear notificación para admin
-        crear_notificacion(
+        # Notificación para admin, encolada en la misma transacción del préstamo
+        notificacion = (
             'prestamo_individual',
             'Nuevo préstamo individual',
             f'{nombre_prestatario} ha solicitado un préstamo de {implemento["implemento"]}',
-            fk_usuario,
-            prestamo_id
+            fk_usuario
         )
         
+        # Registrar el préstamo individual y descontar la unidad del inventario
+        try:
+            registrar_prestamo(conn, {
+                'fk_usuario': fk_usuario,
+                'fk_implemento': implemento_id,
+                'tipo_prestamo': 'individual',
+                'nombre_prestatario': nombre_prestatario,
+                'instructor': instructor,
+                'jornada': jornada,
+                'ambiente': ambiente,
+                'fecha_prestamo': fecha_prestamo,
+            }, notificacion=notificacion)
+        except DisponibilidadInsuficiente:
+            flash('Este implemento ya no está disponible para préstamo.', 'error')
+            return redirect(url_for('admin.gestion_prestamos'))
+        
         flash(f"Préstamo de '{implemento['implemento']}' registrado con éxito", "success")
         
     except Exception as e:
         flash(f"Error en el préstamo: {str(e)}", "error")
-    finally:
-        conn.close()
 
     return redirect(url_for('admin.gestion_prestamos'))
 
@@ -727,7 +724,7 @@ def registrar_prestamo_multiple():
         flash('No tienes permiso para realizar préstamos.', 'error')
         return redirect(url_for('admin.gestion_prestamos'))
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         implemento_id = request.form.get('implemento_id')
         ficha = request.form.get('ficha')
@@ -753,37 +750,34 @@ def registrar_prestamo_multiple():
         fk_usuario = session.get('user_id')
         fecha_prestamo = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Registrar el préstamo múltiple
-        cursor = conn.execute('''
-            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, 
-                                ficha, ambiente, horario, fecha_prestamo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (fk_usuario, implemento_id, 'multiple', nombre_prestatario, ficha, ambiente, horario, fecha_prestamo))
-        
-        prestamo_id = cursor.lastrowid
-
-        # Actualizar la disponibilidad del implemento
-        nueva_disponibilidad = implemento['disponibilidad'] - 1
-        conn.execute('UPDATE implementos SET disponibilidad = ? WHERE id = ?', 
-                    (nueva_disponibilidad, implemento_id))
-
-        conn.commit()
-        
-        # Crear notificación para admin
-        crear_notificacion(
+        # Notificación para admin, encolada en la misma transacción del préstamo
+        notificacion = (
             'prestamo_multiple',
             'Nuevo préstamo múltiple',
             f'{nombre_prestatario} ha solicitado un préstamo múltiple de {implemento["implemento"]} para ficha {ficha}',
-            fk_usuario,
-            prestamo_id
+            fk_usuario
         )
         
+        # Registrar el préstamo múltiple y descontar la unidad del inventario
+        try:
+            registrar_prestamo(conn, {
+                'fk_usuario': fk_usuario,
+                'fk_implemento': implemento_id,
+                'tipo_prestamo': 'multiple',
+                'nombre_prestatario': nombre_prestatario,
+                'ficha': ficha,
+                'ambiente': ambiente,
+                'horario': horario,
+                'fecha_prestamo': fecha_prestamo,
+            }, notificacion=notificacion)
+        except DisponibilidadInsuficiente:
+            flash('Este implemento ya no está disponible para préstamo.', 'error')
+            return redirect(url_for('admin.gestion_prestamos'))
+        
         flash(f"Préstamo múltiple de '{implemento['implemento']}' registrado con éxito", "success")
         
     except Exception as e:
         flash(f"Error en el préstamo: {str(e)}", "error")
-    finally:
-        conn.close()
 
     return redirect(url_for('admin.gestion_prestamos'))
 
@@ -795,7 +789,7 @@ def devolver_prestamo(id):
         flash('No tienes permiso para procesar devoluciones.', 'error')
         return redirect(url_for('admin.gestion_prestamos'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener datos del formulario
         novedad = request.form.get('novedad', 'Ninguna')
@@ -819,85 +813,113 @@ def devolver_prestamo(id):
             flash('Este préstamo ya fue devuelto anteriormente.', 'warning')
             return redirect(url_for('admin.gestion_prestamos'))
 
-        # Registrar la devolución
-        fecha_devolucion = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conn.execute('''
-            UPDATE prestamos 
-            SET fecha_devolucion = ?, novedad = ?, estado_implemento_devolucion = ?, observaciones = ?
-            WHERE id = ?
-        ''', (fecha_devolucion, novedad, estado_implemento, observaciones, id))
-
-        # Actualizar disponibilidad del implemento según la novedad
-        novedades_que_reducen_cantidad = ['Daño', 'Robo', 'Desgaste excesivo', 'Pérdida']
-        cantidad_a_reducir = 0
-        
-        if novedad in novedades_que_reducen_cantidad:
-            cantidad_a_reducir = 1
-            print(f"DEBUG: Novedad '{novedad}' detectada - reduciendo cantidad en {cantidad_a_reducir}")
-        
-        # Calcular nueva disponibilidad (normalmente +1, pero -1 si hay novedad grave)
-        nueva_disponibilidad = prestamo['disponibilidad'] + 1 - cantidad_a_reducir
-        
-        # Asegurar que la disponibilidad no sea negativa
-        if nueva_disponibilidad < 0:
-            nueva_disponibilidad = 0
-        
-        conn.execute(
-            'UPDATE implementos SET disponibilidad = ? WHERE id = ?',
-            (nueva_disponibilidad, prestamo['fk_implemento'])
-        )
-        
-        # Actualizar estado del implemento si es necesario
-        if estado_implemento != 'Bueno':
-            conn.execute(
-                'UPDATE implementos SET estado = ? WHERE id = ?',
-                (estado_implemento, prestamo['fk_implemento'])
-            )
+        # Validar unidades a devolver (por defecto, todas las pendientes)
+        pendientes = unidades_pendientes(prestamo)
+        cantidad = leer_cantidad(request.form.get('cantidad'), pendientes)
+        if cantidad <= 0 or cantidad > pendientes:
+            flash(f'La cantidad a devolver debe estar entre 1 y {pendientes}.', 'error')
+            return redirect(url_for('admin.gestion_prestamos'))
 
-        conn.commit()
-        
-        # Crear notificación con información sobre la novedad
+        # Mensaje de la notificación con información sobre la novedad
+        completo = devolucion_completa(prestamo, cantidad)
         mensaje_notif = f'Devolución de {prestamo["implemento"]} por {prestamo["usuario_nombre"]}'
+        if prestamo['cantidad'] > 1:
+            mensaje_notif += f' ({cantidad} de {prestamo["cantidad"]} unidades)'
+        if not completo:
+            mensaje_notif += ' - Devolución parcial'
         if novedad != 'Ninguna':
             mensaje_notif += f' - Novedad: {novedad}'
-            if novedad in novedades_que_reducen_cantidad:
+            if novedad in NOVEDADES_QUE_REDUCEN_CANTIDAD:
                 mensaje_notif += ' - Se redujo la cantidad disponible del implemento'
         if estado_implemento != 'Bueno':
             mensaje_notif += f' - Estado: {estado_implemento}'
         
-        crear_notificacion(
-            'devolucion',
-            'Devolución registrada',
-            mensaje_notif,
-            session.get('user_id'),
-            id
-        )
+        # Registrar la devolución, reingresar las unidades al inventario y
+        # encolar la notificación en una sola transacción
+        try:
+            registrar_devolucion(
+                conn, prestamo, cantidad, novedad, estado_implemento, observaciones,
+                notificacion=('devolucion', 'Devolución registrada', mensaje_notif, session.get('user_id'))
+            )
+        except DevolucionConcurrente:
+            flash('El préstamo fue modificado por otra devolución. Revisa las unidades pendientes.', 'warning')
+            return redirect(url_for('admin.gestion_prestamos'))
         
         flash(f'Devolución registrada exitosamente: {prestamo["implemento"]}', 'success')
     except Exception as e:
         flash(f'Error al procesar la devolución: {str(e)}', 'error')
-    finally:
-        conn.close()
 
     return redirect(url_for('admin.gestion_prestamos'))
 
+# Devolución de varios préstamos en una sola transacción (fin de clase)
+@admin_bp.route('/api/prestamos/devolver', methods=['POST'])
+@token_required
+def api_devolver_prestamos():
+    """
+    Cuerpo JSON:
+        prestamos: ids o {id, cantidad, novedad, estado_implemento, observaciones}
+        ficha, ambiente, nombre_prestatario: devuelve todos los préstamos activos que coincidan
+        novedad, estado_implemento, observaciones: valores por defecto de cada préstamo
+    """
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Se esperaba un objeto JSON'}), 400
+
+    prestamos = data.get('prestamos') or []
+    if not isinstance(prestamos, list):
+        return jsonify({'error': 'prestamos debe ser una lista'}), 400
+    devoluciones = {}
+    errores = []
+    for posicion, item in enumerate(prestamos, 1):
+        datos = dict(item) if isinstance(item, dict) else {'id': item}
+        id = datos.pop('id', None)
+        if not isinstance(id, int) or isinstance(id, bool):
+            errores.append(f'El préstamo de la posición {posicion} no tiene un id entero')
+        elif id in devoluciones:
+            errores.append(f'El préstamo {id} está repetido')
+        else:
+            devoluciones[id] = {
+                clave: valor for clave, valor in datos.items()
+                if clave in ('cantidad', 'novedad', 'estado_implemento', 'observaciones')
+            }
+    if errores:
+        return jsonify({'error': 'No se registró ninguna devolución', 'errores': errores}), 400
+
+    selector = {columna: data[columna] for columna in SELECTORES_DEVOLUCION if data.get(columna)}
+    comunes = {
+        clave: data[clave] for clave in ('novedad', 'estado_implemento', 'observaciones') if clave in data
+    }
+    usuario_id = g.api_user['uid'] if 'api_user' in g else session.get('user_id')
+
+    try:
+        resumen = registrar_devoluciones(get_db(), devoluciones, selector, comunes, fk_usuario=usuario_id)
+    except DevolucionInvalida as e:
+        return jsonify({'error': 'No se registró ninguna devolución', 'errores': e.errores}), 400
+    except DevolucionConcurrente:
+        return jsonify({'error': 'Los préstamos fueron modificados por otra devolución'}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True, **resumen})
+
 # API estadísticas
 @admin_bp.route('/api/admin/estadisticas')
+@token_required
 def api_estadisticas():
-    conn = get_db_connection()
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
     
-    total_implementos = conn.execute('SELECT COUNT(*) as count FROM implementos').fetchone()['count']
-    total_usuarios = conn.execute('SELECT COUNT(*) as count FROM usuarios').fetchone()['count']
-    total_prestamos = conn.execute('SELECT COUNT(*) as count FROM prestamos').fetchone()['count']
-    prestamos_activos = conn.execute('SELECT COUNT(*) as count FROM prestamos WHERE fecha_devolucion IS NULL').fetchone()['count']
+    conn = get_db()
     
-    conn.close()
+    contadores = obtener_contadores(conn)
     
     return jsonify({
-        'total_implementos': total_implementos,
-        'total_usuarios': total_usuarios,
-        'total_prestamos': total_prestamos,
-        'prestamos_activos': prestamos_activos
+        'total_implementos': contadores['total_implementos'],
+        'total_usuarios': contadores['total_usuarios'],
+        'total_prestamos': contadores['total_prestamos'],
+        'prestamos_activos': contadores['prestamos_activos']
     })
 
 # Gestión de préstamos para instructores
@@ -909,7 +931,7 @@ def gestion_prestamos_instructores():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener y validar filtros
         filtro_estado = request.args.get('estado', 'todos')
@@ -934,18 +956,18 @@ def gestion_prestamos_instructores():
         elif filtro_estado == 'devueltos':
             query += " AND p.fecha_devolucion IS NOT NULL"
         
-        query += " ORDER BY p.fecha_prestamo DESC"
-        
-        prestamos = conn.execute(query, params).fetchall()
+        # Página actual por cursor sobre (fecha_prestamo, id)
+        pagina = paginar_consulta(conn, query, params, CLAVES_PRESTAMOS, request.args)
+        prestamos = pagina['filas']
         
     except Exception as e:
         flash(f'Error al cargar datos: {str(e)}', 'error')
+        pagina = None
         prestamos = []
-    finally:
-        conn.close()
     
     return render_template('views/gestion_prestamos_instructores.html',
                          prestamos=prestamos,
+                         pagina=pagina,
                          filtro_estado=filtro_estado)
 
 # Agregar novedad a préstamo (solo instructores/funcionarios para sus préstamos)
@@ -957,7 +979,7 @@ def agregar_novedad(id):
         flash('No tienes permisos para agregar novedades', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Verificar que el préstamo pertenece al usuario actual
         prestamo = conn.execute('''
@@ -990,23 +1012,22 @@ def agregar_novedad(id):
             WHERE id = ?
         ''', (novedad, descripcion, id))
         
-        conn.commit()
-        
-        # Crear notificación para admin
+        # Crear notificación para admin (en la misma transacción)
         crear_notificacion(
+            conn,
             'novedad_prestamo',
             'Novedad en préstamo',
             f'{session.get("user_nombre")} agregó una novedad al préstamo de {prestamo["implemento"]}: {novedad}',
             session.get('user_id'),
             id
         )
+        conn.commit()
+        avisar_drenador()
         
         flash(f'Novedad agregada exitosamente al préstamo de {prestamo["implemento"]}', 'success')
         
     except Exception as e:
         flash(f'Error al agregar novedad: {str(e)}', 'error')
-    finally:
-        conn.close()
 
     return redirect(url_for('admin.gestion_prestamos_instructores'))
 
@@ -1018,15 +1039,10 @@ def gestion_prestamos_admin():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener implementos disponibles
-        implementos_disponibles = conn.execute('''
-            SELECT id, implemento, disponibilidad, categoria 
-            FROM implementos 
-            WHERE disponibilidad > 0 
-            ORDER BY implemento
-        ''').fetchall()
+        implementos_disponibles = catalogo_cacheado(conn, disponibilidad='disponible')
         
         # Obtener y validar filtros
         filtro_estado = request.args.get('estado', 'todos')
@@ -1047,8 +1063,7 @@ def gestion_prestamos_admin():
         
         # Construir query base para préstamos
         query = '''
-            SELECT p.*, u.nombre as usuario, i.implemento,
-                   julianday('now') - julianday(p.fecha_prestamo) as dias_transcurridos
+            SELECT p.*, u.nombre as usuario, i.implemento
             FROM prestamos p
             JOIN usuarios u ON p.fk_usuario = u.id
             JOIN implementos i ON p.fk_implemento = i.id
@@ -1064,24 +1079,23 @@ def gestion_prestamos_admin():
         
         # Filtro por días
         if filtro_dias > 0:
-            fecha_limite = (datetime.now() - timedelta(days=filtro_dias)).strftime("%Y-%m-%d")
-            query += " AND DATE(p.fecha_prestamo) >= ?"
-            params.append(fecha_limite)
+            query += " AND p.fecha_prestamo >= ?"
+            params.append(inicio_hace_dias(filtro_dias))
         
-        query += " ORDER BY p.fecha_prestamo DESC"
-        
-        prestamos = conn.execute(query, params).fetchall()
+        # Página actual por cursor sobre (fecha_prestamo, id)
+        pagina = paginar_consulta(conn, query, params, CLAVES_PRESTAMOS, request.args)
+        prestamos = pagina['filas']
         
     except Exception as e:
         flash(f'Error al cargar datos: {str(e)}', 'error')
+        pagina = None
         implementos_disponibles = []
         prestamos = []
-    finally:
-        conn.close()
     
     return render_template('admin/gestion_prestamos_admin.html',
                          implementos_disponibles=implementos_disponibles,
                          prestamos=prestamos,
+                         pagina=pagina,
                          filtro_estado=filtro_estado,
                          filtro_dias=filtro_dias)
 
@@ -1093,7 +1107,7 @@ def registrar_prestamo_admin_individual():
         flash('No tienes permisos para realizar esta acción', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         implemento_id = request.form.get('implemento_id')
         nombre_prestatario = request.form.get('nombre_prestatario')
@@ -1117,37 +1131,34 @@ def registrar_prestamo_admin_individual():
         fk_usuario = session.get('user_id')
         fecha_prestamo = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Registrar el préstamo individual
-        cursor = conn.execute('''
-            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, 
-                                instructor, jornada, ambiente, fecha_prestamo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (fk_usuario, implemento_id, 'individual', nombre_prestatario, instructor, jornada, ambiente, fecha_prestamo))
-        
-        prestamo_id = cursor.lastrowid
-
-        # Actualizar la disponibilidad del implemento
-        nueva_disponibilidad = implemento['disponibilidad'] - 1
-        conn.execute('UPDATE implementos SET disponibilidad = ? WHERE id = ?', 
-                    (nueva_disponibilidad, implemento_id))
-
-        conn.commit()
-        
-        # Crear notificación
-        crear_notificacion(
+        # Notificación para admin, encolada en la misma transacción del préstamo
+        notificacion = (
             'prestamo_admin',
             'Préstamo registrado por admin',
             f'Admin registró préstamo individual de {implemento["implemento"]} para {nombre_prestatario}',
-            fk_usuario,
-            prestamo_id
+            fk_usuario
         )
         
+        # Registrar el préstamo individual y descontar la unidad del inventario
+        try:
+            registrar_prestamo(conn, {
+                'fk_usuario': fk_usuario,
+                'fk_implemento': implemento_id,
+                'tipo_prestamo': 'individual',
+                'nombre_prestatario': nombre_prestatario,
+                'instructor': instructor,
+                'jornada': jornada,
+                'ambiente': ambiente,
+                'fecha_prestamo': fecha_prestamo,
+            }, notificacion=notificacion)
+        except DisponibilidadInsuficiente:
+            flash('Este implemento ya no está disponible para préstamo.', 'error')
+            return redirect(url_for('admin.gestion_prestamos_admin'))
+        
         flash(f"Préstamo de '{implemento['implemento']}' registrado con éxito", "success")
         
     except Exception as e:
         flash(f"Error en el préstamo: {str(e)}", "error")
-    finally:
-        conn.close()
 
     return redirect(url_for('admin.gestion_prestamos_admin'))
 
@@ -1159,7 +1170,7 @@ def registrar_prestamo_admin_multiple():
         flash('No tienes permisos para realizar esta acción', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         implemento_id = request.form.get('implemento_id')
         ficha = request.form.get('ficha')
@@ -1186,37 +1197,36 @@ def registrar_prestamo_admin_multiple():
         fk_usuario = session.get('user_id')
         fecha_prestamo = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Registrar el préstamo múltiple
-        cursor = conn.execute('''
-            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, 
-                                instructor, jornada, ficha, ambiente, horario, fecha_prestamo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (fk_usuario, implemento_id, 'multiple', nombre_prestatario, instructor, 'N/A', ficha, ambiente, horario, fecha_prestamo))
-        
-        prestamo_id = cursor.lastrowid
-
-        # Actualizar la disponibilidad del implemento
-        nueva_disponibilidad = implemento['disponibilidad'] - 1
-        conn.execute('UPDATE implementos SET disponibilidad = ? WHERE id = ?', 
-                    (nueva_disponibilidad, implemento_id))
-
-        conn.commit()
-        
-        # Crear notificación
-        crear_notificacion(
+        # Notificación para admin, encolada en la misma transacción del préstamo
+        notificacion = (
             'prestamo_admin',
             'Préstamo múltiple registrado por admin',
             f'Admin registró préstamo múltiple de {implemento["implemento"]} para ficha {ficha}',
-            fk_usuario,
-            prestamo_id
+            fk_usuario
         )
         
+        # Registrar el préstamo múltiple y descontar la unidad del inventario
+        try:
+            registrar_prestamo(conn, {
+                'fk_usuario': fk_usuario,
+                'fk_implemento': implemento_id,
+                'tipo_prestamo': 'multiple',
+                'nombre_prestatario': nombre_prestatario,
+                'instructor': instructor,
+                'jornada': 'N/A',
+                'ficha': ficha,
+                'ambiente': ambiente,
+                'horario': horario,
+                'fecha_prestamo': fecha_prestamo,
+            }, notificacion=notificacion)
+        except DisponibilidadInsuficiente:
+            flash('Este implemento ya no está disponible para préstamo.', 'error')
+            return redirect(url_for('admin.gestion_prestamos_admin'))
+        
         flash(f"Préstamo múltiple de '{implemento['implemento']}' registrado con éxito", "success")
         
     except Exception as e:
         flash(f"Error en el préstamo: {str(e)}", "error")
-    finally:
-        conn.close()
 
     return redirect(url_for('admin.gestion_prestamos_admin'))
 
@@ -1228,7 +1238,7 @@ def editar_prestamo(id):
         flash('No tienes permisos para editar préstamos', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener datos del formulario
         instructor = request.form.get('instructor')
@@ -1262,23 +1272,22 @@ def editar_prestamo(id):
             WHERE id = ?
         ''', (instructor, jornada, ambiente, id))
         
-        conn.commit()
-        
-        # Crear notificación
+        # Crear notificación (en la misma transacción)
         crear_notificacion(
+            conn,
             'prestamo_editado',
             'Préstamo editado',
             f'Admin editó préstamo de {prestamo["implemento"]} - Instructor: {instructor}',
             session.get('user_id'),
             id
         )
+        conn.commit()
+        avisar_drenador()
         
         flash(f'Préstamo de {prestamo["implemento"]} actualizado exitosamente', 'success')
         
     except Exception as e:
         flash(f'Error al editar préstamo: {str(e)}', 'error')
-    finally:
-        conn.close()
 
     return redirect(url_for('admin.gestion_prestamos_admin'))
 
@@ -1291,7 +1300,7 @@ def activar_usuario(id):
     if not is_admin():
         return jsonify({'success': False, 'message': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Verificar que el usuario existe
         usuario = conn.execute('SELECT * FROM usuarios WHERE id = ?', (id,)).fetchone()
@@ -1300,22 +1309,23 @@ def activar_usuario(id):
         
         # Activar usuario
         conn.execute('UPDATE usuarios SET activo = 1 WHERE id = ?', (id,))
-        conn.commit()
-        
-        # Crear notificación
+
+        # Crear notificación (en la misma transacción)
         crear_notificacion(
+            conn,
             'usuario_activado',
             'Usuario activado',
             f'El usuario {usuario["nombre"]} ha sido activado por {session.get("user_nombre")}',
             session.get('user_id')
         )
+        conn.commit()
+        avisar_drenador()
+        invalidar_usuario(id)
         
         return jsonify({'success': True, 'message': 'Usuario activado exitosamente'})
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 # Desactivar usuario
 @admin_bp.route('/desactivar_usuario/<int:id>', methods=['POST'])
@@ -1324,7 +1334,7 @@ def desactivar_usuario(id):
     if not is_admin():
         return jsonify({'success': False, 'message': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Verificar que el usuario existe
         usuario = conn.execute('SELECT * FROM usuarios WHERE id = ?', (id,)).fetchone()
@@ -1337,22 +1347,23 @@ def desactivar_usuario(id):
         
         # Desactivar usuario
         conn.execute('UPDATE usuarios SET activo = 0 WHERE id = ?', (id,))
-        conn.commit()
-        
-        # Crear notificación
+
+        # Crear notificación (en la misma transacción)
         crear_notificacion(
+            conn,
             'usuario_desactivado',
             'Usuario desactivado',
             f'El usuario {usuario["nombre"]} ha sido desactivado por {session.get("user_nombre")}',
             session.get('user_id')
         )
+        conn.commit()
+        avisar_drenador()
+        invalidar_usuario(id)
         
         return jsonify({'success': True, 'message': 'Usuario desactivado exitosamente'})
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 # Editar usuario
 @admin_bp.route('/editar_usuario/<int:id>', methods=['POST'])
@@ -1362,7 +1373,7 @@ def editar_usuario(id):
         flash('No tienes permisos para realizar esta acción', 'error')
         return redirect('/admin/usuarios')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener datos del formulario
         nombre = request.form.get('nombre')
@@ -1400,22 +1411,22 @@ def editar_usuario(id):
             WHERE id = ?
         ''', (nombre, email, telefono, rol, id))
         
-        conn.commit()
-        
-        # Crear notificación
+        # Crear notificación (en la misma transacción)
         crear_notificacion(
+            conn,
             'usuario_editado',
             'Usuario editado',
             f'El usuario {nombre} ha sido editado por {session.get("user_nombre")}',
             session.get('user_id')
         )
+        conn.commit()
+        avisar_drenador()
+        invalidar_usuario(id)
         
         flash(f'Usuario {nombre} actualizado exitosamente', 'success')
         
     except Exception as e:
         flash(f'Error al actualizar usuario: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect('/admin/usuarios')
 
@@ -1426,7 +1437,7 @@ def eliminar_usuario(id):
     if not is_admin():
         return jsonify({'success': False, 'message': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Verificar que el usuario existe
         usuario = conn.execute('SELECT * FROM usuarios WHERE id = ?', (id,)).fetchone()
@@ -1448,31 +1459,32 @@ def eliminar_usuario(id):
         
         # Eliminar usuario
         conn.execute('DELETE FROM usuarios WHERE id = ?', (id,))
-        conn.commit()
-        
-        # Crear notificación
+
+        # Crear notificación (en la misma transacción)
         crear_notificacion(
+            conn,
             'usuario_eliminado',
             'Usuario eliminado',
             f'El usuario {usuario["nombre"]} ha sido eliminado por {session.get("user_nombre")}',
             session.get('user_id')
         )
+        conn.commit()
+        avisar_drenador()
+        invalidar_usuario(id)
         
         return jsonify({'success': True, 'message': 'Usuario eliminado exitosamente'})
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 # API para obtener usuarios pendientes
 @admin_bp.route('/api/usuarios_pendientes')
-@login_required
+@token_required
 def api_usuarios_pendientes():
     if not is_admin():
         return jsonify({'error': 'Sin permisos'}), 403
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         usuarios_pendientes = conn.execute('''
             SELECT id, nombre, email, rol, fecha_registro
@@ -1484,8 +1496,6 @@ def api_usuarios_pendientes():
         return jsonify([dict(usuario) for usuario in usuarios_pendientes])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 # ==================== REPORTES ====================
 
@@ -1497,34 +1507,29 @@ def reportes():
         flash('No tienes permisos para acceder a esta página', 'error')
         return redirect('/')
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener estadísticas básicas para el dashboard
-        total_prestamos = conn.execute('SELECT COUNT(*) as count FROM prestamos').fetchone()['count']
-        prestamos_activos = conn.execute('SELECT COUNT(*) as count FROM prestamos WHERE fecha_devolucion IS NULL').fetchone()['count']
-        prestamos_devueltos = conn.execute('SELECT COUNT(*) as count FROM prestamos WHERE fecha_devolucion IS NOT NULL').fetchone()['count']
+        contadores = obtener_contadores(conn)
+        total_prestamos = contadores['total_prestamos']
+        prestamos_activos = contadores['prestamos_activos']
+        prestamos_devueltos = contadores['prestamos_devueltos']
         
+        # Rankings a partir de los resúmenes diarios, en caché mientras los datos no cambien
+        from utils.cache_reportes import agregado_en_cache
+        from utils.resumenes import implementos_mas_prestados as ranking_implementos, usuarios_mas_activos
+
         # Obtener implementos más prestados
-        implementos_mas_prestados = conn.execute('''
-            SELECT i.implemento, COUNT(p.id) as total_prestamos
-            FROM implementos i
-            LEFT JOIN prestamos p ON i.id = p.fk_implemento
-            GROUP BY i.id, i.implemento
-            ORDER BY total_prestamos DESC
-            LIMIT 10
-        ''').fetchall()
+        implementos_mas_prestados = agregado_en_cache(
+            conn, 'implementos_mas_prestados', {},
+            lambda c: [dict(fila) for fila in ranking_implementos(c)]
+        )
         
         # Obtener usuarios más activos
-        usuarios_activos = conn.execute('''
-            SELECT u.nombre, u.email, COUNT(p.id) as total_prestamos
-            FROM usuarios u
-            LEFT JOIN prestamos p ON u.id = p.fk_usuario
-            GROUP BY u.id, u.nombre, u.email
-            ORDER BY total_prestamos DESC
-            LIMIT 10
-        ''').fetchall()
-        
-        conn.close()
+        usuarios_activos = agregado_en_cache(
+            conn, 'usuarios_activos', {},
+            lambda c: [dict(fila) for fila in usuarios_mas_activos(c)]
+        )
         
         return render_template('admin/reportes.html',
                              total_prestamos=total_prestamos,
@@ -1534,7 +1539,6 @@ def reportes():
                              usuarios_activos=usuarios_activos)
     except Exception as e:
         flash(f'Error al cargar reportes: {str(e)}', 'error')
-        conn.close()
         return redirect('/admin')
 
 # Generar reporte de préstamos en Excel
@@ -1551,187 +1555,35 @@ def generar_reporte_prestamos_excel():
         tipo_reporte = request.form.get('tipo_reporte', 'todos')  # todos, activos, devueltos
         formato = request.form.get('formato', 'detallado')  # detallado, resumen
         
-        print(f"DEBUG: Generando reporte - Tipo: {tipo_reporte}, Formato: {formato}")
-        print(f"DEBUG: Fechas - Inicio: {fecha_inicio}, Fin: {fecha_fin}")
-        
         # Validar fechas
-        if fecha_inicio and fecha_fin:
-            try:
-                from datetime import datetime
-                datetime.strptime(fecha_inicio, '%Y-%m-%d')
-                datetime.strptime(fecha_fin, '%Y-%m-%d')
-            except ValueError:
-                return jsonify({'error': 'Formato de fecha inválido'}), 400
-        
-        # Construir query
-        conn = get_db_connection()
-        
-        query = '''
-            SELECT 
-                p.id,
-                p.tipo_prestamo,
-                p.nombre_prestatario,
-                p.ficha,
-                p.ambiente,
-                p.horario,
-                p.instructor,
-                p.jornada,
-                p.fecha_prestamo,
-                p.fecha_devolucion,
-                p.novedad,
-                p.estado_implemento_devolucion,
-                p.observaciones,
-                i.implemento,
-                i.categoria,
-                u.nombre as usuario_registro,
-                u.email as usuario_email
-            FROM prestamos p
-            JOIN implementos i ON p.fk_implemento = i.id
-            JOIN usuarios u ON p.fk_usuario = u.id
-            WHERE 1=1
-        '''
-        
-        params = []
-        
-        # Filtros de fecha
-        if fecha_inicio:
-            query += " AND DATE(p.fecha_prestamo) >= ?"
-            params.append(fecha_inicio)
-        
-        if fecha_fin:
-            query += " AND DATE(p.fecha_prestamo) <= ?"
-            params.append(fecha_fin)
-        
-        # Filtro de tipo
-        if tipo_reporte == 'activos':
-            query += " AND p.fecha_devolucion IS NULL"
-        elif tipo_reporte == 'devueltos':
-            query += " AND p.fecha_devolucion IS NOT NULL"
-        
-        query += " ORDER BY p.fecha_prestamo DESC"
-        
-        prestamos_raw = conn.execute(query, params).fetchall()
-        conn.close()
-        
-        # Convertir Row objects a diccionarios
-        prestamos = [dict(prestamo) for prestamo in prestamos_raw]
-        print(f"DEBUG: {len(prestamos)} préstamos encontrados para el reporte")
-        
-        # Generar Excel
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        from openpyxl.utils import get_column_letter
-        import io
-        from datetime import datetime
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte de Préstamos"
-        
-        # Estilos
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
+        try:
+            limites_fecha(fecha_inicio, fecha_fin)
+        except ValueError:
+            return jsonify({'error': 'Formato de fecha inválido'}), 400
         
-        # Configurar columnas según el formato
-        if formato == 'detallado':
-            headers = [
-                'ID', 'Tipo Préstamo', 'Prestatario', 'Ficha', 'Ambiente', 'Horario',
-                'Instructor', 'Jornada', 'Implemento', 'Categoría', 'Fecha Préstamo',
-                'Fecha Devolución', 'Estado', 'Novedad', 'Observaciones', 'Registrado por'
-            ]
-            columns = [
-                'id', 'tipo_prestamo', 'nombre_prestatario', 'ficha', 'ambiente', 'horario',
-                'instructor', 'jornada', 'implemento', 'categoria', 'fecha_prestamo',
-                'fecha_devolucion', 'estado_implemento_devolucion', 'novedad', 'observaciones', 'usuario_registro'
-            ]
-        else:  # resumen
-            headers = [
-                'ID', 'Prestatario', 'Implemento', 'Fecha Préstamo', 'Fecha Devolución',
-                'Días Transcurridos', 'Estado', 'Registrado por'
-            ]
-            columns = [
-                'id', 'nombre_prestatario', 'implemento', 'fecha_prestamo',
-                'fecha_devolucion', 'dias_transcurridos', 'estado', 'usuario_registro'
-            ]
-        
-        # Escribir encabezados
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = border
-        
-        # Escribir datos
-        for row, prestamo in enumerate(prestamos, 2):
-            for col, column_name in enumerate(columns, 1):
-                if column_name == 'dias_transcurridos':
-                    # Calcular días transcurridos
-                    if prestamo.get('fecha_devolucion'):
-                        fecha_fin = datetime.strptime(prestamo['fecha_devolucion'][:10], '%Y-%m-%d')
-                        fecha_inicio = datetime.strptime(prestamo['fecha_prestamo'][:10], '%Y-%m-%d')
-                        dias = (fecha_fin - fecha_inicio).days
-                        value = f"{dias} días"
-                    else:
-                        fecha_inicio = datetime.strptime(prestamo['fecha_prestamo'][:10], '%Y-%m-%d')
-                        dias = (datetime.now() - fecha_inicio).days
-                        value = f"{dias} días (activo)"
-                elif column_name == 'estado':
-                    if prestamo.get('fecha_devolucion'):
-                        value = 'Devuelto'
-                    else:
-                        value = 'Activo'
-                else:
-                    # Manejar valores nulos de forma segura
-                    raw_value = prestamo.get(column_name)
-                    if raw_value is None or raw_value == '':
-                        value = ''
-                    else:
-                        value = str(raw_value)
-                
-                cell = ws.cell(row=row, column=col, value=value)
-                cell.border = border
-                cell.alignment = Alignment(vertical='center')
-        
-        # Ajustar ancho de columnas
-        for col in range(1, len(headers) + 1):
-            column_letter = get_column_letter(col)
-            ws.column_dimensions[column_letter].width = 15
-        
-        # Agregar información del reporte
-        ws.cell(row=len(prestamos) + 3, column=1, value="Información del Reporte:")
-        ws.cell(row=len(prestamos) + 4, column=1, value=f"Fecha de generación: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        ws.cell(row=len(prestamos) + 5, column=1, value=f"Total de registros: {len(prestamos)}")
-        ws.cell(row=len(prestamos) + 6, column=1, value=f"Tipo de reporte: {tipo_reporte}")
-        ws.cell(row=len(prestamos) + 7, column=1, value=f"Período: {fecha_inicio or 'Inicio'} - {fecha_fin or 'Actual'}")
-        
-        # Guardar en memoria
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
+        # Reporte desde la caché (mismos parámetros y datos) o generado en disco
+        from flask import send_file
+        from utils.trabajos import parametros_reporte, reporte_prestamos
+
+        ruta = reporte_prestamos(get_db(), parametros_reporte(request.form))
         
         # Generar nombre del archivo
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"reporte_prestamos_{tipo_reporte}_{timestamp}.xlsx"
         
-        from flask import make_response
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        # El archivo se envía por bloques desde el disco
+        response = send_file(
+            ruta,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=filename
+        )
         
-        print(f"DEBUG: Reporte generado exitosamente - {len(prestamos)} registros")
+        current_app.logger.debug('Reporte %s (%s) generado: %s', tipo_reporte, formato, ruta)
         return response
         
     except Exception as e:
-        print(f"ERROR: Error al generar reporte: {e}")
-        import traceback
-        traceback.print_exc()
+        current_app.logger.exception('Error al generar reporte')
         
         # Mensaje de error más amigable
         error_message = str(e)
@@ -1742,11 +1594,123 @@ def generar_reporte_prestamos_excel():
         
         return jsonify({'error': f'Error al generar reporte: {error_message}'}), 500
         
+# Encolar un reporte de préstamos para generarlo en segundo plano
+@admin_bp.route('/reportes/trabajos', methods=['POST'])
+@login_required
+def encolar_reporte_prestamos():
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from utils.trabajos import encolar_reporte, parametros_reporte
+
+    parametros = parametros_reporte(request.form)
+
+    # Validar fechas antes de encolar
+    try:
+        limites_fecha(parametros['fecha_inicio'], parametros['fecha_fin'])
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido'}), 400
+
+    try:
+        trabajo_id = encolar_reporte(get_db(), parametros, session.get('user_id'))
+        return jsonify({
+            'id': trabajo_id,
+            'estado': 'pendiente',
+            'url_estado': url_for('admin.estado_reporte_prestamos', id=trabajo_id),
+            'url_descarga': url_for('admin.descargar_reporte_prestamos', id=trabajo_id),
+        }), 202
+    except Exception as e:
+        return jsonify({'error': f'Error al encolar reporte: {str(e)}'}), 500
+
+# Estado y progreso de un trabajo de reporte
+@admin_bp.route('/reportes/trabajos/<int:id>')
+@login_required
+def estado_reporte_prestamos(id):
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from utils.trabajos import obtener_trabajo
+
+    trabajo = obtener_trabajo(get_db(), id)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    return jsonify({
+        'id': trabajo['id'],
+        'estado': 'vencido' if trabajo['vencido'] else trabajo['estado'],
+        'progreso': trabajo['progreso'],
+        'total_filas': trabajo['total_filas'],
+        'error': trabajo['error'],
+        'expira': trabajo['expira'],
+    })
+
+# Descargar el archivo de un trabajo de reporte terminado
+@admin_bp.route('/reportes/trabajos/<int:id>/descargar')
+@login_required
+def descargar_reporte_prestamos(id):
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from flask import send_file
+    from utils.trabajos import obtener_trabajo, ruta_reporte
+
+    trabajo = obtener_trabajo(get_db(), id)
+    if not trabajo:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    ruta = ruta_reporte(trabajo)
+    if not ruta:
+        if trabajo['estado'] in ('pendiente', 'en_proceso'):
+            return jsonify({'error': 'El reporte aún se está generando'}), 409
+        return jsonify({'error': 'El reporte no está disponible'}), 410
+
+    fecha = trabajo['fecha_creacion'].replace('-', '').replace(':', '').replace(' ', '_')
+    return send_file(
+        ruta,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f"reporte_prestamos_{trabajo['parametros']['tipo_reporte']}_{fecha}.xlsx"
+    )
+
+# Métricas de la caché de reportes
+@admin_bp.route('/api/cache_reportes')
+@login_required
+def api_cache_reportes():
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from utils.cache_reportes import estadisticas_cache
+    from utils.trabajos import directorio_reportes
+
+    return jsonify(estadisticas_cache(directorio_reportes()))
+
+# Métricas de la caché del catálogo
+@admin_bp.route('/api/cache_catalogo')
+@login_required
+def api_cache_catalogo():
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from utils.cache_catalogo import estadisticas_catalogo
+
+    return jsonify(estadisticas_catalogo())
+
+# Métricas de la bandeja de salida de notificaciones
+@admin_bp.route('/api/notificaciones/salida')
+@login_required
+def api_notificaciones_salida():
+    if not is_admin():
+        return jsonify({'error': 'Sin permisos'}), 403
+
+    from utils.notificaciones import estadisticas_notificaciones
+
+    return jsonify(estadisticas_notificaciones(get_db()))
+
 # API para obtener instructores disponibles
 @admin_bp.route('/api/instructores_disponibles')
-@login_required
+@token_required
 def api_instructores_disponibles():
-    conn = get_db_connection()
+    conn = get_db()
     try:
         instructores = conn.execute('''
             SELECT id, nombre, email
@@ -1757,6 +1721,4 @@ def api_instructores_disponibles():
         
         return jsonify([dict(instructor) for instructor in instructores])
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -1,24 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from routes.login import login_required
-from utils.db import get_db_connection, obtener_siguiente_id_consecutivo, reordenar_ids_implementos
+from utils.db import get_db
+from utils.cache_catalogo import catalogo_cacheado
+from utils.helpers import busqueda_fts_disponible, crear_notificacion, expresion_busqueda
+from utils.notificaciones import avisar_drenador
+from utils.prestamos import DisponibilidadInsuficiente, registrar_prestamo
 from datetime import datetime
 
 catalogo_bp = Blueprint('catalogo', __name__, template_folder='templates')
 
-def crear_notificacion(tipo, titulo, mensaje, fk_usuario=None, fk_prestamo=None):
-    """Crea una notificación en el sistema"""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO notificaciones (tipo, titulo, mensaje, fk_usuario, fk_prestamo)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (tipo, titulo, mensaje, fk_usuario, fk_prestamo))
-        conn.commit()
-    except Exception as e:
-        print(f"Error al crear notificación: {e}")
-    finally:
-        conn.close()
-
 # Vista principal del catálogo
 @catalogo_bp.route('/catalogo', methods=['GET', 'POST'])
 @login_required
@@ -49,37 +39,34 @@ def catalogo():
             flash('La disponibilidad debe ser un número entero.', 'error')
             return redirect(url_for('catalogo.catalogo'))
 
-        conn = get_db_connection()
+        conn = get_db()
         try:
-            # Obtener el siguiente ID consecutivo
-            siguiente_id = obtener_siguiente_id_consecutivo()
-            
+            # El número de visualización lo asigna la base de datos (trigger)
             conn.execute(
-                '''INSERT INTO implementos (id, implemento, descripcion, disponibilidad, categoria, imagen_url)
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                (siguiente_id, implemento, descripcion, disponibilidad, categoria, imagen_url)
+                '''INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria, imagen_url)
+                   VALUES (?, ?, ?, ?, ?)''',
+                (implemento, descripcion, disponibilidad, categoria, imagen_url)
             )
-            conn.commit()
-            
-            # Crear notificación para admin
+
+            # Crear notificación para admin (en la misma transacción)
             crear_notificacion(
+                conn,
                 'implemento_nuevo',
                 'Nuevo implemento agregado',
                 f'{implemento} ha sido agregado al catálogo por {session.get("user_nombre")}',
                 session.get('user_id')
             )
+            conn.commit()
+            avisar_drenador()
             
             flash('Implemento agregado al catálogo exitosamente.', 'success')
         except Exception as e:
             flash(f'Error al agregar implemento: {str(e)}', 'error')
-        finally:
-            conn.close()
 
         return redirect(url_for('catalogo.catalogo'))
 
-    conn = get_db_connection()
-    catalogo_items = conn.execute('SELECT * FROM implementos ORDER BY implemento').fetchall()
-    conn.close()
+    conn = get_db()
+    catalogo_items = catalogo_cacheado(conn)
     return render_template('views/catalogo.html', catalogo=catalogo_items)
 
 # Filtrar catálogo
@@ -92,31 +79,58 @@ def filtrar_catalogo():
         categoria = request.args.get('categoria', '').strip()
         disponibilidad = request.args.get('disponibilidad', '').strip()
 
-        conn = get_db_connection()
-        query = "SELECT * FROM implementos WHERE 1=1"
-        params = []
+        conn = get_db()
+        categorias_validas = ['libros', 'computadores', 'mouses', 'teclados', 'otros']
+
+        # Sin texto libre: vista ya filtrada y ordenada de la caché del catálogo
+        if not filtro:
+            catalogo_items = catalogo_cacheado(
+                conn,
+                categoria=categoria if categoria in categorias_validas else None,
+                disponibilidad=disponibilidad if disponibilidad in ('disponible', 'agotado') else None
+            )
+            return render_template('views/catalogo.html',
+                                   catalogo=catalogo_items,
+                                   filtro=filtro,
+                                   categoria=categoria,
+                                   disponibilidad=disponibilidad)
+
+        # Texto libre: índice FTS5 ordenado por relevancia (BM25), sin distinguir
+        # mayúsculas ni tildes y buscando cada palabra como prefijo
+        expresion = expresion_busqueda(filtro)
+        if expresion and busqueda_fts_disponible(conn):
+            query = """
+                SELECT i.* FROM implementos_fts f
+                JOIN implementos i ON i.id = f.rowid
+                WHERE implementos_fts MATCH ?
+            """
+            params = [expresion]
+            orden = " ORDER BY f.rank"
+        else:
+            query = "SELECT i.* FROM implementos i WHERE 1=1"
+            params = []
+            orden = " ORDER BY i.implemento"
+
+            # Sin índice FTS5: filtrar por texto con LIKE (case-insensitive)
+            if filtro:
+                # Limpiar el filtro de caracteres especiales peligrosos
+                filtro_limpio = filtro.replace('%', '').replace('_', '')
+                if filtro_limpio:  # Solo aplicar si queda algo después de limpiar
+                    query += " AND (LOWER(i.implemento) LIKE LOWER(?) OR LOWER(i.descripcion) LIKE LOWER(?))"
+                    params.extend([f'%{filtro_limpio}%', f'%{filtro_limpio}%'])
 
         # Filtrar por categoría (case-insensitive) - validar valores permitidos
-        categorias_validas = ['libros', 'computadores', 'mouses', 'teclados', 'otros']
         if categoria and categoria in categorias_validas:
-            query += " AND LOWER(categoria) = LOWER(?)"
+            query += " AND LOWER(i.categoria) = LOWER(?)"
             params.append(categoria)
 
         # Filtrar por disponibilidad - validar valores permitidos
         if disponibilidad == 'disponible':
-            query += " AND disponibilidad > 0"
+            query += " AND i.disponibilidad > 0"
         elif disponibilidad == 'agotado':
-            query += " AND disponibilidad = 0"
-
-        # Filtrar por texto (case-insensitive) - sanitizar entrada
-        if filtro:
-            # Limpiar el filtro de caracteres especiales peligrosos
-            filtro_limpio = filtro.replace('%', '').replace('_', '')
-            if filtro_limpio:  # Solo aplicar si queda algo después de limpiar
-                query += " AND (LOWER(implemento) LIKE LOWER(?) OR LOWER(descripcion) LIKE LOWER(?))"
-                params.extend([f'%{filtro_limpio}%', f'%{filtro_limpio}%'])
+            query += " AND i.disponibilidad = 0"
 
-        query += " ORDER BY implemento"
+        query += orden
         
         try:
             catalogo_items = conn.execute(query, params).fetchall()
@@ -124,10 +138,8 @@ def filtrar_catalogo():
             print(f"Error en filtro de catálogo: {e}")
             flash('Error al aplicar filtros. Mostrando todos los elementos.', 'warning')
             # Si hay error, mostrar todos los elementos
-            catalogo_items = conn.execute("SELECT * FROM implementos ORDER BY implemento").fetchall()
+            catalogo_items = catalogo_cacheado(conn)
         
-        conn.close()
-
         return render_template('views/catalogo.html',
                                catalogo=catalogo_items,
                                filtro=filtro,
@@ -139,6 +151,21 @@ def filtrar_catalogo():
         flash('Error al procesar la solicitud de filtrado.', 'error')
         return redirect(url_for('catalogo.catalogo'))
 
+# Datos de un implemento para el modal compartido del catálogo
+@catalogo_bp.route('/api/implementos/<int:id>')
+@login_required
+def api_implemento(id):
+    conn = get_db()
+    implemento = conn.execute('''
+        SELECT id, implemento, descripcion, categoria, disponibilidad, imagen_url
+        FROM implementos WHERE id = ?
+    ''', (id,)).fetchone()
+
+    if not implemento:
+        return jsonify({'error': 'Implemento no encontrado'}), 404
+
+    return jsonify(dict(implemento))
+
 # Registrar préstamo
 @catalogo_bp.route('/prestar/<int:id>', methods=['POST'])
 @login_required
@@ -148,7 +175,7 @@ def prestar(id):
         flash('No tienes permiso para realizar préstamos.', 'error')
         return redirect(url_for('catalogo.catalogo'))
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener datos del formulario
         tipo_prestamo = request.form.get('tipo_prestamo')
@@ -193,70 +220,56 @@ def prestar(id):
         fk_usuario = session.get('user_id')
         fecha_prestamo = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Crear registros de préstamo según la cantidad solicitada
-        prestamos_ids = []
-        
-        for i in range(cantidad_solicitada):
-            if tipo_prestamo == 'individual':
-                ambiente = request.form.get('ambiente') or 'SENA'
-                
-                # Registrar el préstamo individual
-                cursor = conn.execute('''
-                    INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, 
-                                        instructor, jornada, ambiente, fecha_prestamo)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (fk_usuario, id, 'individual', nombre_prestatario, instructor, jornada, ambiente, fecha_prestamo))
-                
-                if i == 0:  # Solo para el primer préstamo
-                    tipo_notificacion = 'prestamo_individual'
-                    mensaje_notificacion = f'{nombre_prestatario} ha solicitado {cantidad_solicitada} préstamo{"s" if cantidad_solicitada > 1 else ""} individual{"es" if cantidad_solicitada > 1 else ""} de {implemento["implemento"]}'
-                
-            else:  # tipo_prestamo == 'multiple'
-                ficha = request.form.get('ficha')
-                horario = request.form.get('horario')
-                ambiente = request.form.get('ambiente')
-                
-                if not all([ficha, horario, ambiente]):
-                    flash('Para préstamo múltiple, ficha, horario y ambiente son obligatorios.', 'error')
-                    return redirect(url_for('catalogo.catalogo'))
-                
-                # Registrar el préstamo múltiple
-                cursor = conn.execute('''
-                    INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, 
-                                        instructor, jornada, ficha, horario, ambiente, fecha_prestamo)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (fk_usuario, id, 'multiple', nombre_prestatario, instructor, jornada, ficha, horario, ambiente, fecha_prestamo))
-                
-                if i == 0:  # Solo para el primer préstamo
-                    tipo_notificacion = 'prestamo_multiple'
-                    mensaje_notificacion = f'{nombre_prestatario} ha solicitado {cantidad_solicitada} préstamo{"s" if cantidad_solicitada > 1 else ""} múltiple{"s" if cantidad_solicitada > 1 else ""} de {implemento["implemento"]} - Ficha: {ficha}'
+        # Datos del préstamo según su tipo
+        campos = {
+            'fk_usuario': fk_usuario,
+            'fk_implemento': id,
+            'tipo_prestamo': 'individual',
+            'nombre_prestatario': nombre_prestatario,
+            'instructor': instructor,
+            'jornada': jornada,
+            'fecha_prestamo': fecha_prestamo,
+        }
+        if tipo_prestamo == 'individual':
+            campos['ambiente'] = request.form.get('ambiente') or 'SENA'
             
-            prestamos_ids.append(cursor.lastrowid)
-
-        prestamo_id = prestamos_ids[0]  # Usar el primer ID para la notificación
-
-        # Actualizar la disponibilidad del implemento
-        nueva_disponibilidad = implemento['disponibilidad'] - cantidad_solicitada
-        conn.execute('UPDATE implementos SET disponibilidad = ? WHERE id = ?', 
-                    (nueva_disponibilidad, id))
+            tipo_notificacion = 'prestamo_individual'
+            mensaje_notificacion = f'{nombre_prestatario} ha solicitado {cantidad_solicitada} préstamo{"s" if cantidad_solicitada > 1 else ""} individual{"es" if cantidad_solicitada > 1 else ""} de {implemento["implemento"]}'
+            
+        else:  # tipo_prestamo == 'multiple'
+            ficha = request.form.get('ficha')
+            horario = request.form.get('horario')
+            ambiente = request.form.get('ambiente')
+            
+            if not all([ficha, horario, ambiente]):
+                flash('Para préstamo múltiple, ficha, horario y ambiente son obligatorios.', 'error')
+                return redirect(url_for('catalogo.catalogo'))
+            
+            campos.update(tipo_prestamo='multiple', ficha=ficha, horario=horario, ambiente=ambiente)
+            
+            tipo_notificacion = 'prestamo_multiple'
+            mensaje_notificacion = f'{nombre_prestatario} ha solicitado {cantidad_solicitada} préstamo{"s" if cantidad_solicitada > 1 else ""} múltiple{"s" if cantidad_solicitada > 1 else ""} de {implemento["implemento"]} - Ficha: {ficha}'
 
-        conn.commit()
-        
-        # Crear notificación para admin
-        crear_notificacion(
+        # Notificación para admin, encolada en la misma transacción del préstamo
+        notificacion = (
             tipo_notificacion,
             f'Nuevo préstamo {tipo_prestamo}',
             mensaje_notificacion,
-            fk_usuario,
-            prestamo_id
+            fk_usuario
         )
         
+        # Registrar el préstamo y descontar las unidades en la misma transacción;
+        # si otro préstamo se llevó las unidades entre tanto, no se registra nada
+        try:
+            registrar_prestamo(conn, campos, cantidad_solicitada, notificacion=notificacion)
+        except DisponibilidadInsuficiente:
+            flash(f'Ya no quedan {cantidad_solicitada} unidad{"es" if cantidad_solicitada > 1 else ""} disponible{"s" if cantidad_solicitada > 1 else ""} de {implemento["implemento"]}.', 'error')
+            return redirect(url_for('catalogo.catalogo'))
+        
         flash(f"{cantidad_solicitada} préstamo{'s' if cantidad_solicitada > 1 else ''} {tipo_prestamo}{'s' if cantidad_solicitada > 1 else ''} de '{implemento['implemento']}' registrado{'s' if cantidad_solicitada > 1 else ''} con éxito", "success")
         
     except Exception as e:
         flash(f"Error en el préstamo: {str(e)}", "error")
-    finally:
-        conn.close()
 
     return redirect(url_for('catalogo.catalogo'))
 
@@ -269,7 +282,7 @@ def prestar_multiple(id):
         flash('No tienes permiso para realizar préstamos.', 'error')
         return redirect(url_for('catalogo.catalogo'))
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener cantidad solicitada
         try:
@@ -315,43 +328,34 @@ def prestar_multiple(id):
             flash('Para préstamo múltiple, ficha, ambiente y horario son obligatorios.', 'error')
             return redirect(url_for('catalogo.catalogo'))
 
-        # Crear registros de préstamo según la cantidad solicitada
-        prestamos_ids = []
-        
-        for i in range(cantidad_solicitada):
-            # Registrar el préstamo múltiple
-            cursor = conn.execute('''
-                INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, 
-                                    ficha, ambiente, horario, fecha_prestamo)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (fk_usuario, id, 'multiple', nombre_prestatario, ficha, ambiente, horario, fecha_prestamo))
-            
-            prestamos_ids.append(cursor.lastrowid)
-        
-        prestamo_id = prestamos_ids[0]  # Usar el primer ID para la notificación
-
-        # Actualizar la disponibilidad del implemento
-        nueva_disponibilidad = implemento['disponibilidad'] - cantidad_solicitada
-        conn.execute('UPDATE implementos SET disponibilidad = ? WHERE id = ?', 
-                    (nueva_disponibilidad, id))
-
-        conn.commit()
-        
-        # Crear notificación para admin
-        crear_notificacion(
+        # Notificación para admin, encolada en la misma transacción del préstamo
+        notificacion = (
             'prestamo_multiple',
             'Nuevo préstamo múltiple',
             f'{nombre_prestatario} ha solicitado {cantidad_solicitada} préstamo{"s" if cantidad_solicitada > 1 else ""} múltiple{"s" if cantidad_solicitada > 1 else ""} de {implemento["implemento"]} - Ficha: {ficha}, Ambiente: {ambiente}',
-            fk_usuario,
-            prestamo_id
+            fk_usuario
         )
         
+        # Registrar el préstamo y descontar las unidades en la misma transacción
+        try:
+            registrar_prestamo(conn, {
+                'fk_usuario': fk_usuario,
+                'fk_implemento': id,
+                'tipo_prestamo': 'multiple',
+                'nombre_prestatario': nombre_prestatario,
+                'ficha': ficha,
+                'ambiente': ambiente,
+                'horario': horario,
+                'fecha_prestamo': fecha_prestamo,
+            }, cantidad_solicitada, notificacion=notificacion)
+        except DisponibilidadInsuficiente:
+            flash(f'Ya no quedan {cantidad_solicitada} unidad{"es" if cantidad_solicitada > 1 else ""} disponible{"s" if cantidad_solicitada > 1 else ""} de {implemento["implemento"]}.', 'error')
+            return redirect(url_for('catalogo.catalogo'))
+        
         flash(f"{cantidad_solicitada} préstamo{'s' if cantidad_solicitada > 1 else ''} múltiple{'s' if cantidad_solicitada > 1 else ''} de '{implemento['implemento']}' registrado{'s' if cantidad_solicitada > 1 else ''} con éxito", "success")
         
     except Exception as e:
         flash(f"Error en el préstamo: {str(e)}", "error")
-    finally:
-        conn.close()
 
     return redirect(url_for('catalogo.catalogo'))
 
@@ -382,7 +386,7 @@ def editar_implemento(id):
         flash('La disponibilidad debe ser un número entero.', 'error')
         return redirect(url_for('catalogo.catalogo'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute(
             '''UPDATE implementos 
@@ -395,8 +399,6 @@ def editar_implemento(id):
         flash('Implemento actualizado exitosamente.', 'success')
     except Exception as e:
         flash(f'Error al actualizar implemento: {str(e)}', 'error')
-    finally:
-        conn.close()
 
     return redirect(url_for('catalogo.catalogo'))
 
@@ -408,7 +410,7 @@ def eliminar_implemento(id):
         flash('No tienes permiso para eliminar implementos.', 'error')
         return redirect(url_for('catalogo.catalogo'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Verificar si hay préstamos activos
         prestamos_activos = conn.execute(
@@ -420,17 +422,13 @@ def eliminar_implemento(id):
             flash('No se puede eliminar el implemento porque tiene préstamos activos.', 'error')
             return redirect(url_for('catalogo.catalogo'))
 
+        # Los ids y los números de los demás implementos no cambian
         conn.execute('DELETE FROM implementos WHERE id = ?', (id,))
         conn.commit()
         
-        # Reordenar IDs para mantener secuencia consecutiva
-        reordenar_ids_implementos()
-        
         flash('Implemento eliminado exitosamente.', 'success')
         
     except Exception as e:
         flash(f'Error al eliminar implemento: {str(e)}', 'error')
-    finally:
-        conn.close()
 
     return redirect(url_for('catalogo.catalogo'))
\ No newline at end of file
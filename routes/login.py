@@ -1,46 +1,64 @@
-from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for, session
+from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for, session, current_app, g
 import sqlite3
-from utils.db import get_db_connection
-from werkzeug.security import check_password_hash
+from utils.db import get_db
+from utils.contrasenas import SistemaOcupado, actualizar_hash_si_corresponde, verificar_contrasena
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Configuración del Blueprint
 login_bp = Blueprint('login', __name__, template_folder='templates')
 
-# Diccionario para rastrear intentos de login fallidos
-login_attempts = {}
+# Intentos fallidos permitidos en la ventana, por email y por dirección IP
+INTENTOS_POR_EMAIL = 5
+INTENTOS_POR_IP = 20
+VENTANA_LOGIN = 15 * 60  # segundos
 
 def validate_email(email):
     """Valida el formato del email"""
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
-def is_login_blocked(email):
-    """Verifica si el email está bloqueado por intentos fallidos"""
-    if email in login_attempts:
-        attempts = login_attempts[email]
-        if attempts['count'] >= 5:
-            # Bloquear por 15 minutos
-            if datetime.now() - attempts['last_attempt'] < timedelta(minutes=15):
-                return True
-            else:
-                # Resetear contador después del bloqueo
-                del login_attempts[email]
-    return False
-
-def record_failed_attempt(email):
-    """Registra un intento fallido de login"""
-    if email not in login_attempts:
-        login_attempts[email] = {'count': 0, 'last_attempt': None}
-    
-    login_attempts[email]['count'] += 1
-    login_attempts[email]['last_attempt'] = datetime.now()
+def login_limiters():
+    """
+    Limitadores de intentos de login (email, ip) de la aplicación actual
+
+    LOGIN_LIMITS_STORE elige el almacén: 'sqlite' (por defecto, compartido
+    entre procesos) o 'memory' (LRU por proceso).
+    """
+    limitadores = current_app.extensions.get('login_limiters')
+    if limitadores is None:
+        from utils.limites import AlmacenMemoria, AlmacenSQLite, Limitador
+        if current_app.config.get('LOGIN_LIMITS_STORE', 'sqlite') == 'memory':
+            almacen = AlmacenMemoria()
+        else:
+            almacen = AlmacenSQLite(get_db)
+        limitadores = (
+            Limitador(almacen, INTENTOS_POR_EMAIL, VENTANA_LOGIN),
+            Limitador(almacen, INTENTOS_POR_IP, VENTANA_LOGIN),
+        )
+        current_app.extensions['login_limiters'] = limitadores
+    return limitadores
+
+def is_login_blocked(email, ip):
+    """Verifica si el email o la IP están bloqueados por intentos fallidos"""
+    por_email, por_ip = login_limiters()
+    return por_email.bloqueado(f'email:{email.lower()}') or por_ip.bloqueado(f'ip:{ip}')
+
+def record_failed_attempt(email, ip):
+    """
+    Registra un intento fallido de login
+
+    Returns:
+        int: Intentos que le quedan al email antes del bloqueo
+    """
+    por_email, por_ip = login_limiters()
+    por_ip.registrar(f'ip:{ip}')
+    return por_email.registrar(f'email:{email.lower()}')
 
 def clear_failed_attempts(email):
-    """Limpia los intentos fallidos después de un login exitoso"""
-    if email in login_attempts:
-        del login_attempts[email]
+    """Limpia los intentos fallidos del email después de un login exitoso (los de la IP se mantienen)"""
+    por_email, _ = login_limiters()
+    por_email.reiniciar(f'email:{email.lower()}')
 
 # Rutas del Blueprint
 @login_bp.route('/login', methods=['GET', 'POST'])
@@ -61,21 +79,27 @@ def login():
             flash('Por favor, ingrese un email válido', 'error')
             return render_template('views/login.html')
         
-        # Verificar si el email está bloqueado
-        if is_login_blocked(email):
+        # Verificar si el email o la IP están bloqueados
+        if is_login_blocked(email, request.remote_addr):
             flash('Demasiados intentos fallidos. Por favor, espere 15 minutos antes de intentar nuevamente.', 'error')
             return render_template('views/login.html')
         
         # Buscar usuario en la base de datos
-        conn = get_db_connection()
+        conn = get_db()
         usuario = conn.execute(
             'SELECT * FROM usuarios WHERE email = ?', (email,)
         ).fetchone()
-        conn.close()
         
         
+        # Verificar la contraseña en el pool de hash (acotado)
+        try:
+            valida = usuario is not None and verificar_contrasena(usuario[4], password)
+        except SistemaOcupado:
+            flash('El servidor está ocupado. Por favor, intente de nuevo en unos segundos.', 'warning')
+            return render_template('views/login.html'), 503
+        
         # Verificar si el usuario existe y la contraseña es correcta
-        if usuario and check_password_hash(usuario[4], password):
+        if valida:
             # Verificar si el usuario está activo (1 = activo, 0 = inactivo)
             if usuario[6] != 1:
                 flash('Tu cuenta está pendiente de aprobación por un administrador. Por favor, espera a ser activado.', 'warning')
@@ -84,7 +108,11 @@ def login():
             # Limpiar intentos fallidos después de login exitoso
             clear_failed_attempts(email)
             
-            # Login exitoso - guardar datos en sesión
+            # Actualizar el hash si se generó con otra política
+            actualizar_hash_si_corresponde(conn, usuario[0], usuario[4], password)
+            
+            # Login exitoso - id de sesión nuevo (evita la fijación de sesión) y datos
+            session.regenerar()
             session['user_id'] = usuario[0]
             session['user_nombre'] = usuario[1]
             session['user_email'] = usuario[2]
@@ -106,10 +134,9 @@ def login():
                 return redirect('/')
         else:
             # Login fallido - registrar intento
-            record_failed_attempt(email)
+            attempts_left = record_failed_attempt(email, request.remote_addr)
             
             # Mensaje personalizado según el número de intentos
-            attempts_left = 5 - login_attempts.get(email, {}).get('count', 0)
             if attempts_left > 0:
                 flash(f'Credenciales incorrectas. Te quedan {attempts_left} intentos.', 'error')
             else:
@@ -124,8 +151,9 @@ def logout():
     # Obtener información del usuario antes de limpiar la sesión
     user_name = session.get('user_nombre', 'Usuario')
     
-    # Limpiar la sesión
+    # Limpiar la sesión y descartar su id
     session.clear()
+    session.regenerar()
     
     flash(f'Has cerrado sesión correctamente, {user_name}', 'success')
     return redirect(url_for('login.login'))
@@ -148,22 +176,70 @@ def session_info():
     })
 
 # Middleware para verificar autenticación
+def session_user_valid():
+    """
+    Revalida la cuenta de la sesión con la caché de usuarios
+
+    Si el usuario fue eliminado o desactivado se cierra la sesión; si cambió
+    su rol, la sesión toma el rol vigente.
+
+    Returns:
+        bool: True si la sesión pertenece a un usuario activo
+    """
+    from utils.usuarios import obtener_identidad
+    if 'user_id' not in session:
+        return False
+    identidad = obtener_identidad(session['user_id'])
+    if identidad is None or not identidad.activo:
+        session.clear()
+        return False
+    if session.get('rol') != identidad.rol:
+        session['rol'] = identidad.rol
+    return True
+
 def login_required(view):
     from functools import wraps
     @wraps(view)
     def wrapped_view(*args, **kwargs):
-        if 'user_id' not in session:
+        if not session_user_valid():
             flash('Por favor, inicie sesión para acceder a esta página', 'error')
             return redirect(url_for('login.login'))
         return view(*args, **kwargs)
     return wrapped_view
 
+def bearer_token():
+    """Token de la cabecera 'Authorization: Bearer ...', o None"""
+    auth = request.authorization
+    if auth is not None and auth.type == 'bearer' and auth.token:
+        return auth.token
+    return None
+
+# Middleware para la API JSON: token Bearer o, si no hay, la sesión
+def token_required(view):
+    from functools import wraps
+    @wraps(view)
+    def wrapped_view(*args, **kwargs):
+        token = bearer_token()
+        if token is None:
+            return login_required(view)(*args, **kwargs)
+        
+        # Con token no se lee ni se escribe la sesión
+        from utils.tokens import TokenInvalido, verificar_token
+        try:
+            g.api_user = verificar_token(get_db(), token)
+        except TokenInvalido as e:
+            respuesta = jsonify({'error': str(e)})
+            respuesta.headers['WWW-Authenticate'] = 'Bearer'
+            return respuesta, 401
+        return view(*args, **kwargs)
+    return wrapped_view
+
 # Middleware para verificar si el usuario es admin
 def admin_required(view):
     from functools import wraps
     @wraps(view)
     def wrapped_view(*args, **kwargs):
-        if 'user_id' not in session:
+        if not session_user_valid():
             flash('Por favor, inicie sesión para acceder a esta página', 'error')
             return redirect(url_for('login.login'))
         if session.get('rol') != 'admin':
@@ -177,7 +253,7 @@ def prestamo_required(view):
     from functools import wraps
     @wraps(view)
     def wrapped_view(*args, **kwargs):
-        if 'user_id' not in session:
+        if not session_user_valid():
             flash('Por favor, inicie sesión para acceder a esta página', 'error')
             return redirect(url_for('login.login'))
         if session.get('rol') not in ['admin', 'instructor', 'funcionario']:
@@ -189,23 +265,42 @@ def prestamo_required(view):
 # API endpoint para verificar credenciales
 @login_bp.route('/api/login', methods=['POST'])
 def api_login():
-    data = request.get_json()
+    # Cuerpo ausente, que no es JSON o con campos que no son texto: 400 antes de tocar los limitadores
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        data = {}
     email = data.get('email', '')
     password = data.get('password', '')
     
-    if not email or not password:
+    if not isinstance(email, str) or not isinstance(password, str) or not email or not password:
         return jsonify({'success': False, 'message': 'Email y contraseña requeridos'}), 400
     
-    conn = get_db_connection()
+    if is_login_blocked(email, request.remote_addr):
+        respuesta = jsonify({'success': False, 'message': 'Demasiados intentos fallidos, intente más tarde'})
+        respuesta.headers['Retry-After'] = str(VENTANA_LOGIN)
+        return respuesta, 429
+    
+    conn = get_db()
     usuario = conn.execute(
         'SELECT * FROM usuarios WHERE email = ?', (email,)
     ).fetchone()
-    conn.close()
     
-    if usuario and check_password_hash(usuario[4], password):
+    try:
+        valida = usuario is not None and verificar_contrasena(usuario[4], password)
+    except SistemaOcupado:
+        respuesta = jsonify({'success': False, 'message': 'Servidor ocupado, intente de nuevo'})
+        respuesta.headers['Retry-After'] = '1'
+        return respuesta, 503
+    
+    if valida:
         if usuario[6] != 1:
             return jsonify({'success': False, 'message': 'Cuenta pendiente de aprobación'}), 403
             
+        clear_failed_attempts(email)
+        actualizar_hash_si_corresponde(conn, usuario[0], usuario[4], password)
+        
+        # Token Bearer para las llamadas siguientes a la API
+        from utils.tokens import emitir_token, vida_token
         return jsonify({
             'success': True, 
             'message': 'Login exitoso',
@@ -214,7 +309,22 @@ def api_login():
                 'nombre': usuario[1],
                 'email': usuario[2],
                 'rol': usuario[5]
-            }
+            },
+            'token': emitir_token(usuario[0], usuario[5]),
+            'token_type': 'Bearer',
+            'expires_in': vida_token()
         })
     else:
-        return jsonify({'success': False, 'message': 'Credenciales incorrectas'}), 401
\ No newline at end of file
+        record_failed_attempt(email, request.remote_addr)
+        return jsonify({'success': False, 'message': 'Credenciales incorrectas'}), 401
+
+# API endpoint para revocar el token actual
+@login_bp.route('/api/logout', methods=['POST'])
+@token_required
+def api_logout():
+    if 'api_user' not in g:
+        return jsonify({'success': False, 'message': 'Se requiere un token Bearer'}), 400
+    
+    from utils.tokens import revocar_token
+    revocar_token(get_db(), g.api_user)
+    return jsonify({'success': True, 'message': 'Token revocado'})
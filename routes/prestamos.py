@@ -1,29 +1,22 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from routes.login import login_required
-from utils.db import get_db_connection
-from datetime import datetime, timedelta
+from utils.contadores import obtener_contadores
+from utils.db import get_db
+from utils.helpers import inicio_hace_dias
+from utils.paginacion import CLAVES_PRESTAMOS, paginar_consulta
+from utils.resumenes import totales_periodo
+from utils.prestamos import (
+    NOVEDADES_QUE_REDUCEN_CANTIDAD, DevolucionConcurrente, devolucion_completa, leer_cantidad,
+    registrar_devolucion, unidades_pendientes
+)
 
 prestamos_bp = Blueprint('prestamos', __name__, template_folder='templates')
 
-def crear_notificacion(tipo, titulo, mensaje, fk_usuario=None, fk_prestamo=None):
-    """Crea una notificación en el sistema"""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO notificaciones (tipo, titulo, mensaje, fk_usuario, fk_prestamo)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (tipo, titulo, mensaje, fk_usuario, fk_prestamo))
-        conn.commit()
-    except Exception as e:
-        print(f'Error al crear notificación: {e}')
-    finally:
-        conn.close()
-
 # Obtener detalles de un préstamo (para modal)
 @prestamos_bp.route('/detalle_prestamo/<int:id>', methods=['GET'])
 @login_required
 def detalle_prestamo(id):
-    conn = get_db_connection()
+    conn = get_db()
     try:
         prestamo = conn.execute('''
             SELECT p.*, u.nombre as usuario, u.email, i.implemento, i.estado as estado_implemento
@@ -41,8 +34,6 @@ def detalle_prestamo(id):
     except Exception as e:
         flash(f'Error al obtener detalles: {str(e)}', 'error')
         return redirect(url_for('prestamos.prestamos'))
-    finally:
-        conn.close()
 
 # Exportar datos
 @prestamos_bp.route('/exportar_prestamos', methods=['GET'])
@@ -56,7 +47,7 @@ def exportar_prestamos():
 @prestamos_bp.route('/prestamos', methods=['GET'])
 @login_required
 def prestamos():
-    conn = get_db_connection()
+    conn = get_db()
     
     try:
         # Obtener y validar filtros
@@ -76,56 +67,73 @@ def prestamos():
         except (ValueError, TypeError):
             filtro_dias = 30
         
-        # Construir query base
-        query = '''
-            SELECT p.*, u.nombre as usuario, i.implemento,
-                   julianday('now') - julianday(p.fecha_prestamo) as dias_transcurridos
-            FROM prestamos p
-            JOIN usuarios u ON p.fk_usuario = u.id
-            JOIN implementos i ON p.fk_implemento = i.id
-            WHERE 1=1
-        '''
+        # Filtros comunes al listado y a los totales
+        filtros = ''
         params = []
         
         # Aplicar filtros
         if filtro_estado == 'activos':
-            query += " AND p.fecha_devolucion IS NULL"
+            filtros += " AND p.fecha_devolucion IS NULL"
         elif filtro_estado == 'devueltos':
-            query += " AND p.fecha_devolucion IS NOT NULL"
+            filtros += " AND p.fecha_devolucion IS NOT NULL"
         
         # Filtro por días
         if filtro_dias > 0:
-            fecha_limite = (datetime.now() - timedelta(days=filtro_dias)).strftime("%Y-%m-%d")
-            query += " AND DATE(p.fecha_prestamo) >= ?"
-            params.append(fecha_limite)
+            filtros += " AND p.fecha_prestamo >= ?"
+            params.append(inicio_hace_dias(filtro_dias))
         
         # Si no es admin, solo ver sus propios préstamos
         if session.get('rol') != 'admin':
-            query += " AND p.fk_usuario = ?"
+            filtros += " AND p.fk_usuario = ?"
             params.append(session.get('user_id'))
         
-        query += " ORDER BY p.fecha_prestamo DESC"
-        
-        prestamos_list = conn.execute(query, params).fetchall()
+        # Página actual por cursor sobre (fecha_prestamo, id)
+        query = '''
+            SELECT p.*, u.nombre as usuario, i.implemento
+            FROM prestamos p
+            JOIN usuarios u ON p.fk_usuario = u.id
+            JOIN implementos i ON p.fk_implemento = i.id
+            WHERE 1=1
+        ''' + filtros
+        pagina = paginar_consulta(conn, query, params, CLAVES_PRESTAMOS, request.args)
         
-        # Calcular estadísticas
+        # Totales en unidades del periodo; el estado elegido se aplica sobre ellos
+        desde = inicio_hace_dias(filtro_dias) if filtro_dias > 0 else None
+        if session.get('rol') != 'admin':
+            # Solo los préstamos del usuario: en vivo sobre su índice
+            condicion = 'fk_usuario = ?' + (' AND fecha_prestamo >= ?' if desde else '')
+            fila = conn.execute(f'''
+                SELECT COALESCE(SUM(cantidad), 0), COALESCE(SUM(cantidad - cantidad_devuelta), 0)
+                FROM prestamos WHERE {condicion}
+            ''', [session.get('user_id')] + ([desde] if desde else [])).fetchone()
+            total, activos = fila[0], fila[1]
+        elif desde:
+            # Resúmenes diarios (migración 011)
+            totales = totales_periodo(conn, desde)
+            total, activos = totales['total_prestamos'], totales['activos']
+        else:
+            # Contadores mantenidos por triggers (migración 006)
+            contadores = obtener_contadores(conn)
+            total, activos = contadores['total_prestamos'], contadores['prestamos_activos']
+        if filtro_estado == 'activos':
+            total = activos
+        elif filtro_estado == 'devueltos':
+            total, activos = total - activos, 0
         stats = {
-            'total_prestamos': len(prestamos_list),
-            'prestamos_activos': len([p for p in prestamos_list if p['fecha_devolucion'] is None]),
-            'prestamos_devueltos': len([p for p in prestamos_list if p['fecha_devolucion'] is not None])
+            'total_prestamos': total,
+            'prestamos_activos': activos,
+            'prestamos_devueltos': total - activos
         }
         
-        conn.close()
-        
         return render_template('views/prestamos.html',
-                             prestamos=prestamos_list,
+                             prestamos=pagina['filas'],
+                             pagina=pagina,
                              stats=stats,
                              filtro_estado=filtro_estado,
                              filtro_dias=filtro_dias)
     
     except Exception as e:
         flash(f'Error al cargar préstamos: {str(e)}', 'error')
-        conn.close()
         return redirect(url_for('index'))
 
 # Procesar devolución de préstamo (solo admin)
@@ -136,7 +144,7 @@ def devolver_prestamo(id):
         flash('No tienes permiso para procesar devoluciones.', 'error')
         return redirect(url_for('prestamos.prestamos'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Obtener datos del formulario
         novedad = request.form.get('novedad', 'Ninguna')
@@ -160,64 +168,40 @@ def devolver_prestamo(id):
             flash('Este préstamo ya fue devuelto anteriormente.', 'warning')
             return redirect(url_for('prestamos.prestamos'))
 
-        # Registrar la devolución
-        fecha_devolucion = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conn.execute('''
-            UPDATE prestamos 
-            SET fecha_devolucion = ?, novedad = ?, estado_implemento_devolucion = ?, observaciones = ?
-            WHERE id = ?
-        ''', (fecha_devolucion, novedad, estado_implemento, observaciones, id))
-
-        # Actualizar disponibilidad del implemento según la novedad
-        novedades_que_reducen_cantidad = ['Daño', 'Robo', 'Desgaste excesivo', 'Pérdida']
-        cantidad_a_reducir = 0
-        
-        if novedad in novedades_que_reducen_cantidad:
-            cantidad_a_reducir = 1
-            print(f"DEBUG: Novedad '{novedad}' detectada - reduciendo cantidad en {cantidad_a_reducir}")
-        
-        # Calcular nueva disponibilidad (normalmente +1, pero -1 si hay novedad grave)
-        nueva_disponibilidad = prestamo['disponibilidad'] + 1 - cantidad_a_reducir
-        
-        # Asegurar que la disponibilidad no sea negativa
-        if nueva_disponibilidad < 0:
-            nueva_disponibilidad = 0
-        
-        conn.execute(
-            'UPDATE implementos SET disponibilidad = ? WHERE id = ?',
-            (nueva_disponibilidad, prestamo['fk_implemento'])
-        )
-        
-        # Actualizar estado del implemento si es necesario
-        if estado_implemento != 'Bueno':
-            conn.execute(
-                'UPDATE implementos SET estado = ? WHERE id = ?',
-                (estado_implemento, prestamo['fk_implemento'])
-            )
+        # Validar unidades a devolver (por defecto, todas las pendientes)
+        pendientes = unidades_pendientes(prestamo)
+        cantidad = leer_cantidad(request.form.get('cantidad'), pendientes)
+        if cantidad <= 0 or cantidad > pendientes:
+            flash(f'La cantidad a devolver debe estar entre 1 y {pendientes}.', 'error')
+            return redirect(url_for('prestamos.prestamos'))
 
-        conn.commit()
-        
-        # Crear notificación con información sobre la novedad
+        # Mensaje de la notificación con información sobre la novedad
+        completo = devolucion_completa(prestamo, cantidad)
         mensaje_notif = f'Devolución de {prestamo["implemento"]} por {prestamo["usuario_nombre"]}'
+        if prestamo['cantidad'] > 1:
+            mensaje_notif += f' ({cantidad} de {prestamo["cantidad"]} unidades)'
+        if not completo:
+            mensaje_notif += ' - Devolución parcial'
         if novedad != 'Ninguna':
             mensaje_notif += f' - Novedad: {novedad}'
-            if novedad in novedades_que_reducen_cantidad:
+            if novedad in NOVEDADES_QUE_REDUCEN_CANTIDAD:
                 mensaje_notif += ' - Se redujo la cantidad disponible del implemento'
         if estado_implemento != 'Bueno':
             mensaje_notif += f' - Estado: {estado_implemento}'
         
-        crear_notificacion(
-            'devolucion',
-            'Devolución registrada',
-            mensaje_notif,
-            session.get('user_id'),
-            id
-        )
+        # Registrar la devolución, reingresar las unidades al inventario y
+        # encolar la notificación en una sola transacción
+        try:
+            registrar_devolucion(
+                conn, prestamo, cantidad, novedad, estado_implemento, observaciones,
+                notificacion=('devolucion', 'Devolución registrada', mensaje_notif, session.get('user_id'))
+            )
+        except DevolucionConcurrente:
+            flash('El préstamo fue modificado por otra devolución. Revisa las unidades pendientes.', 'warning')
+            return redirect(url_for('prestamos.prestamos'))
         
         flash(f'Devolución registrada exitosamente: {prestamo["implemento"]}', 'success')
     except Exception as e:
         flash(f'Error al procesar la devolución: {str(e)}', 'error')
-    finally:
-        conn.close()
 
     return redirect(url_for('prestamos.prestamos'))
\ No newline at end of file
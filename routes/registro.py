@@ -1,8 +1,8 @@
 from flask import Blueprint, request, jsonify, render_template, flash, redirect, url_for
 import sqlite3
 import re
-from utils.db import get_db_connection
-from werkzeug.security import generate_password_hash
+from utils.db import get_db
+from utils.contrasenas import SistemaOcupado, generar_hash
 
 # Configuración del Blueprint
 registro_bp = Blueprint('registro', __name__, template_folder='templates')
@@ -47,11 +47,15 @@ def registro_usuario():
             flash('La contraseña debe tener al menos 8 caracteres', 'error')
             return render_template('views/registro.html')
         
-        # Hash de la contraseña
-        hashed_password = generate_password_hash(password)
+        # Hash de la contraseña con la política actual (en el pool de hash)
+        try:
+            hashed_password = generar_hash(password)
+        except SistemaOcupado:
+            flash('El servidor está ocupado. Por favor, intente de nuevo en unos segundos.', 'warning')
+            return render_template('views/registro.html'), 503
         
         # Guardar en la base de datos
-        conn = get_db_connection()
+        conn = get_db()
         try:
             conn.execute(
                 'INSERT INTO usuarios (nombre, email, telefono, password, rol, activo) VALUES (?, ?, ?, ?, ?, ?)',
@@ -84,8 +88,6 @@ def registro_usuario():
                 flash('Error al crear la cuenta. Por favor, intente nuevamente.', 'error')
         except sqlite3.Error as e:
             flash(f'Error al guardar en la base de datos: {str(e)}', 'error')
-        finally:
-            conn.close()
         
         return redirect(url_for('login.login'))
     
@@ -100,9 +102,8 @@ def verificar_email():
     if not email:
         return jsonify({'disponible': False, 'mensaje': 'Email requerido'})
     
-    conn = get_db_connection()
+    conn = get_db()
     usuario = conn.execute('SELECT id FROM usuarios WHERE email = ?', (email,)).fetchone()
-    conn.close()
     
     if usuario:
         return jsonify({'disponible': False, 'mensaje': 'Este email ya está registrado'})
@@ -118,9 +119,8 @@ def verificar_telefono():
     if not telefono:
         return jsonify({'disponible': False, 'mensaje': 'Teléfono requerido'})
     
-    conn = get_db_connection()
+    conn = get_db()
     usuario = conn.execute('SELECT id FROM usuarios WHERE telefono = ?', (telefono,)).fetchone()
-    conn.close()
     
     if usuario:
         return jsonify({'disponible': False, 'mensaje': 'Este teléfono ya está registrado'})
@@ -136,9 +136,8 @@ def verificar_nombre():
     if not nombre:
         return jsonify({'disponible': False, 'mensaje': 'Nombre requerido'})
     
-    conn = get_db_connection()
+    conn = get_db()
     usuario = conn.execute('SELECT id FROM usuarios WHERE nombre = ?', (nombre,)).fetchone()
-    conn.close()
     
     if usuario:
         return jsonify({'disponible': False, 'mensaje': 'Este nombre ya está registrado'})
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Agrupación de notificaciones de un mismo implemento y ficha, y archivo de las
+notificaciones leídas antiguas
+
+Benchmark: python test_agrupacion_notificaciones.py [notificaciones]
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+import utils.db
+import utils.prestamos
+from app import app
+from utils.db import get_db_connection
+from utils.eventos import canal
+from utils.notificaciones import Drenador, archivar_notificaciones
+from utils.prestamos import registrar_devolucion, registrar_prestamo
+
+@pytest.fixture
+def conn(conn, monkeypatch):
+    # El drenador del proceso no interviene: cada prueba drena cuando quiere
+    monkeypatch.setattr(utils.prestamos, 'avisar_drenador', lambda: None)
+    crear_usuarios(conn, 'instructor')
+    conn.executemany(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, 'Prueba', 100, 'otros')",
+        [('Portátil',), ('Mouse',)]
+    )
+    conn.commit()
+    return conn
+
+def _prestar(conn, implemento=1, ficha='2567890'):
+    return registrar_prestamo(conn, {
+        'fk_usuario': 1, 'fk_implemento': implemento, 'tipo_prestamo': 'multiple',
+        'nombre_prestatario': 'Instructor', 'ficha': ficha,
+    }, notificacion=('prestamo_multiple', 'Nuevo préstamo múltiple', f'Préstamo para ficha {ficha}', 1))
+
+def _notificaciones(conn):
+    return conn.execute('SELECT * FROM notificaciones ORDER BY id').fetchall()
+
+def test_rafaga_de_una_clase_queda_en_una_fila(conn):
+    drenador = Drenador(utils.db.DATABASE, lote=10)
+    prestamos = [_prestar(conn) for _ in range(30)]
+    _prestar(conn, ficha='1111111')
+    _prestar(conn, implemento=2)
+    drenador.drenar(conn)
+
+    filas = _notificaciones(conn)
+    assert [(fila['id'], fila['clave'], fila['cantidad']) for fila in filas] == [
+        (1, 'implemento:1:ficha:2567890', 30),
+        (2, 'implemento:1:ficha:1111111', 1),
+        (3, 'implemento:2:ficha:2567890', 1),
+    ]
+    # La fila agrupada conserva el id del primer lote y apunta al último préstamo
+    assert filas[0]['fk_prestamo'] == prestamos[-1]
+    assert drenador.metricas['entregadas'] == 32 and drenador.metricas['lotes'] == 4
+
+    # Las devoluciones forman su propio grupo
+    prestamo = conn.execute('SELECT * FROM prestamos WHERE id = ?', (prestamos[0],)).fetchone()
+    registrar_devolucion(conn, prestamo, 1, 'Ninguna', 'Bueno', '',
+                         notificacion=('devolucion', 'Devolución registrada', 'Portátil devuelto', 1))
+    drenador.drenar(conn)
+    assert [fila['tipo'] for fila in _notificaciones(conn)][-1] == 'devolucion'
+
+    # Pendientes del panel: una por fila, no por evento
+    assert conn.execute('SELECT notificaciones_pendientes FROM stats_counters').fetchone()[0] == 4
+
+def test_leidas_y_antiguas_no_absorben(conn):
+    drenador = Drenador(utils.db.DATABASE)
+    _prestar(conn)
+    drenador.drenar(conn)
+    conn.execute('UPDATE notificaciones SET leida = 1')
+    conn.commit()
+
+    # Tras leerla, el siguiente préstamo abre una fila nueva
+    _prestar(conn)
+    drenador.drenar(conn)
+    assert [fila['cantidad'] for fila in _notificaciones(conn)] == [1, 1]
+
+    # Fuera de la ventana de agrupación, también
+    conn.execute('''
+        UPDATE notificaciones SET fecha_creacion = datetime('now', '-11 minutes'), inicio_grupo = datetime('now', '-11 minutes')
+        WHERE leida = 0
+    ''')
+    conn.commit()
+    _prestar(conn)
+    drenador.drenar(conn)
+    assert [fila['cantidad'] for fila in _notificaciones(conn)] == [1, 1, 1]
+
+def test_la_ventana_se_cuenta_desde_el_inicio_del_grupo(conn):
+    drenador = Drenador(utils.db.DATABASE)
+
+    def atrasar(minutos):
+        conn.execute('''
+            UPDATE notificaciones
+            SET fecha_creacion = datetime(fecha_creacion, ?), inicio_grupo = datetime(inicio_grupo, ?)
+        ''', (f'-{minutos} minutes',) * 2)
+        conn.commit()
+
+    # Un préstamo cada 6 minutos: el segundo se funde, el tercero ya no
+    _prestar(conn)
+    drenador.drenar(conn)
+    atrasar(6)
+    _prestar(conn)
+    drenador.drenar(conn)
+    filas = _notificaciones(conn)
+    assert [fila['cantidad'] for fila in filas] == [2]
+    assert filas[0]['inicio_grupo'] < filas[0]['fecha_creacion']
+    atrasar(6)
+    _prestar(conn)
+    drenador.drenar(conn)
+    assert [fila['cantidad'] for fila in _notificaciones(conn)] == [2, 1]
+
+def test_un_lote_se_entrega_con_sentencias_por_lote(conn):
+    drenador = Drenador(utils.db.DATABASE, lote=100)
+    for ficha in range(10):
+        _prestar(conn, ficha=str(ficha))
+    drenador.drenar(conn)
+
+    # Segundo lote: 10 grupos que absorben cada uno su notificación anterior
+    for ficha in range(10):
+        _prestar(conn, ficha=str(ficha))
+        _prestar(conn, ficha=str(ficha))
+    sentencias = []
+    conn.set_trace_callback(sentencias.append)
+    drenador.drenar_lote(conn)
+    conn.set_trace_callback(None)
+
+    # Los disparadores repiten sentencias en la traza: se comparan las distintas
+    busquedas = {sql for sql in sentencias if 'COALESCE(inicio_grupo, fecha_creacion) AS inicio' in sql}
+    borrados = {sql for sql in sentencias if sql.startswith('DELETE FROM notificaciones ')}
+    assert len(busquedas) == 1 and not borrados
+    assert [(fila['id'], fila['cantidad']) for fila in _notificaciones(conn)] == [(n, 3) for n in range(1, 11)]
+    assert drenador.metricas['entregadas'] == 30 and drenador.metricas['fallidas'] == 0
+
+def test_el_grupo_conserva_su_id_al_crecer(conn):
+    drenador = Drenador(utils.db.DATABASE)
+    _prestar(conn)
+    drenador.drenar(conn)
+    id_grupo = _notificaciones(conn)[0]['id']
+
+    # El flujo de eventos reenvía el grupo con el mismo id y sin id de evento
+    suscripcion = canal.suscribir()
+    try:
+        _prestar(conn)
+        drenador.drenar(conn)
+        eventos = suscripcion.esperar(0)
+    finally:
+        canal.cancelar(suscripcion)
+    assert [(tipo, datos['id'], datos['cantidad'], id) for tipo, datos, id in eventos if tipo == 'notificacion'] == [
+        ('notificacion', id_grupo, 2, None)
+    ]
+
+    # Marcarla como leída con el id que ya tenía la página cierra el grupo
+    crear_usuarios(conn, 'admin')
+    cliente = cliente_con_sesion(2, 'admin')
+    assert cliente.post(f'/admin/api/notificaciones/{id_grupo}/leer').status_code == 200
+    _prestar(conn)
+    drenador.drenar(conn)
+    assert [(fila['id'], fila['cantidad'], fila['leida']) for fila in _notificaciones(conn)] == [
+        (id_grupo, 2, 1), (id_grupo + 1, 1, 0)
+    ]
+
+def test_archivo_de_leidas_antiguas(conn):
+    conn.executemany('''
+        INSERT INTO notificaciones (tipo, titulo, mensaje, leida, fecha_creacion)
+        VALUES ('devolucion', ?, 'x', ?, datetime('now', ?))
+    ''', [(f'N{n}', n % 2, f'-{n} days') for n in range(60)])
+    conn.commit()
+
+    # Leídas (impares) de más de 30 días: 31, 33, ..., 59
+    assert archivar_notificaciones(conn, dias=30, lote=4) == 15
+    assert conn.execute('SELECT COUNT(*) FROM notificaciones_archivo').fetchone()[0] == 15
+    restantes = conn.execute(
+        "SELECT COUNT(*) FROM notificaciones WHERE leida = 1 AND fecha_creacion < datetime('now', '-30 days')"
+    ).fetchone()[0]
+    assert restantes == 0 and len(_notificaciones(conn)) == 45
+    assert conn.execute("SELECT titulo FROM notificaciones_archivo ORDER BY id LIMIT 1").fetchone()[0] == 'N31'
+    assert conn.execute('SELECT notificaciones_pendientes FROM stats_counters').fetchone()[0] == 30
+
+    resultado = app.test_cli_runner().invoke(args=['archive-notifications', '--dias', '0'])
+    assert 'Notificaciones archivadas: 15' in resultado.output
+
+def main():
+    """Filas creadas y tiempo de drenado de una ráfaga de préstamos de pocas clases"""
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    crear_base()
+    conn = get_db_connection()
+    conn.execute(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES ('Lápiz', 'x', ?, 'otros')",
+        (cantidad,)
+    )
+    conn.commit()
+    utils.prestamos.avisar_drenador = lambda: None
+    for n in range(cantidad):
+        _prestar(conn, ficha=str(n % 20))
+
+    drenador = Drenador(utils.db.DATABASE)
+    inicio = time.perf_counter()
+    drenador.drenar(conn)
+    duracion = time.perf_counter() - inicio
+    filas = conn.execute('SELECT COUNT(*) FROM notificaciones').fetchone()[0]
+    print(f"{cantidad} préstamos de 20 fichas -> {filas} notificaciones en {duracion * 1000:.1f} ms")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
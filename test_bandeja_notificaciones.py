@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Bandeja de salida de notificaciones: los préstamos y devoluciones encolan su
+notificación en la misma transacción y el drenador la entrega por lotes
+
+Benchmark: python test_bandeja_notificaciones.py [prestamos]
+"""
+
+import sys
+import os
+import subprocess
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+import utils.db
+import utils.prestamos
+from utils.db import get_db_connection
+from utils.helpers import crear_notificacion
+from utils.notificaciones import Drenador, drenar_notificaciones, encolar_notificacion
+from utils.prestamos import DisponibilidadInsuficiente, registrar_devolucion, registrar_prestamo
+
+@pytest.fixture
+def conn(conn):
+    crear_usuarios(conn, 'admin')
+    conn.execute(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) "
+        "VALUES ('Portátil', 'Prueba', 1, 'computadores')"
+    )
+    conn.commit()
+    return conn
+
+def _contar(conn, tabla):
+    return conn.execute(f'SELECT COUNT(*) FROM {tabla}').fetchone()[0]
+
+def test_prestamo_y_notificacion_en_una_transaccion(conn, monkeypatch):
+    # Sin drenador: la notificación debe quedar en la bandeja
+    monkeypatch.setattr(utils.prestamos, 'avisar_drenador', lambda: None)
+    sentencias = []
+    conn.set_trace_callback(sentencias.append)
+    prestamo_id = registrar_prestamo(conn, {
+        'fk_usuario': 1, 'fk_implemento': 1, 'tipo_prestamo': 'individual', 'nombre_prestatario': 'Aprendiz',
+    }, notificacion=('prestamo_individual', 'Nuevo préstamo individual', 'Aprendiz pidió Portátil', 1))
+    conn.set_trace_callback(None)
+    assert sentencias.count('BEGIN IMMEDIATE') == 1 and sentencias.count('COMMIT') == 1
+
+    fila = conn.execute('SELECT * FROM notificaciones_salida').fetchone()
+    assert (fila['tipo'], fila['fk_usuario'], fila['fk_prestamo']) == ('prestamo_individual', 1, prestamo_id)
+    assert _contar(conn, 'notificaciones') == 0
+
+    # Si el préstamo no se registra, tampoco su notificación
+    with pytest.raises(DisponibilidadInsuficiente):
+        registrar_prestamo(conn, {
+            'fk_usuario': 1, 'fk_implemento': 1, 'tipo_prestamo': 'individual', 'nombre_prestatario': 'Otro',
+        }, notificacion=('prestamo_individual', 'Nuevo préstamo individual', 'Otro pidió Portátil', 1))
+    assert _contar(conn, 'notificaciones_salida') == 1
+
+    prestamo = conn.execute('SELECT * FROM prestamos WHERE id = ?', (prestamo_id,)).fetchone()
+    registrar_devolucion(conn, prestamo, 1, 'Ninguna', 'Bueno', '',
+                         notificacion=('devolucion', 'Devolución registrada', 'Portátil devuelto', 1))
+    assert _contar(conn, 'notificaciones_salida') == 2
+
+def test_drenado_por_lotes_exactamente_una_vez(conn):
+    # 250 notificaciones de todos los tipos que encolan las rutas; 10 de ellas
+    # con un tipo que la tabla no admite
+    tipos = ['devolucion', 'prestamo_admin', 'novedad_prestamo', 'prestamo_editado', 'usuario_activado',
+             'usuario_desactivado', 'usuario_editado', 'usuario_eliminado', 'usuario_nuevo']
+    for n in range(250):
+        tipo = 'tipo_desconocido' if n % 25 == 0 else tipos[n % len(tipos)]
+        encolar_notificacion(conn, tipo, f'Notificación {n:03d}', 'x', 1)
+    conn.commit()
+
+    # Dos procesos drenando a la vez: cada fila se entrega una sola vez
+    drenadores = [Drenador(utils.db.DATABASE, lote=40) for _ in range(2)]
+
+    def drenar(drenador):
+        propia = get_db_connection()
+        try:
+            drenador.drenar(propia)
+        finally:
+            propia.close()
+
+    hilos = [threading.Thread(target=drenar, args=(drenador,)) for drenador in drenadores]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    titulos = [fila[0] for fila in conn.execute('SELECT titulo FROM notificaciones ORDER BY id')]
+    assert titulos == [f'Notificación {n:03d}' for n in range(250) if n % 25 != 0]
+    # Las que fallan se quedan en la bandeja con el error en vez de perderse
+    fallidas = conn.execute('SELECT titulo, estado, error FROM notificaciones_salida ORDER BY id').fetchall()
+    assert [fila['titulo'] for fila in fallidas] == [f'Notificación {n:03d}' for n in range(0, 250, 25)]
+    assert {fila['estado'] for fila in fallidas} == {'fallida'}
+    assert all('CHECK constraint failed' in fila['error'] for fila in fallidas)
+    assert sum(drenador.metricas['entregadas'] for drenador in drenadores) == 240
+    assert sum(drenador.metricas['fallidas'] for drenador in drenadores) == 10
+    assert sum(drenador.metricas['lotes'] for drenador in drenadores) == 7
+
+    # Los contadores del panel (triggers de notificaciones) siguen al día
+    pendientes = conn.execute('SELECT notificaciones_pendientes FROM stats_counters').fetchone()[0]
+    assert pendientes == 240
+
+    # Un nuevo drenado no vuelve a tomar las fallidas
+    assert drenadores[0].drenar_lote(conn) == 0
+    estadisticas = drenadores[0].estadisticas(conn)
+    assert estadisticas['pendientes'] == 0 and estadisticas['fallidas_en_bandeja'] == 10
+
+def test_el_arranque_entrega_lo_que_quedo_en_la_bandeja(conn):
+    # Filas confirmadas que ningún drenador llegó a entregar antes de un reinicio
+    for n in range(3):
+        encolar_notificacion(conn, 'usuario_nuevo', f'Pendiente {n}', 'x', 1)
+    conn.commit()
+
+    entorno = dict(os.environ, FLASK_DATABASE=utils.db.DATABASE)
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                   env=entorno, check=True, capture_output=True)
+
+    titulos = [fila[0] for fila in conn.execute('SELECT titulo FROM notificaciones ORDER BY id')]
+    assert titulos == ['Pendiente 0', 'Pendiente 1', 'Pendiente 2']
+    assert _contar(conn, 'notificaciones_salida') == 0
+
+def test_crear_notificacion_usa_la_transaccion_del_llamador(conn):
+    # Sin commit propio: se descarta con la operación que la origina
+    conn.execute("UPDATE usuarios SET telefono = '1' WHERE id = 1")
+    crear_notificacion(conn, 'usuario_editado', 'Usuario editado', 'x', 1)
+    conn.rollback()
+    assert _contar(conn, 'notificaciones_salida') == 0
+    assert conn.execute('SELECT telefono FROM usuarios WHERE id = 1').fetchone()[0] != '1'
+
+    # Las rutas la confirman junto con su escritura
+    crear_usuarios(conn, 'instructor')
+    respuesta = cliente_con_sesion().post('/admin/desactivar_usuario/2')
+    assert respuesta.get_json()['success']
+    drenar_notificaciones(conn)
+    fila = conn.execute('SELECT tipo FROM notificaciones').fetchone()
+    assert fila['tipo'] == 'usuario_desactivado'
+    assert conn.execute('SELECT activo FROM usuarios WHERE id = 2').fetchone()[0] == 0
+
+def test_rutas_entregan_en_segundo_plano(conn):
+    cliente = cliente_con_sesion()
+    cliente.post('/admin/registrar_prestamo_individual', data={
+        'implemento_id': 1, 'nombre_prestatario': 'Aprendiz', 'instructor': 'Instructor',
+        'jornada': 'Mañana', 'ambiente': '101',
+    })
+    assert _contar(conn, 'prestamos') == 1
+
+    limite = time.monotonic() + 5
+    while _contar(conn, 'notificaciones') == 0 and time.monotonic() < limite:
+        time.sleep(0.01)
+    fila = conn.execute('SELECT tipo, fk_prestamo FROM notificaciones').fetchone()
+    assert tuple(fila) == ('prestamo_individual', 1)
+
+    metricas = cliente.get('/admin/api/notificaciones/salida').get_json()
+    assert metricas['entregadas'] == 1 and metricas['pendientes'] == 0 and metricas['activo']
+    assert metricas['ultimo_retraso'] is not None
+
+def main():
+    """Préstamos por segundo: notificación en una segunda transacción vs bandeja de salida"""
+    prestamos = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    crear_base()
+    conn = get_db_connection()
+    conn.execute(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES ('Lápiz', 'x', ?, 'otros')",
+        (prestamos * 2,)
+    )
+    conn.commit()
+    campos = {'fk_usuario': 1, 'fk_implemento': 1, 'tipo_prestamo': 'individual', 'nombre_prestatario': 'Aprendiz'}
+    notificacion = ('prestamo_individual', 'Nuevo préstamo individual', 'Aprendiz pidió Lápiz', 1)
+
+    # Antes: préstamo confirmado y luego la notificación en su propia transacción
+    inicio = time.perf_counter()
+    for _ in range(prestamos):
+        prestamo_id = registrar_prestamo(conn, campos)
+        conn.execute(
+            'INSERT INTO notificaciones (tipo, titulo, mensaje, fk_usuario, fk_prestamo) VALUES (?, ?, ?, ?, ?)',
+            notificacion + (prestamo_id,)
+        )
+        conn.commit()
+    antes = prestamos / (time.perf_counter() - inicio)
+
+    # Ahora: una transacción por préstamo y la entrega por lotes en el drenador
+    drenador = Drenador(utils.db.DATABASE)
+    utils.prestamos.avisar_drenador = lambda: None
+    inicio = time.perf_counter()
+    for _ in range(prestamos):
+        registrar_prestamo(conn, campos, notificacion=notificacion)
+    ahora = prestamos / (time.perf_counter() - inicio)
+    inicio = time.perf_counter()
+    drenador.drenar(conn)
+    drenado = time.perf_counter() - inicio
+
+    print(f"dos transacciones:   {antes:8.0f} préstamos/s")
+    print(f"bandeja de salida:   {ahora:8.0f} préstamos/s")
+    print(f"drenado de {prestamos} en lotes de {drenador.lote}: {drenado * 1000:.1f} ms {drenador.metricas}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
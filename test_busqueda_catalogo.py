@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Búsqueda de texto completo en el catálogo (FTS5 sin distinguir tildes)
+
+Ejecutado directamente (python test_busqueda_catalogo.py [implementos]) compara
+el tiempo del filtro con LIKE frente a MATCH sobre un catálogo grande.
+"""
+
+import sys
+import os
+import random
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+from utils.db import get_db_connection
+from utils.helpers import expresion_busqueda
+
+CONSULTA_LIKE = '''
+    SELECT * FROM implementos
+    WHERE (LOWER(implemento) LIKE LOWER(?) OR LOWER(descripcion) LIKE LOWER(?))
+    ORDER BY implemento
+'''
+CONSULTA_FTS = '''
+    SELECT i.* FROM implementos_fts f
+    JOIN implementos i ON i.id = f.rowid
+    WHERE implementos_fts MATCH ?
+    ORDER BY f.rank
+'''
+
+@pytest.fixture
+def conn(conn):
+    crear_usuarios(conn, 'instructor')
+    for nombre, descripcion, categoria in [
+        ('Ratón óptico', 'Mouse inalámbrico USB', 'mouses'),
+        ('Teclado mecánico', 'Teclado en español con ñ', 'teclados'),
+        ('Portátil Lenovo', 'Computador para diseño', 'computadores'),
+        ('Cálculo diferencial', 'Libro de matemáticas', 'libros'),
+    ]:
+        conn.execute(
+            'INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, ?, 1, ?)',
+            (nombre, descripcion, categoria)
+        )
+    conn.commit()
+    return conn
+
+def _buscar(conn, texto):
+    return [fila['implemento'] for fila in conn.execute(CONSULTA_FTS, (expresion_busqueda(texto),))]
+
+def test_busqueda_ignora_tildes_y_admite_prefijos(conn):
+    assert _buscar(conn, 'raton') == ['Ratón óptico']
+    assert _buscar(conn, 'CALCULO') == ['Cálculo diferencial']
+    assert _buscar(conn, 'tecl') == ['Teclado mecánico']
+    assert _buscar(conn, 'espanol') == ['Teclado mecánico']
+    # Todas las palabras deben aparecer; los operadores de FTS5 se tratan como texto
+    assert _buscar(conn, 'mouse usb') == ['Ratón óptico']
+    assert _buscar(conn, 'mouse -"libro"') == []
+    assert expresion_busqueda('%_ ') is None
+
+def test_nombre_pesa_mas_que_descripcion(conn):
+    conn.execute(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES ('Funda', 'Para teclado', 1)"
+    )
+    conn.commit()
+    assert _buscar(conn, 'teclado') == ['Teclado mecánico', 'Funda']
+
+def test_indice_sigue_los_cambios_del_catalogo(conn):
+    conn.execute("UPDATE implementos SET implemento = 'Mouse vertical' WHERE implemento = 'Ratón óptico'")
+    conn.execute("DELETE FROM implementos WHERE implemento = 'Portátil Lenovo'")
+    conn.commit()
+    assert _buscar(conn, 'raton') == []
+    assert _buscar(conn, 'vertical') == ['Mouse vertical']
+    assert _buscar(conn, 'lenovo') == []
+    conn.execute("INSERT INTO implementos_fts(implementos_fts) VALUES ('integrity-check')")
+
+def test_filtro_del_catalogo_usa_fts(conn):
+    cliente = cliente_con_sesion(1, 'instructor')
+    respuesta = cliente.get('/catalogo/catalogo/filtrar?filtro=raton&disponibilidad=disponible')
+    assert respuesta.status_code == 200
+    html = respuesta.get_data(as_text=True)
+    assert 'Ratón óptico' in html
+    assert 'Teclado mecánico' not in html
+
+def _generar_catalogo(conn, cantidad):
+    azar = random.Random(7)
+    nombres = ['Ratón', 'Teclado', 'Portátil', 'Monitor', 'Cable', 'Balón', 'Cámara', 'Micrófono', 'Libro', 'Proyector']
+    adjetivos = ['óptico', 'inalámbrico', 'mecánico', 'básico', 'rápido', 'pequeño', 'grande', 'económico']
+    categorias = ['libros', 'computadores', 'mouses', 'teclados', 'otros']
+    filas = [
+        (
+            f'{azar.choice(nombres)} {azar.choice(adjetivos)} {n}',
+            f'{azar.choice(adjetivos)} {azar.choice(nombres).lower()} modelo {azar.randint(1, 9999)}',
+            azar.randint(0, 10),
+            azar.choice(categorias),
+        )
+        for n in range(cantidad)
+    ]
+    conn.executemany(
+        'INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, ?, ?, ?)',
+        filas
+    )
+    conn.commit()
+
+def _medir(conn, sql, params, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        filas = conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - inicio) / repeticiones * 1000, len(filas)
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directorio:
+        crear_base(os.path.join(directorio, 'database.db'))
+        conn = get_db_connection()
+        inicio = time.perf_counter()
+        _generar_catalogo(conn, cantidad)
+        print(f"=== {cantidad} implementos generados en {time.perf_counter() - inicio:.1f} s ===")
+
+        for texto in ['micrófono', 'microfono', 'cam', 'teclado mecánico', 'proyector 123']:
+            like_ms, like_filas = _medir(conn, CONSULTA_LIKE, (f'%{texto}%', f'%{texto}%'), 5)
+            fts_ms, fts_filas = _medir(conn, CONSULTA_FTS, (expresion_busqueda(texto),), 5)
+            print(f"{texto!r:20} LIKE {like_ms:8.1f} ms ({like_filas:6} filas)   "
+                  f"MATCH {fts_ms:8.1f} ms ({fts_filas:6} filas)")
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Caché del catálogo: vistas filtradas y ordenadas en memoria, corregidas por
+las anotaciones de catalogo_cambios que dejan las escrituras
+
+Benchmark: python test_cache_catalogo.py [implementos]
+"""
+
+import sys
+import os
+import random
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+from utils.cache_catalogo import CacheCatalogo, RETENCION_CAMBIOS
+from utils.db import get_db_connection
+from utils.prestamos import registrar_devolucion, registrar_prestamo
+
+CATEGORIAS = ['libros', 'computadores', 'mouses', 'teclados', 'otros']
+
+# Consulta equivalente a cada vista, para comparar
+CONSULTA = '''
+    SELECT id FROM implementos
+    WHERE (? IS NULL OR LOWER(categoria) = ?)
+      AND (? IS NULL OR (? = 'disponible' AND disponibilidad > 0) OR (? = 'agotado' AND disponibilidad = 0))
+    ORDER BY {}
+'''
+ORDEN_SQL = {'nombre': 'implemento, id', 'recientes': 'id DESC'}
+
+def _generar_catalogo(conn, cantidad, semilla=1):
+    azar = random.Random(semilla)
+    conn.executemany(
+        'INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, ?, ?, ?)',
+        [(f'Implemento {azar.randint(0, cantidad)}', 'Prueba', azar.choice([0, 0, 1, 3, 10]),
+          azar.choice(CATEGORIAS + ['Libros'])) for _ in range(cantidad)]
+    )
+    conn.commit()
+
+@pytest.fixture
+def conn(conn):
+    crear_usuarios(conn, 'admin')
+    _generar_catalogo(conn, 300)
+    return conn
+
+def _comparar(cache, conn):
+    for orden in ('nombre', 'recientes'):
+        for categoria in [None] + CATEGORIAS:
+            for disponibilidad in (None, 'disponible', 'agotado'):
+                vista = [fila['id'] for fila in cache.vista(conn, orden, categoria, disponibilidad)]
+                esperado = [fila[0] for fila in conn.execute(
+                    CONSULTA.format(ORDEN_SQL[orden]), (categoria, categoria) + (disponibilidad,) * 3
+                )]
+                assert vista == esperado, (orden, categoria, disponibilidad)
+
+def test_vistas_iguales_a_la_consulta(conn):
+    cache = CacheCatalogo()
+    _comparar(cache, conn)
+    _comparar(cache, conn)
+    assert cache.metricas['recargas'] == 1
+    assert cache.metricas['aciertos'] == cache.metricas['fallos'] == 36
+
+def test_prestamos_y_cambios_se_parchan(conn):
+    cache = CacheCatalogo()
+    _comparar(cache, conn)
+
+    # Préstamo, devolución, edición, alta y baja: solo se releen esos implementos
+    disponible = next(fila for fila in cache.vista(conn, disponibilidad='disponible') if fila['disponibilidad'] == 1)
+    prestamo_id = registrar_prestamo(conn, {
+        'fk_usuario': 1, 'fk_implemento': disponible['id'],
+        'tipo_prestamo': 'individual', 'nombre_prestatario': 'Aprendiz',
+    })
+    _comparar(cache, conn)
+    assert disponible['id'] not in [fila['id'] for fila in cache.vista(conn, disponibilidad='disponible')]
+
+    prestamo = conn.execute('SELECT * FROM prestamos WHERE id = ?', (prestamo_id,)).fetchone()
+    registrar_devolucion(conn, prestamo, 1, 'Ninguna', 'Bueno', '')
+    conn.execute("UPDATE implementos SET implemento = 'AAA primero', categoria = 'mouses' WHERE id = 7")
+    conn.execute("INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES ('ZZZ', 'x', 0, 'otros')")
+    # Una baja no toca los demás implementos: una sola anotación
+    numeros = dict(conn.execute('SELECT id, numero FROM implementos WHERE id <> 150'))
+    version = conn.execute('SELECT MAX(version) FROM catalogo_cambios').fetchone()[0]
+    conn.execute('DELETE FROM implementos WHERE id = 150')
+    conn.commit()
+    assert conn.execute('SELECT COUNT(*) FROM catalogo_cambios WHERE version > ?', (version,)).fetchone()[0] == 1
+    assert dict(conn.execute('SELECT id, numero FROM implementos')) == numeros
+    _comparar(cache, conn)
+    assert cache.vista(conn, categoria='mouses')[0]['implemento'] == 'AAA primero'
+    assert cache.metricas['recargas'] == 1
+    assert cache.metricas['parches'] == 5
+
+def test_lecturas_al_dia_no_consultan_implementos(conn):
+    cache = CacheCatalogo()
+    cache.vista(conn)
+    sentencias = []
+    conn.set_trace_callback(sentencias.append)
+    for _ in range(10):
+        cache.vista(conn)
+    conn.set_trace_callback(None)
+    assert len(sentencias) == 10
+    assert not any('FROM implementos' in sentencia for sentencia in sentencias)
+
+def test_anotaciones_perdidas_recargan(conn):
+    cache = CacheCatalogo()
+    cache.vista(conn)
+
+    # Más cambios de los que conserva la tabla: la caché detecta el hueco
+    conn.executemany('UPDATE implementos SET disponibilidad = ? WHERE id = 1', [(n,) for n in range(RETENCION_CAMBIOS + 5)])
+    conn.commit()
+    assert conn.execute('SELECT COUNT(*) FROM catalogo_cambios').fetchone()[0] == RETENCION_CAMBIOS
+    _comparar(cache, conn)
+    assert cache.metricas['recargas'] == 2 and cache.metricas['parches'] == 0
+
+def test_rutas_usan_la_cache(conn):
+    cliente = cliente_con_sesion()
+    for ruta in ('/catalogo/catalogo', '/catalogo/catalogo/filtrar?categoria=libros&disponibilidad=agotado',
+                 '/admin/catalogo', '/admin/gestion_prestamos', '/admin/gestion_prestamos_admin'):
+        assert cliente.get(ruta).status_code == 200, ruta
+        assert cliente.get(ruta).status_code == 200, ruta
+
+    metricas = cliente.get('/admin/api/cache_catalogo').get_json()
+    assert metricas['aciertos'] == 6 and metricas['fallos'] == 4
+    assert metricas['filas'] == 300 and metricas['vistas'] == 4 and metricas['bytes'] > 0
+
+    html = cliente.get('/catalogo/catalogo/filtrar?categoria=libros&disponibilidad=agotado').get_data(as_text=True)
+    libros_agotados = conn.execute(
+        "SELECT COUNT(*) FROM implementos WHERE LOWER(categoria) = 'libros' AND disponibilidad = 0"
+    ).fetchone()[0]
+    assert html.count('@click="abrir(') == libros_agotados
+
+def main():
+    """Tiempo de obtener el catálogo ordenado: consulta directa vs caché"""
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    crear_base()
+    conn = get_db_connection()
+    _generar_catalogo(conn, cantidad)
+
+    def medir(funcion, repeticiones=50):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        return (time.perf_counter() - inicio) / repeticiones * 1000
+
+    cache = CacheCatalogo()
+    for nombre, sql, vista in [
+        ('catálogo completo', 'SELECT * FROM implementos ORDER BY implemento', {}),
+        ('disponibles', 'SELECT * FROM implementos WHERE disponibilidad > 0 ORDER BY implemento',
+         {'disponibilidad': 'disponible'}),
+        ('libros agotados', "SELECT * FROM implementos WHERE LOWER(categoria) = 'libros' AND disponibilidad = 0 "
+                            "ORDER BY implemento", {'categoria': 'libros', 'disponibilidad': 'agotado'}),
+    ]:
+        directa = medir(lambda: conn.execute(sql).fetchall())
+        cache.vista(conn, **vista)
+        en_cache = medir(lambda: cache.vista(conn, **vista))
+        print(f"{nombre:>18}: consulta {directa:7.2f} ms   caché {en_cache:6.3f} ms")
+
+    # Un préstamo: parche de una fila frente a recargar todo
+    parche = medir(lambda: (
+        conn.execute('UPDATE implementos SET disponibilidad = disponibilidad + 1 WHERE id = 1'),
+        conn.commit(),
+        cache.vista(conn, disponibilidad='disponible'),
+    ), 20)
+    print(f"{'tras un préstamo':>18}: parche + vista {parche:6.2f} ms")
+    print(cache.estadisticas())
+    conn.close()
+
+if __name__ == '__main__':
+    main()
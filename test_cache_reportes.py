@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Caché de reportes: aciertos por parámetros y versión de los datos, invalidación
+al cambiar los datos y desalojo por tamaño
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_usuarios
+from utils.cache_reportes import recortar_archivos, vaciar_cache, version_datos
+from utils.db import get_db_connection
+from utils.trabajos import directorio_reportes
+
+EXCEL = '/admin/reportes/prestamos/excel'
+
+@pytest.fixture
+def cliente(conn):
+    vaciar_cache()
+    crear_usuarios(conn, 'admin')
+    conn.execute("INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES ('Balón', 'Prueba', 10)")
+    conn.executemany('''
+        INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, fecha_prestamo)
+        VALUES (1, 1, 'individual', ?, datetime('2025-03-01', ?))
+    ''', [(f'Aprendiz {n}', f'+{n} hours') for n in range(50)])
+    conn.commit()
+    return cliente_con_sesion()
+
+def _metricas(cliente):
+    return cliente.get('/admin/api/cache_reportes').get_json()
+
+def test_mismo_reporte_sale_de_la_cache(cliente):
+    datos = {'tipo_reporte': 'activos', 'formato': 'resumen'}
+    primera = cliente.post(EXCEL, data=datos)
+    segunda = cliente.post(EXCEL, data=datos)
+    assert primera.status_code == segunda.status_code == 200
+    assert primera.data == segunda.data
+    primera.close()
+    segunda.close()
+
+    archivos = _metricas(cliente)['archivos']
+    assert (archivos['aciertos'], archivos['fallos'], archivos['entradas']) == (1, 1, 1)
+
+    # Un trabajo con los mismos parámetros queda completado sin pasar por el pool
+    trabajo = cliente.post('/admin/reportes/trabajos', data=datos).get_json()
+    assert cliente.get(trabajo['url_estado']).get_json()['estado'] == 'completado'
+    descarga = cliente.get(trabajo['url_descarga'])
+    assert descarga.status_code == 200
+    descarga.close()
+
+def test_cambio_de_datos_invalida(cliente):
+    conn = get_db_connection()
+    version = version_datos(conn)
+    cliente.post(EXCEL, data={'formato': 'resumen'}).close()
+
+    conn.execute('''
+        INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario)
+        VALUES (1, 1, 'individual', 'Nuevo')
+    ''')
+    conn.commit()
+    assert version_datos(conn) > version
+    conn.close()
+
+    cliente.post(EXCEL, data={'formato': 'resumen'}).close()
+    archivos = _metricas(cliente)['archivos']
+    assert (archivos['aciertos'], archivos['fallos'], archivos['entradas']) == (0, 2, 2)
+
+def test_desalojo_por_tamano(cliente):
+    for formato in ('detallado', 'resumen'):
+        cliente.post(EXCEL, data={'formato': formato}).close()
+    directorio = directorio_reportes()
+    rutas = sorted(os.path.join(directorio, nombre) for nombre in os.listdir(directorio))
+
+    # El archivo usado hace más tiempo sale primero
+    hace_una_hora = time.time() - 3600
+    os.utime(rutas[0], (hace_una_hora, hace_una_hora))
+    limite = max(os.path.getsize(ruta) for ruta in rutas)
+    assert recortar_archivos(directorio, limite) == 1
+    assert os.listdir(directorio) == [os.path.basename(rutas[1])]
+    assert _metricas(cliente)['archivos']['desalojos'] == 1
+
+def test_agregados_del_panel(cliente):
+    assert cliente.get('/admin/reportes').status_code == 200
+    assert cliente.get('/admin/reportes').status_code == 200
+    agregados = _metricas(cliente)['agregados']
+    assert (agregados['aciertos'], agregados['fallos'], agregados['entradas']) == (2, 2, 2)
+
+    # Un préstamo nuevo cambia la versión: los rankings se recalculan
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, cantidad)
+        VALUES (1, 1, 'individual', 'Nuevo', 3)
+    ''')
+    conn.commit()
+    conn.close()
+    respuesta = cliente.get('/admin/reportes')
+    assert 'Balón' in respuesta.get_data(as_text=True)
+    assert _metricas(cliente)['agregados']['fallos'] == 4
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Render del catálogo con un único modal compartido
+
+Ejecutado directamente (python test_catalogo_render.py) mide el tamaño de la
+respuesta y el tiempo de render de /catalogo/catalogo con 1k y 10k implementos.
+"""
+
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+from utils.db import get_db_connection
+
+def _generar_catalogo(conn, cantidad):
+    # La sesión de _cliente() pertenece a este usuario
+    crear_usuarios(conn, 'instructor')
+    conn.executemany(
+        'INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, ?, ?, ?)',
+        [(f'Implemento {n}', f'Descripción del implemento {n}', n % 4, 'otros') for n in range(cantidad)]
+    )
+    conn.commit()
+
+def _cliente():
+    return cliente_con_sesion(1, 'instructor', user_nombre='Instructor')
+
+def test_catalogo_tiene_un_solo_modal(conn):
+    _generar_catalogo(conn, 50)
+    html = _cliente().get('/catalogo/catalogo').get_data(as_text=True)
+    assert html.count('@click="abrir(') == 50
+    assert html.count('name="tipo_prestamo"') == 1
+    assert html.count('name="nombre_prestatario"') == 1
+
+def test_api_devuelve_el_implemento(conn):
+    _generar_catalogo(conn, 3)
+    cliente = _cliente()
+    respuesta = cliente.get('/catalogo/api/implementos/2')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json() == {
+        'id': 2,
+        'implemento': 'Implemento 1',
+        'descripcion': 'Descripción del implemento 1',
+        'categoria': 'otros',
+        'disponibilidad': 1,
+        'imagen_url': None,
+    }
+    assert cliente.get('/catalogo/api/implementos/99').status_code == 404
+
+def main():
+    for cantidad in (1000, 10000):
+        with tempfile.TemporaryDirectory() as directorio:
+            crear_base(os.path.join(directorio, 'database.db'))
+            conn = get_db_connection()
+            _generar_catalogo(conn, cantidad)
+            conn.close()
+
+            cliente = _cliente()
+            cliente.get('/catalogo/catalogo')
+            tiempos = []
+            for _ in range(5):
+                inicio = time.perf_counter()
+                respuesta = cliente.get('/catalogo/catalogo')
+                tiempos.append(time.perf_counter() - inicio)
+            print(f"{cantidad:6} implementos: {len(respuesta.data) / 1024:10.1f} KiB   "
+                  f"{min(tiempos) * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Contador de notificaciones sin leer: insignia del admin desde stats_counters y
+endpoint ligero con ETag para sondeo
+
+Benchmark: python test_contador_notificaciones.py [notificaciones]
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+import utils.db
+from app import app
+from utils.db import get_db_connection
+from utils.notificaciones import Drenador, clave_agrupacion, encolar_notificacion
+
+CONTADOR = '/admin/api/notificaciones/contador'
+
+@pytest.fixture
+def conn(conn):
+    crear_usuarios(conn, 'admin', 'instructor')
+    return conn
+
+def _insertar(conn, cantidad):
+    conn.executemany(
+        "INSERT INTO notificaciones (tipo, titulo, mensaje) VALUES ('devolucion', ?, 'x')",
+        [(f'N{n}',) for n in range(cantidad)]
+    )
+    conn.commit()
+
+def test_contador_sigue_inserciones_lecturas_y_borrados(conn):
+    cliente = cliente_con_sesion()
+    assert cliente.get(CONTADOR).get_json() == {'no_leidas': 0, 'ultimo_id': 0}
+
+    _insertar(conn, 5)
+    ids = [fila[0] for fila in conn.execute('SELECT id FROM notificaciones ORDER BY id')]
+    assert cliente.get(CONTADOR).get_json() == {'no_leidas': 5, 'ultimo_id': ids[-1]}
+
+    assert cliente.post(f'/admin/api/notificaciones/{ids[0]}/leer').get_json()['success']
+    assert cliente.post(f'/admin/api/notificaciones/{ids[1]}/eliminar').get_json()['success']
+    # Borrar una ya leída no cambia el total
+    assert cliente.post(f'/admin/api/notificaciones/{ids[0]}/eliminar').get_json()['success']
+    assert cliente.get(CONTADOR).get_json()['no_leidas'] == 3
+
+    respuesta = cliente.post('/admin/api/notificaciones/leer_todas').get_json()
+    assert respuesta['success'] and respuesta['message'].startswith('3 ')
+    assert cliente.get(CONTADOR).get_json() == {'no_leidas': 0, 'ultimo_id': ids[-1]}
+
+    # Una notificación agrupada reemplaza a la anterior: el total no crece
+    drenador = Drenador(utils.db.DATABASE)
+    for _ in range(4):
+        encolar_notificacion(conn, 'prestamo_multiple', 'Préstamo', 'x', 1, clave=clave_agrupacion(1, '2567890'))
+        conn.commit()
+        drenador.drenar(conn)
+    resumen = cliente.get(CONTADOR).get_json()
+    assert resumen['no_leidas'] == 1 and resumen['ultimo_id'] > ids[-1]
+
+def test_etag_responde_304_mientras_no_cambie(conn):
+    cliente = cliente_con_sesion()
+    _insertar(conn, 2)
+    primera = cliente.get(CONTADOR)
+    etag = primera.headers['ETag']
+    assert primera.headers['Cache-Control'] == 'private, no-cache'
+
+    repetida = cliente.get(CONTADOR, headers={'If-None-Match': etag})
+    assert repetida.status_code == 304 and repetida.data == b''
+
+    cliente.post('/admin/api/notificaciones/leer_todas')
+    cambiada = cliente.get(CONTADOR, headers={'If-None-Match': etag})
+    assert cambiada.status_code == 200 and cambiada.headers['ETag'] != etag
+    assert cambiada.get_json()['no_leidas'] == 0
+
+def test_permisos(conn):
+    assert cliente_con_sesion(2, 'instructor').get(CONTADOR).status_code == 403
+    assert app.test_client().get(CONTADOR).status_code in (302, 401)
+
+def test_insignia_cuenta_mas_alla_de_la_lista(conn):
+    # El panel solo lista las 10 más recientes; la insignia usa el contador
+    _insertar(conn, 25)
+    pagina = cliente_con_sesion().get('/admin/').get_data(as_text=True)
+    assert pagina.count('>25</span>') >= 2
+
+def main():
+    """Tiempo por consulta: COUNT(*) + MAX(id) sobre la tabla vs endpoint del contador"""
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeticiones = 500
+    crear_base()
+    conn = get_db_connection()
+    crear_usuarios(conn, 'admin')
+    conn.executemany(
+        "INSERT INTO notificaciones (tipo, titulo, mensaje, leida) VALUES ('devolucion', 'N', 'x', ?)",
+        [(n % 3 == 0,) for n in range(cantidad)]
+    )
+    conn.commit()
+
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        conn.execute('SELECT COUNT(*) FROM notificaciones WHERE leida = 0').fetchone()
+        conn.execute('SELECT MAX(id) FROM notificaciones').fetchone()
+    antes = (time.perf_counter() - inicio) / repeticiones
+
+    cliente = cliente_con_sesion()
+    etag = cliente.get(CONTADOR).headers['ETag']
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cliente.get(CONTADOR)
+    ahora = (time.perf_counter() - inicio) / repeticiones
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cliente.get(CONTADOR, headers={'If-None-Match': etag})
+    condicional = (time.perf_counter() - inicio) / repeticiones
+
+    print(f"{cantidad} notificaciones")
+    print(f"COUNT(*) sobre la tabla:      {antes * 1000:7.3f} ms")
+    print(f"endpoint del contador:        {ahora * 1000:7.3f} ms (petición completa)")
+    print(f"endpoint con If-None-Match:   {condicional * 1000:7.3f} ms (304)")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Verifica que los contadores de stats_counters coinciden con los agregados reales
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from utils.contadores import obtener_contadores, verificar_contadores
+from utils.prestamos import registrar_devolucion, registrar_prestamo
+
+def _prestamo(conn, prestamo_id):
+    return conn.execute('SELECT * FROM prestamos WHERE id = ?', (prestamo_id,)).fetchone()
+
+def test_contadores_siguen_cada_cambio(conn):
+    for n in range(3):
+        conn.execute(
+            'INSERT INTO usuarios (nombre, email, telefono, password, activo) VALUES (?, ?, ?, ?, ?)',
+            (f'Usuario {n}', f'u{n}@prueba.com', f'30000000{n}', 'x', n % 2)
+        )
+    for n in range(4):
+        conn.execute(
+            'INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES (?, ?, ?)',
+            (f'Implemento {n}', 'Prueba', n)
+        )
+    conn.execute("UPDATE usuarios SET activo = 1 WHERE nombre = 'Usuario 0'")
+    conn.commit()
+
+    # Préstamos, devolución parcial y total (agotan el stock del implemento 2)
+    campos = {'fk_usuario': 1, 'fk_implemento': 2, 'tipo_prestamo': 'individual', 'nombre_prestatario': 'A'}
+    primero = registrar_prestamo(conn, campos, 1)
+    segundo = registrar_prestamo(conn, dict(campos, fk_implemento=4), 3)
+    registrar_devolucion(conn, _prestamo(conn, segundo), 2, 'Ninguna', 'Bueno', '')
+    registrar_devolucion(conn, _prestamo(conn, primero), 1, 'Robo', 'Bueno', '')
+
+    # Notificaciones leídas y eliminadas
+    for n in range(5):
+        conn.execute(
+            "INSERT INTO notificaciones (tipo, titulo, mensaje) VALUES ('devolucion', 'T', 'M')"
+        )
+    conn.execute('UPDATE notificaciones SET leida = 1 WHERE id <= 2')
+    conn.execute('DELETE FROM notificaciones WHERE id IN (2, 3)')
+
+    # Bajas
+    conn.execute('DELETE FROM implementos WHERE id = 3')
+    conn.execute('DELETE FROM usuarios WHERE id = 3')
+    conn.commit()
+
+    assert verificar_contadores(conn) == {}
+    assert obtener_contadores(conn) == {
+        'total_implementos': 3,
+        'implementos_disponibles': 1,
+        'total_usuarios': 2,
+        'usuarios_activos': 2,
+        'total_prestamos': 4,
+        'prestamos_activos': 1,
+        'prestamos_devueltos': 3,
+        'notificaciones_pendientes': 2,
+    }
+
+def test_comandos_cli_detectan_y_corrigen_desajustes(conn):
+    conn.execute("INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES ('Balón', 'Prueba', 5)")
+    conn.execute('UPDATE stats_counters SET total_implementos = 99')
+    conn.commit()
+
+    runner = app.test_cli_runner()
+    resultado = runner.invoke(args=['check-counters'])
+    assert resultado.exit_code != 0
+    assert 'total_implementos: contador=99 real=1' in resultado.output
+
+    resultado = runner.invoke(args=['rebuild-counters'])
+    assert resultado.exit_code == 0
+    assert verificar_contadores(conn) == {}
+    assert runner.invoke(args=['check-counters']).exit_code == 0
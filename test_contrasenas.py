@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Política de hash de contraseñas: hash con los parámetros configurados,
+actualización del hash al iniciar sesión y admisión acotada del pool
+
+Benchmark: python test_contrasenas.py [logins] [concurrencia]
+"""
+
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from conftest import crear_base, crear_usuarios
+import routes.login
+from app import app
+from utils.contrasenas import PoolHash, SistemaOcupado
+from utils.db import get_db_connection
+
+# Política barata para las pruebas
+POLITICA = 'pbkdf2:sha256:1000'
+
+@pytest.fixture
+def cliente(conn, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_LIMITS_STORE', 'memory')
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', POLITICA)
+    app.extensions.pop('login_limiters', None)
+    crear_usuarios(conn, 'instructor', password=generate_password_hash('clave-segura', method='scrypt:16384:8:1'))
+    yield app.test_client()
+    app.extensions.pop('login_limiters', None)
+
+def _hash(email):
+    conn = get_db_connection()
+    try:
+        return conn.execute('SELECT password FROM usuarios WHERE email = ?', (email,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_rehash_al_iniciar_sesion(cliente):
+    assert _hash('instructor@prueba.com').startswith('scrypt:16384:8:1$')
+
+    # Una contraseña incorrecta no cambia nada
+    assert cliente.post('/api/login', json={'email': 'instructor@prueba.com', 'password': 'mala'}).status_code == 401
+    assert _hash('instructor@prueba.com').startswith('scrypt:16384:8:1$')
+
+    respuesta = cliente.post('/login', data={'email': 'instructor@prueba.com', 'password': 'clave-segura'})
+    assert respuesta.status_code == 302
+    assert _hash('instructor@prueba.com').startswith(POLITICA + '$')
+
+    # El hash nuevo sigue validando y ya no se vuelve a generar
+    antes = _hash('instructor@prueba.com')
+    assert cliente.post('/api/login', json={'email': 'instructor@prueba.com', 'password': 'clave-segura'}).status_code == 200
+    assert _hash('instructor@prueba.com') == antes
+
+def test_registro_usa_la_politica(cliente):
+    respuesta = cliente.post('/registro/', data={
+        'nombre': 'Nuevo', 'email': 'nuevo@prueba.com', 'telefono': '3000000009',
+        'password': 'clave-segura', 'confirm-password': 'clave-segura', 'tipo_usuario': 'instructor',
+    })
+    assert respuesta.status_code in (200, 302)
+    assert _hash('nuevo@prueba.com').startswith(POLITICA + '$')
+
+def test_admision_acotada():
+    pool = PoolHash(trabajadores=1, cola=2)
+    liberar = threading.Event()
+    hilos = [threading.Thread(target=pool.ejecutar, args=(liberar.wait,)) for _ in range(2)]
+    for hilo in hilos:
+        hilo.start()
+    time.sleep(0.1)
+
+    # Con el cupo lleno se rechaza de inmediato, sin esperar
+    inicio = time.monotonic()
+    with pytest.raises(SistemaOcupado):
+        pool.ejecutar(time.sleep, 0)
+    assert time.monotonic() - inicio < 0.05
+
+    liberar.set()
+    for hilo in hilos:
+        hilo.join()
+    assert pool.ejecutar(sum, [1, 2]) == 3
+    pool.cerrar()
+
+def test_login_ocupado_responde_503(cliente, monkeypatch):
+    def ocupado(*args):
+        raise SistemaOcupado()
+    monkeypatch.setattr(routes.login, 'verificar_contrasena', ocupado)
+
+    respuesta = cliente.post('/api/login', json={'email': 'instructor@prueba.com', 'password': 'clave-segura'})
+    assert respuesta.status_code == 503 and respuesta.headers['Retry-After'] == '1'
+    respuesta = cliente.post('/login', data={'email': 'instructor@prueba.com', 'password': 'clave-segura'})
+    assert respuesta.status_code == 503
+    assert 'servidor está ocupado' in respuesta.get_data(as_text=True)
+
+def main():
+    """Logins por segundo y latencia p95 con distintos costos de hash"""
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    concurrencia = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    app.config.update(LOGIN_LIMITS_STORE='memory', PASSWORD_HASH_QUEUE=concurrencia * 2)
+    crear_base()
+
+    for metodo in ('pbkdf2:sha256:100000', 'pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1'):
+        app.config['PASSWORD_HASH_METHOD'] = metodo
+        conn = get_db_connection()
+        conn.execute('DELETE FROM usuarios')
+        conn.executemany(
+            "INSERT INTO usuarios (nombre, email, telefono, password, rol, activo) VALUES (?, ?, ?, ?, 'instructor', 1)",
+            [(f'U{n}', f'u{n}@prueba.com', f'300{n:07d}', generate_password_hash('clave', method=metodo))
+             for n in range(concurrencia)]
+        )
+        conn.commit()
+        conn.close()
+
+        latencias = []
+        def trabajador(n):
+            cliente = app.test_client()
+            for _ in range(logins // concurrencia):
+                inicio = time.perf_counter()
+                respuesta = cliente.post('/api/login', json={'email': f'u{n}@prueba.com', 'password': 'clave'})
+                assert respuesta.status_code == 200, respuesta.status_code
+                latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        hilos = [threading.Thread(target=trabajador, args=(n,)) for n in range(concurrencia)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        total = time.perf_counter() - inicio
+        latencias.sort()
+        p95 = latencias[int(len(latencias) * 0.95) - 1]
+        print(f"{metodo:>22}: {len(latencias) / total:6.1f} logins/s, p95 {p95 * 1000:6.0f} ms")
+
+if __name__ == '__main__':
+    main()
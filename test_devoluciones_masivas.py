@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Devolución masiva de préstamos: una transacción, un ajuste de inventario por
+implemento y una sola notificación de resumen
+
+Benchmark: python test_devoluciones_masivas.py [prestamos]
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+import utils.prestamos
+from utils.db import get_db_connection
+from utils.prestamos import DevolucionInvalida, registrar_devoluciones, registrar_prestamo
+
+DEVOLVER = '/admin/api/prestamos/devolver'
+
+@pytest.fixture
+def conn(conn, monkeypatch):
+    monkeypatch.setattr(utils.prestamos, 'avisar_drenador', lambda: None)
+    crear_usuarios(conn, 'admin', 'instructor')
+    conn.executemany(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, 'Prueba', 50, 'otros')",
+        [('Portátil',), ('Mouse',)]
+    )
+    conn.commit()
+    return conn
+
+def _prestar(conn, implemento=1, ficha='2567890', ambiente='101', cantidad=1):
+    return registrar_prestamo(conn, {
+        'fk_usuario': 2, 'fk_implemento': implemento, 'tipo_prestamo': 'multiple',
+        'nombre_prestatario': 'Instructor', 'ficha': ficha, 'ambiente': ambiente,
+    }, cantidad=cantidad)
+
+def _disponibles(conn):
+    return [fila[0] for fila in conn.execute('SELECT disponibilidad FROM implementos ORDER BY id')]
+
+def test_selector_de_ficha_en_una_transaccion(conn):
+    for _ in range(10):
+        _prestar(conn, 1)
+        _prestar(conn, 2, cantidad=2)
+    otra_ficha = _prestar(conn, 1, ficha='1111111')
+    assert _disponibles(conn) == [39, 30]
+
+    sentencias = []
+    conn.set_trace_callback(sentencias.append)
+    resumen = registrar_devoluciones(conn, selector={'ficha': '2567890'}, fk_usuario=1)
+    conn.set_trace_callback(None)
+    assert sentencias.count('BEGIN IMMEDIATE') == 1 and sentencias.count('COMMIT') == 1
+    # Un UPDATE de disponibilidad por implemento con la suma de sus unidades
+    ajustes = {sentencia for sentencia in sentencias if 'disponibilidad + ' in sentencia}
+    assert ajustes == {
+        'UPDATE implementos SET disponibilidad = disponibilidad + 10 WHERE id = 1',
+        'UPDATE implementos SET disponibilidad = disponibilidad + 20 WHERE id = 2',
+    }
+
+    assert resumen['prestamos'] == 20 and resumen['unidades'] == 30
+    assert resumen['implementos'] == {'Portátil': 10, 'Mouse': 20} and resumen['parciales'] == []
+    assert _disponibles(conn) == [49, 50]
+    activos = [fila[0] for fila in conn.execute('SELECT id FROM prestamos WHERE fecha_devolucion IS NULL')]
+    assert activos == [otra_ficha]
+
+    # Una sola notificación de resumen en la bandeja
+    salida = conn.execute('SELECT tipo, titulo, mensaje FROM notificaciones_salida').fetchall()
+    assert len(salida) == 1 and salida[0]['titulo'] == 'Devolución múltiple registrada'
+    assert salida[0]['mensaje'].startswith('20 préstamos devueltos (30 unidades): Mouse x20, Portátil x10')
+
+def test_novedad_estado_y_cantidad_por_prestamo(conn):
+    bueno = _prestar(conn, 1, cantidad=3)
+    roto = _prestar(conn, 1, cantidad=2)
+    parcial = _prestar(conn, 2, cantidad=4)
+    resumen = registrar_devoluciones(conn, {
+        bueno: {},
+        roto: {'novedad': 'Daño', 'estado_implemento': 'Dañado', 'observaciones': 'Pantalla rota'},
+        parcial: {'cantidad': 1},
+    })
+
+    # Las unidades dañadas no vuelven al inventario; el parcial sigue activo
+    assert _disponibles(conn) == [48, 47]
+    assert resumen['completos'] == [bueno, roto] and resumen['parciales'] == [parcial]
+    assert resumen['no_reingresan'] == 2 and resumen['con_novedad'] == 1
+    fila = conn.execute('SELECT * FROM prestamos WHERE id = ?', (roto,)).fetchone()
+    assert (fila['novedad'], fila['estado_implemento_devolucion'], fila['observaciones']) == ('Daño', 'Dañado', 'Pantalla rota')
+    assert conn.execute('SELECT estado FROM implementos WHERE id = 1').fetchone()[0] == 'Dañado'
+    fila = conn.execute('SELECT * FROM prestamos WHERE id = ?', (parcial,)).fetchone()
+    assert fila['cantidad_devuelta'] == 1 and fila['fecha_devolucion'] is None
+    # Sin usuario no se encola notificación
+    assert conn.execute('SELECT COUNT(*) FROM notificaciones_salida').fetchone()[0] == 0
+
+def test_un_error_no_registra_ninguna(conn):
+    primero = _prestar(conn, 1)
+    segundo = _prestar(conn, 2, cantidad=2)
+    registrar_devoluciones(conn, {primero: {}})
+
+    with pytest.raises(DevolucionInvalida) as error:
+        registrar_devoluciones(conn, {primero: {}, segundo: {'cantidad': 5}, 999: {}})
+    assert error.value.errores == [
+        'El préstamo 999 no existe',
+        f'El préstamo {primero} ya fue devuelto',
+        f'La cantidad del préstamo {segundo} debe estar entre 1 y 2',
+    ]
+    assert _disponibles(conn) == [50, 48]
+
+    with pytest.raises(DevolucionInvalida):
+        registrar_devoluciones(conn, selector={'horario': 'Mañana'})
+    with pytest.raises(DevolucionInvalida):
+        registrar_devoluciones(conn, {segundo: {'estado_implemento': 'Perdido'}})
+    with pytest.raises(DevolucionInvalida):
+        registrar_devoluciones(conn, selector={'ficha': '0000000'})
+
+    # Una cantidad que no es entera no devuelve todas las unidades pendientes
+    with pytest.raises(DevolucionInvalida) as error:
+        registrar_devoluciones(conn, {segundo: {'cantidad': 'dos', 'novedad': {'tipo': 'Daño'}}})
+    assert error.value.errores == [
+        f'El campo novedad del préstamo {segundo} debe ser texto',
+        f'La cantidad del préstamo {segundo} no es válida',
+    ]
+    assert _disponibles(conn) == [50, 48]
+
+def test_api(conn):
+    prestamos = [_prestar(conn, 1, ambiente='202') for _ in range(3)]
+    _prestar(conn, 2, ambiente='303')
+
+    assert cliente_con_sesion(2, 'instructor').post(DEVOLVER, json={'ambiente': '202'}).status_code == 403
+    respuesta = cliente_con_sesion().post(DEVOLVER, json={'prestamos': ['x']})
+    assert respuesta.status_code == 400
+
+    # Ids repetidos, no enteros o anidados y cantidades no numéricas: 400 con un error por préstamo
+    respuesta = cliente_con_sesion().post(DEVOLVER, json={'prestamos': [
+        prestamos[1], prestamos[1], 1.5, True, {'id': [prestamos[2]]}, {'id': prestamos[2], 'cantidad': 'x'},
+    ]})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['errores'] == [
+        f'El préstamo {prestamos[1]} está repetido',
+        'El préstamo de la posición 3 no tiene un id entero',
+        'El préstamo de la posición 4 no tiene un id entero',
+        'El préstamo de la posición 5 no tiene un id entero',
+    ]
+    respuesta = cliente_con_sesion().post(DEVOLVER, json={'prestamos': [{'id': prestamos[2], 'cantidad': 'x'}]})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['errores'] == [f'La cantidad del préstamo {prestamos[2]} no es válida']
+    respuesta = cliente_con_sesion().post(DEVOLVER, json={'prestamos': {'id': prestamos[2]}})
+    assert respuesta.status_code == 400
+    assert cliente_con_sesion().post(DEVOLVER, json={'ficha': ['2567890']}).status_code == 400
+
+    respuesta = cliente_con_sesion().post(DEVOLVER, json={
+        'ambiente': '202', 'prestamos': [{'id': prestamos[0], 'novedad': 'Pérdida'}],
+        'observaciones': 'Fin de clase',
+    })
+    datos = respuesta.get_json()
+    assert respuesta.status_code == 200 and datos['success']
+    assert datos['prestamos'] == 3 and datos['no_reingresan'] == 1
+    assert _disponibles(conn) == [49, 49]
+    observaciones = {fila[0] for fila in conn.execute('SELECT observaciones FROM prestamos WHERE ambiente = ?', ('202',))}
+    assert observaciones == {'Fin de clase'}
+
+    # Repetirla ya no encuentra préstamos activos
+    respuesta = cliente_con_sesion().post(DEVOLVER, json={'ambiente': '202'})
+    assert respuesta.status_code == 400 and respuesta.get_json()['errores'] == ['No hay préstamos activos para devolver']
+
+def main():
+    """Devolver los préstamos de una clase uno por uno vs en una sola petición"""
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    crear_base()
+    conn = get_db_connection()
+    crear_usuarios(conn, 'admin')
+    conn.executemany(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, 'x', ?, 'otros')",
+        [(f'Implemento {n}', cantidad * 2) for n in range(10)]
+    )
+    conn.commit()
+    utils.prestamos.avisar_drenador = lambda: None
+    cliente = cliente_con_sesion()
+
+    ids = [registrar_prestamo(conn, {
+        'fk_usuario': 1, 'fk_implemento': 1 + n % 10, 'tipo_prestamo': 'multiple',
+        'nombre_prestatario': 'Admin', 'ficha': 'A',
+    }) for n in range(cantidad)]
+    inicio = time.perf_counter()
+    for id in ids:
+        cliente.post(f'/admin/devolver_prestamo/{id}', data={'novedad': 'Ninguna', 'estado_implemento': 'Bueno'})
+    uno_por_uno = time.perf_counter() - inicio
+
+    for n in range(cantidad):
+        registrar_prestamo(conn, {
+            'fk_usuario': 1, 'fk_implemento': 1 + n % 10, 'tipo_prestamo': 'multiple',
+            'nombre_prestatario': 'Admin', 'ficha': 'B',
+        })
+    inicio = time.perf_counter()
+    respuesta = cliente.post(DEVOLVER, json={'ficha': 'B'})
+    masiva = time.perf_counter() - inicio
+    assert respuesta.get_json()['prestamos'] == cantidad
+
+    print(f"{cantidad} préstamos de 10 implementos")
+    print(f"uno por uno:  {uno_por_uno * 1000:8.1f} ms")
+    print(f"masiva:       {masiva * 1000:8.1f} ms")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
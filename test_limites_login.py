@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Límite de intentos de login: bloqueo por email y por IP, ataques de
+credential stuffing y vencimiento de la ventana deslizante
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from conftest import crear_usuarios
+from app import app
+from routes.login import INTENTOS_POR_EMAIL, INTENTOS_POR_IP, VENTANA_LOGIN, login_limiters
+from utils.limites import AlmacenMemoria, AlmacenSQLite, Limitador
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def cliente(request, conn, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_LIMITS_STORE', request.param)
+    app.extensions.pop('login_limiters', None)
+    crear_usuarios(conn, 'instructor', password=generate_password_hash('clave-correcta'))
+    yield app.test_client()
+    app.extensions.pop('login_limiters', None)
+
+def _login(cliente, email, password, ip):
+    return cliente.post('/login', data={'email': email, 'password': password},
+                        environ_base={'REMOTE_ADDR': ip})
+
+def _api_login(cliente, email, password, ip):
+    return cliente.post('/api/login', json={'email': email, 'password': password},
+                        environ_base={'REMOTE_ADDR': ip})
+
+def test_bloqueo_por_email_desde_varias_ips(cliente):
+    for n in range(INTENTOS_POR_EMAIL):
+        respuesta = _login(cliente, 'instructor@prueba.com', 'mala', f'10.0.0.{n}')
+        assert 'Credenciales incorrectas' in respuesta.get_data(as_text=True) or n == INTENTOS_POR_EMAIL - 1
+
+    # Ni la contraseña correcta entra mientras dure el bloqueo, desde ninguna IP
+    respuesta = _login(cliente, 'Instructor@prueba.com', 'clave-correcta', '10.0.1.1')
+    assert 'Demasiados intentos fallidos' in respuesta.get_data(as_text=True)
+    with cliente.session_transaction() as sesion:
+        assert 'user_id' not in sesion
+
+    # Otro email no se ve afectado
+    respuesta = _api_login(cliente, 'otro@prueba.com', 'x', '10.0.1.1')
+    assert respuesta.status_code == 401
+
+def test_credential_stuffing_desde_una_ip(cliente):
+    # Ráfaga de emails distintos desde la misma IP: cada email falla una sola vez
+    codigos = [
+        _api_login(cliente, f'victima{n}@prueba.com', 'filtrada', '203.0.113.7').status_code
+        for n in range(INTENTOS_POR_IP + 10)
+    ]
+    assert codigos[:INTENTOS_POR_IP] == [401] * INTENTOS_POR_IP
+    assert codigos[INTENTOS_POR_IP:] == [429] * 10
+
+    # La IP atacante queda bloqueada incluso con credenciales válidas
+    respuesta = _api_login(cliente, 'instructor@prueba.com', 'clave-correcta', '203.0.113.7')
+    assert respuesta.status_code == 429
+    assert respuesta.headers['Retry-After'] == str(VENTANA_LOGIN)
+
+    # El usuario legítimo entra desde su propia IP y sus fallos se reinician
+    _api_login(cliente, 'instructor@prueba.com', 'mala', '198.51.100.2')
+    assert _api_login(cliente, 'instructor@prueba.com', 'clave-correcta', '198.51.100.2').status_code == 200
+    with app.test_request_context():
+        por_email, _ = app.extensions['login_limiters']
+        assert por_email.intentos('email:instructor@prueba.com') == 0
+
+def test_api_login_rechaza_cuerpos_invalidos(cliente):
+    cuerpos = [
+        {'data': 'no es json', 'content_type': 'application/json'},
+        {'data': 'email=instructor@prueba.com&password=x', 'content_type': 'application/x-www-form-urlencoded'},
+        {'json': ['instructor@prueba.com', 'x']},
+        {'json': {'email': ['instructor@prueba.com'], 'password': 'x'}},
+        {'json': {'email': 'instructor@prueba.com', 'password': 12345}},
+        {'json': {'email': None, 'password': None}},
+    ]
+    for cuerpo in cuerpos:
+        respuesta = cliente.post('/api/login', environ_base={'REMOTE_ADDR': '10.0.2.1'}, **cuerpo)
+        assert respuesta.status_code == 400
+        assert respuesta.get_json()['success'] is False
+
+    # Ninguno cuenta como intento fallido
+    with app.test_request_context():
+        por_email, por_ip = login_limiters()
+        assert por_ip.intentos('ip:10.0.2.1') == 0
+        assert por_email.intentos('email:instructor@prueba.com') == 0
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1_000_000 * 900.0
+
+    def __call__(self):
+        return self.ahora
+
+def test_ventana_deslizante_y_lru():
+    reloj = Reloj()
+    limitador = Limitador(AlmacenMemoria(maximo=100), limite=5, segundos=900, reloj=reloj)
+    restantes = [limitador.registrar('email:a') for _ in range(5)]
+    assert restantes == [4, 3, 2, 1, 0]
+    assert limitador.bloqueado('email:a')
+
+    # A mitad de la ventana siguiente cuenta la mitad de los intentos anteriores
+    reloj.ahora += 900 * 1.5
+    assert limitador.intentos('email:a') == pytest.approx(2.5)
+    assert not limitador.bloqueado('email:a')
+
+    # Dos ventanas después la clave ya no cuenta
+    reloj.ahora += 900
+    assert limitador.intentos('email:a') == 0
+
+    # El almacén en memoria no crece con cada email distinto
+    for n in range(1000):
+        limitador.registrar(f'email:{n}')
+    assert len(limitador.almacen) == 100
+
+def test_almacen_sqlite_elimina_claves_vencidas(conn):
+    reloj = Reloj()
+    almacen = AlmacenSQLite(lambda: conn)
+    limitador = Limitador(almacen, limite=3, segundos=60, reloj=reloj)
+    for n in range(50):
+        limitador.registrar(f'ip:10.0.0.{n}')
+    limitador.registrar('ip:10.0.0.1')
+    assert limitador.intentos('ip:10.0.0.1') == 2
+
+    reloj.ahora += 60
+    limitador.registrar('ip:10.0.0.1')
+    assert tuple(conn.execute("SELECT actual, anterior FROM login_limites WHERE clave = 'ip:10.0.0.1'").fetchone()) == (1, 2)
+
+    # Dos ventanas después solo se conserva la clave que volvió a intentar
+    reloj.ahora += 120
+    limitador.registrar('ip:10.0.0.1')
+    assert almacen.limpiar_vencidos(conn, int(reloj() // 60)) == 49
+    assert conn.execute('SELECT COUNT(*) FROM login_limites').fetchone()[0] == 1
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Paginación por cursor de los listados de préstamos y usuarios
+"""
+
+import sys
+import os
+import re
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_usuarios
+import utils.db
+from utils.paginacion import CLAVES_PRESTAMOS, decodificar_cursor, paginar
+
+CONSULTA = 'SELECT p.id, p.fecha_prestamo FROM prestamos p WHERE 1=1'
+
+@pytest.fixture
+def conn(conn):
+    crear_usuarios(conn, 'admin')
+    conn.execute("INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES ('Balón', 'Prueba', 1)")
+    # Varias filas comparten fecha para comprobar el desempate por id
+    for n in range(23):
+        conn.execute('''
+            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, fecha_prestamo)
+            VALUES (1, 1, 'individual', 'Aprendiz', datetime('2025-01-01', ?))
+        ''', (f'+{n // 3} days',))
+    conn.commit()
+    return conn
+
+def _ids(pagina):
+    return [fila['id'] for fila in pagina['filas']]
+
+def test_paginas_sin_huecos_ni_repetidos(conn):
+    esperado = [fila['id'] for fila in conn.execute(f'{CONSULTA} ORDER BY p.fecha_prestamo DESC, p.id DESC')]
+
+    # Hacia adelante
+    paginas = [paginar(conn, CONSULTA, [], CLAVES_PRESTAMOS, por_pagina=5)]
+    while paginas[-1]['siguiente']:
+        paginas.append(paginar(conn, CONSULTA, [], CLAVES_PRESTAMOS, despues=paginas[-1]['siguiente'], por_pagina=5))
+    assert [len(p['filas']) for p in paginas] == [5, 5, 5, 5, 3]
+    assert sum((_ids(p) for p in paginas), []) == esperado
+    assert paginas[0]['anterior'] is None
+
+    # Hacia atrás desde la última página se recuperan las mismas páginas
+    pagina = paginas[-1]
+    for anterior in reversed(paginas[:-1]):
+        pagina = paginar(conn, CONSULTA, [], CLAVES_PRESTAMOS, antes=pagina['anterior'], por_pagina=5)
+        assert _ids(pagina) == _ids(anterior)
+    assert pagina['anterior'] is None
+
+def test_cursor_invalido_vuelve_a_la_primera_pagina(conn):
+    assert decodificar_cursor('no-es-un-cursor', 2) is None
+    pagina = paginar(conn, CONSULTA, [], CLAVES_PRESTAMOS, despues='basura', por_pagina=5)
+    assert _ids(pagina) == _ids(paginar(conn, CONSULTA, [], CLAVES_PRESTAMOS, por_pagina=5))
+
+def test_listado_enlaza_la_pagina_siguiente(conn):
+    cliente = cliente_con_sesion()
+    respuesta = cliente.get('/admin/gestion_prestamos_admin?estado=todos&dias=0&por_pagina=20')
+    assert respuesta.status_code == 200
+    enlace = re.search(r'href="([^"]*despues=[^"]*)"', respuesta.get_data(as_text=True))
+    assert enlace and 'por_pagina=20' in enlace.group(1)
+
+    respuesta = cliente.get(enlace.group(1).replace('&amp;', '&'))
+    html = respuesta.get_data(as_text=True)
+    assert respuesta.status_code == 200
+    assert 'antes=' in html and 'despues=' not in html
+
+def test_totales_en_unidades_segun_el_filtro(conn, monkeypatch):
+    # Un préstamo de hoy de 4 unidades con 1 devuelta y otro de 2 ya devuelto
+    conn.execute('''
+        INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, cantidad, cantidad_devuelta)
+        VALUES (1, 1, 'multiple', 'Ficha', 4, 1)
+    ''')
+    conn.execute('''
+        INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, cantidad, cantidad_devuelta, fecha_devolucion)
+        VALUES (1, 1, 'multiple', 'Ficha', 2, 2, CURRENT_TIMESTAMP)
+    ''')
+    conn.commit()
+
+    consultas = []
+    configurar = utils.db._configurar_conexion
+    def configurar_con_traza(conexion):
+        conexion.set_trace_callback(consultas.append)
+        return configurar(conexion)
+    monkeypatch.setattr(utils.db, '_configurar_conexion', configurar_con_traza)
+
+    def totales(url, rol='admin'):
+        cliente = cliente_con_sesion(1, rol)
+        consultas.clear()
+        html = cliente.get(url).get_data(as_text=True)
+        return [int(n) for n in re.findall(r'text-2xl font-semibold text-gray-900">(\d+)<', html)]
+
+    # Todo el historial: 23 + 4 + 2 unidades, 23 + 3 sin devolver; sin recorrer prestamos
+    assert totales('/prestamos/prestamos?dias=0') == [29, 26, 3]
+    assert not [sql for sql in consultas if 'SUM(' in sql and 'FROM prestamos' in sql]
+    # Últimos 30 días: solo los de hoy, y el estado elegido se aplica a los totales
+    assert totales('/prestamos/prestamos?dias=30') == [6, 3, 3]
+    assert totales('/prestamos/prestamos?dias=30&estado=activos') == [3, 3, 0]
+    assert totales('/prestamos/prestamos?dias=30&estado=devueltos') == [3, 0, 3]
+    # Con fecha tampoco: el admin lee los resúmenes diarios
+    assert not [sql for sql in consultas if 'SUM(' in sql and 'FROM prestamos' in sql]
+    # El usuario solo agrega sobre los suyos
+    assert totales('/prestamos/prestamos?dias=0', rol='instructor') == [29, 26, 3]
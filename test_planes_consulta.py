@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Verifica con EXPLAIN QUERY PLAN que los listados usan los índices secundarios
+"""
+
+import sys
+import os
+import re
+import sqlite3
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from conftest import crear_usuarios
+import utils.db
+from app import app
+from utils.db import get_db_connection
+
+TABLAS_CALIENTES = ('prestamos', 'notificaciones', 'implementos')
+
+def _sembrar_datos(conn):
+    crear_usuarios(conn, 'admin', 'instructor', password=generate_password_hash('clave12345'))
+    for n in range(20):
+        conn.execute(
+            'INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) VALUES (?, ?, ?, ?)',
+            (f'Implemento {n}', 'Descripción', 10, 'otros')
+        )
+    for n in range(200):
+        conn.execute('''
+            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, fecha_prestamo, fecha_devolucion)
+            VALUES (?, ?, 'individual', 'Aprendiz', datetime('now', ?), ?)
+        ''', (1 + n % 2, 1 + n % 20, f'-{n} days', None if n % 3 else '2024-01-01 00:00:00'))
+        conn.execute('''
+            INSERT INTO notificaciones (tipo, titulo, mensaje, fk_usuario, leida)
+            VALUES ('devolucion', 'Titulo', 'Mensaje', 1, ?)
+        ''', (n % 2,))
+    conn.commit()
+
+@pytest.fixture
+def entorno(conn, monkeypatch):
+    _sembrar_datos(conn)
+
+    # Registrar cada sentencia ejecutada por las conexiones del pool
+    consultas = []
+    configurar = utils.db._configurar_conexion
+    def configurar_con_traza(conn):
+        conn.set_trace_callback(consultas.append)
+        return configurar(conn)
+    monkeypatch.setattr(utils.db, '_configurar_conexion', configurar_con_traza)
+
+    app.config['TESTING'] = True
+    yield consultas
+
+def _cliente(email):
+    cliente = app.test_client()
+    cliente.post('/login', data={'email': email, 'password': 'clave12345'})
+    return cliente
+
+def _problemas_plan(sql):
+    """Devuelve los pasos del plan que recorren una tabla caliente sin índice o ordenan en memoria"""
+    conn = sqlite3.connect(utils.db.DATABASE)
+    try:
+        plan = [fila[3] for fila in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        alias = set(TABLAS_CALIENTES)
+        for tabla in TABLAS_CALIENTES:
+            alias.update(re.findall(rf'\b{tabla}\s+(?:AS\s+)?([a-z])\b', sql, re.IGNORECASE))
+        # Un listado completo sin filtros puede recorrer la tabla en orden de rowid
+        filtra = 'WHERE' in sql.upper()
+        problemas = []
+        for paso in plan:
+            tabla = re.match(r'SCAN (\w+)', paso)
+            if filtra and tabla and tabla.group(1) in alias and 'USING' not in paso:
+                problemas.append(paso)
+            if 'TEMP B-TREE FOR ORDER BY' in paso:
+                problemas.append(paso)
+        return problemas
+    finally:
+        conn.close()
+
+def _verificar_listados(consultas, cliente, urls):
+    for url in urls:
+        consultas.clear()
+        respuesta = cliente.get(url)
+        assert respuesta.status_code == 200, url
+        selects = [
+            sql for sql in consultas
+            if sql.lstrip().upper().startswith('SELECT')
+            and any(tabla in sql for tabla in TABLAS_CALIENTES)
+        ]
+        for sql in selects:
+            assert not _problemas_plan(sql), f'{url}: {sql}\n{_problemas_plan(sql)}'
+
+def test_listados_admin_usan_indices(entorno):
+    cliente = _cliente('admin@prueba.com')
+    _verificar_listados(entorno, cliente, [
+        '/admin/',
+        '/admin/catalogo',
+        '/admin/devolucion_prestamos',
+        '/admin/gestion_prestamos',
+        '/admin/gestion_prestamos?estado=activos',
+        '/admin/gestion_prestamos_admin',
+        '/admin/gestion_prestamos_admin?estado=activos&dias=7',
+        '/admin/gestion_prestamos_admin?estado=devueltos&dias=0',
+        '/admin/gestion_prestamos_admin?por_pagina=10',
+        '/admin/usuarios',
+        '/admin/usuarios?estado=activos&rol=instructor',
+        '/admin/notificaciones',
+        '/admin/api/notificaciones',
+        '/prestamos/prestamos',
+        '/prestamos/prestamos?estado=activos&dias=0',
+        '/prestamos/prestamos?por_pagina=10',
+    ])
+
+def test_listados_instructor_usan_indices(entorno):
+    cliente = _cliente('instructor@prueba.com')
+    _verificar_listados(entorno, cliente, [
+        '/prestamos/prestamos',
+        '/prestamos/prestamos?estado=devueltos&dias=0',
+        '/admin/gestion_prestamos_instructores',
+        '/admin/gestion_prestamos_instructores?estado=activos',
+        '/catalogo/catalogo',
+        '/catalogo/catalogo/filtrar?disponibilidad=disponible',
+        '/catalogo/catalogo/filtrar?filtro=implemento&disponibilidad=disponible',
+    ])
+
+def test_migraciones_registran_version(entorno):
+    from utils.migraciones import MIGRACIONES, aplicar_migraciones
+    conn = get_db_connection()
+    try:
+        versiones = [fila[0] for fila in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+        assert versiones == [version for version, _, _ in MIGRACIONES]
+        # Una segunda ejecución no vuelve a aplicar nada
+        assert aplicar_migraciones(conn) == []
+    finally:
+        conn.close()
+
+def test_rangos_de_fecha_usan_busqueda_por_indice(entorno):
+    from utils.helpers import limites_fecha
+    desde, hasta = limites_fecha('2025-03-01', '2025-03-31')
+    assert (desde, hasta) == ('2025-03-01 00:00:00', '2025-04-01 00:00:00')
+
+    conn = get_db_connection()
+    try:
+        plan = ' '.join(fila[3] for fila in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM prestamos WHERE fecha_prestamo >= ? AND fecha_prestamo < ?',
+            (desde, hasta)
+        ))
+        assert 'SEARCH prestamos USING' in plan and 'fecha_prestamo>? AND fecha_prestamo<?' in plan
+
+        # Las fechas que llegan en otro formato se guardan en el canónico
+        cursor = conn.execute('''
+            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, fecha_prestamo)
+            VALUES (1, 1, 'individual', 'Aprendiz', '2025-03-31T23:59:59.500')
+        ''')
+        conn.commit()
+        fecha = conn.execute('SELECT fecha_prestamo FROM prestamos WHERE id = ?', (cursor.lastrowid,)).fetchone()[0]
+        assert fecha == '2025-03-31 23:59:59'
+        assert desde <= fecha < hasta
+
+        # También las que llegan al editar el préstamo
+        conn.execute('''
+            UPDATE prestamos SET fecha_prestamo = '2025-03-15T08:00:00', fecha_devolucion = '2025-03-16T09:30:00Z'
+            WHERE id = ?
+        ''', (cursor.lastrowid,))
+        conn.commit()
+        fila = conn.execute('SELECT fecha_prestamo, fecha_devolucion FROM prestamos WHERE id = ?', (cursor.lastrowid,)).fetchone()
+        assert tuple(fila) == ('2025-03-15 08:00:00', '2025-03-16 09:30:00')
+    finally:
+        conn.close()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Prueba de estrés: préstamos simultáneos del mismo implemento sin sobreventa
+
+Ejecutado directamente (python test_prestamos_concurrentes.py [hilos] [solicitudes])
+funciona como benchmark e informa los préstamos por segundo.
+"""
+
+import sys
+import os
+import random
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from conftest import crear_base, crear_usuarios
+from utils.db import get_db_connection
+from utils.prestamos import DisponibilidadInsuficiente, registrar_prestamo
+
+def _sembrar(conn, stock):
+    """Agrega un usuario y un implemento con el stock indicado; devuelve el id del implemento"""
+    crear_usuarios(conn, 'instructor')
+    implemento_id = conn.execute(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES ('Balón', 'Prueba', ?)",
+        (stock,)
+    ).lastrowid
+    conn.commit()
+    return implemento_id
+
+def _simular_prestamos(implemento_id, hilos, solicitudes_por_hilo):
+    """Lanza los hilos y devuelve (unidades prestadas, rechazos, errores, segundos)"""
+    prestadas = []
+    rechazos = []
+    errores = []
+    inicio_comun = threading.Barrier(hilos)
+
+    def trabajador(semilla):
+        azar = random.Random(semilla)
+        conn = get_db_connection()
+        inicio_comun.wait()
+        try:
+            for _ in range(solicitudes_por_hilo):
+                cantidad = azar.randint(1, 3)
+                try:
+                    registrar_prestamo(conn, {
+                        'fk_usuario': 1,
+                        'fk_implemento': implemento_id,
+                        'tipo_prestamo': 'individual',
+                        'nombre_prestatario': f'Aprendiz {semilla}',
+                    }, cantidad)
+                    prestadas.append(cantidad)
+                except DisponibilidadInsuficiente:
+                    rechazos.append(cantidad)
+                except Exception as e:
+                    errores.append(e)
+        finally:
+            conn.close()
+
+    hebras = [threading.Thread(target=trabajador, args=(n,)) for n in range(hilos)]
+    inicio = time.perf_counter()
+    for hebra in hebras:
+        hebra.start()
+    for hebra in hebras:
+        hebra.join()
+    return prestadas, rechazos, errores, time.perf_counter() - inicio
+
+def _verificar_inventario(implemento_id, stock, prestadas):
+    conn = get_db_connection()
+    try:
+        disponibilidad = conn.execute(
+            'SELECT disponibilidad FROM implementos WHERE id = ?', (implemento_id,)
+        ).fetchone()[0]
+        registradas = conn.execute(
+            'SELECT COALESCE(SUM(cantidad), 0) FROM prestamos WHERE fk_implemento = ?', (implemento_id,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert disponibilidad >= 0
+    assert registradas == sum(prestadas)
+    assert disponibilidad == stock - registradas
+    return disponibilidad
+
+def test_prestamos_concurrentes_no_sobrevenden(conn):
+    stock = 60
+    implemento_id = _sembrar(conn, stock)
+
+    prestadas, rechazos, errores, _ = _simular_prestamos(implemento_id, hilos=8, solicitudes_por_hilo=20)
+
+    assert not errores, errores
+    assert rechazos, 'La demanda debería superar el stock'
+    disponibilidad = _verificar_inventario(implemento_id, stock, prestadas)
+    # Solo se rechaza cuando de verdad no alcanzan las unidades restantes
+    assert disponibilidad < 3
+
+def main():
+    hilos = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    solicitudes = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    stock = hilos * solicitudes  # Alcanza aproximadamente para la mitad de la demanda
+
+    with tempfile.TemporaryDirectory() as directorio:
+        crear_base(os.path.join(directorio, 'database.db'))
+        conn = get_db_connection()
+        implemento_id = _sembrar(conn, stock)
+        conn.close()
+        print(f"=== {hilos} hilos x {solicitudes} solicitudes, stock inicial {stock} ===")
+
+        prestadas, rechazos, errores, segundos = _simular_prestamos(implemento_id, hilos, solicitudes)
+        disponibilidad = _verificar_inventario(implemento_id, stock, prestadas)
+
+        total = len(prestadas) + len(rechazos)
+        print(f"Préstamos registrados: {len(prestadas)} ({sum(prestadas)} unidades)")
+        print(f"Rechazados por falta de stock: {len(rechazos)}")
+        print(f"Errores: {len(errores)}")
+        print(f"Disponibilidad final: {disponibilidad} (sin sobreventa)")
+        print(f"Tiempo: {segundos:.2f} s - {total / segundos:.0f} solicitudes/s, {len(prestadas) / segundos:.0f} préstamos/s")
+
+if __name__ == '__main__':
+    main()
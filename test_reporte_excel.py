@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Exportación del reporte de préstamos a Excel en modo write-only
+
+Ejecutado directamente (python test_reporte_excel.py [préstamos ...]) mide
+filas por segundo y memoria máxima (RSS) de la exportación; cada tamaño corre
+en un proceso aparte para que el pico de memoria no se arrastre entre medidas.
+"""
+
+import sys
+import os
+import io
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from openpyxl import load_workbook
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+from utils.db import get_db_connection
+
+def _sembrar(conn, cantidad):
+    crear_usuarios(conn, 'admin')
+    conn.execute(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad, categoria) "
+        "VALUES ('Balón', 'Prueba', 1, 'otros')"
+    )
+    lote = 50000
+    for inicio in range(0, cantidad, lote):
+        conn.executemany('''
+            INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, ficha,
+                                   fecha_prestamo, fecha_devolucion, cantidad, cantidad_devuelta)
+            VALUES (1, 1, 'individual', ?, '123456', datetime('2024-01-01', ?), ?, 2, ?)
+        ''', [
+            (f'Aprendiz {n % 500}', f'+{n % 700} days', None if n % 3 else '2026-01-01 00:00:00', 0 if n % 3 else 2)
+            for n in range(inicio, min(inicio + lote, cantidad))
+        ])
+    conn.commit()
+
+@pytest.fixture
+def conn(conn):
+    _sembrar(conn, 30)
+    return conn
+
+def test_reporte_detallado(conn):
+    respuesta = cliente_con_sesion().post('/admin/reportes/prestamos/excel', data={'tipo_reporte': 'activos'})
+    assert respuesta.status_code == 200
+    assert 'reporte_prestamos_activos_' in respuesta.headers['Content-Disposition']
+
+    hoja = load_workbook(io.BytesIO(respuesta.data)).active
+    filas = list(hoja.iter_rows(values_only=True))
+    assert filas[0][:3] == ('ID', 'Tipo Préstamo', 'Prestatario')
+    assert hoja['A1'].style == 'Reporte encabezado'
+    assert hoja['A2'].style == 'Reporte celda'
+    # 20 préstamos activos, una fila en blanco y el bloque de información
+    assert len(filas) == 1 + 20 + 1 + 5
+    assert filas[1][2] == 'Aprendiz 29' and filas[1][13] is None
+    # Fechas y cantidades como valores nativos de Excel
+    assert filas[1][10:13] == (2, 0, datetime(2024, 1, 30))
+    assert hoja['M2'].style == 'Reporte fecha'
+    assert filas[-3] == ('Total de registros: 20',) + (None,) * 17
+
+def test_reporte_resumen(conn):
+    respuesta = cliente_con_sesion().post('/admin/reportes/prestamos/excel', data={
+        'formato': 'resumen', 'fecha_inicio': '2024-01-01', 'fecha_fin': '2024-01-10'
+    })
+    filas = list(load_workbook(io.BytesIO(respuesta.data)).active.iter_rows(values_only=True))
+    assert filas[0] == ('ID', 'Prestatario', 'Implemento', 'Cantidad', 'Fecha Préstamo',
+                        'Fecha Devolución', 'Días Transcurridos', 'Estado', 'Registrado por')
+    assert len(filas) == 1 + 10 + 1 + 5
+    devuelto = next(fila for fila in filas[1:] if fila[7] == 'Devuelto')
+    assert devuelto[6].endswith(' días') and devuelto[3] == 2
+
+def medir(cantidad):
+    """Exporta `cantidad` préstamos y devuelve (segundos, bytes, RSS máximo en MiB)"""
+    with tempfile.TemporaryDirectory() as directorio:
+        crear_base(os.path.join(directorio, 'database.db'))
+        conn = get_db_connection()
+        _sembrar(conn, cantidad)
+        conn.close()
+
+        cliente = cliente_con_sesion()
+        inicio = time.perf_counter()
+        respuesta = cliente.post('/admin/reportes/prestamos/excel', data={}, buffered=False)
+        tamano = sum(len(bloque) for bloque in respuesta.iter_encoded())
+        respuesta.close()
+        segundos = time.perf_counter() - inicio
+    return segundos, tamano, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--medir':
+        cantidad = int(sys.argv[2])
+        segundos, tamano, rss = medir(cantidad)
+        print(f"{cantidad:8} préstamos: {cantidad / segundos:9.0f} filas/s   "
+              f"{tamano / 2**20:7.1f} MiB   RSS máx {rss:7.1f} MiB")
+        return
+
+    for cantidad in [int(valor) for valor in sys.argv[1:]] or [10000, 100000, 1000000]:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--medir', str(cantidad)], check=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Resúmenes diarios de préstamos: se mantienen al prestar, devolver, editar y
+eliminar, y los reportes por rango coinciden con los agregados sobre prestamos
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from app import app
+from utils.helpers import generar_reporte_prestamos, limites_fecha
+from utils.prestamos import registrar_devolucion, registrar_prestamo
+from utils.resumenes import (
+    implementos_mas_prestados, recalcular_resumenes, usuarios_mas_activos, verificar_resumenes
+)
+
+# Consultas originales sobre prestamos, para comparar
+REPORTE_DIRECTO = '''
+    SELECT
+        COALESCE(SUM(cantidad), 0) as total_prestamos,
+        COALESCE(SUM(cantidad - cantidad_devuelta), 0) as activos,
+        COALESCE(SUM(cantidad_devuelta), 0) as devueltos,
+        COALESCE(SUM(CASE WHEN tipo_prestamo = 'individual' THEN cantidad END), 0) as individuales,
+        COALESCE(SUM(CASE WHEN tipo_prestamo = 'multiple' THEN cantidad END), 0) as multiples
+    FROM prestamos
+    WHERE fecha_prestamo >= ? AND fecha_prestamo < ?
+'''
+
+IMPLEMENTOS_DIRECTO = '''
+    SELECT i.implemento, COALESCE(SUM(p.cantidad), 0) as total_prestamos
+    FROM implementos i
+    LEFT JOIN prestamos p ON i.id = p.fk_implemento
+    GROUP BY i.id, i.implemento
+    ORDER BY total_prestamos DESC, i.implemento
+'''
+
+@pytest.fixture
+def conn(conn):
+    conn.executemany(
+        "INSERT INTO usuarios (nombre, email, telefono, password, rol, activo) VALUES (?, ?, ?, 'x', 'admin', 1)",
+        [(f'Usuario {n}', f'u{n}@prueba.com', f'30000000{n:02d}') for n in range(3)]
+    )
+    conn.executemany(
+        "INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES (?, 'Prueba', 1000)",
+        [(f'Implemento {n}',) for n in range(4)]
+    )
+    conn.commit()
+
+    # Préstamos repartidos en dos semanas, por las funciones de la aplicación
+    for n in range(120):
+        registrar_prestamo(conn, {
+            'fk_usuario': 1 + n % 3,
+            'fk_implemento': 1 + n % 4,
+            'tipo_prestamo': 'multiple' if n % 5 == 0 else 'individual',
+            'nombre_prestatario': f'Aprendiz {n}',
+            'fecha_prestamo': f'2025-03-{1 + n % 14:02d} {n % 24:02d}:30:00',
+        }, cantidad=1 + n % 3)
+    return conn
+
+def _devolver(conn, prestamo_id, cantidad, novedad='Ninguna'):
+    prestamo = conn.execute('SELECT * FROM prestamos WHERE id = ?', (prestamo_id,)).fetchone()
+    registrar_devolucion(conn, prestamo, cantidad, novedad, 'Bueno', '')
+
+def test_resumenes_siguen_los_cambios(conn):
+    assert verificar_resumenes(conn) == {}
+
+    # Devoluciones totales y parciales
+    for prestamo_id in range(1, 120, 7):
+        _devolver(conn, prestamo_id, 1)
+    _devolver(conn, 3, 2, novedad='Perdido')
+
+    # Edición: cambia implemento, tipo y día de un préstamo
+    conn.execute('''
+        UPDATE prestamos SET fk_implemento = 4, tipo_prestamo = 'multiple', fecha_prestamo = '2025-04-01 08:00:00'
+        WHERE id = 10
+    ''')
+    conn.execute('DELETE FROM prestamos WHERE id = 11')
+    conn.commit()
+    assert verificar_resumenes(conn) == {}
+
+    # Los días que quedan sin préstamos no dejan filas vacías
+    assert conn.execute('SELECT COUNT(*) FROM resumen_diario_tipos WHERE prestamos = 0').fetchone()[0] == 0
+
+def test_reportes_iguales_a_los_agregados(conn):
+    for prestamo_id in range(2, 120, 5):
+        _devolver(conn, prestamo_id, 1)
+
+    with app.test_request_context():
+        for inicio, fin in [('2025-03-01', '2025-03-14'), ('2025-03-03', '2025-03-03'), ('2025-03-05', '2025-03-09')]:
+            directo = dict(conn.execute(REPORTE_DIRECTO, limites_fecha(inicio, fin)).fetchone())
+            assert generar_reporte_prestamos(inicio, fin) == directo
+        sin_rango = REPORTE_DIRECTO.split('WHERE')[0]
+        total = dict(conn.execute(sin_rango).fetchone())
+        assert generar_reporte_prestamos() == total
+
+    directo = [tuple(fila) for fila in conn.execute(IMPLEMENTOS_DIRECTO)]
+    assert [tuple(fila) for fila in implementos_mas_prestados(conn)] == directo
+    usuarios = {fila['email']: fila['total_prestamos'] for fila in usuarios_mas_activos(conn)}
+    assert sum(usuarios.values()) == total['total_prestamos']
+
+def test_verificador_y_reconstruccion(conn):
+    conn.execute("UPDATE resumen_diario_implementos SET cantidad = cantidad + 1 WHERE dia = '2025-03-02'")
+    conn.execute("DELETE FROM resumen_diario_usuarios WHERE dia = '2025-03-05'")
+    conn.commit()
+    diferencias = verificar_resumenes(conn)
+    assert set(diferencias) == {'implemento', 'usuario'}
+    assert all(dia == '2025-03-02' for dia, _ in diferencias['implemento'])
+
+    filas = recalcular_resumenes(conn)
+    conn.commit()
+    assert verificar_resumenes(conn) == {}
+    assert filas['tipo'] == conn.execute(
+        'SELECT COUNT(DISTINCT date(fecha_prestamo) || tipo_prestamo) FROM prestamos'
+    ).fetchone()[0]
+
+    runner = app.test_cli_runner()
+    resultado = runner.invoke(args=['check-rollups'])
+    assert resultado.exit_code == 0 and 'Resúmenes consistentes' in resultado.output
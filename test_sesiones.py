@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Sesiones en SQLite: lecturas sin escritura, vencimiento deslizante, limpieza
+de sesiones vencidas y comparación con el backend de archivos
+
+Benchmark: python test_sesiones.py [requests]
+"""
+
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from flask import Flask, flash, get_flashed_messages, session
+from werkzeug.security import generate_password_hash
+
+from conftest import crear_usuarios
+from utils.sesiones import AlmacenSesiones, SesionesSQLite
+
+def crear_app(ruta):
+    """Aplicación mínima que lee, modifica y vacía la sesión"""
+    app = Flask(__name__)
+    app.secret_key = 'clave-de-prueba'
+    app.config['PERMANENT_SESSION_LIFETIME'] = 3600
+    app.session_interface = SesionesSQLite(AlmacenSesiones(ruta))
+
+    @app.route('/entrar')
+    def entrar():
+        session['user_id'] = 1
+        return 'ok'
+
+    @app.route('/leer')
+    def leer():
+        return str(session.get('user_id'))
+
+    @app.route('/avisar')
+    def avisar():
+        flash('Guardado', 'success')
+        return 'ok'
+
+    @app.route('/mensajes')
+    def mensajes():
+        return ','.join(get_flashed_messages())
+
+    @app.route('/salir')
+    def salir():
+        session.clear()
+        return 'ok'
+
+    @app.route('/login')
+    def login():
+        session.regenerar()
+        session['user_id'] = 2
+        return 'ok'
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        session.regenerar()
+        flash('Hasta pronto', 'success')
+        return 'ok'
+
+    return app
+
+@pytest.fixture
+def app(tmp_path):
+    return crear_app(str(tmp_path / 'sesiones.db'))
+
+def _fila(app):
+    return app.session_interface.almacen._conexion().execute('SELECT id, datos, expira FROM sesiones').fetchall()
+
+def test_lecturas_no_escriben(app):
+    cliente = app.test_client()
+    assert 'Set-Cookie' not in cliente.get('/leer').headers
+    assert _fila(app) == []
+
+    assert 'Set-Cookie' in cliente.get('/entrar').headers
+    antes = _fila(app)
+    assert len(antes) == 1 and 'user_id' in antes[0][1]
+
+    for _ in range(3):
+        respuesta = cliente.get('/leer')
+        assert respuesta.data == b'1'
+        assert 'Set-Cookie' not in respuesta.headers
+    assert _fila(app) == antes
+
+    # Los mensajes flash sí modifican la sesión y se guardan
+    cliente.get('/avisar')
+    assert cliente.get('/mensajes').data == b'Guardado'
+    assert cliente.get('/mensajes').data == b''
+
+def test_cookie_firmada_y_cierre(app):
+    cliente = app.test_client()
+    cliente.get('/entrar')
+    sid = _fila(app)[0][0]
+    cookie = cliente.get_cookie('session').value
+    assert cookie.startswith(sid + '.')
+
+    # Un id sin firma válida no abre la sesión
+    otro = app.test_client()
+    otro.set_cookie('session', sid)
+    assert otro.get('/leer').data == b'None'
+
+    cliente.get('/salir')
+    assert _fila(app) == []
+    assert cliente.get_cookie('session') is None
+
+def test_login_y_logout_regeneran_el_id(app):
+    # Un id obtenido antes del login (p. ej. fijado por un atacante)
+    cliente = app.test_client()
+    cliente.get('/avisar')
+    cookie_previa = cliente.get_cookie('session').value
+    sid_previo = _fila(app)[0][0]
+
+    cliente.get('/login')
+    assert [fila[0] for fila in _fila(app)] != [sid_previo] and len(_fila(app)) == 1
+    # Los datos previos se conservan con el id nuevo; el id viejo ya no abre nada
+    assert cliente.get('/mensajes').data == b'Guardado'
+    atacante = app.test_client()
+    atacante.set_cookie('session', cookie_previa)
+    assert atacante.get('/leer').data == b'None'
+
+    # Al cerrar sesión el mensaje flash se guarda con otro id
+    sid_login = _fila(app)[0][0]
+    cliente.get('/logout')
+    assert [fila[0] for fila in _fila(app)] != [sid_login] and len(_fila(app)) == 1
+    assert cliente.get('/leer').data == b'None'
+    assert cliente.get('/mensajes').data == b'Hasta pronto'
+
+def test_login_de_la_aplicacion_invalida_el_id_previo(conn):
+    from app import app as lendix
+    crear_usuarios(conn, 'admin', password=generate_password_hash('clave12345'))
+    interfaz = lendix.session_interface
+
+    # Una página protegida sin sesión guarda un aviso con un id previo al login
+    cliente = lendix.test_client()
+    cliente.get('/prestamos/prestamos')
+    cookie_previa = cliente.get_cookie('session').value
+    sid_previo = interfaz._firmador(lendix).unsign(cookie_previa).decode()
+    assert interfaz.almacen.leer(sid_previo, time.time())
+
+    respuesta = cliente.post('/login', data={'email': 'admin@prueba.com', 'password': 'clave12345'})
+    assert respuesta.status_code == 302
+    with cliente.session_transaction() as sesion:
+        assert sesion['user_id'] == 1 and sesion.sid != sid_previo
+
+    # El id previo ya no resuelve ninguna sesión, ni siquiera con su cookie firmada
+    assert interfaz.almacen.leer(sid_previo, time.time()) is None
+    atacante = lendix.test_client()
+    atacante.set_cookie('session', cookie_previa)
+    with atacante.session_transaction() as sesion:
+        assert sesion.nueva and not sesion
+
+def test_vencimiento_y_limpieza(app):
+    almacen = app.session_interface.almacen
+    cliente = app.test_client()
+    cliente.get('/entrar')
+    sid, _, expira = _fila(app)[0]
+    assert 3590 < expira - time.time() <= 3600
+
+    # Pasada la mitad de la vida se renueva solo el vencimiento
+    almacen._conexion().execute('UPDATE sesiones SET expira = ?', (time.time() + 600,))
+    respuesta = cliente.get('/leer')
+    assert 'Set-Cookie' in respuesta.headers
+    assert _fila(app)[0][2] - time.time() > 3500
+
+    # Una sesión vencida ya no se abre y la limpieza la elimina
+    almacen._conexion().execute('UPDATE sesiones SET expira = ?', (time.time() - 1,))
+    assert cliente.get('/leer').data == b'None'
+    otros = [(f'vieja{n}', '{}', time.time() - 10) for n in range(5)]
+    almacen._conexion().executemany('INSERT INTO sesiones VALUES (?, ?, ?)', otros)
+    assert almacen.limpiar_vencidas() == 6
+    assert almacen.contar() == 0
+
+def test_aplicacion_usa_sesiones_sqlite():
+    from app import app as lendix
+    assert isinstance(lendix.session_interface, SesionesSQLite)
+    cliente = lendix.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['user_id'] = 1
+        sesion['user_nombre'] = 'Admin'
+        sesion['rol'] = 'admin'
+    cookie = cliente.get_cookie('session').value
+    respuesta = cliente.get('/logout')
+    assert respuesta.status_code == 302
+    assert cliente.get_cookie('session').value != cookie
+    with cliente.session_transaction() as sesion:
+        assert 'user_id' not in sesion
+
+def _medir(app, requests_por_tipo):
+    cliente = app.test_client()
+    cliente.get('/entrar')
+    resultados = {}
+    # Lectura: solo consulta la sesión; flash: guarda un mensaje y lo muestra (dos escrituras)
+    for nombre, rutas in (('lectura', ('/leer',)), ('flash', ('/avisar', '/mensajes'))):
+        inicio = time.perf_counter()
+        for _ in range(requests_por_tipo // len(rutas)):
+            for ruta in rutas:
+                cliente.get(ruta)
+        resultados[nombre] = requests_por_tipo / (time.perf_counter() - inicio)
+    return resultados
+
+def main():
+    """Compara requests/s contra el backend de archivos de Flask-Session"""
+    requests_por_tipo = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    directorio = tempfile.mkdtemp()
+
+    backends = {'sqlite': crear_app(os.path.join(directorio, 'sesiones.db'))}
+    try:
+        from flask_session import Session
+    except ImportError:
+        print('Flask-Session no está instalado: se mide solo SQLite')
+    else:
+        archivos = crear_app(os.path.join(directorio, 'no-usada.db'))
+        archivos.config.update(SESSION_TYPE='filesystem', SESSION_FILE_DIR=os.path.join(directorio, 'archivos'))
+        Session(archivos)
+        backends['filesystem'] = archivos
+
+    for nombre, app in backends.items():
+        resultados = _medir(app, requests_por_tipo)
+        print(f"{nombre:>10}: lectura {resultados['lectura']:.0f} req/s, flash {resultados['flash']:.0f} req/s")
+
+if __name__ == '__main__':
+    main()
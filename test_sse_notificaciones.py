@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Flujo de eventos (SSE) de notificaciones del admin: notificaciones nuevas y
+total sin leer en vivo, reanudación con Last-Event-ID y límites de conexiones
+"""
+
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_usuarios
+import utils.eventos
+from utils.eventos import canal
+from utils.helpers import crear_notificacion
+from utils.notificaciones import drenar_notificaciones
+
+STREAM = '/admin/api/notificaciones/stream'
+
+@pytest.fixture
+def conn(conn, monkeypatch):
+    # Latidos rápidos para que las pruebas no esperen
+    monkeypatch.setattr(utils.eventos, 'INTERVALO_LATIDO', 0.05)
+    crear_usuarios(conn, 'admin', 'instructor')
+    yield conn
+    assert len(canal) == 0
+
+def _eventos(respuesta):
+    """Itera los eventos del flujo como (tipo, datos, id); los latidos son ('latido', None, None)"""
+    for bloque in respuesta.response:
+        texto = bloque.decode() if isinstance(bloque, bytes) else bloque
+        campos = {}
+        for linea in texto.strip().split('\n'):
+            clave, _, valor = linea.partition(':')
+            campos[clave or 'comentario'] = valor.strip()
+        if 'comentario' in campos:
+            yield 'latido', None, None
+        elif 'retry' in campos:
+            yield 'retry', int(campos['retry']), None
+        else:
+            id = int(campos['id']) if 'id' in campos else None
+            yield campos['event'], json.loads(campos['data']), id
+
+def _siguiente(eventos, tipo):
+    """Primer evento del tipo indicado, saltando latidos y el retry inicial"""
+    for evento in eventos:
+        if evento[0] == tipo:
+            return evento
+        assert evento[0] in ('latido', 'retry'), evento
+    raise AssertionError(f'El flujo terminó sin un evento {tipo}')
+
+def _notificar(conn, titulo, tipo='implemento_nuevo'):
+    crear_notificacion(conn, tipo, titulo, f'Mensaje de {titulo}', 1)
+    conn.commit()
+    # Entrega la bandeja ya, sin esperar al hilo drenador
+    drenar_notificaciones(conn)
+
+def test_notificaciones_en_vivo(conn):
+    cliente = cliente_con_sesion()
+    respuesta = cliente.get(STREAM, buffered=False)
+    assert respuesta.status_code == 200
+    assert respuesta.mimetype == 'text/event-stream'
+    assert respuesta.headers['Cache-Control'] == 'no-cache'
+
+    eventos = _eventos(respuesta)
+    assert next(eventos) == ('retry', utils.eventos.REINTENTO_MS, None)
+    assert next(eventos) == ('no_leidas', {'no_leidas': 0}, None)
+
+    _notificar(conn, 'Implemento A')
+    tipo, datos, id = _siguiente(eventos, 'notificacion')
+    assert datos['titulo'] == 'Implemento A' and datos['usuario_nombre'] == 'Admin' and id == datos['id']
+    assert _siguiente(eventos, 'no_leidas')[1] == {'no_leidas': 1}
+
+    # Marcar como leída publica el nuevo total
+    assert cliente.post(f'/admin/api/notificaciones/{id}/leer').get_json()['success']
+    assert _siguiente(eventos, 'no_leidas')[1] == {'no_leidas': 0}
+    respuesta.close()
+
+def test_reanudar_con_last_event_id(conn):
+    for n in range(3):
+        _notificar(conn, f'Implemento {n}')
+    primera = conn.execute('SELECT MIN(id) FROM notificaciones').fetchone()[0]
+
+    respuesta = cliente_con_sesion().get(STREAM, headers={'Last-Event-ID': str(primera)}, buffered=False)
+    eventos = _eventos(respuesta)
+    next(eventos)
+    recibidas = [_siguiente(eventos, 'notificacion')[2] for _ in range(2)]
+    assert recibidas == [primera + 1, primera + 2]
+    assert _siguiente(eventos, 'no_leidas')[1] == {'no_leidas': 3}
+    respuesta.close()
+
+def test_notificaciones_de_otros_procesos_llegan_en_el_latido(conn):
+    respuesta = cliente_con_sesion().get(STREAM, buffered=False)
+    eventos = _eventos(respuesta)
+    _siguiente(eventos, 'no_leidas')
+
+    # Una inserción directa no pasa por el canal de este proceso
+    conn.execute("INSERT INTO notificaciones (tipo, titulo, mensaje) VALUES ('devolucion', 'Otro proceso', 'x')")
+    conn.commit()
+    assert _siguiente(eventos, 'notificacion')[1]['titulo'] == 'Otro proceso'
+    assert _siguiente(eventos, 'no_leidas')[1] == {'no_leidas': 1}
+    respuesta.close()
+
+def test_cliente_lento_y_duracion_maxima_cierran_el_flujo(conn, monkeypatch):
+    respuesta = cliente_con_sesion().get(STREAM, buffered=False)
+    eventos = _eventos(respuesta)
+    _siguiente(eventos, 'no_leidas')
+    for _ in range(utils.eventos.TAMANO_COLA + 1):
+        canal.publicar('no_leidas', {'no_leidas': 0})
+    assert list(eventos) == []
+    assert len(canal) == 0
+
+    monkeypatch.setattr(utils.eventos, 'DURACION_MAXIMA', 0.2)
+    respuesta = cliente_con_sesion().get(STREAM, buffered=False)
+    assert {tipo for tipo, _, _ in _eventos(respuesta)} == {'retry', 'no_leidas', 'latido'}
+    assert len(canal) == 0
+
+def test_permisos_y_maximo_de_conexiones(conn, monkeypatch):
+    assert cliente_con_sesion(2, 'instructor').get(STREAM).status_code == 403
+
+    monkeypatch.setattr(canal, 'maximo', 1)
+    abierta = cliente_con_sesion().get(STREAM, buffered=False)
+    rechazada = cliente_con_sesion().get(STREAM)
+    assert rechazada.status_code == 503 and rechazada.headers['Retry-After'] == '30'
+    abierta.close()
+    assert len(canal) == 0
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tokens Bearer de la API: emisión en /api/login, acceso a los endpoints JSON
+sin tocar el almacén de sesiones, vencimiento y revocación
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from conftest import crear_usuarios
+import utils.tokens
+from app import app
+from utils.db import get_db_connection
+
+ENDPOINTS = [
+    '/admin/api/notificaciones',
+    '/admin/api/admin/estadisticas',
+    '/admin/api/usuarios_pendientes',
+    '/admin/api/instructores_disponibles',
+]
+
+@pytest.fixture
+def cliente(conn, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_LIMITS_STORE', 'memory')
+    app.extensions.pop('login_limiters', None)
+    crear_usuarios(conn, 'admin', 'instructor', password=generate_password_hash('clave'))
+
+    # Contar cualquier acceso al almacén de sesiones
+    almacen = app.session_interface.almacen
+    accesos = []
+    for metodo in ('leer', 'guardar', 'renovar', 'eliminar'):
+        original = getattr(almacen, metodo)
+        monkeypatch.setattr(almacen, metodo, lambda *a, _o=original, _m=metodo: accesos.append(_m) or _o(*a))
+    cliente = app.test_client()
+    cliente.accesos_sesion = accesos
+    yield cliente
+    app.extensions.pop('login_limiters', None)
+
+def _token(cliente, email):
+    datos = cliente.post('/api/login', json={'email': email, 'password': 'clave'}).get_json()
+    assert datos['token_type'] == 'Bearer' and datos['expires_in'] == 3600
+    return {'Authorization': f"Bearer {datos['token']}"}
+
+def test_endpoints_con_token_sin_sesion(cliente):
+    cabecera = _token(cliente, 'admin@prueba.com')
+    del cliente.accesos_sesion[:]
+    for endpoint in ENDPOINTS:
+        respuesta = cliente.get(endpoint, headers=cabecera)
+        assert respuesta.status_code == 200, endpoint
+        assert 'Set-Cookie' not in respuesta.headers
+    assert cliente.accesos_sesion == []
+
+    # Un instructor solo accede a lo que no es de administración
+    cabecera = _token(cliente, 'instructor@prueba.com')
+    assert cliente.get('/admin/api/notificaciones', headers=cabecera).status_code == 403
+    assert cliente.get('/admin/api/instructores_disponibles', headers=cabecera).status_code == 200
+
+def test_sesion_sigue_funcionando(cliente):
+    with cliente.session_transaction() as sesion:
+        sesion['user_id'] = 1
+        sesion['rol'] = 'admin'
+    for endpoint in ENDPOINTS:
+        assert cliente.get(endpoint).status_code == 200, endpoint
+
+    # Sin sesión ni token se redirige al login, como antes
+    assert app.test_client().get('/admin/api/notificaciones').status_code == 302
+
+def test_tokens_invalidos_y_vencidos(cliente, monkeypatch):
+    cabecera = _token(cliente, 'admin@prueba.com')
+    alterado = {'Authorization': cabecera['Authorization'][:-2] + 'xx'}
+    respuesta = cliente.get(ENDPOINTS[0], headers=alterado)
+    assert respuesta.status_code == 401 and respuesta.headers['WWW-Authenticate'] == 'Bearer'
+
+    monkeypatch.setitem(app.config, 'API_TOKEN_LIFETIME', -1)
+    respuesta = cliente.get(ENDPOINTS[0], headers=cabecera)
+    assert respuesta.status_code == 401 and respuesta.get_json()['error'] == 'Token vencido'
+
+def test_revocacion_con_version_en_cache(cliente, monkeypatch):
+    cabecera = _token(cliente, 'admin@prueba.com')
+    otro = _token(cliente, 'admin@prueba.com')
+    instructor = _token(cliente, 'instructor@prueba.com')
+
+    # La lista solo se recarga cuando cambia su versión
+    monkeypatch.setattr(utils.tokens, '_revocaciones', {'version': None, 'claves': {}})
+
+    def consultar():
+        return cliente.get(ENDPOINTS[1], headers=cabecera).status_code
+
+    cargas = []
+    for _ in range(5):
+        version = utils.tokens._revocaciones['version']
+        assert consultar() == 200
+        cargas.append(utils.tokens._revocaciones['version'] != version)
+    assert cargas == [True, False, False, False, False]
+
+    # Cerrar sesión en la API revoca solo ese token
+    assert cliente.post('/api/logout', headers=cabecera).get_json()['success']
+    assert consultar() == 401
+    assert cliente.get(ENDPOINTS[1], headers=otro).status_code == 200
+
+    # Desactivar al usuario revoca todos sus tokens emitidos
+    conn = get_db_connection()
+    conn.execute("UPDATE usuarios SET activo = 0 WHERE email = 'instructor@prueba.com'")
+    conn.commit()
+    assert cliente.get(ENDPOINTS[3], headers=instructor).status_code == 401
+    conn.execute("UPDATE usuarios SET activo = 1 WHERE email = 'instructor@prueba.com'")
+    conn.commit()
+    assert cliente.get(ENDPOINTS[3], headers=_token(cliente, 'instructor@prueba.com')).status_code == 200
+
+    # Las revocaciones de tokens ya vencidos se pueden eliminar
+    assert utils.tokens.limpiar_revocaciones(conn, segundos=-60) == 2
+    conn.close()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Reportes generados en segundo plano: encolar, consultar progreso y descargar
+"""
+
+import sys
+import os
+import io
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from openpyxl import load_workbook
+
+from conftest import cliente_con_sesion, crear_usuarios
+import utils.db
+from utils.db import get_db_connection
+from utils.trabajos import directorio_reportes, ejecutar_reporte, limpiar_reportes_vencidos
+
+@pytest.fixture
+def cliente(conn):
+    crear_usuarios(conn, 'admin')
+    conn.execute("INSERT INTO implementos (implemento, descripcion, disponibilidad) VALUES ('Balón', 'Prueba', 1)")
+    conn.executemany('''
+        INSERT INTO prestamos (fk_usuario, fk_implemento, tipo_prestamo, nombre_prestatario, fecha_prestamo, fecha_devolucion)
+        VALUES (1, 1, 'individual', ?, datetime('2025-03-01', ?), ?)
+    ''', [(f'Aprendiz {n}', f'+{n} hours', None if n % 2 else '2025-04-01 00:00:00') for n in range(5000)])
+    conn.commit()
+    return cliente_con_sesion()
+
+def _esperar(cliente, url, limite=60):
+    inicio = time.monotonic()
+    while time.monotonic() - inicio < limite:
+        estado = cliente.get(url).get_json()
+        if estado['estado'] not in ('pendiente', 'en_proceso'):
+            return estado
+        time.sleep(0.2)
+    raise AssertionError('El trabajo no terminó a tiempo')
+
+def test_reporte_en_segundo_plano(cliente):
+    respuesta = cliente.post('/admin/reportes/trabajos', data={'tipo_reporte': 'activos', 'formato': 'resumen'})
+    assert respuesta.status_code == 202
+    trabajo = respuesta.get_json()
+
+    estado = _esperar(cliente, trabajo['url_estado'])
+    assert estado['estado'] == 'completado', estado
+    assert estado['progreso'] == 100 and estado['total_filas'] == 2500
+
+    descarga = cliente.get(trabajo['url_descarga'])
+    assert descarga.status_code == 200
+    assert 'reporte_prestamos_activos_' in descarga.headers['Content-Disposition']
+    filas = list(load_workbook(io.BytesIO(descarga.data)).active.iter_rows(values_only=True))
+    assert filas[0][1] == 'Prestatario'
+    assert len(filas) == 1 + 2500 + 1 + 5
+    descarga.close()
+
+    # Al vencer, la descarga del trabajo deja de estar disponible
+    conn = get_db_connection()
+    conn.execute("UPDATE report_jobs SET expira = datetime('now', '-1 minute')")
+    conn.commit()
+    assert cliente.get(trabajo['url_estado']).get_json()['estado'] == 'vencido'
+    assert cliente.get(trabajo['url_descarga']).status_code == 410
+
+    # El archivo sigue en la caché hasta pasar su tiempo de vida sin usarse
+    assert limpiar_reportes_vencidos(conn) == 0
+    archivos = os.listdir(directorio_reportes())
+    assert len(archivos) == 1
+    hace_dos_dias = time.time() - 2 * 24 * 3600
+    os.utime(os.path.join(directorio_reportes(), archivos[0]), (hace_dos_dias, hace_dos_dias))
+    assert limpiar_reportes_vencidos(conn) == 1
+    assert os.listdir(directorio_reportes()) == []
+    conn.close()
+
+def test_errores_del_trabajo(cliente):
+    respuesta = cliente.post('/admin/reportes/trabajos', data={'fecha_inicio': '01/03/2025'})
+    assert respuesta.status_code == 400
+    assert cliente.get('/admin/reportes/trabajos/999').status_code == 404
+
+    # Un fallo dentro del trabajo queda registrado (se ejecuta aquí mismo)
+    conn = get_db_connection()
+    trabajo_id = conn.execute(
+        "INSERT INTO report_jobs (parametros) VALUES ('{\"fecha_inicio\": \"ayer\"}')"
+    ).lastrowid
+    conn.commit()
+    ejecutar_reporte(trabajo_id, utils.db.DATABASE, directorio_reportes())
+    estado = cliente.get(f'/admin/reportes/trabajos/{trabajo_id}').get_json()
+    assert estado['estado'] == 'error' and estado['error']
+    assert cliente.get(f'/admin/reportes/trabajos/{trabajo_id}/descargar').status_code == 410
+    conn.close()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Caché de identidades de usuario: login_required revalida rol y estado sin
+consultar la base en cada request, y los cambios de usuarios la invalidan
+
+Benchmark: python test_usuarios_cache.py [consultas]
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from conftest import cliente_con_sesion, crear_base, crear_usuarios
+from utils.db import get_db_connection
+from utils.usuarios import CacheUsuarios
+
+@pytest.fixture
+def conn(conn):
+    crear_usuarios(conn, 'admin', 'instructor')
+    return conn
+
+def _version(conn):
+    return conn.execute('SELECT version FROM usuarios_version WHERE id = 1').fetchone()[0]
+
+def test_desactivar_y_eliminar_cierran_la_sesion(conn):
+    admin = cliente_con_sesion(1, 'admin')
+    instructor = cliente_con_sesion(2, 'instructor')
+    assert instructor.get('/catalogo/catalogo').status_code == 200
+
+    assert admin.post('/admin/desactivar_usuario/2').get_json()['success']
+    respuesta = instructor.get('/catalogo/catalogo')
+    assert respuesta.status_code == 302 and '/login' in respuesta.headers['Location']
+    with instructor.session_transaction() as sesion:
+        assert 'user_id' not in sesion
+
+    # Una sesión de un usuario eliminado tampoco sirve
+    assert admin.post('/admin/activar_usuario/2').get_json()['success']
+    instructor = cliente_con_sesion(2, 'instructor')
+    assert instructor.get('/catalogo/catalogo').status_code == 200
+    assert admin.post('/admin/eliminar_usuario/2').get_json()['success']
+    assert instructor.get('/catalogo/catalogo').status_code == 302
+
+def test_cambio_de_rol_actualiza_la_sesion(conn):
+    admin = cliente_con_sesion(1, 'admin')
+    instructor = cliente_con_sesion(2, 'instructor')
+    admin.post('/admin/editar_usuario/2', data={
+        'nombre': 'Instructor', 'email': 'instructor@prueba.com', 'telefono': '3000000002', 'rol': 'funcionario',
+    })
+    assert instructor.get('/catalogo/catalogo').status_code == 200
+    with instructor.session_transaction() as sesion:
+        assert sesion['rol'] == 'funcionario'
+
+    # Un rol 'admin' puesto en la sesión no da acceso si la base no lo respalda
+    intruso = cliente_con_sesion(2, 'admin')
+    assert intruso.get('/admin/api/usuarios_pendientes').status_code == 403
+
+def test_version_solo_cambia_con_rol_estado_altas_y_bajas(conn):
+    version = _version(conn)
+    conn.execute("UPDATE usuarios SET password = 'y', telefono = '3000000009' WHERE id = 2")
+    conn.execute("UPDATE usuarios SET rol = 'instructor' WHERE id = 2")
+    conn.commit()
+    assert _version(conn) == version
+
+    conn.execute("UPDATE usuarios SET activo = 0 WHERE id = 2")
+    conn.execute("INSERT INTO usuarios (nombre, email, telefono, password) VALUES ('Otro', 'o@p.com', '3', 'x')")
+    conn.execute("DELETE FROM usuarios WHERE email = 'o@p.com'")
+    conn.commit()
+    assert _version(conn) == version + 3
+
+def test_aciertos_sin_consultas_y_version_entre_procesos(conn):
+    ahora = [0.0]
+    cache = CacheUsuarios(intervalo=1.0, vida=60, reloj=lambda: ahora[0])
+    conexiones = []
+
+    def obtener_conexion():
+        conexiones.append(1)
+        return conn
+
+    assert cache.obtener(obtener_conexion, 2).rol == 'instructor'
+    del conexiones[:]
+    for _ in range(100):
+        assert cache.obtener(obtener_conexion, 2).activo
+    assert conexiones == [] and cache.aciertos == 100
+
+    # Otro proceso desactiva al usuario: se ve al releer la versión
+    conn.execute('UPDATE usuarios SET activo = 0 WHERE id = 2')
+    conn.commit()
+    ahora[0] = 0.5
+    assert cache.obtener(obtener_conexion, 2).activo
+    ahora[0] = 1.5
+    assert not cache.obtener(obtener_conexion, 2).activo
+    assert cache.lecturas_version == 2
+
+    # Los inexistentes también se guardan, y la vida de las entradas es acotada
+    assert cache.obtener(obtener_conexion, 99) is None
+    del conexiones[:]
+    assert cache.obtener(obtener_conexion, 99) is None
+    assert conexiones == []
+    ahora[0] = 62.0
+    cache.obtener(obtener_conexion, 99)
+    assert len(conexiones) == 2
+
+def test_lru_acotado(conn):
+    cache = CacheUsuarios(maximo=2)
+    for usuario_id in (1, 2, 3):
+        cache.obtener(lambda: conn, usuario_id)
+    assert len(cache) == 2
+
+def main():
+    """Costo por request de revalidar al usuario: consulta directa vs caché"""
+    consultas = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    crear_base()
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT INTO usuarios (nombre, email, telefono, password, rol) VALUES (?, ?, ?, 'x', 'instructor')",
+        [(f'U{n}', f'u{n}@prueba.com', f'{n}') for n in range(1000)]
+    )
+    conn.commit()
+    conn.close()
+
+    # Antes: validar_rol_usuario abría una conexión nueva por llamada
+    inicio = time.perf_counter()
+    for n in range(consultas):
+        nueva = get_db_connection()
+        nueva.execute('SELECT rol FROM usuarios WHERE id = ?', (n % 1000 + 1,)).fetchone()
+        nueva.close()
+    directa = (time.perf_counter() - inicio) / consultas * 1e6
+
+    conn = get_db_connection()
+    cache = CacheUsuarios()
+    inicio = time.perf_counter()
+    for n in range(consultas):
+        cache.obtener(lambda: conn, n % 1000 + 1)
+    en_cache = (time.perf_counter() - inicio) / consultas * 1e6
+    print(f"conexión + SELECT: {directa:8.1f} µs/request")
+    print(f"caché:             {en_cache:8.1f} µs/request "
+          f"({cache.aciertos} aciertos, {cache.fallos} fallos, {cache.lecturas_version} lecturas de versión)")
+
+if __name__ == '__main__':
+    main()
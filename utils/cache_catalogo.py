@@ -0,0 +1,194 @@
+"""
+Caché del catálogo de implementos
+
+El catálogo cambia pocas veces al día pero se lee en cada vista del catálogo,
+del panel de administración y de la gestión de préstamos. Cada proceso guarda
+en memoria todas las filas de implementos y, a partir de ellas, vistas ya
+filtradas (categoría, disponibilidad) y ordenadas (por nombre o las más
+recientes primero), que se construyen la primera vez que se piden.
+
+Las escrituras no invalidan la caché completa: los triggers de la migración
+015 anotan en catalogo_cambios el id de cada implemento creado, modificado o
+eliminado, en la misma transacción que la escritura (catálogo, préstamos y
+devoluciones incluidos). En cada lectura se consultan las anotaciones
+posteriores a la última vista; si no hay ninguna la lectura no toca la tabla
+implementos, y si las hay solo se vuelven a leer esos implementos y se
+corrigen las vistas en su lugar. Si faltan anotaciones (la tabla conserva
+solo las RETENCION_CAMBIOS más recientes) o son demasiadas, se recarga todo.
+"""
+import bisect
+import sys
+import threading
+
+# Anotaciones que conserva catalogo_cambios (las más antiguas se eliminan)
+RETENCION_CAMBIOS = 1000
+
+# Con más implementos cambiados que esto conviene recargar el catálogo completo
+LIMITE_PARCHE = 200
+
+# Criterios de orden de las vistas: clave de orden de cada fila
+ORDENES = {
+    'nombre': lambda fila: (fila['implemento'] or '', fila['id']),
+    'recientes': lambda fila: -fila['id'],
+}
+
+def _cumple(fila, categoria, disponibilidad):
+    """Indica si una fila pertenece a la vista (categoria, disponibilidad)"""
+    if categoria and (fila['categoria'] or '').lower() != categoria:
+        return False
+    if disponibilidad == 'disponible':
+        return fila['disponibilidad'] > 0
+    if disponibilidad == 'agotado':
+        return fila['disponibilidad'] == 0
+    return True
+
+class CacheCatalogo:
+    """Filas de implementos y vistas ordenadas, sincronizadas con catalogo_cambios"""
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self._filas = None
+        self._vistas = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self.metricas = {'aciertos': 0, 'fallos': 0, 'parches': 0, 'recargas': 0}
+
+    def _recargar(self, conn):
+        # La versión se lee antes que las filas: un cambio intermedio se
+        # volverá a aplicar en la siguiente lectura, lo que es inocuo
+        version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM catalogo_cambios').fetchone()[0]
+        filas = {fila['id']: dict(fila) for fila in conn.execute('SELECT * FROM implementos')}
+        self._filas = filas
+        self._vistas = {}
+        self._version = version
+        self.metricas['recargas'] += 1
+
+    def _parchar(self, conn, cambios):
+        ids = {fk_implemento for _, fk_implemento in cambios}
+        marcas = ', '.join('?' * len(ids))
+        nuevas = {
+            fila['id']: dict(fila)
+            for fila in conn.execute(f'SELECT * FROM implementos WHERE id IN ({marcas})', tuple(ids))
+        }
+        filas = dict(self._filas)
+        for implemento_id in ids:
+            if implemento_id in nuevas:
+                filas[implemento_id] = nuevas[implemento_id]
+            else:
+                filas.pop(implemento_id, None)
+
+        # Cada vista se copia sin las filas cambiadas y estas se insertan en su
+        # posición; las listas entregadas antes no se modifican
+        vistas = {}
+        for (orden, categoria, disponibilidad), vista in self._vistas.items():
+            clave_orden = ORDENES[orden]
+            vista = [fila for fila in vista if fila['id'] not in ids]
+            for fila in nuevas.values():
+                if _cumple(fila, categoria, disponibilidad):
+                    bisect.insort(vista, fila, key=clave_orden)
+            vistas[(orden, categoria, disponibilidad)] = vista
+
+        self._filas = filas
+        self._vistas = vistas
+        self._version = cambios[-1][0]
+        self.metricas['parches'] += len(ids)
+
+    def _sincronizar(self, conn):
+        """Aplica las anotaciones pendientes; devuelve True si no había ninguna"""
+        if self._filas is None:
+            self._recargar(conn)
+            return False
+        cambios = conn.execute(
+            'SELECT version, fk_implemento FROM catalogo_cambios WHERE version > ? ORDER BY version',
+            (self._version,)
+        ).fetchall()
+        if not cambios:
+            return True
+        ids = {fk_implemento for _, fk_implemento in cambios}
+        if cambios[0][0] != self._version + 1 or len(ids) > LIMITE_PARCHE:
+            self._recargar(conn)
+        else:
+            self._parchar(conn, cambios)
+        return False
+
+    def vista(self, conn, orden='nombre', categoria=None, disponibilidad=None):
+        """
+        Implementos filtrados y ordenados
+
+        Args:
+            conn: Conexión a la base de datos
+            orden: 'nombre' o 'recientes'
+            categoria: Categoría (en minúsculas) o None para todas
+            disponibilidad: 'disponible', 'agotado' o None para todos
+
+        Returns:
+            list: Filas (dict) de implementos; la lista es compartida y no debe modificarse
+        """
+        clave = (orden, categoria or None, disponibilidad or None)
+        with self._lock:
+            al_dia = self._sincronizar(conn)
+            vista = self._vistas.get(clave)
+            if al_dia and vista is not None:
+                self.metricas['aciertos'] += 1
+                return vista
+            self.metricas['fallos'] += 1
+            if vista is None:
+                vista = sorted(
+                    (fila for fila in self._filas.values() if _cumple(fila, clave[1], clave[2])),
+                    key=ORDENES[orden]
+                )
+                self._vistas[clave] = vista
+            return vista
+
+    def vaciar(self):
+        with self._lock:
+            self._filas = None
+            self._vistas = {}
+            self._version = None
+            for evento in self.metricas:
+                self.metricas[evento] = 0
+
+    def estadisticas(self):
+        """
+        Métricas de la caché
+
+        Returns:
+            dict: Aciertos, fallos, parches, recargas, tasa de aciertos y memoria estimada
+        """
+        with self._lock:
+            metricas = dict(self.metricas)
+            filas = list(self._filas.values()) if self._filas else []
+            vistas = dict(self._vistas)
+        consultas = metricas['aciertos'] + metricas['fallos']
+        metricas['tasa_aciertos'] = round(metricas['aciertos'] / consultas, 3) if consultas else None
+        metricas['filas'] = len(filas)
+        metricas['vistas'] = len(vistas)
+        # Las vistas comparten las filas; solo se cuenta su lista de referencias
+        metricas['bytes'] = (
+            sum(sys.getsizeof(fila) + sum(sys.getsizeof(valor) for valor in fila.values()) for fila in filas)
+            + sum(sys.getsizeof(vista) for vista in vistas.values())
+        )
+        return metricas
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _obtener_cache():
+    """Caché de la base de datos actual (se reemplaza si cambia la ruta)"""
+    global _cache
+    import utils.db
+    with _cache_lock:
+        if _cache is None or _cache.ruta != utils.db.DATABASE:
+            _cache = CacheCatalogo(utils.db.DATABASE)
+        return _cache
+
+def catalogo_cacheado(conn, orden='nombre', categoria=None, disponibilidad=None):
+    """Vista del catálogo desde la caché del proceso (ver CacheCatalogo.vista)"""
+    return _obtener_cache().vista(conn, orden, categoria, disponibilidad)
+
+def estadisticas_catalogo():
+    return _obtener_cache().estadisticas()
+
+def vaciar_cache_catalogo():
+    """Vacía la caché y reinicia las métricas (pruebas)"""
+    _obtener_cache().vaciar()
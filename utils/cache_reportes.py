@@ -0,0 +1,184 @@
+"""
+Caché de reportes
+
+La clave de cada entrada combina los parámetros del reporte con la versión de
+los datos (tabla data_version, que los triggers incrementan con cada cambio en
+préstamos, implementos o usuarios). Mientras los datos no cambien, el mismo
+reporte se sirve sin volver a consultarlo; al cambiar la versión las entradas
+viejas dejan de usarse y salen por antigüedad.
+
+Los archivos de Excel se guardan en disco con un límite de tamaño (LRU por
+fecha de último uso) y los agregados del panel de reportes en memoria.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Tamaño máximo de los archivos de reportes guardados en disco
+LIMITE_BYTES_ARCHIVOS = 256 * 1024 * 1024
+
+# Número máximo de agregados guardados en memoria por proceso
+LIMITE_AGREGADOS = 64
+
+_lock = threading.Lock()
+_agregados = OrderedDict()
+_metricas = {
+    'archivos': {'aciertos': 0, 'fallos': 0, 'desalojos': 0},
+    'agregados': {'aciertos': 0, 'fallos': 0, 'desalojos': 0},
+}
+
+def version_datos(conn):
+    """Versión actual de los datos (0 si la tabla aún no existe)"""
+    try:
+        fila = conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()
+    except Exception:
+        return 0
+    return fila[0] if fila else 0
+
+def clave_cache(tipo, parametros, version):
+    """Clave estable para un reporte: tipo, parámetros y versión de los datos"""
+    texto = json.dumps([tipo, parametros, version], sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode()).hexdigest()[:32]
+
+def _registrar(cache, evento, cantidad=1):
+    with _lock:
+        _metricas[cache][evento] += cantidad
+
+def buscar_archivo(directorio, clave):
+    """
+    Busca un reporte generado en disco
+
+    Returns:
+        str: Ruta del archivo, o None si no está en la caché
+    """
+    ruta = os.path.join(directorio, f'{clave}.xlsx')
+    try:
+        # La fecha de modificación marca el último uso (orden LRU)
+        os.utime(ruta)
+    except FileNotFoundError:
+        _registrar('archivos', 'fallos')
+        return None
+    _registrar('archivos', 'aciertos')
+    return ruta
+
+def _archivos(directorio):
+    """Archivos de la caché con su tamaño y fecha de último uso"""
+    try:
+        entradas = list(os.scandir(directorio))
+    except FileNotFoundError:
+        return []
+    archivos = []
+    for entrada in entradas:
+        if entrada.is_file() and entrada.name.endswith('.xlsx'):
+            estado = entrada.stat()
+            archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+    return archivos
+
+def recortar_archivos(directorio, limite=LIMITE_BYTES_ARCHIVOS, conservar=()):
+    """
+    Elimina los reportes usados hace más tiempo hasta quedar bajo el límite
+
+    Args:
+        directorio: Carpeta de la caché
+        limite: Tamaño máximo en bytes
+        conservar: Rutas que no deben eliminarse (p. ej. el reporte recién generado)
+
+    Returns:
+        int: Número de archivos eliminados
+    """
+    archivos = sorted(_archivos(directorio))
+    total = sum(tamano for _, tamano, _ in archivos)
+    eliminados = 0
+    for _, tamano, ruta in archivos:
+        if total <= limite:
+            break
+        if ruta in conservar:
+            continue
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tamano
+        eliminados += 1
+    if eliminados:
+        _registrar('archivos', 'desalojos', eliminados)
+    return eliminados
+
+def eliminar_archivos_sin_uso(directorio, segundos):
+    """
+    Elimina los reportes que no se han usado en los últimos `segundos`
+
+    Returns:
+        int: Número de archivos eliminados
+    """
+    limite = time.time() - segundos
+    eliminados = 0
+    for usado, _, ruta in _archivos(directorio):
+        if usado < limite:
+            try:
+                os.remove(ruta)
+                eliminados += 1
+            except FileNotFoundError:
+                pass
+    return eliminados
+
+def agregado_en_cache(conn, nombre, parametros, calcular):
+    """
+    Devuelve un agregado de la caché en memoria o lo calcula
+
+    Args:
+        conn: Conexión a la base de datos
+        nombre: Nombre del agregado
+        parametros: Parámetros que afectan el resultado
+        calcular: Función que recibe la conexión y devuelve el valor
+
+    Returns:
+        El valor del agregado
+    """
+    clave = clave_cache(nombre, parametros, version_datos(conn))
+    with _lock:
+        if clave in _agregados:
+            _agregados.move_to_end(clave)
+            _metricas['agregados']['aciertos'] += 1
+            return _agregados[clave]
+        _metricas['agregados']['fallos'] += 1
+
+    # Calcular fuera del candado; dos requests simultáneos pueden calcular lo mismo
+    valor = calcular(conn)
+    with _lock:
+        _agregados[clave] = valor
+        _agregados.move_to_end(clave)
+        while len(_agregados) > LIMITE_AGREGADOS:
+            _agregados.popitem(last=False)
+            _metricas['agregados']['desalojos'] += 1
+    return valor
+
+def estadisticas_cache(directorio):
+    """
+    Métricas de la caché de reportes
+
+    Returns:
+        dict: Aciertos, fallos y desalojos por caché, más su ocupación actual
+    """
+    archivos = _archivos(directorio)
+    with _lock:
+        metricas = {cache: dict(valores) for cache, valores in _metricas.items()}
+        metricas['agregados']['entradas'] = len(_agregados)
+    metricas['archivos']['entradas'] = len(archivos)
+    metricas['archivos']['bytes'] = sum(tamano for _, tamano, _ in archivos)
+    metricas['archivos']['limite_bytes'] = LIMITE_BYTES_ARCHIVOS
+    for valores in metricas.values():
+        consultas = valores['aciertos'] + valores['fallos']
+        valores['tasa_aciertos'] = round(valores['aciertos'] / consultas, 3) if consultas else None
+    return metricas
+
+def vaciar_cache():
+    """Vacía los agregados en memoria y reinicia las métricas (pruebas)"""
+    with _lock:
+        _agregados.clear()
+        for valores in _metricas.values():
+            for evento in valores:
+                valores[evento] = 0
@@ -0,0 +1,74 @@
+"""
+Contadores de estadísticas del dashboard (tabla stats_counters)
+
+La tabla tiene una sola fila que los triggers creados en la migración 006
+mantienen exacta con cada INSERT, UPDATE o DELETE; los dashboards la leen
+por clave primaria en lugar de recorrer las tablas con COUNT(*).
+"""
+
+# Consulta que calcula cada contador a partir de los datos reales
+AGREGADOS = {
+    'total_implementos': 'SELECT COUNT(*) FROM implementos',
+    'implementos_disponibles': 'SELECT COUNT(*) FROM implementos WHERE disponibilidad > 0',
+    'total_usuarios': 'SELECT COUNT(*) FROM usuarios',
+    'usuarios_activos': 'SELECT COUNT(*) FROM usuarios WHERE activo = 1',
+    'total_prestamos': 'SELECT COALESCE(SUM(cantidad), 0) FROM prestamos',
+    'prestamos_activos': '''
+        SELECT COALESCE(SUM(cantidad - cantidad_devuelta), 0) FROM prestamos
+        WHERE fecha_devolucion IS NULL
+    ''',
+    'prestamos_devueltos': 'SELECT COALESCE(SUM(cantidad_devuelta), 0) FROM prestamos',
+    'notificaciones_pendientes': 'SELECT COUNT(*) FROM notificaciones WHERE leida = 0',
+}
+
+def calcular_agregados(conn):
+    """Calcula todos los contadores recorriendo las tablas (costoso)"""
+    return {nombre: conn.execute(sql).fetchone()[0] for nombre, sql in AGREGADOS.items()}
+
+def obtener_contadores(conn):
+    """
+    Lee los contadores mantenidos por triggers
+
+    Args:
+        conn: Conexión a la base de datos
+
+    Returns:
+        dict: Valor de cada contador de AGREGADOS
+    """
+    fila = conn.execute(
+        f"SELECT {', '.join(AGREGADOS)} FROM stats_counters WHERE id = 1"
+    ).fetchone()
+    if fila is None:
+        # Tabla vacía (p. ej. borrada a mano): calcular en vivo
+        return calcular_agregados(conn)
+    return dict(fila)
+
+def recalcular_contadores(conn):
+    """
+    Reemplaza los contadores por los valores calculados en vivo (sin confirmar la transacción)
+
+    Returns:
+        dict: Valores guardados
+    """
+    valores = calcular_agregados(conn)
+    conn.execute(
+        f"INSERT OR REPLACE INTO stats_counters (id, {', '.join(valores)}) "
+        f"VALUES (1, {', '.join('?' * len(valores))})",
+        tuple(valores.values())
+    )
+    return valores
+
+def verificar_contadores(conn):
+    """
+    Compara los contadores con los agregados reales
+
+    Returns:
+        dict: {contador: (valor guardado, valor real)} solo para los que no coinciden
+    """
+    guardados = obtener_contadores(conn)
+    reales = calcular_agregados(conn)
+    return {
+        nombre: (guardados[nombre], reales[nombre])
+        for nombre in AGREGADOS
+        if guardados[nombre] != reales[nombre]
+    }
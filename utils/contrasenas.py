@@ -0,0 +1,135 @@
+"""
+Política de hash de contraseñas
+
+Los hashes de werkzeug ya guardan su método y parámetros como prefijo
+('scrypt:32768:8:1$sal$hash'), así que la política solo define el método con
+el que se generan los hashes nuevos (PASSWORD_HASH_METHOD). Un hash guardado
+con otros parámetros se vuelve a generar con la política actual la próxima vez
+que su dueño inicia sesión.
+
+El cálculo del hash es deliberadamente costoso en CPU; para que una ráfaga de
+logins no ocupe todos los hilos del servidor, se ejecuta en un pool de hilos
+acotado (PASSWORD_HASH_WORKERS) con control de admisión: si ya hay
+PASSWORD_HASH_QUEUE operaciones en curso o en espera, la solicitud se rechaza
+de inmediato con SistemaOcupado en lugar de encolarse sin límite.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Método por defecto (el de werkzeug 3): scrypt con N=2**15, r=8, p=1
+METODO_HASH = 'scrypt:32768:8:1'
+
+# Hilos que calculan hashes y operaciones admitidas a la vez (en curso + en espera)
+TRABAJADORES_HASH = 2
+COLA_HASH = 8
+
+# Segundos máximos que un request espera su turno en el pool
+ESPERA_HASH = 10
+
+class SistemaOcupado(Exception):
+    """Hay demasiadas verificaciones de contraseña en curso"""
+    pass
+
+class PoolHash:
+    """Pool de hilos acotado con admisión por semáforo"""
+
+    def __init__(self, trabajadores, cola):
+        self.trabajadores = trabajadores
+        self.cola = cola
+        self._ejecutor = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix='hash')
+        self._admision = threading.BoundedSemaphore(cola)
+
+    def ejecutar(self, funcion, *args, espera=ESPERA_HASH):
+        """
+        Ejecuta funcion(*args) en el pool y espera el resultado
+
+        Raises:
+            SistemaOcupado: Si no hay cupo en el pool
+        """
+        if not self._admision.acquire(blocking=False):
+            raise SistemaOcupado()
+        try:
+            futuro = self._ejecutor.submit(funcion, *args)
+        except Exception:
+            self._admision.release()
+            raise
+        futuro.add_done_callback(lambda _: self._admision.release())
+        try:
+            return futuro.result(timeout=espera)
+        except TimeoutError:
+            raise SistemaOcupado()
+
+    def cerrar(self):
+        self._ejecutor.shutdown(wait=False, cancel_futures=True)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _obtener_pool():
+    global _pool
+    trabajadores = current_app.config.get('PASSWORD_HASH_WORKERS', TRABAJADORES_HASH)
+    cola = current_app.config.get('PASSWORD_HASH_QUEUE', COLA_HASH)
+    with _pool_lock:
+        if _pool is None or (_pool.trabajadores, _pool.cola) != (trabajadores, cola):
+            if _pool is not None:
+                _pool.cerrar()
+            _pool = PoolHash(trabajadores, cola)
+        return _pool
+
+def metodo_hash():
+    """Método de hash configurado (PASSWORD_HASH_METHOD)"""
+    return current_app.config.get('PASSWORD_HASH_METHOD', METODO_HASH)
+
+@lru_cache(maxsize=8)
+def _parametros(metodo):
+    """Prefijo que werkzeug escribe para un método (p. ej. 'pbkdf2' -> 'pbkdf2:sha256:1000000')"""
+    return generate_password_hash('', method=metodo).split('$', 1)[0]
+
+def necesita_rehash(password_hash):
+    """Indica si un hash se generó con parámetros distintos a los de la política"""
+    return password_hash.split('$', 1)[0] != _parametros(metodo_hash())
+
+def generar_hash(password):
+    """
+    Genera el hash de una contraseña con la política actual (en el pool)
+
+    Raises:
+        SistemaOcupado: Si no hay cupo en el pool
+    """
+    return _obtener_pool().ejecutar(generate_password_hash, password, metodo_hash())
+
+def verificar_contrasena(password_hash, password):
+    """
+    Verifica una contraseña contra su hash (en el pool)
+
+    Raises:
+        SistemaOcupado: Si no hay cupo en el pool
+    """
+    return _obtener_pool().ejecutar(check_password_hash, password_hash, password)
+
+def actualizar_hash_si_corresponde(conn, usuario_id, password_hash, password):
+    """
+    Vuelve a generar el hash con la política actual tras un login correcto
+
+    La actualización se condiciona al hash leído, así que dos logins
+    simultáneos no se pisan. Si el pool está ocupado se deja para otro login.
+
+    Returns:
+        bool: True si se actualizó el hash
+    """
+    if not necesita_rehash(password_hash):
+        return False
+    try:
+        nuevo = generar_hash(password)
+    except SistemaOcupado:
+        return False
+    cursor = conn.execute(
+        'UPDATE usuarios SET password = ? WHERE id = ? AND password = ?',
+        (nuevo, usuario_id, password_hash)
+    )
+    conn.commit()
+    return cursor.rowcount == 1
@@ -1,11 +1,126 @@
 import sqlite3
 import os
+import queue
+import time
+from flask import g
 
-def get_db_connection():
-    conn = sqlite3.connect('models/database.db')
+# Ruta de la base de datos (puede sobrescribirse con app.config['DATABASE'])
+DATABASE = 'models/database.db'
+
+# Número máximo de conexiones ociosas que se conservan en el pool
+POOL_MAXIMO = 8
+
+# Reintentos de una transacción de escritura cuando la base está ocupada
+INTENTOS_BLOQUEO = 4
+
+def _configurar_conexion(conn):
+    """Aplica la configuración de rendimiento una sola vez por conexión"""
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute('PRAGMA cache_size = -16000')  # ~16 MB de caché de páginas
+    conn.execute('PRAGMA mmap_size = 134217728')  # 128 MB mapeados en memoria
     return conn
 
+def get_db_connection(ruta=None):
+    """Abre una conexión nueva e independiente (scripts, CLI, hilos e inicialización)"""
+    conn = sqlite3.connect(ruta or DATABASE, timeout=5)
+    return _configurar_conexion(conn)
+
+class PoolConexiones:
+    """Pool de conexiones reutilizables; cada hilo toma una en exclusiva durante el request"""
+
+    def __init__(self, ruta, maximo=POOL_MAXIMO):
+        self.ruta = ruta
+        self._libres = queue.LifoQueue(maxsize=maximo)
+
+    def obtener(self):
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.ruta, timeout=5, check_same_thread=False)
+            return _configurar_conexion(conn)
+
+    def devolver(self, conn):
+        # Descartar cualquier transacción que el request haya dejado abierta
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._libres.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def cerrar(self):
+        while True:
+            try:
+                self._libres.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool = None
+
+def _obtener_pool():
+    global _pool
+    if _pool is None or _pool.ruta != DATABASE:
+        if _pool is not None:
+            _pool.cerrar()
+        _pool = PoolConexiones(DATABASE)
+    return _pool
+
+def get_db():
+    """Devuelve la conexión asociada al contexto actual (una por request)"""
+    if 'db' not in g:
+        g.db = _obtener_pool().obtener()
+    return g.db
+
+def close_db(exception=None):
+    """Devuelve la conexión del contexto al pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        _obtener_pool().devolver(conn)
+
+def _base_ocupada(error):
+    """Indica si el error corresponde a SQLITE_BUSY (base bloqueada por otro escritor)"""
+    mensaje = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in mensaje or 'busy' in mensaje)
+
+def transaccion_inmediata(conn, operacion, intentos=INTENTOS_BLOQUEO):
+    """
+    Ejecuta operacion(conn) dentro de BEGIN IMMEDIATE y confirma al terminar
+
+    El bloqueo de escritura se toma al inicio, de modo que las lecturas y
+    escrituras de la operación no pueden intercalarse con las de otro
+    request. Si la base sigue ocupada tras busy_timeout se reintenta un
+    número acotado de veces con espera creciente.
+
+    Args:
+        conn: Conexión a la base de datos (sin transacción abierta)
+        operacion: Función que recibe la conexión y realiza las escrituras
+        intentos: Número máximo de intentos
+
+    Returns:
+        El valor devuelto por operacion
+    """
+    for intento in range(1, intentos + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            resultado = operacion(conn)
+            conn.commit()
+            return resultado
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if intento == intentos or not _base_ocupada(e):
+                raise
+            time.sleep(0.05 * intento)
+
+def init_app(app):
+    """Registra la base de datos en la aplicación Flask"""
+    global DATABASE
+    DATABASE = app.config.setdefault('DATABASE', DATABASE)
+    app.teardown_appcontext(close_db)
+
 def init_db():
     conn = get_db_connection()
     with conn:
@@ -125,159 +240,17 @@ def crear_admin_inicial():
         conn.close()
 
 def migrar_base_datos():
-    """Migra la base de datos existente para corregir inconsistencias"""
+    """Aplica las migraciones de esquema pendientes (ver utils/migraciones.py)"""
+    from utils.migraciones import aplicar_migraciones
+
     conn = get_db_connection()
     try:
-        # Verificar si la tabla prestamos existe y tiene las columnas correctas
-        cursor = conn.execute("PRAGMA table_info(prestamos)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # Agregar columnas faltantes si no existen
-        if 'instructor' not in columns:
-            conn.execute('''
-                ALTER TABLE prestamos ADD COLUMN instructor TEXT
-            ''')
-            print("Columna instructor agregada a prestamos")
-        
-        if 'jornada' not in columns:
-            conn.execute('''
-                ALTER TABLE prestamos ADD COLUMN jornada TEXT
-            ''')
-            print("Columna jornada agregada a prestamos")
-        
-        if 'estado_implemento_devolucion' not in columns:
-            conn.execute('''
-                ALTER TABLE prestamos ADD COLUMN estado_implemento_devolucion TEXT DEFAULT 'Bueno'
-            ''')
-            print("Columna estado_implemento_devolucion agregada a prestamos")
-        
-        if 'observaciones' not in columns:
-            conn.execute('''
-                ALTER TABLE prestamos ADD COLUMN observaciones TEXT
-            ''')
-            print("Columna observaciones agregada a prestamos")
-        
-        # Eliminar tablas de permisos si existen
-        try:
-            conn.execute('DROP TABLE IF EXISTS permisos_ambientes')
-            conn.execute('DROP TABLE IF EXISTS permisos_aprendices')
-            print("Tablas de permisos eliminadas")
-        except Exception as e:
-            print(f"Error al eliminar tablas de permisos: {e}")
-        
-        # Actualizar constraint de estado si es necesario
-        try:
-            # Actualizar estados a los nuevos valores
-            conn.execute('''
-                UPDATE implementos SET estado = 'Bueno' 
-                WHERE estado NOT IN ('Bueno', 'Desgaste notable', 'Dañado')
-            ''')
-            
-            conn.execute('''
-                UPDATE prestamos SET estado_implemento_devolucion = 'Bueno' 
-                WHERE estado_implemento_devolucion NOT IN ('Bueno', 'Desgaste notable', 'Dañado')
-                OR estado_implemento_devolucion IS NULL
-            ''')
-            
-            conn.commit()
+        aplicadas = aplicar_migraciones(conn)
+        if aplicadas:
             print("Migración de base de datos completada exitosamente")
-            
-        except Exception as e:
-            print(f"Error durante la migración: {e}")
-            
+        else:
+            print("La base de datos ya está en la última versión")
     except Exception as e:
         print(f"Error al migrar base de datos: {e}")
     finally:
         conn.close()
-
-def reordenar_ids_implementos():
-    """Reordena los IDs de los implementos para que sean consecutivos"""
-    conn = get_db_connection()
-    try:
-        # Obtener todos los implementos ordenados por ID actual
-        implementos = conn.execute('SELECT * FROM implementos ORDER BY id').fetchall()
-        
-        if not implementos:
-            return
-        
-        # Crear tabla temporal con los mismos datos
-        conn.execute('''
-            CREATE TEMPORARY TABLE implementos_temp (
-                id INTEGER PRIMARY KEY,
-                implemento TEXT NOT NULL,
-                descripcion TEXT NOT NULL,
-                disponibilidad INTEGER NOT NULL DEFAULT 0,
-                categoria TEXT,
-                imagen_url TEXT,
-                estado TEXT DEFAULT 'Bueno' CHECK(estado IN ('Bueno', 'Desgaste notable', 'Dañado')),
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Insertar datos con nuevos IDs consecutivos
-        nuevo_id = 1
-        for implemento in implementos:
-            conn.execute('''
-                INSERT INTO implementos_temp (id, implemento, descripcion, disponibilidad, categoria, imagen_url, estado, fecha_creacion, fecha_actualizacion)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                nuevo_id,
-                implemento['implemento'],
-                implemento['descripcion'],
-                implemento['disponibilidad'],
-                implemento['categoria'],
-                implemento['imagen_url'],
-                implemento['estado'],
-                implemento['fecha_creacion'],
-                implemento['fecha_actualizacion']
-            ))
-            
-            # Actualizar referencias en préstamos si el ID cambió
-            if implemento['id'] != nuevo_id:
-                conn.execute('''
-                    UPDATE prestamos SET fk_implemento = ? WHERE fk_implemento = ?
-                ''', (nuevo_id, implemento['id']))
-            
-            nuevo_id += 1
-        
-        # Eliminar tabla original y renombrar la temporal
-        conn.execute('DROP TABLE implementos')
-        conn.execute('ALTER TABLE implementos_temp RENAME TO implementos')
-        
-        # Recrear la secuencia de autoincremento
-        conn.execute('DELETE FROM sqlite_sequence WHERE name = "implementos"')
-        conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES ("implementos", ?)', (nuevo_id - 1,))
-        
-        conn.commit()
-        print(f"IDs de implementos reordenados exitosamente. Nuevo último ID: {nuevo_id - 1}")
-        
-    except Exception as e:
-        print(f"Error al reordenar IDs: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
-
-def obtener_siguiente_id_consecutivo():
-    """Obtiene el siguiente ID consecutivo para implementos"""
-    conn = get_db_connection()
-    try:
-        # Obtener el último ID actual
-        resultado = conn.execute('SELECT MAX(id) as max_id FROM implementos').fetchone()
-        ultimo_id = resultado['max_id'] if resultado['max_id'] else 0
-        
-        # Verificar si hay gaps en los IDs
-        total_implementos = conn.execute('SELECT COUNT(*) as count FROM implementos').fetchone()['count']
-        
-        if ultimo_id != total_implementos:
-            # Hay gaps, reordenar
-            reordenar_ids_implementos()
-            ultimo_id = conn.execute('SELECT MAX(id) as max_id FROM implementos').fetchone()['max_id']
-        
-        return ultimo_id + 1
-        
-    except Exception as e:
-        print(f"Error al obtener siguiente ID: {e}")
-        return 1
-    finally:
-        conn.close()
\ No newline at end of file
@@ -0,0 +1,246 @@
+"""
+Canal de eventos en vivo (Server-Sent Events) para las notificaciones del admin
+
+Cada administrador conectado a /admin/api/notificaciones/stream recibe:
+- 'notificacion': cada fila nueva de notificaciones, con su id como id del
+  evento. El id es el AUTOINCREMENT de la tabla, así que crece siempre y el
+  navegador lo devuelve en Last-Event-ID al reconectarse. Una notificación
+  agrupada que el drenador actualiza en su lugar se reenvía con sus datos
+  nuevos y sin id de evento, para no retroceder el Last-Event-ID.
+- 'no_leidas': el número de notificaciones sin leer cada vez que cambia.
+
+El drenador de la bandeja de salida (utils/notificaciones.py) publica en este
+proceso cada lote después de confirmarlo (publicar_notificaciones). Al
+conectarse, o al reanudar con Last-Event-ID, el flujo se suscribe antes de
+leer de la base lo pendiente, así que ningún evento se pierde entre ambas
+cosas; los repetidos se descartan por id. Las notificaciones entregadas por
+otros procesos se leen de la base en cada latido.
+
+Cada conexión ocupa un hilo mientras dura. Por eso hay como máximo
+MAXIMO_SUSCRIPTORES conexiones, y cada una se cierra tras DURACION_MAXIMA
+segundos; el navegador se reconecta solo y retoma desde el último id. Un
+cliente que no lee lo bastante rápido pierde su cola y se desconecta.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+# Conexiones simultáneas permitidas y eventos en espera por conexión
+MAXIMO_SUSCRIPTORES = 32
+TAMANO_COLA = 100
+
+# Segundos entre latidos (comentario SSE + revisión de la base) y vida de una conexión
+INTERVALO_LATIDO = 15
+DURACION_MAXIMA = 300
+
+# Milisegundos que espera el navegador antes de reconectarse
+REINTENTO_MS = 3000
+
+# Notificaciones que se reenvían como máximo al reanudar
+RESPALDO_MAXIMO = 100
+
+CONSULTA_NOTIFICACIONES = '''
+    SELECT n.*, u.nombre as usuario_nombre
+    FROM notificaciones n
+    LEFT JOIN usuarios u ON n.fk_usuario = u.id
+'''
+
+class CanalLleno(Exception):
+    """Se alcanzó el máximo de conexiones simultáneas"""
+    pass
+
+class Suscripcion:
+    """Cola acotada de eventos de una conexión"""
+
+    def __init__(self, maximo=TAMANO_COLA):
+        self.maximo = maximo
+        self.desbordada = False
+        self._eventos = deque()
+        self._condicion = threading.Condition()
+
+    def entregar(self, evento):
+        with self._condicion:
+            if len(self._eventos) >= self.maximo:
+                # El cliente se reconectará y leerá lo pendiente de la base
+                self.desbordada = True
+                self._eventos.clear()
+            elif not self.desbordada:
+                self._eventos.append(evento)
+            self._condicion.notify()
+
+    def esperar(self, segundos):
+        """
+        Espera eventos hasta `segundos`
+
+        Returns:
+            list: Eventos (tipo, datos, id) pendientes, posiblemente vacía
+        """
+        with self._condicion:
+            if not self._eventos and not self.desbordada:
+                self._condicion.wait(segundos)
+            eventos = list(self._eventos)
+            self._eventos.clear()
+            return eventos
+
+class CanalEventos:
+    """Difusión en el proceso de eventos a las suscripciones activas"""
+
+    def __init__(self, maximo=MAXIMO_SUSCRIPTORES):
+        self.maximo = maximo
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self):
+        """
+        Raises:
+            CanalLleno: Si ya hay `maximo` suscripciones
+        """
+        with self._lock:
+            if len(self._suscripciones) >= self.maximo:
+                raise CanalLleno()
+            suscripcion = Suscripcion()
+            self._suscripciones.add(suscripcion)
+            return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def hay_suscriptores(self):
+        return bool(self._suscripciones)
+
+    def publicar(self, tipo, datos, id=None):
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+        for suscripcion in suscripciones:
+            suscripcion.entregar((tipo, datos, id))
+
+    def __len__(self):
+        return len(self._suscripciones)
+
+canal = CanalEventos()
+
+def formatear_evento(tipo, datos, id=None):
+    """Texto SSE de un evento (datos en JSON)"""
+    lineas = []
+    if id is not None:
+        lineas.append(f'id: {id}')
+    lineas.append(f'event: {tipo}')
+    lineas.append(f'data: {json.dumps(datos, default=str)}')
+    return '\n'.join(lineas) + '\n\n'
+
+def contar_no_leidas(conn):
+    """Notificaciones sin leer, del contador que mantienen los triggers (migración 006)"""
+    from utils.contadores import obtener_contadores
+    return obtener_contadores(conn)['notificaciones_pendientes']
+
+def resumen_no_leidas(conn):
+    """
+    Total sin leer y último id de notificaciones, sin recorrer la tabla
+
+    Returns:
+        dict: {'no_leidas': int, 'ultimo_id': int}
+    """
+    return {
+        'no_leidas': contar_no_leidas(conn),
+        'ultimo_id': conn.execute('SELECT COALESCE(MAX(id), 0) FROM notificaciones').fetchone()[0],
+    }
+
+def publicar_no_leidas(conn):
+    """Publica el número de notificaciones sin leer (tras marcar o eliminar)"""
+    if canal.hay_suscriptores():
+        canal.publicar('no_leidas', {'no_leidas': contar_no_leidas(conn)})
+
+def publicar_notificaciones(conn, desde, hasta, actualizadas=()):
+    """
+    Publica las notificaciones recién confirmadas y el nuevo total sin leer
+
+    Args:
+        conn: Conexión a la base de datos
+        desde, hasta: Rango (desde, hasta] de ids insertados
+        actualizadas: Ids de notificaciones agrupadas que se actualizaron en su lugar
+    """
+    if not canal.hay_suscriptores():
+        return
+    if actualizadas:
+        marcas = ', '.join('?' * len(actualizadas))
+        filas = conn.execute(
+            CONSULTA_NOTIFICACIONES + f' WHERE n.id IN ({marcas}) ORDER BY n.fecha_creacion, n.id', list(actualizadas)
+        ).fetchall()
+        # Sin id de evento: el Last-Event-ID del navegador no retrocede
+        for fila in filas:
+            canal.publicar('notificacion', dict(fila))
+    filas = conn.execute(
+        CONSULTA_NOTIFICACIONES + ' WHERE n.id > ? AND n.id <= ? ORDER BY n.id', (desde, hasta)
+    ).fetchall()
+    for fila in filas:
+        canal.publicar('notificacion', dict(fila), fila['id'])
+    publicar_no_leidas(conn)
+
+def flujo_notificaciones(obtener_conexion, ultimo_id=None, suscripcion=None):
+    """
+    Generador del flujo SSE de una conexión
+
+    Args:
+        obtener_conexion: Función que abre una conexión propia del flujo
+        ultimo_id: Último id recibido por el cliente (Last-Event-ID), o None
+        suscripcion: Suscripción ya tomada en canal (se cancela al terminar)
+
+    Yields:
+        str: Texto SSE
+    """
+    suscripcion = suscripcion or canal.suscribir()
+    conn = obtener_conexion()
+    try:
+        yield f'retry: {REINTENTO_MS}\n\n'
+
+        # Lo pendiente desde el último id (o nada si es una conexión nueva)
+        if ultimo_id is None:
+            enviado = conn.execute('SELECT COALESCE(MAX(id), 0) FROM notificaciones').fetchone()[0]
+        else:
+            enviado = ultimo_id
+
+        def pendientes():
+            nonlocal enviado
+            filas = conn.execute(
+                CONSULTA_NOTIFICACIONES + ' WHERE n.id > ? ORDER BY n.id LIMIT ?', (enviado, RESPALDO_MAXIMO)
+            ).fetchall()
+            for fila in filas:
+                enviado = fila['id']
+                yield formatear_evento('notificacion', dict(fila), fila['id'])
+
+        yield from pendientes()
+        no_leidas = contar_no_leidas(conn)
+        yield formatear_evento('no_leidas', {'no_leidas': no_leidas})
+
+        inicio = time.monotonic()
+        while time.monotonic() - inicio < DURACION_MAXIMA:
+            eventos = suscripcion.esperar(INTERVALO_LATIDO)
+            if suscripcion.desbordada:
+                break
+            if not eventos:
+                # Latido: mantiene viva la conexión, detecta clientes que se
+                # fueron y trae lo creado por otros procesos
+                yield from pendientes()
+                actual = contar_no_leidas(conn)
+                if actual != no_leidas:
+                    no_leidas = actual
+                    yield formatear_evento('no_leidas', {'no_leidas': no_leidas})
+                yield ': latido\n\n'
+                continue
+            for tipo, datos, id in eventos:
+                if id is not None:
+                    if id <= enviado:
+                        continue
+                    if id != enviado + 1:
+                        # Hay ids intermedios (otro proceso o entregas fallidas): se leen en orden de la base
+                        yield from pendientes()
+                        continue
+                    enviado = id
+                if tipo == 'no_leidas':
+                    no_leidas = datos['no_leidas']
+                yield formatear_evento(tipo, datos, id)
+    finally:
+        canal.cancelar(suscripcion)
+        conn.close()
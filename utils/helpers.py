@@ -1,33 +1,33 @@
 """
 Utilidades y funciones auxiliares para el sistema Lendix
 """
-from utils.db import get_db_connection
-from datetime import datetime
+from utils.db import get_db
+from utils.contadores import obtener_contadores
+from datetime import datetime, timedelta
+import re
 
-def crear_notificacion(tipo, titulo, mensaje, fk_usuario=None, fk_prestamo=None):
+# Formato canónico de las fechas guardadas (ordenable como texto)
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+
+def crear_notificacion(conn, tipo, titulo, mensaje, fk_usuario=None, fk_prestamo=None):
     """
     Crea una notificación en el sistema
+
+    La notificación pasa por la bandeja de salida (utils/notificaciones.py) y
+    no se confirma aquí: se guarda con el commit de la operación que la origina
+    (o se descarta con ella). Después del commit, el llamador debe llamar a
+    avisar_drenador().
     
     Args:
-        tipo: Tipo de notificación (prestamo_individual, prestamo_multiple, devolucion, implemento_nuevo)
+        conn: Conexión con la transacción de la operación
+        tipo: Tipo de notificación (ver la restricción de la tabla notificaciones)
         titulo: Título de la notificación
         mensaje: Mensaje descriptivo
         fk_usuario: ID del usuario relacionado (opcional)
         fk_prestamo: ID del préstamo relacionado (opcional)
     """
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO notificaciones (tipo, titulo, mensaje, fk_usuario, fk_prestamo)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (tipo, titulo, mensaje, fk_usuario, fk_prestamo))
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"Error al crear notificación: {e}")
-        return False
-    finally:
-        conn.close()
+    from utils.notificaciones import encolar_notificacion
+    encolar_notificacion(conn, tipo, titulo, mensaje, fk_usuario, fk_prestamo)
 
 def obtener_estadisticas_dashboard():
     """
@@ -36,49 +36,30 @@ def obtener_estadisticas_dashboard():
     Returns:
         dict: Diccionario con estadísticas del sistema
     """
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        stats = {}
-        
-        # Implementos
-        stats['total_implementos'] = conn.execute(
-            'SELECT COUNT(*) as count FROM implementos'
-        ).fetchone()['count']
-        
-        stats['implementos_disponibles'] = conn.execute(
-            'SELECT COUNT(*) as count FROM implementos WHERE disponibilidad > 0'
-        ).fetchone()['count']
-        
-        # Usuarios
-        stats['total_usuarios'] = conn.execute(
-            'SELECT COUNT(*) as count FROM usuarios WHERE activo = 1'
-        ).fetchone()['count']
-        
-        # Préstamos
-        stats['total_prestamos'] = conn.execute(
-            'SELECT COUNT(*) as count FROM prestamos'
-        ).fetchone()['count']
-        
-        stats['prestamos_activos'] = conn.execute(
-            'SELECT COUNT(*) as count FROM prestamos WHERE fecha_devolucion IS NULL'
-        ).fetchone()['count']
+        # Contadores mantenidos por triggers (una lectura por clave primaria)
+        contadores = obtener_contadores(conn)
+        stats = {
+            'total_implementos': contadores['total_implementos'],
+            'implementos_disponibles': contadores['implementos_disponibles'],
+            'total_usuarios': contadores['usuarios_activos'],
+            'total_prestamos': contadores['total_prestamos'],
+            'prestamos_activos': contadores['prestamos_activos'],
+            'notificaciones_pendientes': contadores['notificaciones_pendientes'],
+        }
         
+        hoy = datetime.now().strftime("%Y-%m-%d")
         stats['prestamos_hoy'] = conn.execute(
-            '''SELECT COUNT(*) as count FROM prestamos 
-               WHERE DATE(fecha_prestamo) = DATE('now')'''
-        ).fetchone()['count']
-        
-        # Notificaciones
-        stats['notificaciones_pendientes'] = conn.execute(
-            'SELECT COUNT(*) as count FROM notificaciones WHERE leida = 0'
+            '''SELECT COALESCE(SUM(cantidad), 0) as count FROM prestamos 
+               WHERE fecha_prestamo >= ? AND fecha_prestamo < ?''',
+            limites_fecha(hoy, hoy)
         ).fetchone()['count']
         
         return stats
     except Exception as e:
         print(f"Error al obtener estadísticas: {e}")
         return {}
-    finally:
-        conn.close()
 
 def verificar_disponibilidad_implemento(implemento_id):
     """
@@ -90,7 +71,7 @@ def verificar_disponibilidad_implemento(implemento_id):
     Returns:
         tuple: (bool disponible, str mensaje)
     """
-    conn = get_db_connection()
+    conn = get_db()
     try:
         implemento = conn.execute(
             'SELECT disponibilidad, estado FROM implementos WHERE id = ?',
@@ -109,8 +90,6 @@ def verificar_disponibilidad_implemento(implemento_id):
         return True, "Disponible"
     except Exception as e:
         return False, f"Error al verificar disponibilidad: {str(e)}"
-    finally:
-        conn.close()
 
 def registrar_accion_historial(usuario_id, accion, detalle=None, ip_address=None):
     """
@@ -122,7 +101,7 @@ def registrar_accion_historial(usuario_id, accion, detalle=None, ip_address=None
         detalle: Detalle adicional (opcional)
         ip_address: Dirección IP del usuario (opcional)
     """
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('''
             INSERT INTO historial_acciones (fk_usuario, accion, detalle, ip_address)
@@ -133,8 +112,6 @@ def registrar_accion_historial(usuario_id, accion, detalle=None, ip_address=None
     except Exception as e:
         print(f"Error al registrar en historial: {e}")
         return False
-    finally:
-        conn.close()
 
 def obtener_prestamos_usuario(usuario_id, incluir_devueltos=False):
     """
@@ -147,7 +124,7 @@ def obtener_prestamos_usuario(usuario_id, incluir_devueltos=False):
     Returns:
         list: Lista de préstamos del usuario
     """
-    conn = get_db_connection()
+    conn = get_db()
     try:
         query = '''
             SELECT p.*, i.implemento, i.categoria
@@ -166,30 +143,78 @@ def obtener_prestamos_usuario(usuario_id, incluir_devueltos=False):
     except Exception as e:
         print(f"Error al obtener préstamos: {e}")
         return []
-    finally:
-        conn.close()
 
-def calcular_dias_prestamo(fecha_prestamo):
+def calcular_dias_prestamo(fecha_prestamo, referencia=None):
     """
     Calcula los días transcurridos desde un préstamo
     
     Args:
         fecha_prestamo: Fecha del préstamo (string)
+        referencia: Momento contra el que se calcula (por defecto ahora);
+            al recorrer un listado conviene calcularlo una sola vez
         
     Returns:
         int: Número de días transcurridos
     """
     try:
-        fecha_prestamo_dt = datetime.strptime(fecha_prestamo, "%Y-%m-%d %H:%M:%S")
-        dias = (datetime.now() - fecha_prestamo_dt).days
+        fecha_prestamo_dt = datetime.strptime(fecha_prestamo, FORMATO_FECHA)
+        dias = ((referencia or datetime.now()) - fecha_prestamo_dt).days
         return dias
     except Exception as e:
         print(f"Error al calcular días: {e}")
         return 0
 
+def limites_fecha(fecha_inicio=None, fecha_fin=None):
+    """
+    Convierte un rango de días 'YYYY-MM-DD' en límites semiabiertos [desde, hasta)
+    comparables directamente con las columnas de fecha, sin envolverlas en DATE()
+    
+    Args:
+        fecha_inicio: Primer día incluido (opcional)
+        fecha_fin: Último día incluido (opcional)
+        
+    Returns:
+        tuple: (desde, hasta) como texto en FORMATO_FECHA, o None si no aplica
+    """
+    desde = hasta = None
+    if fecha_inicio:
+        desde = datetime.strptime(fecha_inicio, "%Y-%m-%d").strftime(FORMATO_FECHA)
+    if fecha_fin:
+        hasta = (datetime.strptime(fecha_fin, "%Y-%m-%d") + timedelta(days=1)).strftime(FORMATO_FECHA)
+    return desde, hasta
+
+def inicio_hace_dias(dias, referencia=None):
+    """Devuelve la medianoche de hace `dias` días en FORMATO_FECHA"""
+    fecha = (referencia or datetime.now()) - timedelta(days=dias)
+    return fecha.strftime("%Y-%m-%d 00:00:00")
+
+def expresion_busqueda(texto):
+    """
+    Convierte el texto escrito por el usuario en una consulta MATCH de FTS5
+
+    Cada palabra se busca como prefijo y todas deben aparecer; las comillas
+    evitan que caracteres como '-', '*' o '"' se interpreten como operadores.
+
+    Args:
+        texto: Texto libre del buscador
+
+    Returns:
+        str: Expresión para MATCH, o None si no hay palabras que buscar
+    """
+    palabras = re.findall(r'[^\W_]+', texto or '')
+    if not palabras:
+        return None
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
+
+def busqueda_fts_disponible(conn):
+    """Indica si existe el índice FTS5 del catálogo (migración 007)"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'implementos_fts'"
+    ).fetchone() is not None
+
 def validar_rol_usuario(usuario_id, roles_permitidos):
     """
-    Valida si un usuario tiene uno de los roles permitidos
+    Valida si un usuario activo tiene uno de los roles permitidos
     
     Args:
         usuario_id: ID del usuario
@@ -198,22 +223,17 @@ def validar_rol_usuario(usuario_id, roles_permitidos):
     Returns:
         bool: True si el usuario tiene un rol permitido
     """
-    conn = get_db_connection()
+    from utils.usuarios import obtener_identidad
     try:
-        usuario = conn.execute(
-            'SELECT rol FROM usuarios WHERE id = ?',
-            (usuario_id,)
-        ).fetchone()
+        usuario = obtener_identidad(usuario_id)
         
-        if not usuario:
+        if not usuario or not usuario.activo:
             return False
         
-        return usuario['rol'] in roles_permitidos
+        return usuario.rol in roles_permitidos
     except Exception as e:
         print(f"Error al validar rol: {e}")
         return False
-    finally:
-        conn.close()
 
 def obtener_implementos_con_problemas():
     """
@@ -222,7 +242,7 @@ def obtener_implementos_con_problemas():
     Returns:
         list: Lista de implementos con problemas
     """
-    conn = get_db_connection()
+    conn = get_db()
     try:
         implementos = conn.execute('''
             SELECT * FROM implementos 
@@ -233,8 +253,6 @@ def obtener_implementos_con_problemas():
     except Exception as e:
         print(f"Error al obtener implementos con problemas: {e}")
         return []
-    finally:
-        conn.close()
 
 def generar_reporte_prestamos(fecha_inicio=None, fecha_fin=None):
     """
@@ -247,32 +265,13 @@ def generar_reporte_prestamos(fecha_inicio=None, fecha_fin=None):
     Returns:
         dict: Reporte con estadísticas
     """
-    conn = get_db_connection()
+    from utils.resumenes import totales_periodo
+
+    conn = get_db()
     try:
-        query = '''
-            SELECT 
-                COUNT(*) as total_prestamos,
-                COUNT(CASE WHEN fecha_devolucion IS NULL THEN 1 END) as activos,
-                COUNT(CASE WHEN fecha_devolucion IS NOT NULL THEN 1 END) as devueltos,
-                COUNT(CASE WHEN tipo_prestamo = 'individual' THEN 1 END) as individuales,
-                COUNT(CASE WHEN tipo_prestamo = 'multiple' THEN 1 END) as multiples
-            FROM prestamos
-            WHERE 1=1
-        '''
-        params = []
-        
-        if fecha_inicio:
-            query += ' AND DATE(fecha_prestamo) >= ?'
-            params.append(fecha_inicio)
-        
-        if fecha_fin:
-            query += ' AND DATE(fecha_prestamo) <= ?'
-            params.append(fecha_fin)
-        
-        reporte = conn.execute(query, params).fetchone()
-        return dict(reporte)
+        # Suma los resúmenes diarios en lugar de recorrer todos los préstamos
+        desde, hasta = limites_fecha(fecha_inicio, fecha_fin)
+        return totales_periodo(conn, desde, hasta)
     except Exception as e:
         print(f"Error al generar reporte: {e}")
-        return {}
-    finally:
-        conn.close()
\ No newline at end of file
+        return {}
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+Límite de intentos de login con ventana deslizante
+
+Cada clave ('email:...' o 'ip:...') guarda solo dos contadores: los intentos de
+la ventana actual y los de la anterior. El total estimado pondera la ventana
+anterior por la fracción que aún cae dentro de los últimos `segundos`, de modo
+que el límite se comporta como una ventana deslizante con memoria constante
+por clave. Las claves cuya última ventana ya no cuenta se eliminan solas.
+
+Hay dos almacenes con la misma interfaz:
+- AlmacenSQLite: tabla login_limites compartida por todos los procesos.
+- AlmacenMemoria: LRU acotado por proceso (pruebas o un solo worker).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Segundos mínimos entre dos limpiezas de claves vencidas en SQLite
+INTERVALO_LIMPIEZA = 300
+
+def _estimar(ventana_guardada, actual, anterior, ventana, fraccion):
+    """Intentos en la ventana deslizante a partir de los contadores guardados"""
+    if ventana_guardada == ventana - 1:
+        actual, anterior = 0, actual
+    elif ventana_guardada != ventana:
+        return 0.0
+    return anterior * (1 - fraccion) + actual
+
+class AlmacenSQLite:
+    """Contadores en la tabla login_limites (compartida entre procesos)"""
+
+    def __init__(self, obtener_conexion):
+        self.obtener_conexion = obtener_conexion
+        self._ultima_limpieza = 0
+        self._lock = threading.Lock()
+
+    def leer(self, clave):
+        """Devuelve (ventana, actual, anterior) de una clave, o None"""
+        return self.obtener_conexion().execute(
+            'SELECT ventana, actual, anterior FROM login_limites WHERE clave = ?', (clave,)
+        ).fetchone()
+
+    def incrementar(self, clave, ventana):
+        """Suma un intento en la ventana actual (una sola sentencia atómica)"""
+        conn = self.obtener_conexion()
+        fila = conn.execute('''
+            INSERT INTO login_limites (clave, ventana, actual, anterior) VALUES (?, ?, 1, 0)
+            ON CONFLICT (clave) DO UPDATE SET
+                anterior = CASE
+                    WHEN ventana = excluded.ventana THEN anterior
+                    WHEN ventana = excluded.ventana - 1 THEN actual
+                    ELSE 0
+                END,
+                actual = CASE WHEN ventana = excluded.ventana THEN actual + 1 ELSE 1 END,
+                ventana = excluded.ventana
+            RETURNING ventana, actual, anterior
+        ''', (clave, ventana)).fetchone()
+        conn.commit()
+        self._limpiar_si_corresponde(conn, ventana)
+        return fila
+
+    def eliminar(self, clave):
+        conn = self.obtener_conexion()
+        conn.execute('DELETE FROM login_limites WHERE clave = ?', (clave,))
+        conn.commit()
+
+    def _limpiar_si_corresponde(self, conn, ventana):
+        ahora = time.monotonic()
+        with self._lock:
+            if ahora - self._ultima_limpieza < INTERVALO_LIMPIEZA:
+                return
+            self._ultima_limpieza = ahora
+        self.limpiar_vencidos(conn, ventana)
+
+    def limpiar_vencidos(self, conn, ventana):
+        """
+        Elimina las claves cuya última ventana ya no cuenta
+
+        Returns:
+            int: Número de claves eliminadas
+        """
+        eliminadas = conn.execute('DELETE FROM login_limites WHERE ventana < ?', (ventana - 1,)).rowcount
+        conn.commit()
+        return eliminadas
+
+class AlmacenMemoria:
+    """Contadores en un diccionario LRU acotado (por proceso)"""
+
+    def __init__(self, maximo=10000):
+        self.maximo = maximo
+        self._claves = OrderedDict()
+        self._lock = threading.Lock()
+
+    def leer(self, clave):
+        with self._lock:
+            return self._claves.get(clave)
+
+    def incrementar(self, clave, ventana):
+        with self._lock:
+            guardada, actual, anterior = self._claves.pop(clave, (ventana, 0, 0))
+            if guardada == ventana - 1:
+                actual, anterior = 0, actual
+            elif guardada != ventana:
+                actual, anterior = 0, 0
+            fila = (ventana, actual + 1, anterior)
+            self._claves[clave] = fila
+            # Las claves usadas hace más tiempo salen primero
+            while len(self._claves) > self.maximo:
+                self._claves.popitem(last=False)
+            return fila
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._claves.pop(clave, None)
+
+    def __len__(self):
+        return len(self._claves)
+
+class Limitador:
+    """
+    Límite de `limite` intentos cada `segundos` por clave
+
+    Args:
+        almacen: AlmacenSQLite o AlmacenMemoria
+        limite: Intentos permitidos en la ventana
+        segundos: Duración de la ventana deslizante
+        reloj: Función que devuelve la hora actual (pruebas)
+    """
+
+    def __init__(self, almacen, limite, segundos, reloj=time.time):
+        self.almacen = almacen
+        self.limite = limite
+        self.segundos = segundos
+        self.reloj = reloj
+
+    def _ventana(self):
+        ventana, resto = divmod(self.reloj(), self.segundos)
+        return int(ventana), resto / self.segundos
+
+    def intentos(self, clave):
+        """Intentos estimados de la clave en la ventana deslizante"""
+        fila = self.almacen.leer(clave)
+        if fila is None:
+            return 0.0
+        ventana, fraccion = self._ventana()
+        return _estimar(fila[0], fila[1], fila[2], ventana, fraccion)
+
+    def bloqueado(self, clave):
+        return self.intentos(clave) >= self.limite
+
+    def registrar(self, clave):
+        """
+        Registra un intento y devuelve los intentos que aún quedan
+
+        Returns:
+            int: Intentos restantes antes del bloqueo (0 si ya está bloqueada)
+        """
+        ventana, fraccion = self._ventana()
+        fila = self.almacen.incrementar(clave, ventana)
+        return max(0, self.limite - math.ceil(_estimar(fila[0], fila[1], fila[2], ventana, fraccion)))
+
+    def reiniciar(self, clave):
+        self.almacen.eliminar(clave)
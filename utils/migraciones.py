@@ -0,0 +1,744 @@
+"""
+Motor de migraciones versionadas para la base de datos de Lendix
+
+Cada migración se registra en la tabla schema_version y se aplica una sola
+vez, dentro de su propia transacción. Para agregar un cambio de esquema basta
+con añadir una función nueva al final de MIGRACIONES con el siguiente número.
+"""
+
+
+def _columnas(conn, tabla):
+    """Devuelve los nombres de columna de una tabla"""
+    return [column[1] for column in conn.execute(f'PRAGMA table_info({tabla})').fetchall()]
+
+def _agregar_columna(conn, tabla, columna, definicion):
+    """Agrega una columna solo si todavía no existe"""
+    if columna not in _columnas(conn, tabla):
+        conn.execute(f'ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}')
+
+
+def _m001_columnas_prestamos(conn):
+    """Columnas agregadas a prestamos y limpieza de datos heredados"""
+    _agregar_columna(conn, 'prestamos', 'instructor', 'TEXT')
+    _agregar_columna(conn, 'prestamos', 'jornada', 'TEXT')
+    _agregar_columna(conn, 'prestamos', 'estado_implemento_devolucion', "TEXT DEFAULT 'Bueno'")
+    _agregar_columna(conn, 'prestamos', 'observaciones', 'TEXT')
+
+    # Tablas de permisos que ya no se usan
+    conn.execute('DROP TABLE IF EXISTS permisos_ambientes')
+    conn.execute('DROP TABLE IF EXISTS permisos_aprendices')
+
+    # Normalizar estados a los valores permitidos
+    conn.execute('''
+        UPDATE implementos SET estado = 'Bueno'
+        WHERE estado NOT IN ('Bueno', 'Desgaste notable', 'Dañado')
+    ''')
+    conn.execute('''
+        UPDATE prestamos SET estado_implemento_devolucion = 'Bueno'
+        WHERE estado_implemento_devolucion NOT IN ('Bueno', 'Desgaste notable', 'Dañado')
+        OR estado_implemento_devolucion IS NULL
+    ''')
+
+def _m002_indices_consultas(conn):
+    """Índices secundarios para los filtros y ordenamientos de las vistas"""
+    # Préstamos activos (devoluciones, validaciones antes de eliminar)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_prestamos_activos
+        ON prestamos(fecha_prestamo DESC) WHERE fecha_devolucion IS NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_prestamos_activos_implemento
+        ON prestamos(fk_implemento) WHERE fecha_devolucion IS NULL
+    ''')
+    # Historial de un usuario ordenado por fecha
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_prestamos_usuario_fecha
+        ON prestamos(fk_usuario, fecha_prestamo DESC)
+    ''')
+    # Listados generales filtrados y ordenados por fecha
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_prestamos_fecha
+        ON prestamos(fecha_prestamo DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_prestamos_implemento
+        ON prestamos(fk_implemento)
+    ''')
+
+    # Notificaciones no leídas y listado general
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notificaciones_no_leidas
+        ON notificaciones(fecha_creacion DESC) WHERE leida = 0
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notificaciones_fecha
+        ON notificaciones(fecha_creacion DESC)
+    ''')
+
+    # Catálogo ordenado por nombre y por fecha de creación
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_implementos_nombre
+        ON implementos(implemento)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_implementos_fecha_creacion
+        ON implementos(fecha_creacion DESC)
+    ''')
+
+    # Usuarios pendientes de aprobación e instructores activos
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_usuarios_activo_fecha
+        ON usuarios(activo, fecha_registro DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_usuarios_rol_activo
+        ON usuarios(rol, activo, nombre)
+    ''')
+
+def _m003_fechas_canonicas(conn):
+    """Normaliza las fechas de prestamos al formato ordenable 'YYYY-MM-DD HH:MM:SS'"""
+    # Los filtros usan rangos semiabiertos sobre el texto de la columna, lo que
+    # solo es correcto si todas las filas comparten el mismo formato
+    for columna in ('fecha_prestamo', 'fecha_devolucion'):
+        conn.execute(f'''
+            UPDATE prestamos
+            SET {columna} = strftime('%Y-%m-%d %H:%M:%S', {columna})
+            WHERE {columna} IS NOT NULL
+            AND strftime('%Y-%m-%d %H:%M:%S', {columna}) IS NOT NULL
+            AND {columna} <> strftime('%Y-%m-%d %H:%M:%S', {columna})
+        ''')
+
+    # Corregir cualquier inserción futura que llegue en otro formato (p. ej. ISO con 'T')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_prestamos_fecha_canonica
+        AFTER INSERT ON prestamos
+        WHEN NEW.fecha_prestamo <> strftime('%Y-%m-%d %H:%M:%S', NEW.fecha_prestamo)
+        BEGIN
+            UPDATE prestamos
+            SET fecha_prestamo = strftime('%Y-%m-%d %H:%M:%S', NEW.fecha_prestamo)
+            WHERE id = NEW.id;
+        END
+    ''')
+    # Y las ediciones; el UPDATE del trigger no lo vuelve a disparar
+    # (recursive_triggers está desactivado) y las fechas no reconocibles se conservan
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_prestamos_fecha_canonica_edicion
+        AFTER UPDATE OF fecha_prestamo, fecha_devolucion ON prestamos
+        WHEN NEW.fecha_prestamo <> strftime('%Y-%m-%d %H:%M:%S', NEW.fecha_prestamo)
+          OR NEW.fecha_devolucion <> strftime('%Y-%m-%d %H:%M:%S', NEW.fecha_devolucion)
+        BEGIN
+            UPDATE prestamos
+            SET fecha_prestamo = COALESCE(strftime('%Y-%m-%d %H:%M:%S', NEW.fecha_prestamo), NEW.fecha_prestamo),
+                fecha_devolucion = COALESCE(strftime('%Y-%m-%d %H:%M:%S', NEW.fecha_devolucion), NEW.fecha_devolucion)
+            WHERE id = NEW.id;
+        END
+    ''')
+
+def _m004_numero_implementos(conn):
+    """Número de visualización creciente, independiente del id de los implementos"""
+    # El id nunca cambia (lo referencian los préstamos); el número que ve el
+    # usuario se mantiene aparte y de forma incremental
+    _agregar_columna(conn, 'implementos', 'numero', 'INTEGER')
+    conn.execute('''
+        UPDATE implementos SET numero = orden.n
+        FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS n FROM implementos) AS orden
+        WHERE orden.id = implementos.id
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_implementos_numero ON implementos(numero)')
+
+    # Último número entregado; no baja al borrar, así un número nunca se reutiliza
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS secuencias (
+            nombre TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO secuencias (nombre, valor)
+        SELECT 'implementos_numero', COALESCE(MAX(numero), 0) FROM implementos
+    ''')
+
+    # Alta: siguiente valor de la secuencia. Baja: el número se pierde y queda
+    # un hueco; renumerar los siguientes haría cada baja O(catálogo)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_implementos_numero_alta
+        AFTER INSERT ON implementos
+        WHEN NEW.numero IS NULL
+        BEGIN
+            UPDATE secuencias SET valor = valor + 1 WHERE nombre = 'implementos_numero';
+            UPDATE implementos
+            SET numero = (SELECT valor FROM secuencias WHERE nombre = 'implementos_numero')
+            WHERE id = NEW.id;
+        END
+    ''')
+
+def _m005_cantidad_prestamos(conn):
+    """Un préstamo por entrega con columna cantidad, en vez de una fila por unidad"""
+    _agregar_columna(conn, 'prestamos', 'cantidad', 'INTEGER NOT NULL DEFAULT 1')
+    _agregar_columna(conn, 'prestamos', 'cantidad_devuelta', 'INTEGER NOT NULL DEFAULT 0')
+
+    # Agrupar las filas idénticas de una misma entrega; también deben coincidir
+    # los datos de devolución para no perder novedades de unidades concretas
+    conn.execute('''
+        CREATE TEMP TABLE fusion_prestamos AS
+        SELECT id, superviviente, unidades FROM (
+            SELECT id,
+                   MIN(id) OVER grupo AS superviviente,
+                   COUNT(*) OVER grupo AS unidades
+            FROM prestamos
+            WINDOW grupo AS (
+                PARTITION BY fk_usuario, fk_implemento, fecha_prestamo, tipo_prestamo,
+                             nombre_prestatario, ficha, ambiente, horario, instructor, jornada,
+                             fecha_devolucion, novedad, estado_implemento_devolucion, observaciones
+            )
+        )
+        WHERE unidades > 1
+    ''')
+    conn.execute('''
+        UPDATE prestamos SET cantidad = fusion.unidades
+        FROM fusion_prestamos AS fusion
+        WHERE fusion.id = prestamos.id AND fusion.id = fusion.superviviente
+    ''')
+    conn.execute('''
+        UPDATE notificaciones SET fk_prestamo = fusion.superviviente
+        FROM fusion_prestamos AS fusion
+        WHERE fusion.id = notificaciones.fk_prestamo AND fusion.id <> fusion.superviviente
+    ''')
+    conn.execute('''
+        DELETE FROM prestamos
+        WHERE id IN (SELECT id FROM fusion_prestamos WHERE id <> superviviente)
+    ''')
+    conn.execute('DROP TABLE fusion_prestamos')
+
+    conn.execute('''
+        UPDATE prestamos SET cantidad_devuelta = cantidad
+        WHERE fecha_devolucion IS NOT NULL
+    ''')
+
+def _m006_contadores_estadisticas(conn):
+    """Tabla stats_counters de una fila mantenida por triggers"""
+    from utils.contadores import recalcular_contadores
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_implementos INTEGER NOT NULL DEFAULT 0,
+            implementos_disponibles INTEGER NOT NULL DEFAULT 0,
+            total_usuarios INTEGER NOT NULL DEFAULT 0,
+            usuarios_activos INTEGER NOT NULL DEFAULT 0,
+            total_prestamos INTEGER NOT NULL DEFAULT 0,
+            prestamos_activos INTEGER NOT NULL DEFAULT 0,
+            prestamos_devueltos INTEGER NOT NULL DEFAULT 0,
+            notificaciones_pendientes INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    recalcular_contadores(conn)
+
+    # Cada trigger suma la diferencia entre la fila nueva y la anterior
+    disponible = '(CASE WHEN {0}.disponibilidad > 0 THEN 1 ELSE 0 END)'
+    activo = '(CASE WHEN {0}.activo = 1 THEN 1 ELSE 0 END)'
+    pendientes = '(CASE WHEN {0}.fecha_devolucion IS NULL THEN {0}.cantidad - {0}.cantidad_devuelta ELSE 0 END)'
+    no_leida = '(CASE WHEN {0}.leida = 0 THEN 1 ELSE 0 END)'
+
+    triggers = {
+        'trg_contadores_implementos_alta': ('AFTER INSERT ON implementos', f'''
+            total_implementos = total_implementos + 1,
+            implementos_disponibles = implementos_disponibles + {disponible.format('NEW')}
+        '''),
+        'trg_contadores_implementos_baja': ('AFTER DELETE ON implementos', f'''
+            total_implementos = total_implementos - 1,
+            implementos_disponibles = implementos_disponibles - {disponible.format('OLD')}
+        '''),
+        'trg_contadores_implementos_cambio': ('AFTER UPDATE OF disponibilidad ON implementos', f'''
+            implementos_disponibles = implementos_disponibles
+                + {disponible.format('NEW')} - {disponible.format('OLD')}
+        '''),
+        'trg_contadores_usuarios_alta': ('AFTER INSERT ON usuarios', f'''
+            total_usuarios = total_usuarios + 1,
+            usuarios_activos = usuarios_activos + {activo.format('NEW')}
+        '''),
+        'trg_contadores_usuarios_baja': ('AFTER DELETE ON usuarios', f'''
+            total_usuarios = total_usuarios - 1,
+            usuarios_activos = usuarios_activos - {activo.format('OLD')}
+        '''),
+        'trg_contadores_usuarios_cambio': ('AFTER UPDATE OF activo ON usuarios', f'''
+            usuarios_activos = usuarios_activos + {activo.format('NEW')} - {activo.format('OLD')}
+        '''),
+        'trg_contadores_prestamos_alta': ('AFTER INSERT ON prestamos', f'''
+            total_prestamos = total_prestamos + NEW.cantidad,
+            prestamos_activos = prestamos_activos + {pendientes.format('NEW')},
+            prestamos_devueltos = prestamos_devueltos + NEW.cantidad_devuelta
+        '''),
+        'trg_contadores_prestamos_baja': ('AFTER DELETE ON prestamos', f'''
+            total_prestamos = total_prestamos - OLD.cantidad,
+            prestamos_activos = prestamos_activos - {pendientes.format('OLD')},
+            prestamos_devueltos = prestamos_devueltos - OLD.cantidad_devuelta
+        '''),
+        'trg_contadores_prestamos_cambio': (
+            'AFTER UPDATE OF cantidad, cantidad_devuelta, fecha_devolucion ON prestamos', f'''
+            total_prestamos = total_prestamos + NEW.cantidad - OLD.cantidad,
+            prestamos_activos = prestamos_activos + {pendientes.format('NEW')} - {pendientes.format('OLD')},
+            prestamos_devueltos = prestamos_devueltos + NEW.cantidad_devuelta - OLD.cantidad_devuelta
+        '''),
+        'trg_contadores_notificaciones_alta': ('AFTER INSERT ON notificaciones', f'''
+            notificaciones_pendientes = notificaciones_pendientes + {no_leida.format('NEW')}
+        '''),
+        'trg_contadores_notificaciones_baja': ('AFTER DELETE ON notificaciones', f'''
+            notificaciones_pendientes = notificaciones_pendientes - {no_leida.format('OLD')}
+        '''),
+        'trg_contadores_notificaciones_cambio': ('AFTER UPDATE OF leida ON notificaciones', f'''
+            notificaciones_pendientes = notificaciones_pendientes
+                + {no_leida.format('NEW')} - {no_leida.format('OLD')}
+        '''),
+    }
+    for nombre, (evento, asignaciones) in triggers.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {nombre} {evento}
+            BEGIN
+                UPDATE stats_counters SET {asignaciones} WHERE id = 1;
+            END
+        ''')
+
+def _m007_busqueda_implementos(conn):
+    """Índice de texto completo FTS5 sobre el catálogo, sin distinguir tildes"""
+    opciones = [fila[0] for fila in conn.execute('PRAGMA compile_options')]
+    if 'ENABLE_FTS5' not in opciones:
+        # Sin FTS5 el filtro del catálogo sigue usando LIKE
+        print("SQLite sin FTS5: se omite el índice de búsqueda")
+        return
+
+    # Tabla de contenido externo: el texto vive en implementos y el índice
+    # solo guarda los términos (remove_diacritics 2 hace que 'raton' = 'ratón')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS implementos_fts USING fts5(
+            implemento, descripcion, categoria,
+            content='implementos', content_rowid='id',
+            tokenize="unicode61 remove_diacritics 2"
+        )
+    ''')
+    conn.execute("INSERT INTO implementos_fts(implementos_fts) VALUES ('rebuild')")
+    # Ranking BM25 con más peso para el nombre que para la descripción y la categoría
+    conn.execute("INSERT INTO implementos_fts(implementos_fts, rank) VALUES ('rank', 'bm25(10.0, 2.0, 1.0)')")
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_implementos_fts_alta
+        AFTER INSERT ON implementos
+        BEGIN
+            INSERT INTO implementos_fts(rowid, implemento, descripcion, categoria)
+            VALUES (NEW.id, NEW.implemento, NEW.descripcion, NEW.categoria);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_implementos_fts_baja
+        AFTER DELETE ON implementos
+        BEGIN
+            INSERT INTO implementos_fts(implementos_fts, rowid, implemento, descripcion, categoria)
+            VALUES ('delete', OLD.id, OLD.implemento, OLD.descripcion, OLD.categoria);
+        END
+    ''')
+    # Solo los cambios de texto tocan el índice (no los de disponibilidad)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_implementos_fts_cambio
+        AFTER UPDATE OF implemento, descripcion, categoria ON implementos
+        BEGIN
+            INSERT INTO implementos_fts(implementos_fts, rowid, implemento, descripcion, categoria)
+            VALUES ('delete', OLD.id, OLD.implemento, OLD.descripcion, OLD.categoria);
+            INSERT INTO implementos_fts(rowid, implemento, descripcion, categoria)
+            VALUES (NEW.id, NEW.implemento, NEW.descripcion, NEW.categoria);
+        END
+    ''')
+
+def _m008_indices_paginacion(conn):
+    """Índices con el id como desempate para la paginación por cursor"""
+    # Los listados se ordenan por (fecha_prestamo, id) descendente; con el id
+    # dentro del índice la página siguiente es una búsqueda por rango
+    for nombre, definicion in [
+        ('idx_prestamos_fecha', 'prestamos(fecha_prestamo DESC, id DESC)'),
+        ('idx_prestamos_activos', 'prestamos(fecha_prestamo DESC, id DESC) WHERE fecha_devolucion IS NULL'),
+        ('idx_prestamos_usuario_fecha', 'prestamos(fk_usuario, fecha_prestamo DESC, id DESC)'),
+    ]:
+        conn.execute(f'DROP INDEX IF EXISTS {nombre}')
+        conn.execute(f'CREATE INDEX {nombre} ON {definicion}')
+
+    # Gestión de usuarios: filtros por estado o rol, más recientes primero
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_usuarios_activo_id ON usuarios(activo, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_usuarios_rol_id ON usuarios(rol, id)')
+
+def _m009_trabajos_reportes(conn):
+    """Tabla de trabajos de reportes generados en segundo plano"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parametros TEXT NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendiente'
+                CHECK(estado IN ('pendiente', 'en_proceso', 'completado', 'error', 'vencido')),
+            progreso INTEGER NOT NULL DEFAULT 0,
+            total_filas INTEGER,
+            archivo TEXT,
+            error TEXT,
+            fk_usuario INTEGER,
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            fecha_inicio TIMESTAMP,
+            fecha_fin TIMESTAMP,
+            expira TIMESTAMP,
+            FOREIGN KEY (fk_usuario) REFERENCES usuarios(id)
+        )
+    ''')
+    # Limpieza de reportes vencidos
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_report_jobs_expira
+        ON report_jobs(expira) WHERE estado = 'completado'
+    ''')
+
+def _m010_version_datos(conn):
+    """Contador de escrituras que forma parte de la clave de la caché de reportes"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+
+    # Cualquier cambio en las tablas que leen los reportes invalida la caché
+    for tabla in ('prestamos', 'implementos', 'usuarios'):
+        for sufijo, evento in (('alta', 'INSERT'), ('baja', 'DELETE'), ('cambio', 'UPDATE')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{sufijo} AFTER {evento} ON {tabla}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+def _m011_resumenes_diarios(conn):
+    """Resúmenes diarios de préstamos por implemento, usuario y tipo, mantenidos por triggers"""
+    from utils.resumenes import DIA, MEDIDAS, RESUMENES, recalcular_resumenes
+
+    for tabla, columna in RESUMENES.values():
+        tipo = 'TEXT' if columna == 'tipo_prestamo' else 'INTEGER'
+        medidas = ',\n'.join(f'{medida} INTEGER NOT NULL DEFAULT 0' for medida in MEDIDAS)
+        # Clave (columna, día): cada implemento/usuario lee su rango de días por índice
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {tabla} (
+                {columna} {tipo} NOT NULL,
+                dia TEXT NOT NULL,
+                {medidas},
+                PRIMARY KEY ({columna}, dia)
+            ) WITHOUT ROWID
+        ''')
+    recalcular_resumenes(conn)
+
+    def sumar(fila, signo):
+        """Sentencias que suman (o restan) un préstamo en cada resumen"""
+        valores = ', '.join(f"{signo}{expresion.format(fila)}" for expresion in MEDIDAS.values())
+        asignaciones = ', '.join(f'{medida} = {medida} + excluded.{medida}' for medida in MEDIDAS)
+        sentencias = []
+        for tabla, columna in RESUMENES.values():
+            sentencias.append(f'''
+                INSERT INTO {tabla} ({columna}, dia, {', '.join(MEDIDAS)})
+                VALUES ({fila}.{columna}, {DIA.format(fila)}, {valores})
+                ON CONFLICT ({columna}, dia) DO UPDATE SET {asignaciones};
+            ''')
+            if signo == '-':
+                # Las filas que quedan en cero se eliminan para no acumular días vacíos
+                sentencias.append(f'''
+                    DELETE FROM {tabla}
+                    WHERE {columna} = {fila}.{columna} AND dia = {DIA.format(fila)} AND prestamos = 0;
+                ''')
+        return '\n'.join(sentencias)
+
+    triggers = {
+        'trg_resumenes_prestamos_alta': ('AFTER INSERT ON prestamos', sumar('NEW', '')),
+        'trg_resumenes_prestamos_baja': ('AFTER DELETE ON prestamos', sumar('OLD', '-')),
+        'trg_resumenes_prestamos_cambio': (
+            'AFTER UPDATE OF fk_usuario, fk_implemento, tipo_prestamo, fecha_prestamo, '
+            'cantidad, cantidad_devuelta, fecha_devolucion ON prestamos',
+            sumar('OLD', '-') + sumar('NEW', '')
+        ),
+    }
+    for nombre, (evento, sentencias) in triggers.items():
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {nombre} {evento}
+            BEGIN
+                {sentencias}
+            END
+        ''')
+
+def _m012_limites_login(conn):
+    """Contadores de intentos de login por email e IP (ventana deslizante)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS login_limites (
+            clave TEXT PRIMARY KEY,
+            ventana INTEGER NOT NULL,
+            actual INTEGER NOT NULL DEFAULT 0,
+            anterior INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_login_limites_ventana ON login_limites(ventana)')
+
+def _m013_revocaciones_tokens(conn):
+    """Lista de revocaciones de tokens de la API y su número de versión"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS api_revocaciones (
+            clave TEXT PRIMARY KEY,
+            emitidos_antes REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS api_revocaciones_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO api_revocaciones_version (id, version) VALUES (1, 0)')
+
+    # Cada cambio en la lista invalida la copia en memoria de los procesos
+    for sufijo, evento in (('alta', 'INSERT'), ('baja', 'DELETE'), ('cambio', 'UPDATE')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_api_revocaciones_{sufijo} AFTER {evento} ON api_revocaciones
+            BEGIN
+                UPDATE api_revocaciones_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+    # Cambiar el rol o el estado de un usuario, o eliminarlo, revoca sus tokens emitidos
+    ahora = "(julianday('now') - 2440587.5) * 86400.0"
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_api_revocaciones_usuario_cambio
+        AFTER UPDATE OF rol, activo ON usuarios
+        WHEN NEW.rol IS NOT OLD.rol OR NEW.activo IS NOT OLD.activo
+        BEGIN
+            INSERT OR REPLACE INTO api_revocaciones (clave, emitidos_antes)
+            VALUES ('usuario:' || NEW.id, {ahora});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_api_revocaciones_usuario_baja
+        AFTER DELETE ON usuarios
+        BEGIN
+            INSERT OR REPLACE INTO api_revocaciones (clave, emitidos_antes)
+            VALUES ('usuario:' || OLD.id, {ahora});
+        END
+    ''')
+
+def _m014_version_usuarios(conn):
+    """Contador de cambios de identidad de usuarios para la caché de utils/usuarios.py"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO usuarios_version (id, version) VALUES (1, 0)')
+
+    # Solo cuentan las altas, las bajas y los cambios de rol o de estado;
+    # cambiar la contraseña o el teléfono no invalida la caché
+    for sufijo, evento, condicion in (
+        ('alta', 'INSERT', ''),
+        ('baja', 'DELETE', ''),
+        ('cambio', 'UPDATE OF rol, activo', 'WHEN NEW.rol IS NOT OLD.rol OR NEW.activo IS NOT OLD.activo'),
+    ):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_version_{sufijo} AFTER {evento} ON usuarios
+            {condicion}
+            BEGIN
+                UPDATE usuarios_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+def _m015_cambios_catalogo(conn):
+    """Anotaciones de implementos modificados para la caché de utils/cache_catalogo.py"""
+    from utils.cache_catalogo import RETENCION_CAMBIOS
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalogo_cambios (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            fk_implemento INTEGER NOT NULL
+        )
+    ''')
+
+    # Cada alta, baja o cambio de un implemento deja una anotación en la misma
+    # transacción, y las anotaciones más antiguas se eliminan
+    for sufijo, evento, fila in (('alta', 'INSERT', 'NEW'), ('baja', 'DELETE', 'OLD'), ('cambio', 'UPDATE', 'NEW')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_catalogo_cambios_{sufijo} AFTER {evento} ON implementos
+            BEGIN
+                INSERT INTO catalogo_cambios (fk_implemento) VALUES ({fila}.id);
+                DELETE FROM catalogo_cambios WHERE version <= last_insert_rowid() - {RETENCION_CAMBIOS};
+            END
+        ''')
+
+def _m016_bandeja_notificaciones(conn):
+    """Bandeja de salida de notificaciones que entrega utils/notificaciones.py"""
+    # Sin la restricción de tipo de notificaciones: un tipo inválido no debe
+    # deshacer el préstamo que lo encola (el drenador lo marca como fallido)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notificaciones_salida (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            titulo TEXT NOT NULL,
+            mensaje TEXT NOT NULL,
+            fk_usuario INTEGER,
+            fk_prestamo INTEGER,
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            creada REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+        )
+    ''')
+
+def _m017_agrupacion_notificaciones(conn):
+    """Agrupación de notificaciones por clave y archivo de las antiguas (utils/notificaciones.py)"""
+    _agregar_columna(conn, 'notificaciones', 'clave', 'TEXT')
+    _agregar_columna(conn, 'notificaciones', 'cantidad', 'INTEGER NOT NULL DEFAULT 1')
+    _agregar_columna(conn, 'notificaciones', 'inicio_grupo', 'TIMESTAMP')
+    _agregar_columna(conn, 'notificaciones_salida', 'clave', 'TEXT')
+
+    # Notificación sin leer de una clave dentro de la ventana de agrupación
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notificaciones_agrupacion
+        ON notificaciones(clave, tipo) WHERE leida = 0 AND clave IS NOT NULL
+    ''')
+
+    # Archivo compacto: solo leídas, sin clave ni estado y sin índices secundarios
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notificaciones_archivo (
+            id INTEGER PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            titulo TEXT NOT NULL,
+            mensaje TEXT NOT NULL,
+            fk_usuario INTEGER,
+            fk_prestamo INTEGER,
+            cantidad INTEGER NOT NULL DEFAULT 1,
+            fecha_creacion TIMESTAMP
+        )
+    ''')
+
+def _m018_indices_devoluciones(conn):
+    """Préstamos activos por ficha, ambiente y prestatario (devoluciones masivas)"""
+    for columna in ('ficha', 'ambiente', 'nombre_prestatario'):
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_prestamos_activos_{columna}
+            ON prestamos({columna}) WHERE fecha_devolucion IS NULL
+        ''')
+
+def _m019_tipos_notificaciones(conn):
+    """Restricción de notificaciones con todos los tipos que encolan las rutas; fallos en la bandeja"""
+    tipos = ', '.join(f"'{tipo}'" for tipo in (
+        'prestamo_individual', 'prestamo_multiple', 'prestamo_admin', 'prestamo_editado',
+        'novedad_prestamo', 'devolucion', 'implemento_nuevo', 'usuario_nuevo',
+        'usuario_activado', 'usuario_desactivado', 'usuario_editado', 'usuario_eliminado',
+    ))
+
+    # SQLite no modifica un CHECK: se reconstruye la tabla y se recrean sus
+    # índices y triggers, conservando la secuencia de ids (Last-Event-ID)
+    dependientes = [fila[0] for fila in conn.execute('''
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = 'notificaciones' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    ''')]
+    secuencia = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'notificaciones'").fetchone()
+    conn.execute(f'''
+        CREATE TABLE notificaciones_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL CHECK(tipo IN ({tipos})),
+            titulo TEXT NOT NULL,
+            mensaje TEXT NOT NULL,
+            fk_usuario INTEGER,
+            fk_prestamo INTEGER,
+            leida BOOLEAN DEFAULT 0,
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            clave TEXT,
+            cantidad INTEGER NOT NULL DEFAULT 1,
+            inicio_grupo TIMESTAMP,
+            FOREIGN KEY (fk_usuario) REFERENCES usuarios(id),
+            FOREIGN KEY (fk_prestamo) REFERENCES prestamos(id)
+        )
+    ''')
+    columnas = ', '.join(_columnas(conn, 'notificaciones_nueva'))
+    conn.execute(f'INSERT INTO notificaciones_nueva ({columnas}) SELECT {columnas} FROM notificaciones')
+    conn.execute('DROP TABLE notificaciones')
+    conn.execute('ALTER TABLE notificaciones_nueva RENAME TO notificaciones')
+    for sql in dependientes:
+        conn.execute(sql)
+    if secuencia:
+        conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'notificaciones'", (secuencia[0],)
+        )
+
+    # Una fila que aun así no se pueda entregar queda en la bandeja como fallida, con su error
+    _agregar_columna(conn, 'notificaciones_salida', 'estado', "TEXT NOT NULL DEFAULT 'pendiente'")
+    _agregar_columna(conn, 'notificaciones_salida', 'error', 'TEXT')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notificaciones_salida_pendientes
+        ON notificaciones_salida(id) WHERE estado = 'pendiente'
+    ''')
+
+
+# Lista ordenada de migraciones: (versión, descripción, función)
+MIGRACIONES = [
+    (1, 'Columnas de prestamos y limpieza de estados', _m001_columnas_prestamos),
+    (2, 'Índices para consultas frecuentes', _m002_indices_consultas),
+    (3, 'Fechas de préstamos en formato canónico', _m003_fechas_canonicas),
+    (4, 'Número de visualización de implementos', _m004_numero_implementos),
+    (5, 'Cantidad por préstamo y fusión de filas duplicadas', _m005_cantidad_prestamos),
+    (6, 'Contadores de estadísticas mantenidos por triggers', _m006_contadores_estadisticas),
+    (7, 'Búsqueda de texto completo en el catálogo', _m007_busqueda_implementos),
+    (8, 'Índices para paginación por cursor', _m008_indices_paginacion),
+    (9, 'Trabajos de reportes en segundo plano', _m009_trabajos_reportes),
+    (10, 'Versión de datos para la caché de reportes', _m010_version_datos),
+    (11, 'Resúmenes diarios de préstamos', _m011_resumenes_diarios),
+    (12, 'Límites de intentos de login', _m012_limites_login),
+    (13, 'Revocación de tokens de la API', _m013_revocaciones_tokens),
+    (14, 'Versión de usuarios para la caché de identidades', _m014_version_usuarios),
+    (15, 'Anotaciones de cambios del catálogo', _m015_cambios_catalogo),
+    (16, 'Bandeja de salida de notificaciones', _m016_bandeja_notificaciones),
+    (17, 'Agrupación y archivo de notificaciones', _m017_agrupacion_notificaciones),
+    (18, 'Índices de préstamos activos para devoluciones masivas', _m018_indices_devoluciones),
+    (19, 'Todos los tipos de notificación y entregas fallidas', _m019_tipos_notificaciones),
+]
+
+
+def version_actual(conn):
+    """Devuelve la última versión de esquema aplicada (0 si no hay ninguna)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            fecha_aplicacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    fila = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return fila[0] or 0
+
+def aplicar_migraciones(conn):
+    """
+    Aplica en orden las migraciones pendientes
+
+    Args:
+        conn: Conexión a la base de datos
+
+    Returns:
+        list: Versiones aplicadas en esta ejecución
+    """
+    actual = version_actual(conn)
+    aplicadas = []
+
+    for version, descripcion, migracion in MIGRACIONES:
+        if version <= actual:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migracion(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, descripcion) VALUES (?, ?)',
+                (version, descripcion)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migración {version:03d} aplicada: {descripcion}")
+        aplicadas.append(version)
+
+    if aplicadas:
+        # Actualizar estadísticas del planificador con los índices nuevos
+        conn.execute('PRAGMA optimize')
+    return aplicadas
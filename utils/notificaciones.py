@@ -0,0 +1,407 @@
+"""
+Bandeja de salida de notificaciones
+
+Las notificaciones no se insertan directamente en la tabla notificaciones: se
+escriben en notificaciones_salida (encolar_notificacion) sin confirmar, de
+modo que los préstamos y las devoluciones las guardan en su propia transacción
+y se confirman o se descartan junto con ellos, sin una segunda escritura en
+el request.
+
+Un hilo por proceso (el drenador) las mueve en lotes a notificaciones. Cada
+lote se inserta y se borra de la bandeja en una misma transacción BEGIN
+IMMEDIATE, así que cada notificación se entrega exactamente una vez aunque
+varios procesos drenen a la vez. Tras confirmar el lote se publica en el canal
+de eventos (utils/eventos.py).
+
+El drenador despierta cuando este proceso confirma una notificación y, como
+respaldo, cada INTERVALO_DRENADO segundos; en cada vuelta entrega también lo
+encolado por otros procesos. Las filas que no se pueden insertar en
+notificaciones se quedan en la bandeja marcadas como fallidas (estado y
+error) y se cuentan en las métricas; el drenador ya no las vuelve a tomar.
+Al arrancar, la aplicación entrega en una pasada (entregar_pendientes) lo que
+quedó en la bandeja tras una caída o un reinicio.
+
+Agrupación: las notificaciones con clave (préstamos y devoluciones de un mismo
+implemento y ficha, ver clave_agrupacion) se funden con la notificación sin
+leer del mismo tipo y clave cuyo grupo empezó hace menos de VENTANA_AGRUPACION
+minutos (inicio_grupo). Esa notificación se actualiza en su lugar: suma la
+cantidad, toma el mensaje y la fecha del último evento y conserva su id, así
+que las páginas siguen pudiendo marcarla como leída y el flujo de eventos la
+reenvía sin mover el Last-Event-ID. Treinta préstamos de una misma clase
+quedan en una sola fila. Cada lote busca las notificaciones que absorbe con
+una consulta, las actualiza con un executemany e inserta el resto con otro.
+
+Retención: las notificaciones leídas con más de DIAS_RETENCION días se mueven
+a notificaciones_archivo (sin índices ni columnas de estado), por lotes y como
+máximo una vez cada INTERVALO_ARCHIVADO segundos desde el drenador, o con
+'flask archive-notifications' desde un cron.
+"""
+import sqlite3
+import threading
+import time
+
+from utils.db import get_db_connection, transaccion_inmediata
+
+# Notificaciones que se mueven por transacción
+LOTE_DRENADO = 100
+
+# Segundos máximos que el drenador espera sin aviso
+INTERVALO_DRENADO = 2.0
+
+# Minutos en que una notificación sin leer absorbe las siguientes de su misma clave
+VENTANA_AGRUPACION = 10
+
+# Días que se conserva una notificación leída antes de archivarla
+DIAS_RETENCION = 30
+
+# Notificaciones archivadas por transacción y segundos entre archivados
+LOTE_ARCHIVADO = 500
+INTERVALO_ARCHIVADO = 3600
+
+def clave_agrupacion(fk_implemento, ficha=None):
+    """Clave que agrupa las notificaciones de un implemento (y ficha, si la hay)"""
+    clave = f'implemento:{fk_implemento}'
+    return f'{clave}:ficha:{ficha}' if ficha else clave
+
+def encolar_notificacion(conn, tipo, titulo, mensaje, fk_usuario=None, fk_prestamo=None, clave=None):
+    """
+    Escribe una notificación en la bandeja de salida, sin confirmar
+
+    Debe llamarse dentro de la transacción de la operación que la origina;
+    después del commit conviene llamar a avisar_drenador(). Las notificaciones
+    con la misma clave (clave_agrupacion) se agrupan al entregarse.
+    """
+    conn.execute('''
+        INSERT INTO notificaciones_salida (tipo, titulo, mensaje, fk_usuario, fk_prestamo, clave)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (tipo, titulo, mensaje, fk_usuario, fk_prestamo, clave))
+
+def _agrupar(filas):
+    """
+    Funde las filas de un lote con el mismo tipo y clave
+
+    Returns:
+        list: dicts en el orden de la última fila de cada grupo, con su cantidad,
+            en inicio la fecha de la primera y en salida los ids de sus filas en la bandeja
+    """
+    grupos = {}
+    for indice, fila in enumerate(filas):
+        clave = (fila['tipo'], fila['clave']) if fila['clave'] is not None else indice
+        anterior = grupos.pop(clave, None)
+        # Al reinsertarse, el grupo queda en la posición de su última fila
+        grupos[clave] = dict(
+            fila,
+            cantidad=(anterior['cantidad'] + 1) if anterior else 1,
+            inicio=anterior['inicio'] if anterior else fila['fecha_creacion'],
+            salida=(anterior['salida'] if anterior else []) + [fila['id']],
+        )
+    return list(grupos.values())
+
+def _anteriores(conn, grupos):
+    """
+    Notificaciones sin leer que absorben a los grupos del lote, en una sola consulta
+
+    La ventana se cuenta desde el inicio del grupo (la primera notificación
+    absorbida), no desde la última, para que un goteo constante no se funda
+    indefinidamente.
+
+    Returns:
+        dict: {(tipo, clave): fila con id, cantidad e inicio}
+    """
+    claves = sorted({fila['clave'] for fila in grupos if fila['clave'] is not None})
+    if not claves:
+        return {}
+    marcas = ', '.join('?' * len(claves))
+    filas = conn.execute(f'''
+        SELECT id, tipo, clave, cantidad, COALESCE(inicio_grupo, fecha_creacion) AS inicio
+        FROM notificaciones
+        WHERE clave IN ({marcas}) AND clave IS NOT NULL AND leida = 0
+          AND COALESCE(inicio_grupo, fecha_creacion) >= datetime('now', ?)
+        ORDER BY id
+    ''', (*claves, f'-{VENTANA_AGRUPACION} minutes')).fetchall()
+    return {(fila['tipo'], fila['clave']): fila for fila in filas}
+
+def _insertar(conn, grupos):
+    """
+    Inserta los grupos nuevos de un lote con un solo executemany
+
+    Si alguna fila falla (por ejemplo, un tipo que la tabla no admite) se
+    deshace el executemany y se insertan una por una, para entregar las demás.
+
+    Returns:
+        list: (grupo, error) de los grupos que no se pudieron insertar
+    """
+    insertar = '''
+        INSERT INTO notificaciones
+            (tipo, titulo, mensaje, fk_usuario, fk_prestamo, fecha_creacion, clave, cantidad, inicio_grupo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    valores = [
+        (fila['tipo'], fila['titulo'], fila['mensaje'], fila['fk_usuario'], fila['fk_prestamo'],
+         fila['fecha_creacion'], fila['clave'], fila['cantidad'], fila['inicio'])
+        for fila in grupos
+    ]
+    conn.execute('SAVEPOINT entrega')
+    try:
+        conn.executemany(insertar, valores)
+        return []
+    except sqlite3.Error:
+        conn.execute('ROLLBACK TO entrega')
+        fallidas = []
+        for fila, valor in zip(grupos, valores):
+            try:
+                conn.execute(insertar, valor)
+            except sqlite3.Error as e:
+                fallidas.append((fila, str(e)))
+        return fallidas
+    finally:
+        conn.execute('RELEASE entrega')
+
+def _entregar(conn, grupos, desde):
+    """
+    Entrega las notificaciones agrupadas de un lote
+
+    Una consulta busca las notificaciones sin leer que absorben a los grupos;
+    un executemany las actualiza en su lugar y otro inserta los grupos nuevos.
+    Las filas de la bandeja de un grupo que no se pudo insertar se marcan como
+    fallidas con el error, en vez de perderse.
+
+    Args:
+        conn: Conexión dentro de la transacción del lote
+        grupos: Resultado de _agrupar
+        desde: Mayor id de notificaciones antes del lote
+
+    Returns:
+        tuple: (notificaciones del lote entregadas, ids de las notificaciones
+            actualizadas, filas de la bandeja marcadas como fallidas)
+    """
+    anteriores = _anteriores(conn, grupos)
+    nuevas = []
+    actualizadas = []
+    fundidas = 0
+    for fila in grupos:
+        anterior = anteriores.get((fila['tipo'], fila['clave'])) if fila['clave'] is not None else None
+        if anterior is not None:
+            actualizadas.append((fila['titulo'], fila['mensaje'], fila['fk_usuario'], fila['fk_prestamo'],
+                                 fila['fecha_creacion'], anterior['cantidad'] + fila['cantidad'], anterior['id']))
+            fundidas += fila['cantidad']
+        else:
+            nuevas.append(fila)
+
+    # El grupo conserva su id y su inicio; vuelve arriba por la fecha del último evento
+    conn.executemany('''
+        UPDATE notificaciones
+        SET titulo = ?, mensaje = ?, fk_usuario = ?, fk_prestamo = ?, fecha_creacion = ?, cantidad = ?, leida = 0
+        WHERE id = ?
+    ''', actualizadas)
+    fallidas = [(error, id) for fila, error in _insertar(conn, nuevas) for id in fila['salida']]
+    conn.executemany(
+        "UPDATE notificaciones_salida SET estado = 'fallida', error = ? WHERE id = ?", fallidas
+    )
+    insertadas = conn.execute(
+        'SELECT COALESCE(SUM(cantidad), 0) FROM notificaciones WHERE id > ?', (desde,)
+    ).fetchone()[0]
+    return insertadas + fundidas, [fila[-1] for fila in actualizadas], len(fallidas)
+
+def archivar_notificaciones(conn, dias=DIAS_RETENCION, lote=LOTE_ARCHIVADO):
+    """
+    Mueve a notificaciones_archivo las notificaciones leídas con más de `dias` días
+
+    Cada lote es una transacción corta, para no bloquear a los préstamos.
+
+    Returns:
+        int: Notificaciones archivadas
+    """
+    def operacion(conn):
+        ids = [fila[0] for fila in conn.execute('''
+            SELECT id FROM notificaciones
+            WHERE fecha_creacion < datetime('now', ?) AND leida = 1
+            ORDER BY fecha_creacion LIMIT ?
+        ''', (f'-{dias} days', lote))]
+        if ids:
+            marcas = ', '.join('?' * len(ids))
+            conn.execute(f'''
+                INSERT OR REPLACE INTO notificaciones_archivo
+                    (id, tipo, titulo, mensaje, fk_usuario, fk_prestamo, cantidad, fecha_creacion)
+                SELECT id, tipo, titulo, mensaje, fk_usuario, fk_prestamo, cantidad, fecha_creacion
+                FROM notificaciones WHERE id IN ({marcas})
+            ''', ids)
+            conn.execute(f'DELETE FROM notificaciones WHERE id IN ({marcas})', ids)
+        return len(ids)
+
+    total = 0
+    while True:
+        archivadas = transaccion_inmediata(conn, operacion)
+        total += archivadas
+        if archivadas < lote:
+            return total
+
+class Drenador:
+    """Hilo que entrega la bandeja de salida de una base de datos"""
+
+    def __init__(self, ruta, lote=LOTE_DRENADO, intervalo=INTERVALO_DRENADO):
+        self.ruta = ruta
+        self.lote = lote
+        self.intervalo = intervalo
+        self._aviso = threading.Event()
+        self._detenido = False
+        self._hilo = None
+        self._archivado = float('-inf')
+        self._lock = threading.Lock()
+        self.metricas = {
+            'lotes': 0, 'entregadas': 0, 'fallidas': 0, 'errores': 0, 'archivadas': 0,
+            'ultimo_retraso': None, 'retraso_maximo': 0.0,
+        }
+
+    def drenar_lote(self, conn):
+        """
+        Mueve hasta `lote` notificaciones de la bandeja a notificaciones
+
+        Returns:
+            int: Filas tomadas de la bandeja (0 si estaba vacía)
+        """
+        def operacion(conn):
+            filas = conn.execute(
+                "SELECT * FROM notificaciones_salida WHERE estado = 'pendiente' ORDER BY id LIMIT ?", (self.lote,)
+            ).fetchall()
+            if not filas:
+                return 0, 0, 0, None, None, None
+            desde = conn.execute('SELECT COALESCE(MAX(id), 0) FROM notificaciones').fetchone()[0]
+            # Las filas de un grupo fundidas en otra cuentan como entregadas
+            entregadas, actualizadas, fallidas = _entregar(conn, _agrupar(filas), desde)
+            conn.execute(
+                "DELETE FROM notificaciones_salida WHERE id <= ? AND estado = 'pendiente'", (filas[-1]['id'],)
+            )
+            hasta = conn.execute('SELECT COALESCE(MAX(id), 0) FROM notificaciones').fetchone()[0]
+            return (len(filas), entregadas, fallidas, (desde, hasta), actualizadas,
+                    min(fila['creada'] for fila in filas))
+
+        tomadas, entregadas, fallidas, ids, actualizadas, creada = transaccion_inmediata(conn, operacion)
+        if not tomadas:
+            return 0
+
+        retraso = max(0.0, time.time() - creada)
+        with self._lock:
+            self.metricas['lotes'] += 1
+            self.metricas['entregadas'] += entregadas
+            self.metricas['fallidas'] += fallidas
+            self.metricas['ultimo_retraso'] = round(retraso, 3)
+            self.metricas['retraso_maximo'] = round(max(self.metricas['retraso_maximo'], retraso), 3)
+
+        if entregadas:
+            from utils.eventos import publicar_notificaciones
+            publicar_notificaciones(conn, *ids, actualizadas=actualizadas)
+        return tomadas
+
+    def drenar(self, conn):
+        """
+        Entrega toda la bandeja, lote por lote
+
+        Returns:
+            int: Filas tomadas de la bandeja
+        """
+        total = 0
+        while True:
+            tomadas = self.drenar_lote(conn)
+            total += tomadas
+            if tomadas < self.lote:
+                return total
+
+    def _ejecutar(self):
+        conn = get_db_connection(self.ruta)
+        try:
+            while not self._detenido:
+                self._aviso.wait(self.intervalo)
+                self._aviso.clear()
+                if self._detenido:
+                    break
+                try:
+                    self.drenar(conn)
+                    if time.monotonic() - self._archivado >= INTERVALO_ARCHIVADO:
+                        self._archivado = time.monotonic()
+                        with self._lock:
+                            self.metricas['archivadas'] += archivar_notificaciones(conn)
+                except Exception as e:
+                    # Las filas siguen en la bandeja y se reintentan en la próxima vuelta
+                    with self._lock:
+                        self.metricas['errores'] += 1
+                    print(f"Error al entregar notificaciones: {e}")
+        finally:
+            conn.close()
+
+    def avisar(self):
+        """Despierta al drenador (y lo inicia si todavía no corre)"""
+        with self._lock:
+            if self._hilo is None and not self._detenido:
+                self._hilo = threading.Thread(target=self._ejecutar, name='drenador-notificaciones', daemon=True)
+                self._hilo.start()
+        self._aviso.set()
+
+    def detener(self):
+        self._detenido = True
+        self._aviso.set()
+
+    def estadisticas(self, conn):
+        """
+        Métricas del drenador y estado de la bandeja
+
+        Returns:
+            dict: Lotes, entregadas, fallidas, archivadas, errores, retrasos
+                (segundos desde que se encoló la notificación más antigua de un lote
+                hasta su entrega), pendientes en la bandeja con la antigüedad de la
+                más antigua, filas fallidas que siguen en la bandeja y filas de
+                notificaciones y de su archivo
+        """
+        with self._lock:
+            metricas = dict(self.metricas)
+        pendientes, creada = conn.execute(
+            "SELECT COUNT(*), MIN(creada) FROM notificaciones_salida WHERE estado = 'pendiente'"
+        ).fetchone()
+        metricas['pendientes'] = pendientes
+        metricas['antiguedad_pendientes'] = round(max(0.0, time.time() - creada), 3) if creada else 0.0
+        metricas['fallidas_en_bandeja'] = conn.execute(
+            "SELECT COUNT(*) FROM notificaciones_salida WHERE estado = 'fallida'"
+        ).fetchone()[0]
+        metricas['notificaciones'] = conn.execute('SELECT COUNT(*) FROM notificaciones').fetchone()[0]
+        metricas['archivo'] = conn.execute('SELECT COUNT(*) FROM notificaciones_archivo').fetchone()[0]
+        metricas['activo'] = self._hilo is not None and self._hilo.is_alive()
+        return metricas
+
+_drenador = None
+_drenador_lock = threading.Lock()
+
+def _obtener_drenador():
+    """Drenador de la base de datos actual (se reemplaza si cambia la ruta)"""
+    global _drenador
+    import utils.db
+    with _drenador_lock:
+        if _drenador is None or _drenador.ruta != utils.db.DATABASE:
+            if _drenador is not None:
+                _drenador.detener()
+            _drenador = Drenador(utils.db.DATABASE)
+        return _drenador
+
+def avisar_drenador():
+    """Se llama después de confirmar notificaciones encoladas"""
+    _obtener_drenador().avisar()
+
+def drenar_notificaciones(conn):
+    """Entrega ahora la bandeja en este hilo (CLI y pruebas); devuelve las filas tomadas"""
+    return _obtener_drenador().drenar(conn)
+
+def entregar_pendientes():
+    """
+    Entrega en una pasada lo que quedó en la bandeja (tras una caída o un
+    reinicio) sin esperar a que una nueva notificación despierte al drenador
+
+    Returns:
+        int: Filas tomadas de la bandeja
+    """
+    conn = get_db_connection()
+    try:
+        return drenar_notificaciones(conn)
+    finally:
+        conn.close()
+
+def estadisticas_notificaciones(conn):
+    return _obtener_drenador().estadisticas(conn)
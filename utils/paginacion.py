@@ -0,0 +1,110 @@
+"""
+Paginación por cursor (keyset) para los listados de Lendix
+
+En lugar de OFFSET, cada página continúa a partir de la clave de orden de la
+última fila mostrada, de modo que el costo de una página no crece con el
+historial. El cursor es opaco para el usuario (JSON en base64 URL-safe).
+"""
+import base64
+import json
+
+TAMANO_PAGINA = 25
+TAMANO_MAXIMO = 100
+
+# Clave de orden de los listados de préstamos (más recientes primero)
+CLAVES_PRESTAMOS = (('p.fecha_prestamo', 'fecha_prestamo'), ('p.id', 'id'))
+
+def leer_tamano_pagina(valor):
+    """Valida el tamaño de página recibido por parámetro"""
+    try:
+        tamano = int(valor)
+    except (ValueError, TypeError):
+        return TAMANO_PAGINA
+    return min(max(tamano, 1), TAMANO_MAXIMO)
+
+def codificar_cursor(valores):
+    """Convierte los valores de la clave de orden en un cursor para la URL"""
+    texto = json.dumps(list(valores), separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor, cantidad):
+    """
+    Recupera los valores de la clave de orden de un cursor
+
+    Returns:
+        list: Valores de la clave, o None si el cursor no es válido
+    """
+    if not cursor:
+        return None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(valores, list) or len(valores) != cantidad:
+        return None
+    return valores
+
+def paginar(conn, query, params, claves, despues=None, antes=None, por_pagina=TAMANO_PAGINA):
+    """
+    Ejecuta un listado ordenado de forma descendente por `claves` y devuelve una página
+
+    Args:
+        conn: Conexión a la base de datos
+        query: SELECT con su cláusula WHERE (sin ORDER BY ni LIMIT)
+        params: Parámetros de la consulta
+        claves: Pares (expresión SQL, columna del resultado) que forman una clave única
+        despues: Cursor de la página siguiente
+        antes: Cursor de la página anterior
+        por_pagina: Número de filas por página
+
+    Returns:
+        dict: filas, siguiente y anterior (cursores o None) y por_pagina
+    """
+    expresiones = ', '.join(expresion for expresion, _ in claves)
+    marcadores = ', '.join('?' * len(claves))
+    params = list(params)
+
+    valores_antes = decodificar_cursor(antes, len(claves))
+    valores_despues = None if valores_antes else decodificar_cursor(despues, len(claves))
+
+    if valores_antes:
+        # Página anterior: recorrer en orden ascendente desde el cursor y voltear
+        ascendente = ', '.join(f'{expresion} ASC' for expresion, _ in claves)
+        filas = conn.execute(
+            f'{query} AND ({expresiones}) > ({marcadores}) ORDER BY {ascendente} LIMIT ?',
+            params + valores_antes + [por_pagina + 1]
+        ).fetchall()
+        hay_anterior = len(filas) > por_pagina
+        filas = list(reversed(filas[:por_pagina]))
+        hay_siguiente = True
+    else:
+        if valores_despues:
+            query += f' AND ({expresiones}) < ({marcadores})'
+            params += valores_despues
+        descendente = ', '.join(f'{expresion} DESC' for expresion, _ in claves)
+        filas = conn.execute(
+            f'{query} ORDER BY {descendente} LIMIT ?', params + [por_pagina + 1]
+        ).fetchall()
+        hay_siguiente = len(filas) > por_pagina
+        filas = filas[:por_pagina]
+        hay_anterior = valores_despues is not None
+
+    def cursor_de(fila):
+        return codificar_cursor(fila[columna] for _, columna in claves)
+
+    return {
+        'filas': filas,
+        'siguiente': cursor_de(filas[-1]) if filas and hay_siguiente else None,
+        'anterior': cursor_de(filas[0]) if filas and hay_anterior else None,
+        'por_pagina': por_pagina,
+    }
+
+def paginar_consulta(conn, query, params, claves, args):
+    """paginar() tomando los cursores y el tamaño de página de los parámetros de la URL"""
+    return paginar(
+        conn, query, params, claves,
+        despues=args.get('despues'),
+        antes=args.get('antes'),
+        por_pagina=leer_tamano_pagina(args.get('por_pagina'))
+    )
@@ -0,0 +1,336 @@
+"""
+Operaciones sobre préstamos compartidas por las rutas de Lendix
+"""
+from collections import defaultdict
+from datetime import datetime
+from utils.db import transaccion_inmediata
+from utils.notificaciones import avisar_drenador, clave_agrupacion, encolar_notificacion
+
+# Novedades que impiden que las unidades devueltas vuelvan al inventario
+NOVEDADES_QUE_REDUCEN_CANTIDAD = ['Daño', 'Robo', 'Desgaste excesivo', 'Pérdida']
+
+# Estados en que se pueden recibir las unidades (CHECK de prestamos e implementos)
+ESTADOS_IMPLEMENTO = ['Bueno', 'Desgaste notable', 'Dañado']
+
+# Columnas por las que se pueden elegir los préstamos activos de una devolución masiva
+SELECTORES_DEVOLUCION = ['ficha', 'ambiente', 'nombre_prestatario']
+
+# Préstamos que admite como máximo una devolución masiva
+MAXIMO_DEVOLUCIONES = 500
+
+class DisponibilidadInsuficiente(Exception):
+    """No quedan unidades suficientes del implemento para el préstamo"""
+
+class DevolucionConcurrente(Exception):
+    """El préstamo cambió mientras se registraba la devolución"""
+
+class DevolucionInvalida(Exception):
+    """Algún préstamo de una devolución masiva no se puede devolver; no se registra ninguno"""
+
+    def __init__(self, errores):
+        super().__init__('; '.join(errores))
+        self.errores = errores
+
+def unidades_pendientes(prestamo):
+    """Unidades de un préstamo que todavía no se han devuelto"""
+    return prestamo['cantidad'] - prestamo['cantidad_devuelta']
+
+def leer_cantidad(valor, por_defecto=1):
+    """Convierte el valor de un formulario en cantidad entera"""
+    try:
+        return int(valor)
+    except (ValueError, TypeError):
+        return por_defecto
+
+def _cantidad_entera(valor):
+    """Cantidad de una devolución masiva como entero, o None si no es un entero"""
+    if isinstance(valor, bool):
+        return None
+    if isinstance(valor, int):
+        return valor
+    if isinstance(valor, str) and valor.strip().isdigit():
+        return int(valor)
+    return None
+
+def devolucion_completa(prestamo, cantidad):
+    """Indica si devolver `cantidad` unidades completa el préstamo"""
+    return prestamo['cantidad_devuelta'] + cantidad >= prestamo['cantidad']
+
+def registrar_prestamo(conn, campos, cantidad=1, notificacion=None):
+    """
+    Descuenta las unidades del inventario y registra el préstamo en una sola transacción
+
+    El descuento es una única sentencia condicionada a que haya stock, así que
+    dos solicitudes simultáneas nunca pueden prestar la misma unidad.
+
+    Args:
+        conn: Conexión a la base de datos
+        campos: Columnas del préstamo (debe incluir fk_implemento)
+        cantidad: Unidades prestadas
+        notificacion: (tipo, titulo, mensaje, fk_usuario) de la notificación para
+            los administradores; se encola en la misma transacción con el id del
+            préstamo y se agrupa con las del mismo implemento y ficha
+
+    Returns:
+        int: ID del préstamo registrado
+
+    Raises:
+        DisponibilidadInsuficiente: Si el implemento ya no tiene unidades suficientes
+    """
+    columnas = dict(campos, cantidad=cantidad)
+    insertar = 'INSERT INTO prestamos ({}) VALUES ({})'.format(
+        ', '.join(columnas), ', '.join('?' * len(columnas))
+    )
+
+    def operacion(conn):
+        cursor = conn.execute('''
+            UPDATE implementos SET disponibilidad = disponibilidad - ?
+            WHERE id = ? AND disponibilidad >= ?
+        ''', (cantidad, campos['fk_implemento'], cantidad))
+        if cursor.rowcount == 0:
+            raise DisponibilidadInsuficiente()
+        prestamo_id = conn.execute(insertar, tuple(columnas.values())).lastrowid
+        if notificacion:
+            encolar_notificacion(
+                conn, *notificacion, fk_prestamo=prestamo_id,
+                clave=clave_agrupacion(campos['fk_implemento'], campos.get('ficha'))
+            )
+        return prestamo_id
+
+    prestamo_id = transaccion_inmediata(conn, operacion)
+    if notificacion:
+        avisar_drenador()
+    return prestamo_id
+
+def registrar_devolucion(conn, prestamo, cantidad, novedad, estado_implemento, observaciones, notificacion=None):
+    """
+    Registra la devolución total o parcial de un préstamo en una sola transacción
+
+    La actualización solo se aplica si cantidad_devuelta sigue siendo la que
+    se leyó, de modo que dos devoluciones simultáneas no reingresan dos veces
+    las mismas unidades.
+
+    Args:
+        conn: Conexión a la base de datos
+        prestamo: Fila del préstamo (id, fk_implemento, cantidad, cantidad_devuelta)
+        cantidad: Unidades que se devuelven
+        novedad: Novedad reportada en la devolución
+        estado_implemento: Estado en que se reciben las unidades
+        observaciones: Observaciones adicionales
+        notificacion: (tipo, titulo, mensaje, fk_usuario) de la notificación para
+            los administradores; se encola en la misma transacción y se agrupa con
+            las del mismo implemento y ficha
+
+    Returns:
+        bool: True si con esta devolución el préstamo queda completamente devuelto
+
+    Raises:
+        DevolucionConcurrente: Si otra devolución del mismo préstamo se registró antes
+    """
+    devueltas = prestamo['cantidad_devuelta'] + cantidad
+    completo = devolucion_completa(prestamo, cantidad)
+    fecha_devolucion = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if completo else None
+
+    def operacion(conn):
+        cursor = conn.execute('''
+            UPDATE prestamos
+            SET cantidad_devuelta = ?, fecha_devolucion = ?, novedad = ?,
+                estado_implemento_devolucion = ?, observaciones = ?
+            WHERE id = ? AND cantidad_devuelta = ? AND fecha_devolucion IS NULL
+        ''', (devueltas, fecha_devolucion, novedad, estado_implemento, observaciones,
+              prestamo['id'], prestamo['cantidad_devuelta']))
+        if cursor.rowcount == 0:
+            raise DevolucionConcurrente()
+
+        # Las unidades con novedad grave no vuelven a estar disponibles
+        reingresan = 0 if novedad in NOVEDADES_QUE_REDUCEN_CANTIDAD else cantidad
+        conn.execute(
+            'UPDATE implementos SET disponibilidad = disponibilidad + ? WHERE id = ?',
+            (reingresan, prestamo['fk_implemento'])
+        )
+
+        # Actualizar estado del implemento si es necesario
+        if estado_implemento != 'Bueno':
+            conn.execute(
+                'UPDATE implementos SET estado = ? WHERE id = ?',
+                (estado_implemento, prestamo['fk_implemento'])
+            )
+
+        if notificacion:
+            ficha = prestamo['ficha'] if 'ficha' in prestamo.keys() else None
+            encolar_notificacion(
+                conn, *notificacion, fk_prestamo=prestamo['id'],
+                clave=clave_agrupacion(prestamo['fk_implemento'], ficha)
+            )
+
+    transaccion_inmediata(conn, operacion)
+    if notificacion:
+        avisar_drenador()
+    return completo
+
+def _mensaje_devoluciones(resumen):
+    """Mensaje de la notificación de resumen de una devolución masiva"""
+    implementos = sorted(resumen['implementos'].items(), key=lambda item: -item[1])
+    detalle = ', '.join(f'{nombre} x{unidades}' for nombre, unidades in implementos[:5])
+    if len(implementos) > 5:
+        detalle += f' y {len(implementos) - 5} implementos más'
+    mensaje = f"{resumen['prestamos']} préstamos devueltos ({resumen['unidades']} unidades): {detalle}"
+    if resumen['parciales']:
+        mensaje += f" - Devoluciones parciales: {len(resumen['parciales'])}"
+    if resumen['con_novedad']:
+        mensaje += f" - Con novedad: {resumen['con_novedad']}"
+    if resumen['no_reingresan']:
+        mensaje += f" - {resumen['no_reingresan']} unidades no volvieron al inventario"
+    return mensaje
+
+def registrar_devoluciones(conn, devoluciones=None, selector=None, comunes=None, fk_usuario=None):
+    """
+    Registra la devolución de varios préstamos en una sola transacción
+
+    Los préstamos se indican por id, con un selector sobre los préstamos
+    activos (p. ej. {'ficha': '2567890'}) o con ambas cosas. Lo que un
+    préstamo no indique se toma de `comunes`; sin cantidad se devuelven todas
+    sus unidades pendientes. El inventario se ajusta con una sentencia por
+    implemento, no por préstamo, y se encola una sola notificación de resumen.
+    Si algún préstamo no se puede devolver no se registra ninguno.
+
+    Args:
+        conn: Conexión a la base de datos
+        devoluciones: {id_prestamo: {cantidad, novedad, estado_implemento, observaciones}}
+        selector: {columna: valor} con columnas de SELECTORES_DEVOLUCION
+        comunes: novedad, estado_implemento y observaciones por defecto
+        fk_usuario: Usuario que registra; si se indica se encola la notificación
+
+    Returns:
+        dict: prestamos, unidades, completos y parciales (ids), con_novedad,
+            no_reingresan e implementos ({nombre: unidades devueltas})
+
+    Raises:
+        DevolucionInvalida: Si algún préstamo no existe, ya fue devuelto o la
+            cantidad, el estado o el selector no son válidos
+    """
+    devoluciones = devoluciones or {}
+    selector = selector or {}
+    comunes = dict({'novedad': 'Ninguna', 'estado_implemento': 'Bueno', 'observaciones': ''}, **(comunes or {}))
+
+    errores = [f'Selector no válido: {columna}' for columna in selector if columna not in SELECTORES_DEVOLUCION]
+    if not devoluciones and not selector:
+        errores.append('Indique los préstamos o un selector')
+    elif len(devoluciones) > MAXIMO_DEVOLUCIONES:
+        errores.append(f'Se pueden devolver como máximo {MAXIMO_DEVOLUCIONES} préstamos a la vez')
+    errores += [
+        f'Valor no válido para el selector {columna}' for columna, valor in selector.items()
+        if not isinstance(valor, (str, int)) or isinstance(valor, bool)
+    ]
+    for id, datos in [(None, comunes), *devoluciones.items()]:
+        sufijo = f' del préstamo {id}' if id is not None else ''
+        estado = datos.get('estado_implemento')
+        if estado is not None and (not isinstance(estado, str) or estado not in ESTADOS_IMPLEMENTO):
+            errores.append(f'Estado no válido{sufijo}: {estado}')
+        for campo in ('novedad', 'observaciones'):
+            if datos.get(campo) is not None and not isinstance(datos[campo], str):
+                errores.append(f'El campo {campo}{sufijo} debe ser texto')
+        if id is not None and datos.get('cantidad') is not None and _cantidad_entera(datos['cantidad']) is None:
+            errores.append(f'La cantidad del préstamo {id} no es válida')
+    if errores:
+        raise DevolucionInvalida(errores)
+
+    consulta = '''
+        SELECT p.*, i.implemento
+        FROM prestamos p
+        JOIN implementos i ON p.fk_implemento = i.id
+    '''
+
+    def operacion(conn):
+        # Se leen dentro de la transacción: nadie más puede devolverlos a la vez
+        prestamos = {}
+        if devoluciones:
+            marcadores = ', '.join('?' * len(devoluciones))
+            for fila in conn.execute(consulta + f' WHERE p.id IN ({marcadores})', tuple(devoluciones)):
+                prestamos[fila['id']] = fila
+        if selector:
+            condiciones = ' AND '.join(f'p.{columna} = ?' for columna in selector)
+            filas = conn.execute(
+                consulta + f' WHERE p.fecha_devolucion IS NULL AND {condiciones} ORDER BY p.id',
+                tuple(selector.values())
+            )
+            for fila in filas:
+                prestamos.setdefault(fila['id'], fila)
+
+        errores = [f'El préstamo {id} no existe' for id in devoluciones if id not in prestamos]
+        if not prestamos and not errores:
+            errores.append('No hay préstamos activos para devolver')
+        elif len(prestamos) > MAXIMO_DEVOLUCIONES:
+            errores.append(f'Se pueden devolver como máximo {MAXIMO_DEVOLUCIONES} préstamos a la vez')
+
+        ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        actualizaciones = []
+        reingresos = defaultdict(int)
+        estados = {}
+        resumen = {
+            'prestamos': 0, 'unidades': 0, 'completos': [], 'parciales': [],
+            'con_novedad': 0, 'no_reingresan': 0, 'implementos': defaultdict(int),
+        }
+        for id, prestamo in prestamos.items():
+            datos = dict(comunes, **devoluciones.get(id, {}))
+            if prestamo['fecha_devolucion'] is not None:
+                errores.append(f'El préstamo {id} ya fue devuelto')
+                continue
+            pendientes = unidades_pendientes(prestamo)
+            cantidad = pendientes if datos.get('cantidad') is None else _cantidad_entera(datos['cantidad'])
+            if cantidad <= 0 or cantidad > pendientes:
+                errores.append(f'La cantidad del préstamo {id} debe estar entre 1 y {pendientes}')
+                continue
+
+            completo = devolucion_completa(prestamo, cantidad)
+            actualizaciones.append((
+                prestamo['cantidad_devuelta'] + cantidad, ahora if completo else None, datos['novedad'],
+                datos['estado_implemento'], datos['observaciones'], id, prestamo['cantidad_devuelta']
+            ))
+            # Las unidades con novedad grave no vuelven a estar disponibles
+            if datos['novedad'] in NOVEDADES_QUE_REDUCEN_CANTIDAD:
+                resumen['no_reingresan'] += cantidad
+            else:
+                reingresos[prestamo['fk_implemento']] += cantidad
+            if datos['estado_implemento'] != 'Bueno':
+                estados[prestamo['fk_implemento']] = datos['estado_implemento']
+            if datos['novedad'] != 'Ninguna':
+                resumen['con_novedad'] += 1
+
+            resumen['prestamos'] += 1
+            resumen['unidades'] += cantidad
+            resumen['completos' if completo else 'parciales'].append(id)
+            resumen['implementos'][prestamo['implemento']] += cantidad
+        if errores:
+            raise DevolucionInvalida(errores)
+
+        cursor = conn.executemany('''
+            UPDATE prestamos
+            SET cantidad_devuelta = ?, fecha_devolucion = ?, novedad = ?,
+                estado_implemento_devolucion = ?, observaciones = ?
+            WHERE id = ? AND cantidad_devuelta = ? AND fecha_devolucion IS NULL
+        ''', actualizaciones)
+        if cursor.rowcount != len(actualizaciones):
+            raise DevolucionConcurrente()
+
+        # Una sentencia por implemento, con las unidades de todos sus préstamos
+        conn.executemany(
+            'UPDATE implementos SET disponibilidad = disponibilidad + ? WHERE id = ?',
+            [(unidades, fk_implemento) for fk_implemento, unidades in reingresos.items()]
+        )
+        conn.executemany(
+            'UPDATE implementos SET estado = ? WHERE id = ?',
+            [(estado, fk_implemento) for fk_implemento, estado in estados.items()]
+        )
+
+        resumen['implementos'] = dict(resumen['implementos'])
+        if fk_usuario is not None:
+            encolar_notificacion(
+                conn, 'devolucion', 'Devolución múltiple registrada', _mensaje_devoluciones(resumen), fk_usuario
+            )
+        return resumen
+
+    resumen = transaccion_inmediata(conn, operacion)
+    if fk_usuario is not None:
+        avisar_drenador()
+    return resumen
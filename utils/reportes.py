@@ -0,0 +1,211 @@
+"""
+Reporte de préstamos en Excel
+
+La hoja se escribe con openpyxl en modo write-only: las filas se leen del cursor
+de SQLite una a una y se vuelcan al archivo de destino, así que la memoria no
+crece con el número de préstamos. Las celdas comparten estilos con nombre en
+lugar de crear Border/Alignment por celda, y fechas y números se guardan como
+valores nativos para no llenar la tabla de textos compartidos del libro.
+"""
+from datetime import datetime
+
+CONSULTA_REPORTE = '''
+    SELECT
+        p.id,
+        p.tipo_prestamo,
+        p.nombre_prestatario,
+        p.ficha,
+        p.ambiente,
+        p.horario,
+        p.instructor,
+        p.jornada,
+        p.fecha_prestamo,
+        p.fecha_devolucion,
+        p.cantidad,
+        p.cantidad_devuelta,
+        p.novedad,
+        p.estado_implemento_devolucion,
+        p.observaciones,
+        i.implemento,
+        i.categoria,
+        u.nombre as usuario_registro,
+        u.email as usuario_email
+    FROM prestamos p
+    JOIN implementos i ON p.fk_implemento = i.id
+    JOIN usuarios u ON p.fk_usuario = u.id
+    WHERE 1=1
+'''
+
+# Encabezados y columnas de cada formato
+FORMATOS = {
+    'detallado': (
+        [
+            'ID', 'Tipo Préstamo', 'Prestatario', 'Ficha', 'Ambiente', 'Horario',
+            'Instructor', 'Jornada', 'Implemento', 'Categoría', 'Cantidad', 'Devueltas',
+            'Fecha Préstamo', 'Fecha Devolución', 'Estado', 'Novedad', 'Observaciones', 'Registrado por'
+        ],
+        [
+            'id', 'tipo_prestamo', 'nombre_prestatario', 'ficha', 'ambiente', 'horario',
+            'instructor', 'jornada', 'implemento', 'categoria', 'cantidad', 'cantidad_devuelta',
+            'fecha_prestamo', 'fecha_devolucion', 'estado_implemento_devolucion', 'novedad', 'observaciones', 'usuario_registro'
+        ],
+    ),
+    'resumen': (
+        [
+            'ID', 'Prestatario', 'Implemento', 'Cantidad', 'Fecha Préstamo', 'Fecha Devolución',
+            'Días Transcurridos', 'Estado', 'Registrado por'
+        ],
+        [
+            'id', 'nombre_prestatario', 'implemento', 'cantidad', 'fecha_prestamo',
+            'fecha_devolucion', 'dias_transcurridos', 'estado', 'usuario_registro'
+        ],
+    ),
+}
+
+ESTILO_ENCABEZADO = 'Reporte encabezado'
+ESTILO_CELDA = 'Reporte celda'
+ESTILO_FECHA = 'Reporte fecha'
+
+COLUMNAS_FECHA = ('fecha_prestamo', 'fecha_devolucion')
+
+def consulta_reporte_prestamos(desde=None, hasta=None, tipo_reporte='todos'):
+    """
+    Construye la consulta del reporte de préstamos
+
+    Args:
+        desde: Inicio del rango (incluido) en formato canónico, o None
+        hasta: Fin del rango (excluido) en formato canónico, o None
+        tipo_reporte: 'todos', 'activos' o 'devueltos'
+
+    Returns:
+        tuple: (query, params)
+    """
+    query = CONSULTA_REPORTE
+    params = []
+
+    # Filtros de fecha (rango semiabierto sobre la columna indexada)
+    if desde:
+        query += " AND p.fecha_prestamo >= ?"
+        params.append(desde)
+
+    if hasta:
+        query += " AND p.fecha_prestamo < ?"
+        params.append(hasta)
+
+    # Filtro de tipo
+    if tipo_reporte == 'activos':
+        query += " AND p.fecha_devolucion IS NULL"
+    elif tipo_reporte == 'devueltos':
+        query += " AND p.fecha_devolucion IS NOT NULL"
+
+    query += " ORDER BY p.fecha_prestamo DESC"
+    return query, params
+
+def _registrar_estilos(wb):
+    """Agrega al libro los estilos con nombre que comparten todas las celdas"""
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+
+    borde = Side(style='thin')
+    encabezado = NamedStyle(name=ESTILO_ENCABEZADO)
+    encabezado.font = Font(bold=True, color="FFFFFF")
+    encabezado.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    encabezado.alignment = Alignment(horizontal='center', vertical='center')
+    encabezado.border = Border(left=borde, right=borde, top=borde, bottom=borde)
+
+    celda = NamedStyle(name=ESTILO_CELDA)
+    celda.alignment = Alignment(vertical='center')
+    celda.border = Border(left=borde, right=borde, top=borde, bottom=borde)
+
+    fecha = NamedStyle(name=ESTILO_FECHA, number_format='yyyy-mm-dd hh:mm:ss')
+    fecha.alignment = Alignment(vertical='center')
+    fecha.border = Border(left=borde, right=borde, top=borde, bottom=borde)
+
+    for estilo in (encabezado, celda, fecha):
+        wb.add_named_style(estilo)
+
+def _fecha(valor):
+    """Convierte una fecha de la base de datos en datetime (o la deja como texto si no se reconoce)"""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return valor
+
+def _valor(prestamo, columna, ahora):
+    """Valor de una columna del reporte para un préstamo"""
+    if columna == 'dias_transcurridos':
+        fecha_inicio = datetime.strptime(prestamo['fecha_prestamo'][:10], '%Y-%m-%d')
+        if prestamo['fecha_devolucion']:
+            fecha_fin = datetime.strptime(prestamo['fecha_devolucion'][:10], '%Y-%m-%d')
+            return f"{(fecha_fin - fecha_inicio).days} días"
+        return f"{(ahora - fecha_inicio).days} días (activo)"
+    if columna == 'estado':
+        return 'Devuelto' if prestamo['fecha_devolucion'] else 'Activo'
+    if columna in COLUMNAS_FECHA:
+        return _fecha(prestamo[columna])
+
+    # Los vacíos quedan como celdas sin valor (conservan el borde)
+    valor = prestamo[columna]
+    return None if valor == '' else valor
+
+def escribir_reporte_prestamos(destino, filas, formato='detallado', info=(), progreso=None, cada=1000):
+    """
+    Escribe el reporte de préstamos en un archivo .xlsx
+
+    Args:
+        destino: Ruta o archivo binario donde guardar el libro
+        filas: Iterable de préstamos (p. ej. el cursor de CONSULTA_REPORTE)
+        formato: 'detallado' o 'resumen'
+        info: Líneas adicionales para el bloque "Información del Reporte"
+        progreso: Función opcional que recibe el número de filas escritas
+        cada: Cada cuántas filas se llama a progreso
+
+    Returns:
+        int: Número de préstamos escritos
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    encabezados, columnas = FORMATOS.get(formato, FORMATOS['resumen'])
+
+    wb = Workbook(write_only=True)
+    _registrar_estilos(wb)
+    ws = wb.create_sheet("Reporte de Préstamos")
+
+    # Ancho de columnas (debe fijarse antes de escribir filas)
+    for col in range(1, len(encabezados) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = 15
+
+    def celda(valor, estilo):
+        nueva = WriteOnlyCell(ws, value=valor)
+        nueva.style = estilo
+        return nueva
+
+    ws.append([celda(encabezado, ESTILO_ENCABEZADO) for encabezado in encabezados])
+
+    # Una celda con estilo por columna que se reutiliza en cada fila: append()
+    # serializa la fila al instante, así que solo cambia el valor
+    celdas = [celda(None, ESTILO_FECHA if columna in COLUMNAS_FECHA else ESTILO_CELDA) for columna in columnas]
+
+    ahora = datetime.now()
+    total = 0
+    for prestamo in filas:
+        for destino_celda, columna in zip(celdas, columnas):
+            destino_celda.value = _valor(prestamo, columna, ahora)
+        ws.append(celdas)
+        total += 1
+        if progreso and total % cada == 0:
+            progreso(total)
+
+    # Agregar información del reporte
+    ws.append([])
+    ws.append(["Información del Reporte:"])
+    ws.append([f"Fecha de generación: {ahora.strftime('%Y-%m-%d %H:%M:%S')}"])
+    ws.append([f"Total de registros: {total}"])
+    for linea in info:
+        ws.append([linea])
+
+    wb.save(destino)
+    return total
@@ -0,0 +1,143 @@
+"""
+Resúmenes diarios de préstamos
+
+Tres tablas acumulan los préstamos por día (fecha del préstamo) y por
+implemento, por usuario que registró y por tipo de préstamo. Los triggers de la
+migración 011 las mantienen al registrar, devolver, editar o eliminar un
+préstamo, de modo que los reportes por rango de fechas suman unos cientos de
+filas de resumen en lugar de recorrer toda la tabla prestamos.
+"""
+
+# Tabla de resumen de cada dimensión: nombre -> (tabla, columna de prestamos)
+RESUMENES = {
+    'implemento': ('resumen_diario_implementos', 'fk_implemento'),
+    'usuario': ('resumen_diario_usuarios', 'fk_usuario'),
+    'tipo': ('resumen_diario_tipos', 'tipo_prestamo'),
+}
+
+# Día de un préstamo ('' si la fecha no es válida, para no dejar la clave en NULL)
+DIA = "COALESCE(date({0}.fecha_prestamo), '')"
+
+# Medidas de cada fila de resumen y su valor para un préstamo
+MEDIDAS = {
+    'prestamos': '1',
+    'cantidad': '{0}.cantidad',
+    'devueltos': '{0}.cantidad_devuelta',
+    'activos': '(CASE WHEN {0}.fecha_devolucion IS NULL THEN {0}.cantidad - {0}.cantidad_devuelta ELSE 0 END)',
+}
+
+def _agregado(columna):
+    """Consulta que calcula las filas de un resumen recorriendo prestamos (costoso)"""
+    medidas = ', '.join(f"SUM({expresion.format('p')})" for expresion in MEDIDAS.values())
+    return f'''
+        SELECT {DIA.format('p')} AS dia, p.{columna}, {medidas}
+        FROM prestamos p
+        GROUP BY 1, 2
+    '''
+
+def recalcular_resumenes(conn):
+    """
+    Reconstruye los resúmenes diarios a partir de prestamos (sin confirmar la transacción)
+
+    Returns:
+        dict: Número de filas de cada resumen
+    """
+    filas = {}
+    for nombre, (tabla, columna) in RESUMENES.items():
+        conn.execute(f'DELETE FROM {tabla}')
+        conn.execute(f'''
+            INSERT INTO {tabla} (dia, {columna}, {', '.join(MEDIDAS)})
+            {_agregado(columna)}
+        ''')
+        filas[nombre] = conn.execute(f'SELECT COUNT(*) FROM {tabla}').fetchone()[0]
+    return filas
+
+def verificar_resumenes(conn):
+    """
+    Compara los resúmenes diarios con los agregados reales
+
+    Returns:
+        dict: {resumen: [(dia, clave), ...]} solo para los que tienen diferencias
+    """
+    diferencias = {}
+    for nombre, (tabla, columna) in RESUMENES.items():
+        guardadas = f'''
+            SELECT dia, {columna}, {', '.join(MEDIDAS)} FROM {tabla}
+            WHERE prestamos <> 0
+        '''
+        reales = _agregado(columna)
+        claves = conn.execute(f'''
+            SELECT dia, {columna} FROM ({guardadas} EXCEPT {reales})
+            UNION
+            SELECT dia, {columna} FROM ({reales} EXCEPT {guardadas})
+            ORDER BY 1, 2
+        ''').fetchall()
+        if claves:
+            diferencias[nombre] = [tuple(clave) for clave in claves]
+    return diferencias
+
+def _filtro_dias(desde=None, hasta=None):
+    """
+    Condición sobre la columna dia para un rango [desde, hasta) de limites_fecha()
+
+    Los límites son medianoches, así que comparar solo el día da el mismo
+    resultado que filtrar prestamos.fecha_prestamo.
+    """
+    condiciones = []
+    params = []
+    if desde:
+        condiciones.append('r.dia >= ?')
+        params.append(desde[:10])
+    if hasta:
+        condiciones.append("r.dia < ? AND r.dia <> ''")
+        params.append(hasta[:10])
+    return ' AND '.join(condiciones) or '1=1', params
+
+def totales_periodo(conn, desde=None, hasta=None):
+    """
+    Totales de préstamos en un rango de fechas
+
+    Args:
+        conn: Conexión a la base de datos
+        desde: Inicio del rango (incluido) de limites_fecha(), o None
+        hasta: Fin del rango (excluido) de limites_fecha(), o None
+
+    Returns:
+        dict: total_prestamos, activos, devueltos, individuales y multiples
+    """
+    filtro, params = _filtro_dias(desde, hasta)
+    fila = conn.execute(f'''
+        SELECT
+            COALESCE(SUM(r.cantidad), 0) as total_prestamos,
+            COALESCE(SUM(r.cantidad - r.devueltos), 0) as activos,
+            COALESCE(SUM(r.devueltos), 0) as devueltos,
+            COALESCE(SUM(CASE WHEN r.tipo_prestamo = 'individual' THEN r.cantidad END), 0) as individuales,
+            COALESCE(SUM(CASE WHEN r.tipo_prestamo = 'multiple' THEN r.cantidad END), 0) as multiples
+        FROM resumen_diario_tipos r
+        WHERE {filtro}
+    ''', params).fetchone()
+    return dict(fila)
+
+def implementos_mas_prestados(conn, limite=10, desde=None, hasta=None):
+    """Implementos con más unidades prestadas en el rango (incluye los que no tienen préstamos)"""
+    filtro, params = _filtro_dias(desde, hasta)
+    return conn.execute(f'''
+        SELECT i.implemento, COALESCE(SUM(r.cantidad), 0) as total_prestamos
+        FROM implementos i
+        LEFT JOIN resumen_diario_implementos r ON r.fk_implemento = i.id AND {filtro}
+        GROUP BY i.id, i.implemento
+        ORDER BY total_prestamos DESC
+        LIMIT ?
+    ''', params + [limite]).fetchall()
+
+def usuarios_mas_activos(conn, limite=10, desde=None, hasta=None):
+    """Usuarios que registraron más unidades prestadas en el rango"""
+    filtro, params = _filtro_dias(desde, hasta)
+    return conn.execute(f'''
+        SELECT u.nombre, u.email, COALESCE(SUM(r.cantidad), 0) as total_prestamos
+        FROM usuarios u
+        LEFT JOIN resumen_diario_usuarios r ON r.fk_usuario = u.id AND {filtro}
+        GROUP BY u.id, u.nombre, u.email
+        ORDER BY total_prestamos DESC
+        LIMIT ?
+    ''', params + [limite]).fetchall()
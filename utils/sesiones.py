@@ -0,0 +1,211 @@
+"""
+Sesiones del servidor guardadas en SQLite
+
+Reemplaza el backend de archivos de Flask-Session: cada sesión es una fila de
+una base de datos propia (sesiones.db, en modo WAL) indexada por su id, así que
+los requests de lectura no escriben nada y el vencimiento se limpia con un
+DELETE por índice en lugar de acumular archivos en flask_session/.
+
+- La cookie solo lleva el id de la sesión firmado con la secret_key.
+- Los datos se serializan con el formato JSON etiquetado de Flask (sin pickle).
+- Si la sesión no se modificó no se escribe; el vencimiento deslizante solo se
+  renueva cuando ha pasado la mitad de PERMANENT_SESSION_LIFETIME.
+- Las sesiones vencidas se eliminan como máximo cada INTERVALO_LIMPIEZA
+  segundos desde el propio request, o con `flask purge-sessions`.
+- Al iniciar y cerrar sesión el id se regenera (regenerar()) y la fila
+  anterior se elimina, para que un id conocido antes del login no sirva después.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+
+# Segundos mínimos entre dos limpiezas de sesiones vencidas
+INTERVALO_LIMPIEZA = 300
+
+class SesionServidor(SecureCookieSession):
+    """Sesión cuyos datos viven en la base de sesiones; la cookie guarda solo el id"""
+
+    def __init__(self, datos=None, sid=None, expira=None):
+        super().__init__(datos)
+        self.sid = sid
+        self.expira = expira
+        self.nueva = sid is None
+        self.sid_anterior = None
+
+    def regenerar(self):
+        """Guarda los datos con un id nuevo y elimina la fila del id actual"""
+        if self.sid is not None:
+            self.sid_anterior = self.sid
+        self.sid = None
+        self.nueva = True
+        self.modified = True
+
+class AlmacenSesiones:
+    """Tabla de sesiones en su propia base SQLite, con una conexión por hilo"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._ultima_limpieza = 0
+        self._lock = threading.Lock()
+        self._conexion().execute('''
+            CREATE TABLE IF NOT EXISTS sesiones (
+                id TEXT PRIMARY KEY,
+                datos TEXT NOT NULL,
+                expira REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self._conexion().execute('CREATE INDEX IF NOT EXISTS idx_sesiones_expira ON sesiones(expira)')
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+            # Modo autocommit: cada sentencia es su propia transacción corta
+            conn = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            self._local.conn = conn
+        return conn
+
+    def leer(self, sid, ahora):
+        """Devuelve (datos, expira) de una sesión vigente, o None"""
+        return self._conexion().execute(
+            'SELECT datos, expira FROM sesiones WHERE id = ? AND expira > ?', (sid, ahora)
+        ).fetchone()
+
+    def guardar(self, sid, datos, expira):
+        self._conexion().execute(
+            'INSERT OR REPLACE INTO sesiones (id, datos, expira) VALUES (?, ?, ?)', (sid, datos, expira)
+        )
+
+    def renovar(self, sid, expira):
+        self._conexion().execute('UPDATE sesiones SET expira = ? WHERE id = ?', (expira, sid))
+
+    def eliminar(self, sid):
+        self._conexion().execute('DELETE FROM sesiones WHERE id = ?', (sid,))
+
+    def limpiar_vencidas(self, ahora=None):
+        """
+        Elimina las sesiones vencidas
+
+        Returns:
+            int: Número de sesiones eliminadas
+        """
+        ahora = time.time() if ahora is None else ahora
+        self._ultima_limpieza = ahora
+        return self._conexion().execute('DELETE FROM sesiones WHERE expira <= ?', (ahora,)).rowcount
+
+    def limpiar_si_corresponde(self, ahora):
+        """Limpia las sesiones vencidas si pasó INTERVALO_LIMPIEZA desde la última vez"""
+        with self._lock:
+            if ahora - self._ultima_limpieza < INTERVALO_LIMPIEZA:
+                return 0
+            self._ultima_limpieza = ahora
+        return self.limpiar_vencidas(ahora)
+
+    def contar(self):
+        return self._conexion().execute('SELECT COUNT(*) FROM sesiones').fetchone()[0]
+
+class SesionesSQLite(SessionInterface):
+    """Interfaz de sesiones de Flask sobre AlmacenSesiones"""
+
+    serializador = TaggedJSONSerializer()
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+
+    def _firmador(self, app):
+        return Signer(app.secret_key, salt='lendix-sesion')
+
+    def _vida(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        # Las llamadas a la API con token Bearer no usan sesión
+        if request.authorization is not None and request.authorization.type == 'bearer':
+            return SesionServidor()
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._firmador(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            fila = self.almacen.leer(sid, time.time()) if sid else None
+            if fila:
+                try:
+                    return SesionServidor(self.serializador.loads(fila[0]), sid, fila[1])
+                except ValueError:
+                    pass
+        return SesionServidor()
+
+    def save_session(self, app, session, response):
+        nombre = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        ruta = self.get_cookie_path(app)
+        ahora = time.time()
+
+        # Id regenerado: la fila anterior deja de ser válida
+        if session.sid_anterior:
+            self.almacen.eliminar(session.sid_anterior)
+            session.sid_anterior = None
+
+        # Sesión vacía: borrar la fila y la cookie si existían
+        if not session:
+            if not session.nueva:
+                self.almacen.eliminar(session.sid)
+            if session.modified:
+                response.delete_cookie(
+                    nombre, domain=dominio, path=ruta,
+                    secure=self.get_cookie_secure(app),
+                    samesite=self.get_cookie_samesite(app),
+                    httponly=self.get_cookie_httponly(app),
+                )
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        self.almacen.limpiar_si_corresponde(ahora)
+        vida = self._vida(app)
+        if session.nueva or session.modified:
+            session.sid = session.sid or secrets.token_urlsafe(32)
+            self.almacen.guardar(session.sid, self.serializador.dumps(dict(session)), ahora + vida)
+        elif session.expira - ahora < vida / 2:
+            # Vencimiento deslizante sin reescribir los datos
+            self.almacen.renovar(session.sid, ahora + vida)
+        else:
+            # Sin cambios: ni escritura en la base ni Set-Cookie
+            return
+
+        response.set_cookie(
+            nombre,
+            self._firmador(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=dominio,
+            path=ruta,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+def init_app(app):
+    """
+    Instala las sesiones en SQLite en la aplicación
+
+    La base se toma de SESSION_DATABASE o, por defecto, sesiones.db junto a la
+    base de datos principal.
+    """
+    ruta = app.config.get('SESSION_DATABASE') or os.path.join(
+        os.path.dirname(os.path.abspath(app.config['DATABASE'])), 'sesiones.db'
+    )
+    app.session_interface = SesionesSQLite(AlmacenSesiones(ruta))
+    return app.session_interface
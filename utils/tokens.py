@@ -0,0 +1,114 @@
+"""
+Tokens Bearer firmados para la API JSON
+
+Los tokens los emite /api/login y se firman con la secret_key mediante
+itsdangerous, de modo que validarlos no requiere sesión: basta la firma, la
+fecha de emisión y la lista de revocaciones.
+
+La lista de revocaciones (tabla api_revocaciones) tiene dos tipos de entrada:
+- 'jti:<id>': un token concreto (cierre de sesión de la API).
+- 'usuario:<id>': todos los tokens emitidos antes de cierto momento; los
+  triggers de la migración 013 la crean al cambiar el rol o el estado de un
+  usuario, o al eliminarlo.
+Cada proceso guarda la lista en memoria junto con su número de versión, y por
+request solo lee ese número (una fila por clave primaria); la lista se vuelve
+a cargar únicamente cuando la versión cambió.
+"""
+import secrets
+import threading
+import time
+
+from flask import current_app
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+# Vida de un token en segundos (configurable con API_TOKEN_LIFETIME)
+VIDA_TOKEN = 3600
+
+_lock = threading.Lock()
+_revocaciones = {'version': None, 'claves': {}}
+
+class TokenInvalido(Exception):
+    """El token no tiene firma válida, venció o fue revocado"""
+    pass
+
+def _serializador():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='lendix-api-token')
+
+def vida_token():
+    return current_app.config.get('API_TOKEN_LIFETIME', VIDA_TOKEN)
+
+def emitir_token(usuario_id, rol):
+    """
+    Emite un token para un usuario
+
+    Returns:
+        str: Token firmado
+    """
+    return _serializador().dumps({
+        'uid': usuario_id,
+        'rol': rol,
+        'jti': secrets.token_urlsafe(12),
+        'iat': time.time(),
+    })
+
+def _claves_revocadas(conn):
+    """Lista de revocaciones en caché, recargada solo si cambió su versión"""
+    version = conn.execute('SELECT version FROM api_revocaciones_version WHERE id = 1').fetchone()[0]
+    with _lock:
+        if _revocaciones['version'] == version:
+            return _revocaciones['claves']
+    claves = dict(conn.execute('SELECT clave, emitidos_antes FROM api_revocaciones').fetchall())
+    with _lock:
+        _revocaciones['version'] = version
+        _revocaciones['claves'] = claves
+    return claves
+
+def verificar_token(conn, token):
+    """
+    Valida un token y devuelve sus datos
+
+    Args:
+        conn: Conexión a la base de datos (solo para la versión de revocaciones)
+        token: Token recibido en la cabecera Authorization
+
+    Returns:
+        dict: uid, rol, jti e iat del token
+
+    Raises:
+        TokenInvalido: Si la firma no es válida, el token venció o fue revocado
+    """
+    try:
+        datos = _serializador().loads(token, max_age=vida_token())
+    except SignatureExpired:
+        raise TokenInvalido('Token vencido')
+    except BadSignature:
+        raise TokenInvalido('Token inválido')
+
+    revocadas = _claves_revocadas(conn)
+    if f"jti:{datos['jti']}" in revocadas:
+        raise TokenInvalido('Token revocado')
+    if revocadas.get(f"usuario:{datos['uid']}", 0) >= datos['iat']:
+        raise TokenInvalido('Token revocado')
+    return datos
+
+def revocar_token(conn, datos):
+    """Agrega un token a la lista de revocaciones"""
+    conn.execute(
+        "INSERT OR REPLACE INTO api_revocaciones (clave, emitidos_antes) VALUES (?, ?)",
+        (f"jti:{datos['jti']}", time.time())
+    )
+    conn.commit()
+
+def limpiar_revocaciones(conn, segundos=None):
+    """
+    Elimina las revocaciones de tokens que ya vencieron por sí solos
+
+    Returns:
+        int: Número de entradas eliminadas
+    """
+    segundos = vida_token() if segundos is None else segundos
+    eliminadas = conn.execute(
+        'DELETE FROM api_revocaciones WHERE emitidos_antes < ?', (time.time() - segundos,)
+    ).rowcount
+    conn.commit()
+    return eliminadas
@@ -0,0 +1,254 @@
+"""
+Trabajos de reportes en segundo plano
+
+Los reportes de Excel se generan en un pool de procesos para no ocupar el
+hilo del request. Cada trabajo queda registrado en la tabla report_jobs con
+su estado y progreso; el archivo terminado se guarda en disco junto a la base
+de datos, con un nombre derivado de la clave de caché (parámetros + versión de
+los datos), de modo que el mismo reporte sobre los mismos datos se genera una
+sola vez. Los archivos se eliminan al pasar su tiempo de vida sin usarse o al
+superar el límite de tamaño de la caché.
+"""
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import utils.db
+from utils.cache_reportes import (
+    buscar_archivo, clave_cache, eliminar_archivos_sin_uso, recortar_archivos, version_datos
+)
+from utils.db import get_db_connection
+
+# Procesos que generan reportes en paralelo
+TRABAJADORES = 2
+
+# Horas que se conserva un reporte terminado
+HORAS_VIGENCIA = 24
+
+# Cada cuántas filas se actualiza el progreso del trabajo
+FILAS_POR_AVANCE = 2000
+
+# Tipo de reporte en la clave de caché
+TIPO_REPORTE = 'prestamos_excel'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def directorio_reportes():
+    """Carpeta de los reportes generados (junto a la base de datos)"""
+    return os.path.join(os.path.dirname(os.path.abspath(utils.db.DATABASE)), 'reportes')
+
+def _obtener_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: el proceso hijo no hereda los hilos ni las conexiones del servidor
+            _pool = ProcessPoolExecutor(
+                max_workers=TRABAJADORES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+def parametros_reporte(formulario):
+    """Parámetros normalizados de un reporte a partir del formulario"""
+    return {
+        'fecha_inicio': formulario.get('fecha_inicio') or None,
+        'fecha_fin': formulario.get('fecha_fin') or None,
+        'tipo_reporte': formulario.get('tipo_reporte') or 'todos',
+        'formato': formulario.get('formato') or 'detallado',
+    }
+
+def _clave_actual(conn, parametros):
+    return clave_cache(TIPO_REPORTE, parametros, version_datos(conn))
+
+def generar_archivo_reporte(conn, parametros, directorio, progreso=None):
+    """
+    Genera el Excel de un reporte en la carpeta de la caché (si no existe ya)
+
+    La versión de los datos se lee antes que los préstamos: si otra escritura
+    ocurre en medio, el archivo queda con la versión vieja y solo provoca un
+    fallo de caché más adelante, nunca un reporte desactualizado.
+
+    Args:
+        conn: Conexión a la base de datos
+        parametros: dict de parametros_reporte()
+        directorio: Carpeta de la caché
+        progreso: Función opcional que recibe (porcentaje, total de filas)
+
+    Returns:
+        str: Ruta del archivo generado
+    """
+    from utils.helpers import limites_fecha
+    from utils.reportes import consulta_reporte_prestamos, escribir_reporte_prestamos
+
+    ruta = os.path.join(directorio, f'{_clave_actual(conn, parametros)}.xlsx')
+    if os.path.exists(ruta):
+        return ruta
+
+    desde, hasta = limites_fecha(parametros['fecha_inicio'], parametros['fecha_fin'])
+    query, params = consulta_reporte_prestamos(desde, hasta, parametros['tipo_reporte'])
+
+    if progreso:
+        # Total de filas para calcular el porcentaje de avance
+        total = conn.execute(f'SELECT COUNT(*) FROM ({query})', params).fetchone()[0]
+        progreso(0, total)
+
+        def avance(filas):
+            progreso(min(99, filas * 100 // max(total, 1)), total)
+    else:
+        avance = None
+
+    os.makedirs(directorio, exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    try:
+        with open(temporal, 'wb') as archivo:
+            escribir_reporte_prestamos(
+                archivo, conn.execute(query, params), parametros['formato'],
+                info=[
+                    f"Tipo de reporte: {parametros['tipo_reporte']}",
+                    f"Período: {parametros['fecha_inicio'] or 'Inicio'} - {parametros['fecha_fin'] or 'Actual'}",
+                ],
+                progreso=avance, cada=FILAS_POR_AVANCE
+            )
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    recortar_archivos(directorio, conservar={ruta})
+    return ruta
+
+def reporte_prestamos(conn, parametros):
+    """
+    Devuelve la ruta del reporte, desde la caché o generándolo en este hilo
+
+    Returns:
+        str: Ruta del archivo
+    """
+    directorio = directorio_reportes()
+    ruta = buscar_archivo(directorio, _clave_actual(conn, parametros))
+    return ruta or generar_archivo_reporte(conn, parametros, directorio)
+
+def encolar_reporte(conn, parametros, fk_usuario=None):
+    """
+    Registra un trabajo de reporte y lo envía al pool de procesos
+
+    Si el mismo reporte ya está en la caché para la versión actual de los
+    datos, el trabajo se registra directamente como completado.
+
+    Args:
+        conn: Conexión a la base de datos
+        parametros: dict de parametros_reporte()
+        fk_usuario: Usuario que solicita el reporte
+
+    Returns:
+        int: id del trabajo
+    """
+    limpiar_reportes_vencidos(conn)
+
+    ruta = buscar_archivo(directorio_reportes(), _clave_actual(conn, parametros))
+    if ruta:
+        cursor = conn.execute('''
+            INSERT INTO report_jobs (parametros, estado, progreso, archivo, fk_usuario, fecha_inicio, fecha_fin, expira)
+            VALUES (?, 'completado', 100, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, datetime('now', ?))
+        ''', (json.dumps(parametros), os.path.basename(ruta), fk_usuario, f'+{HORAS_VIGENCIA} hours'))
+        conn.commit()
+        return cursor.lastrowid
+
+    cursor = conn.execute(
+        'INSERT INTO report_jobs (parametros, fk_usuario) VALUES (?, ?)',
+        (json.dumps(parametros), fk_usuario)
+    )
+    conn.commit()
+    trabajo_id = cursor.lastrowid
+
+    try:
+        _obtener_pool().submit(ejecutar_reporte, trabajo_id, utils.db.DATABASE, directorio_reportes())
+    except Exception as e:
+        conn.execute(
+            "UPDATE report_jobs SET estado = 'error', error = ?, fecha_fin = CURRENT_TIMESTAMP WHERE id = ?",
+            (f'No se pudo iniciar el trabajo: {e}', trabajo_id)
+        )
+        conn.commit()
+    return trabajo_id
+
+def ejecutar_reporte(trabajo_id, database, directorio):
+    """
+    Genera el Excel de un trabajo (se ejecuta en un proceso del pool)
+
+    Args:
+        trabajo_id: id en report_jobs
+        database: Ruta de la base de datos
+        directorio: Carpeta donde guardar el archivo
+    """
+    utils.db.DATABASE = database
+    conn = get_db_connection()
+    try:
+        trabajo = conn.execute('SELECT parametros FROM report_jobs WHERE id = ?', (trabajo_id,)).fetchone()
+        parametros = json.loads(trabajo['parametros'])
+
+        def avance(porcentaje, total):
+            conn.execute('''
+                UPDATE report_jobs
+                SET estado = 'en_proceso', progreso = ?, total_filas = ?,
+                    fecha_inicio = COALESCE(fecha_inicio, CURRENT_TIMESTAMP)
+                WHERE id = ?
+            ''', (porcentaje, total, trabajo_id))
+            conn.commit()
+
+        ruta = generar_archivo_reporte(conn, parametros, directorio, progreso=avance)
+
+        conn.execute('''
+            UPDATE report_jobs
+            SET estado = 'completado', progreso = 100, archivo = ?,
+                fecha_inicio = COALESCE(fecha_inicio, CURRENT_TIMESTAMP),
+                fecha_fin = CURRENT_TIMESTAMP, expira = datetime('now', ?)
+            WHERE id = ?
+        ''', (os.path.basename(ruta), f'+{HORAS_VIGENCIA} hours', trabajo_id))
+        conn.commit()
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute(
+            "UPDATE report_jobs SET estado = 'error', error = ?, fecha_fin = CURRENT_TIMESTAMP WHERE id = ?",
+            (str(e), trabajo_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def obtener_trabajo(conn, trabajo_id):
+    """Devuelve el trabajo como dict (o None si no existe)"""
+    fila = conn.execute('''
+        SELECT *, COALESCE(expira <= CURRENT_TIMESTAMP, 0) AS vencido
+        FROM report_jobs WHERE id = ?
+    ''', (trabajo_id,)).fetchone()
+    if fila is None:
+        return None
+    trabajo = dict(fila)
+    trabajo['parametros'] = json.loads(trabajo['parametros'])
+    return trabajo
+
+def ruta_reporte(trabajo):
+    """Ruta del archivo de un trabajo completado y vigente (o None)"""
+    if trabajo['estado'] != 'completado' or not trabajo['archivo'] or trabajo['vencido']:
+        return None
+    ruta = os.path.join(directorio_reportes(), trabajo['archivo'])
+    return ruta if os.path.exists(ruta) else None
+
+def limpiar_reportes_vencidos(conn):
+    """
+    Marca como vencidos los trabajos cuyo tiempo de vida terminó y elimina del
+    disco los reportes que no se han usado en ese tiempo
+
+    Returns:
+        int: Número de archivos eliminados
+    """
+    conn.execute('''
+        UPDATE report_jobs SET estado = 'vencido', archivo = NULL
+        WHERE estado = 'completado' AND expira <= CURRENT_TIMESTAMP
+    ''')
+    conn.commit()
+    return eliminar_archivos_sin_uso(directorio_reportes(), HORAS_VIGENCIA * 3600)
@@ -0,0 +1,130 @@
+"""
+Caché por proceso de la identidad de los usuarios (rol y estado)
+
+login_required revalida en cada request que la cuenta de la sesión siga
+existiendo y activa, y toma de aquí su rol vigente. Para no consultar la tabla
+usuarios en cada request, cada proceso guarda id -> (rol, activo, versión) en
+un diccionario LRU acotado (MAXIMO_ENTRADAS) con vida máxima VIDA_ENTRADA.
+
+La invalidación usa el contador usuarios_version (migración 014), que los
+triggers incrementan al crear o eliminar un usuario y al cambiar su rol o su
+estado:
+- El contador se lee como máximo cada INTERVALO_VERSION segundos; si cambió,
+  se descarta toda la caché. Entre lecturas no hay consulta a la base.
+- El proceso que modifica un usuario llama a invalidar_usuario(), así que en
+  ese proceso el cambio se ve en el siguiente request; los demás procesos lo
+  ven en menos de INTERVALO_VERSION segundos.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Usuarios guardados por proceso y segundos que vive cada entrada
+MAXIMO_ENTRADAS = 1024
+VIDA_ENTRADA = 60
+
+# Segundos máximos entre dos lecturas del contador usuarios_version
+INTERVALO_VERSION = 1.0
+
+Identidad = namedtuple('Identidad', 'rol activo version')
+
+class CacheUsuarios:
+    """Identidades de usuario en un diccionario LRU con vida acotada"""
+
+    def __init__(self, ruta=None, maximo=MAXIMO_ENTRADAS, vida=VIDA_ENTRADA, intervalo=INTERVALO_VERSION,
+                 reloj=time.monotonic):
+        self.ruta = ruta
+        self.maximo = maximo
+        self.vida = vida
+        self.intervalo = intervalo
+        self.reloj = reloj
+        self._entradas = OrderedDict()
+        self._version = None
+        self._version_leida = None
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.lecturas_version = 0
+
+    def _version_vigente(self, obtener_conexion, ahora):
+        """Versión de usuarios, releída de la base solo si pasó el intervalo"""
+        with self._lock:
+            if self._version_leida is not None and ahora - self._version_leida < self.intervalo:
+                return self._version
+        version = obtener_conexion().execute(
+            'SELECT version FROM usuarios_version WHERE id = 1'
+        ).fetchone()[0]
+        with self._lock:
+            self.lecturas_version += 1
+            if version != self._version:
+                self._entradas.clear()
+                self._version = version
+            self._version_leida = ahora
+        return version
+
+    def obtener(self, obtener_conexion, usuario_id):
+        """
+        Identidad de un usuario, de la caché o de la base
+
+        Args:
+            obtener_conexion: Función que devuelve la conexión (solo se llama si hace falta)
+            usuario_id: ID del usuario
+
+        Returns:
+            Identidad: rol, activo y versión, o None si el usuario no existe
+        """
+        ahora = self.reloj()
+        version = self._version_vigente(obtener_conexion, ahora)
+        with self._lock:
+            entrada = self._entradas.get(usuario_id)
+            if entrada is not None and entrada[1] == version and ahora - entrada[2] < self.vida:
+                self._entradas.move_to_end(usuario_id)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+
+        fila = obtener_conexion().execute(
+            'SELECT rol, activo FROM usuarios WHERE id = ?', (usuario_id,)
+        ).fetchone()
+        identidad = None if fila is None else Identidad(fila[0], bool(fila[1]), version)
+        with self._lock:
+            # Los usuarios inexistentes también se guardan: una sesión de un
+            # usuario eliminado no vuelve a consultar la base en cada request
+            self._entradas[usuario_id] = (identidad, version, ahora)
+            self._entradas.move_to_end(usuario_id)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+        return identidad
+
+    def invalidar(self, usuario_id=None):
+        """Descarta un usuario (o todos) y fuerza a releer la versión"""
+        with self._lock:
+            if usuario_id is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(usuario_id, None)
+            self._version_leida = None
+
+    def __len__(self):
+        return len(self._entradas)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _obtener_cache():
+    """Caché de la base de datos actual (se reemplaza si cambia la ruta)"""
+    global _cache
+    import utils.db
+    with _cache_lock:
+        if _cache is None or _cache.ruta != utils.db.DATABASE:
+            _cache = CacheUsuarios(utils.db.DATABASE)
+        return _cache
+
+def obtener_identidad(usuario_id):
+    """Identidad vigente de un usuario (rol y activo), o None si no existe"""
+    from utils.db import get_db
+    return _obtener_cache().obtener(get_db, usuario_id)
+
+def invalidar_usuario(usuario_id=None):
+    """Se llama tras modificar un usuario para que este proceso lo vea de inmediato"""
+    _obtener_cache().invalidar(usuario_id)